@@ -0,0 +1,100 @@
+"""
+Measures allocation throughput and the cost of garbage collection.
+
+Run from the repository root with:
+
+    python -m benchmarks.allocation --objects 20000 --heap-sizes 65536 1048576
+
+The program allocates `--objects` pairs, vectors and strings in sequence,
+keeping one object in `--live` alive in lists held by a vector, and is run
+once per heap size with the collector's statistics enabled. Smaller heaps
+collect more often, but each collection only copies the live objects.
+"""
+from typing import Callable
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+
+from pasquim.compiler import Compiler
+from pasquim.target import get_target
+
+
+def _allocation(i: int, live: int, slots: int) -> str:
+    if i % live == 0:
+        # push a new pair onto one of the lists the vector keeps alive
+        slot = i // live % slots
+        return (f"(primcall vector-set! keep {slot} (primcall cons {i} "
+                f"(primcall vector-ref keep {slot})))")
+    return ["(primcall cons {i} {i})", "(primcall make-vector 6 {i})",
+            "(primcall make-string 24 a)"][i % 3].format(i=i)
+
+
+def synthetic_program(objects: int, live: int, slots: int = 16) -> str:
+    """Builds a program allocating objects, of which every live-th one is
+    kept alive until the end."""
+    body = " ".join(_allocation(i, live, slots) for i in range(objects))
+    return (f"(let ((keep (primcall make-vector {slots} 0))) {body} "
+            f"(primcall vector-length keep))")
+
+
+def allocated_bytes(objects: int, live: int, wordsize: int,
+                    slots: int = 16) -> int:
+    """Bytes the program allocates on a target with the given word size."""
+    sizes = [2 * wordsize, 7 * wordsize, wordsize + 24]
+    total = ((slots + 1) * wordsize + 7) & -8
+    for i in range(objects):
+        size = sizes[0] if i % live == 0 else sizes[i % 3]
+        total += (size + 7) & -8
+    return total
+
+
+def time_it(func: Callable[[], object]) -> float:
+    """Returns the wall time of a single call to func, in seconds."""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    args.add_argument("--objects", type=int, default=20000,
+                      help="number of objects allocated")
+    args.add_argument("--live", type=int, default=8,
+                      help="keep one in this many objects alive")
+    args.add_argument("--heap-sizes", nargs="+", type=int,
+                      default=[2 ** 16, 2 ** 18, 2 ** 20, 2 ** 22],
+                      help="bytes per semispace")
+    args.add_argument("--backend", default="gcc")
+    args.add_argument("--target", default="x86_64")
+    opts = args.parse_args()
+
+    target = get_target(opts.target)
+    total = allocated_bytes(opts.objects, opts.live, target.wordsize)
+    with tempfile.TemporaryDirectory() as path:
+        build = time_it(lambda: Compiler(
+            path, synthetic_program(opts.objects, opts.live),
+            backend=opts.backend, target=opts.target).compile_to_binary())
+        print(f"{opts.objects} objects, {total / 2 ** 20:.2f} MB allocated "
+              f"(built in {build:.2f}s)\n")
+
+        print(f"{'heap (KB)':>10} {'run (s)':>9} {'MB/s':>8}  gc")
+        for size in opts.heap_sizes:
+            env = dict(os.environ, PASQUIM_HEAP_SIZE=str(size),
+                       PASQUIM_GC_STATS="1")
+            result = None
+
+            def run():
+                nonlocal result
+                result = subprocess.run([os.path.join(path, "a.out")],
+                                        env=env, stdout=subprocess.PIPE,
+                                        stderr=subprocess.PIPE, text=True)
+            seconds = time_it(run)
+            stats = result.stderr.strip() or "-"
+            print(f"{size // 1024:>10} {seconds:>9.4f} "
+                  f"{total / 2 ** 20 / seconds:>8.1f}  {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Compares bulk vector and string primitives against element-by-element code.
+
+Run from the repository root with:
+
+    python -m benchmarks.bulk --elements 4194304 --lengths 64 1024 16384
+
+For each length, one program applies a bulk primitive to objects of that
+length until `--elements` elements have been processed. Another does the
+same work with one `vector-set!` or `string-set!` per element, unrolled since
+the language has no loops yet, and so stops after `--statements` elements.
+Each binary is run `--repeat` times and the best time, less that of an empty
+program, is reported per element.
+"""
+from typing import Dict, Tuple
+import argparse
+import os
+import tempfile
+
+from benchmarks.timing import best_time
+from pasquim.compiler import Compiler
+
+
+# How each operation makes its objects `a` and `b`, and processes a whole
+# object or its element j
+OPERATIONS: Dict[str, Tuple[str, str, str]] = {
+    'vector-fill!': ("(primcall make-vector {n} 0)",
+                     "(primcall vector-fill! a {i})",
+                     "(primcall vector-set! a {j} {i})"),
+    'vector-copy!': ("(primcall make-vector {n} 0)",
+                     "(primcall vector-copy! a 0 b)",
+                     "(primcall vector-set! a {j} "
+                     "(primcall vector-ref b {j}))"),
+    'string-fill!': ("(primcall make-string {n} x)",
+                     "(primcall string-fill! a y)",
+                     "(primcall string-set! a {j} y)"),
+    'string-copy!': ("(primcall make-string {n} x)",
+                     "(primcall string-copy! a 0 b)",
+                     "(primcall string-set! a {j} "
+                     "(primcall string-ref b {j}))"),
+}
+
+
+def synthetic_program(operation: str, length: int, statements: int,
+                      bulk: bool) -> str:
+    """Builds a program running operation on objects of the given length,
+    as that many bulk or element statements."""
+    make, whole, element = OPERATIONS[operation]
+    form = whole if bulk else element
+    body = " ".join(form.format(i=k // length, j=k % length)
+                    for k in range(statements))
+    make = make.format(n=length)
+    return f"(let ((a {make}) (b {make})) {body} (primcall vector? a))"
+
+
+def build(path: str, program: str, opts: argparse.Namespace) -> str:
+    Compiler(path, program, backend=opts.backend,
+             target=opts.target).compile_to_binary()
+    return path
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    args.add_argument("--elements", type=int, default=2 ** 22,
+                      help="number of elements processed in bulk")
+    args.add_argument("--statements", type=int, default=2 ** 16,
+                      help="number of elements processed one at a time")
+    args.add_argument("--lengths", nargs="+", type=int,
+                      default=[64, 1024, 16384],
+                      help="lengths of the vectors and strings")
+    args.add_argument("--operations", nargs="+", default=list(OPERATIONS),
+                      choices=list(OPERATIONS))
+    args.add_argument("--repeat", type=int, default=20)
+    args.add_argument("--backend", default="gcc")
+    args.add_argument("--target", default="x86_64")
+    opts = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        empty = best_time(build(os.path.join(tmp, "empty"), "0", opts),
+                          opts.repeat)
+        print(f"{'operation':>14} {'length':>7} {'bulk (ns)':>10} "
+              f"{'element (ns)':>13} {'speedup':>8}")
+        for operation in opts.operations:
+            for length in opts.lengths:
+                times = []
+                for bulk in (True, False):
+                    statements = (max(1, opts.elements // length) if bulk
+                                  else opts.statements)
+                    path = os.path.join(tmp, f"{operation}-{length}-{bulk}")
+                    program = synthetic_program(operation, length,
+                                                statements, bulk)
+                    seconds = best_time(build(path, program, opts),
+                                        opts.repeat)
+                    elements = statements * length if bulk else statements
+                    times.append(max(seconds - empty, 0) / elements * 1e9)
+                speedup = times[1] / times[0] if times[0] else float("inf")
+                print(f"{operation:>14} {length:>7} {times[0]:>10.2f} "
+                      f"{times[1]:>13.2f} {speedup:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
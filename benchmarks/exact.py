@@ -0,0 +1,69 @@
+"""
+Measures what exact integers cost arithmetic that never overflows.
+
+Run from the repository root with:
+
+    python -m benchmarks.exact --iterations 10000000 100000000
+
+Each loop is compiled twice, with wrapping fixnums and with exact integers,
+and both binaries are run `--repeat` times, reporting the best time per
+iteration and the overhead of exact integers. The loops only compute
+fixnums, so exact integers add just their inline checks: a tag test, left
+out for literals, and a `jo` after each addition, subtraction and
+multiplication, none of which is ever taken. `overflow` is the exception,
+adding up multiples of 2^59 so that its sum soon needs a bignum, and shows
+the cost of the calls to the runtime instead.
+"""
+from typing import Dict
+import argparse
+import os
+import tempfile
+
+from benchmarks.timing import best_time
+from pasquim.compiler import Compiler
+
+
+LOOPS: Dict[str, str] = {
+    'count': "(letrec ((loop (lambda (i acc) (if (primcall zero? i) acc "
+             "(loop (primcall sub1 i) (primcall add1 acc)))))) "
+             "(loop {n} 0))",
+    'sum': "(letrec ((loop (lambda (i acc) (if (primcall zero? i) acc "
+           "(loop (primcall - i 1) (primcall + acc i)))))) (loop {n} 0))",
+    'poly': "(letrec ((loop (lambda (i acc) (if (primcall < i 1) acc "
+            "(loop (primcall sub1 i) (primcall - (primcall + acc "
+            "(primcall * i 3)) (primcall * 2 i))))))) (loop {n} 0))",
+    'overflow': "(letrec ((loop (lambda (i acc) (if (primcall zero? i) acc "
+                "(loop (primcall sub1 i) (primcall + acc "
+                "576460752303423488)))))) (loop {n} 0))",
+}
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    args.add_argument("--iterations", nargs="+", type=int,
+                      default=[10 ** 7, 10 ** 8])
+    args.add_argument("--loops", nargs="+", default=list(LOOPS),
+                      choices=list(LOOPS))
+    args.add_argument("--repeat", type=int, default=3)
+    args.add_argument("--opt-level", type=int, default=1)
+    opts = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'loop':>8} {'iterations':>11} {'wrapping':>9} "
+              f"{'exact':>9} {'overhead':>9}")
+        for loop in opts.loops:
+            for n in sorted(opts.iterations):
+                seconds = {}
+                for exact in (False, True):
+                    path = os.path.join(tmp, f"{loop}-{n}-{exact}")
+                    Compiler(path, LOOPS[loop].format(n=n), target="x86_64",
+                             opt_level=opts.opt_level,
+                             exact=exact).compile_to_binary()
+                    seconds[exact] = best_time(path, opts.repeat)
+                overhead = seconds[True] / seconds[False] - 1
+                print(f"{loop:>8} {n:>11} {seconds[False] / n * 1e9:>9.2f} "
+                      f"{seconds[True] / n * 1e9:>9.2f} {overhead:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Compares the streaming `Reader` against the legacy `Lexer` + `Parser` pair.
+
+Run from the repository root with:
+
+    python -m benchmarks.reader --sizes 1 2 4 8
+
+The legacy parser pops tokens off the front of a list, so its running time
+grows quadratically; it is only timed up to `--legacy-limit` megabytes.
+"""
+from typing import Callable
+import argparse
+import random
+import sys
+import time
+
+from pasquim.parser import Lexer, Parser, Reader
+
+
+def synthetic_program(size: int, depth: int = 8, seed: int = 0) -> str:
+    """Builds a single expression of roughly `size` bytes."""
+    rng = random.Random(seed)
+    ops = ["+", "-", "*", "=", "<"]
+
+    def form(level: int) -> str:
+        if level == 0:
+            return str(rng.randint(-1000, 1000))
+        return (f"(primcall {rng.choice(ops)} "
+                f"{form(level - 1)} {form(level - 1)})")
+
+    chunks, total = [], 0
+    while total < size:
+        chunk = form(rng.randint(1, depth))
+        chunks.append(chunk)
+        total += len(chunk) + 1
+
+    return "(begin\n" + "\n".join(chunks) + ")"
+
+
+def time_it(func: Callable[[], object]) -> float:
+    """Returns the wall time of a single call to func, in seconds."""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    args.add_argument("--sizes", nargs="+", type=float,
+                      default=[0.125, 0.25, 1, 2, 4, 8],
+                      help="program sizes to read, in megabytes")
+    args.add_argument("--legacy-limit", type=float, default=0.25,
+                      help="largest size timed with the legacy parser")
+    args.add_argument("--depth", type=int, default=100000,
+                      help="nesting depth for the deep-expression check")
+    opts = args.parse_args()
+
+    print(f"{'size (MB)':>10} {'Reader (s)':>12} {'MB/s':>8} "
+          f"{'legacy (s)':>12} {'speedup':>8}")
+    for size in opts.sizes:
+        program = synthetic_program(int(size * 2 ** 20))
+        reader = time_it(lambda: Reader(program).read_all())
+        row = f"{size:>10} {reader:>12.3f} {size / reader:>8.1f}"
+        if size <= opts.legacy_limit:
+            legacy = time_it(
+                lambda: Parser(Lexer(program).tokenize()).parse())
+            row += f" {legacy:>12.3f} {legacy / reader:>7.1f}x"
+        else:
+            row += f" {'skipped':>12} {'-':>8}"
+        print(row)
+
+    deep = "(primcall add1 " * opts.depth + "0" + ")" * opts.depth
+    print(f"\nReader, {opts.depth} nested forms: "
+          f"{time_it(lambda: Reader(deep).read()):.3f}s "
+          f"(recursion limit is {sys.getrecursionlimit()})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Measures compiler throughput and the speed of generated code.
+
+Run from the repository root with:
+
+    python -m benchmarks.suite run --output results.json
+    python -m benchmarks.suite compare before.json results.json
+
+`run` builds synthetic programs of each of `--sizes` statements, calling
+every primitive in `primitive_ops` in turn on operands nested
+`--nesting` deep, and programs nesting each of `--depths` forms in a single
+expression. For each program it records:
+
+    parse    AST nodes per second read by the legacy `Parser`
+    read     AST nodes per second read by `Reader`
+    codegen  AST nodes per second compiled by `compile_expr`
+    compile  seconds `compile_to_binary` takes, linking included
+    run      seconds the binary takes, less those of an empty program
+
+Every measurement is the best of `--repeat`. Linked binaries are not reused
+from the build cache between repeats, so `compile` always runs gcc.
+
+`compare` reports how each measurement changed between two runs, and exits
+with status 1 when any got worse by more than `--threshold`.
+"""
+from typing import Any, Callable, Dict, List, Optional
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from pasquim.build import BuildCache
+from pasquim.compiler import Compiler
+from pasquim.emitter import Emitter
+from pasquim.parser import Lexer, Parser, Reader
+from pasquim.primitives import compile_expr, primitive_ops
+from pasquim.profiling import program_size
+from pasquim.target import get_target
+
+
+# Whether a larger value of each measurement is better
+METRICS: Dict[str, bool] = {
+    "parse": True, "read": True, "codegen": True,
+    "compile": False, "run": False,
+}
+
+# Objects every synthetic program binds: vectors v and w, strings s and t
+# of LENGTH elements, a pair p and a symbol y
+LENGTH = 8
+BINDINGS = (f"(v (primcall make-vector {LENGTH} 1)) "
+            f"(w (primcall make-vector {LENGTH} 0)) "
+            f"(s (primcall make-string {LENGTH} a)) "
+            f"(t (primcall make-string {LENGTH} b)) "
+            f"(p (primcall cons 1 2)) (y 'name)")
+
+# A call of each primitive on the objects above, where each {x} is a fixnum
+# operand and {i} an index
+CALLS: Dict[str, str] = {
+    'add1': "(primcall add1 {x})",
+    'sub1': "(primcall sub1 {x})",
+    'integer?': "(primcall integer? {x})",
+    'zero?': "(primcall zero? {x})",
+    'boolean?': "(primcall boolean? {x})",
+    'char?': "(primcall char? {x})",
+    '+': "(primcall + {x} {x})",
+    '-': "(primcall - {x} {x})",
+    '*': "(primcall * {x} {x})",
+    '=': "(primcall = {x} {x})",
+    '<': "(primcall < {x} {x})",
+    'char=?': "(primcall char=? (primcall string-ref s {i}) c)",
+    'pair?': "(primcall pair? p)",
+    'vector?': "(primcall vector? v)",
+    'string?': "(primcall string? s)",
+    'cons': "(primcall cons {x} {x})",
+    'car': "(primcall car p)",
+    'cdr': "(primcall cdr p)",
+    'make-vector': "(primcall make-vector 4 {x})",
+    'vector-length': "(primcall vector-length v)",
+    'vector-ref': "(primcall vector-ref v {i})",
+    'vector-set!': "(primcall vector-set! v {i} {x})",
+    'make-string': "(primcall make-string 4 c)",
+    'string-length': "(primcall string-length s)",
+    'string-ref': "(primcall string-ref s {i})",
+    'string-set!': "(primcall string-set! s {i} c)",
+    'vector-fill!': "(primcall vector-fill! w {x})",
+    'vector-copy': "(primcall vector-copy v)",
+    'vector-copy!': "(primcall vector-copy! w 0 v)",
+    'string-fill!': "(primcall string-fill! t d)",
+    'string-copy': "(primcall string-copy s)",
+    'string-copy!': "(primcall string-copy! t 0 s)",
+    'string=?': "(primcall string=? s t)",
+    'procedure?': "(primcall procedure? {x})",
+    'symbol?': "(primcall symbol? y)",
+    'eq?': "(primcall eq? y 'name)",
+    'symbol->string': "(primcall symbol->string y)",
+    'string->symbol': "(primcall string->symbol s)",
+}
+
+# Primitives making a fixnum out of fixnums, and fixnums to start from
+ARITHMETIC = ["(primcall add1 {x})", "(primcall sub1 {x})",
+              "(primcall + {x} {x})", "(primcall - {x} {x})",
+              "(primcall * {x} {x})"]
+FIXNUMS = ["(primcall vector-ref v {i})", "(primcall vector-length v)",
+           "(primcall string-length s)", "(primcall car p)"]
+
+
+def _fill(template: str, nesting: int, rng: random.Random) -> str:
+    """Fills the operands of template with fixnum expressions nested up to
+    nesting deep."""
+    while "{x}" in template or "{i}" in template:
+        template = template.replace("{i}", str(rng.randrange(LENGTH)), 1)
+        if nesting == 0 or rng.random() < 0.25:
+            operand = rng.choice(
+                [str(rng.randint(-8, 8)), rng.choice(FIXNUMS)])
+        else:
+            operand = _fill(rng.choice(ARITHMETIC), nesting - 1, rng)
+        template = template.replace("{x}", operand, 1)
+    return template
+
+
+def wide_program(statements: int, nesting: int = 3, seed: int = 0) -> str:
+    """Builds a program of the given number of statements, each calling the
+    next primitive in `primitive_ops` on operands nested up to nesting
+    deep."""
+    missing = set(primitive_ops) - set(CALLS)
+    assert not missing, f"No benchmark calls for {', '.join(missing)}"
+
+    rng = random.Random(seed)
+    ops = list(primitive_ops)
+    body = "\n".join(_fill(CALLS[ops[k % len(ops)]], nesting, rng)
+                     for k in range(statements))
+    return (f"(let ({BINDINGS})\n{body}\n"
+            f"(primcall vector-length v))")
+
+
+def deep_program(depth: int) -> str:
+    """Builds a single expression nesting depth forms, alternating
+    primitive calls and `let`."""
+    program = "0"
+    for level in range(depth):
+        if level % 2:
+            program = f"(let ((x{level} {program})) (primcall add1 x{level}))"
+        else:
+            program = f"(primcall + 1 {program})"
+    return program
+
+
+def best_time(func: Callable[[], object], repeat: int) -> float:
+    """Returns the best wall time of repeat calls to func, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def _run_binary(path: str) -> None:
+    subprocess.run([os.path.join(path, "a.out")], check=True,
+                   stdout=subprocess.DEVNULL)
+
+
+def measure(name: str, program: str, path: str, cache: BuildCache,
+            opts: argparse.Namespace,
+            empty: float = 0.0) -> Dict[str, Optional[float]]:
+    """Measures reading, compiling and running program, building it in
+    path.
+
+    Measurements that fail, such as those of programs nested deeper than
+    the recursion limit allows, are None.
+    """
+    target = get_target(opts.target)
+    results: Dict[str, Optional[float]] = dict.fromkeys(METRICS)
+    expr = Reader(program).read()
+    _, nodes = program_size(expr)
+
+    def compile_binary() -> None:
+        shutil.rmtree(cache.root.joinpath("bin"), ignore_errors=True)
+        Compiler(path, program, backend=opts.backend, target=opts.target,
+                 opt_level=opts.opt_level, cache=cache).compile_to_binary()
+
+    steps: Dict[str, Callable[[], object]] = {
+        "parse": lambda: Parser(Lexer(program).tokenize()).parse(),
+        "read": lambda: Reader(program).read(),
+        "codegen": lambda: compile_expr(expr, -target.wordsize,
+                                        Emitter(target=target)),
+        "compile": compile_binary,
+        "run": lambda: _run_binary(path),
+    }
+    for metric, step in steps.items():
+        if metric == "run" and results["compile"] is None:
+            break
+        try:
+            seconds = best_time(step, opts.repeat)
+        except RecursionError:
+            print(f"{name}: {metric} exceeded the recursion limit",
+                  file=sys.stderr)
+            continue
+        if metric == "run":
+            results[metric] = max(seconds - empty, 0.0)
+        elif METRICS[metric]:
+            results[metric] = nodes / seconds
+        else:
+            results[metric] = seconds
+    return results
+
+
+def run_suite(opts: argparse.Namespace) -> Dict[str, Any]:
+    """Runs every benchmark, returning the report `compare` reads."""
+    programs = {f"wide-{size}": wide_program(size, opts.nesting)
+                for size in opts.sizes}
+    programs.update({f"deep-{depth}": deep_program(depth)
+                     for depth in opts.depths})
+
+    benchmarks = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = BuildCache(os.path.join(tmp, "cache"))
+        empty_path = os.path.join(tmp, "empty")
+        Compiler(empty_path, "0", backend=opts.backend, target=opts.target,
+                 cache=cache).compile_to_binary()
+        empty = best_time(lambda: _run_binary(empty_path), opts.repeat)
+
+        for name, program in programs.items():
+            path = os.path.join(tmp, name)
+            benchmarks[name] = measure(name, program, path, cache, opts,
+                                       empty)
+            print(f"{name}: " + ", ".join(
+                f"{metric} {_format(metric, value)}"
+                for metric, value in benchmarks[name].items()),
+                file=sys.stderr)
+
+    return {
+        "config": {
+            "target": opts.target, "backend": opts.backend,
+            "opt_level": opts.opt_level, "repeat": opts.repeat,
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def _format(metric: str, value: Optional[float]) -> str:
+    if value is None:
+        return "-"
+    if METRICS[metric]:
+        return f"{value:.0f} nodes/s"
+    return f"{value * 1000:.2f} ms"
+
+
+def compare(before: Dict[str, Any], after: Dict[str, Any],
+            threshold: float) -> List[Dict[str, Any]]:
+    """Compares the measurements of two runs.
+
+    Returns:
+        One row per measurement taken in both runs, with its values, the
+        ratio of the new value to the old one, and whether it regressed,
+        that is got worse by more than threshold, a fraction of the old
+        value.
+    """
+    rows = []
+    for name, old_metrics in before["benchmarks"].items():
+        new_metrics = after["benchmarks"].get(name, {})
+        for metric, old in old_metrics.items():
+            new = new_metrics.get(metric)
+            if old is None or new is None or old == 0:
+                continue
+            ratio = new / old
+            worse = 1 / ratio - 1 if METRICS[metric] and ratio else \
+                ratio - 1
+            rows.append({"benchmark": name, "metric": metric, "before": old,
+                         "after": new, "ratio": ratio,
+                         "regressed": worse > threshold})
+    return rows
+
+
+def _compare(opts: argparse.Namespace) -> int:
+    reports = []
+    for path in (opts.before, opts.after):
+        with open(path) as f:
+            reports.append(json.load(f))
+    if reports[0]["config"] != reports[1]["config"]:
+        print("warning: the runs were configured differently",
+              file=sys.stderr)
+
+    rows = compare(*reports, opts.threshold)
+    print(f"{'benchmark':>12} {'metric':>8} {'before':>18} {'after':>18} "
+          f"{'change':>8}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regressed"] else ""
+        print(f"{row['benchmark']:>12} {row['metric']:>8} "
+              f"{_format(row['metric'], row['before']):>18} "
+              f"{_format(row['metric'], row['after']):>18} "
+              f"{(row['ratio'] - 1) * 100:>+7.1f}%{flag}")
+    return 1 if any(row["regressed"] for row in rows) else 0
+
+
+def _run(opts: argparse.Namespace) -> int:
+    report = run_suite(opts)
+    with open(opts.output, "w") as f:
+        json.dump(report, f, indent=2)
+    return 0
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = args.add_subparsers(dest="command", required=True)
+
+    run_args = commands.add_parser("run", help="run every benchmark")
+    run_args.add_argument("--output", "-o", default="benchmarks.json",
+                          help="file the results are written to, as JSON")
+    run_args.add_argument("--sizes", nargs="+", type=int,
+                          default=[100, 1000, 10000],
+                          help="statements in the wide programs")
+    run_args.add_argument("--nesting", type=int, default=3,
+                          help="nesting of the operands of each statement")
+    run_args.add_argument("--depths", nargs="+", type=int,
+                          default=[50, 200, 1000],
+                          help="forms nested in the deep programs")
+    run_args.add_argument("--repeat", type=int, default=5)
+    run_args.add_argument("-O", dest="opt_level", type=int, default=0)
+    run_args.add_argument("--backend", default="gcc")
+    run_args.add_argument("--target", default="x86_64")
+    run_args.set_defaults(func=_run)
+
+    compare_args = commands.add_parser(
+        "compare", help="compare two runs, flagging regressions")
+    compare_args.add_argument("before")
+    compare_args.add_argument("after")
+    compare_args.add_argument("--threshold", type=float, default=0.1,
+                              help="largest fraction a measurement may get "
+                                   "worse by")
+    compare_args.set_defaults(func=_compare)
+
+    opts = args.parse_args()
+    sys.exit(opts.func(opts))
+
+
+if __name__ == "__main__":
+    main()
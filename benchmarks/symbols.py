@@ -0,0 +1,123 @@
+"""
+Measures interning large sets of symbols, at compile time and at runtime.
+
+Run from the repository root with:
+
+    python -m benchmarks.symbols --sizes 16384 131072 1048576
+
+For each size n, a program counts through n distinct names of hexadecimal
+digits spelled with the letters a to p, in a string it updates in place.
+Without interning, the loop only updates the string; with it, each name is
+also made into a symbol with `string->symbol`, once in a single pass and
+twice in two, so that the second pass finds every symbol already made. The
+difference between the passes is the time to find an existing symbol, and
+the rest that of making a new one.
+
+Another program quotes n distinct names, which the compiler lays out once
+in the data section however many times they are quoted, and which the
+runtime puts in its table on the first `string->symbol`. Its compile time,
+without optimizations, and the time the runtime takes to seed the table
+are reported per name.
+
+Every binary is run `--repeat` times and the best time is reported.
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.timing import best_time
+from pasquim.compiler import Compiler
+
+
+LETTERS = "abcdefghijklmnop"
+
+
+def counting_program(digits: int, n: int, intern: bool, passes: int) -> str:
+    """Builds a program spelling n names of the given number of digits,
+    passes times, interning each one if intern is set."""
+    alphabet = " ".join(f"(primcall vector-set! alpha {i} {c})"
+                        for i, c in enumerate(LETTERS))
+    work = "(primcall string->symbol s)" if intern else "s"
+    loops = " ".join([f"(loop {n})"] * passes)
+    return (
+        f"(let ((alpha (primcall make-vector 16 a)) "
+        f"(digits (primcall make-vector {digits} 0)) "
+        f"(s (primcall make-string {digits} a))) {alphabet} "
+        f"(letrec ((next (lambda (i) (if (primcall = i {digits}) #f "
+        f"(let ((d (primcall add1 (primcall vector-ref digits i)))) "
+        f"(if (primcall = d 16) "
+        f"(let ((u (primcall vector-set! digits i 0))) "
+        f"(primcall string-set! s i a) (next (primcall add1 i))) "
+        f"(let ((u (primcall vector-set! digits i d))) "
+        f"(primcall string-set! s i (primcall vector-ref alpha d)) #t)))))) "
+        f"(loop (lambda (n) (if (primcall zero? n) 0 "
+        f"(let ((x {work})) (next 0) (loop (primcall sub1 n))))))) "
+        f"{loops} (primcall symbol? (primcall string->symbol s))))")
+
+
+def quoting_program(n: int) -> str:
+    """Builds a program quoting n distinct names, each twice."""
+    quotes = " ".join(f"(primcall vector-set! v {i} 'name{i})"
+                      for i in list(range(n)) * 2)
+    return f"(let ((v (primcall make-vector {n} 0)) " \
+           f"(x (primcall make-string 1 z))) {quotes} " \
+           f"(primcall symbol? (primcall string->symbol x)))"
+
+
+def build(path: str, program: str, opts: argparse.Namespace,
+          opt_level: int = 1) -> float:
+    """Builds program into path, returning the seconds it took."""
+    start = time.perf_counter()
+    Compiler(path, program, backend=opts.backend, target=opts.target,
+             opt_level=opt_level).compile_to_binary()
+    return time.perf_counter() - start
+
+
+def run(path: str, program: str, opts: argparse.Namespace,
+        opt_level: int = 1) -> float:
+    build(path, program, opts, opt_level)
+    return best_time(path, opts.repeat)
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    args.add_argument("--sizes", nargs="+", type=int,
+                      default=[2 ** 14, 2 ** 17, 2 ** 20],
+                      help="numbers of distinct names")
+    args.add_argument("--quoted", nargs="+", type=int,
+                      default=[1000, 10000],
+                      help="numbers of distinct names quoted by a program")
+    args.add_argument("--repeat", type=int, default=5)
+    args.add_argument("--backend", default="gcc")
+    args.add_argument("--target", default="x86_64")
+    opts = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'names':>9} {'new (ns)':>9} {'existing (ns)':>14}")
+        for n in sorted(opts.sizes):
+            digits = max(1, ((n - 1).bit_length() + 3) // 4)
+            seconds = {}
+            for intern in (False, True):
+                for passes in (1, 2):
+                    path = os.path.join(tmp, f"count-{n}-{intern}-{passes}")
+                    program = counting_program(digits, n, intern, passes)
+                    seconds[intern, passes] = run(path, program, opts)
+            new = seconds[True, 1] - seconds[False, 1]
+            existing = (seconds[True, 2] - seconds[False, 2]) - new
+            print(f"{n:>9} {max(new, 0) / n * 1e9:>9.1f} "
+                  f"{max(existing, 0) / n * 1e9:>14.1f}")
+
+        print()
+        print(f"{'quoted':>9} {'compile (us)':>13} {'seed (ns)':>10}")
+        empty = run(os.path.join(tmp, "empty"), quoting_program(0), opts, 0)
+        for n in sorted(opts.quoted):
+            path = os.path.join(tmp, f"quote-{n}")
+            compile_seconds = build(path, quoting_program(n), opts, 0)
+            seed = best_time(path, opts.repeat) - empty
+            print(f"{n:>9} {compile_seconds / n * 1e6:>13.1f} "
+                  f"{max(seed, 0) / n * 1e9:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
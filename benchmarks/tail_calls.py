@@ -0,0 +1,68 @@
+"""
+Measures loops written as tail calls, which must run in constant stack space.
+
+Run from the repository root with:
+
+    python -m benchmarks.tail_calls --iterations 1000000 10000000 100000000
+
+Each loop counts down from the number of iterations, once as a procedure
+calling itself and once as two procedures calling each other. Every binary
+is run `--repeat` times and the best time is reported per iteration. The
+binaries run with a stack of only `--stack` KB, far less than a frame per
+iteration would take, since calls in tail position reuse the frame of the
+caller.
+"""
+from typing import Callable, Dict
+import argparse
+import os
+import resource
+import tempfile
+
+from benchmarks.timing import best_time
+from pasquim.compiler import Compiler
+
+
+LOOPS: Dict[str, str] = {
+    'self': "(letrec ((loop (lambda (i acc) (if (primcall zero? i) acc "
+            "(loop (primcall sub1 i) (primcall add1 acc)))))) (loop {n} 0))",
+    'mutual': "(letrec ((even (lambda (i) (if (primcall zero? i) #t "
+              "(odd (primcall sub1 i))))) (odd (lambda (i) (if (primcall "
+              "zero? i) #f (even (primcall sub1 i)))))) (even {n}))",
+}
+
+
+def limit_stack(size: int) -> Callable[[], None]:
+    """Returns a function limiting the stack of the process it runs in to
+    size bytes."""
+    def limit() -> None:
+        resource.setrlimit(resource.RLIMIT_STACK, (size, size))
+    return limit
+
+
+def main() -> None:
+    args = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    args.add_argument("--iterations", nargs="+", type=int,
+                      default=[10 ** 6, 10 ** 7, 10 ** 8])
+    args.add_argument("--loops", nargs="+", default=list(LOOPS),
+                      choices=list(LOOPS))
+    args.add_argument("--repeat", type=int, default=3)
+    args.add_argument("--stack", type=int, default=256,
+                      help="KB of stack the binaries may use")
+    args.add_argument("--backend", default="gcc")
+    args.add_argument("--target", default="x86_64")
+    opts = args.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"{'loop':>8} {'iterations':>11} {'ns/iter':>8}")
+        for loop in opts.loops:
+            for n in sorted(opts.iterations):
+                path = os.path.join(tmp, f"{loop}-{n}")
+                Compiler(path, LOOPS[loop].format(n=n), backend=opts.backend,
+                         target=opts.target, opt_level=1).compile_to_binary()
+                seconds = best_time(path, opts.repeat,
+                                    limit_stack(opts.stack * 1024))
+                print(f"{loop:>8} {n:>11} {seconds / n * 1e9:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+"""
+Timing of compiled binaries, shared by the benchmarks.
+"""
+from typing import Callable, Optional
+import os
+import subprocess
+import time
+
+
+def best_time(path: str, repeat: int,
+              preexec_fn: Optional[Callable[[], None]] = None) -> float:
+    """Returns the best wall time of running the binary in path, in
+    seconds. preexec_fn, if given, runs in the child before the binary,
+    as in `subprocess.run`."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([os.path.join(path, "a.out")], check=True,
+                       stdout=subprocess.DEVNULL, preexec_fn=preexec_fn)
+        times.append(time.perf_counter() - start)
+    return min(times)
@@ -0,0 +1,183 @@
+from typing import List, Optional
+import argparse
+import json
+import os
+import sys
+import time
+
+from pasquim.batch import batch_summary, run_batch
+from pasquim.client import default_socket
+from pasquim.compiler import Compiler
+from pasquim.profiling import Instrumentation
+from pasquim.server import serve
+from pasquim.target import TARGETS
+
+
+"""
+Command-line interface.
+
+    python -m pasquim compile program.scm -o build --profile
+
+compiles the first expression of `program.scm` into `build/a.out`. With
+`--profile`, the time and sizes of each phase of compilation are printed to
+stderr; given a file name, they are written to it as JSON instead. With
+`--instrument`, the program writes a profile of the primitives it calls
+when it exits.
+
+    python -m pasquim batch programs/ -j 8 --timeout 10
+
+compiles and runs every `.scm` file in `programs/`, eight at a time,
+printing the result of each as a line of JSON as soon as it's done, and
+the number of programs run per second to stderr.
+
+    python -m pasquim serve -j 4
+
+keeps the compiler loaded in a server taking requests from
+`python -m pasquim.client` on a Unix socket, until it's told to shut down.
+"""
+
+
+def _compile(opts: argparse.Namespace) -> int:
+    with open(opts.program) as f:
+        program = f.read()
+    compiler = Compiler(opts.output, program, backend=opts.backend,
+                        target=opts.target, opt_level=opts.opt_level,
+                        use_ir=opts.ir, safe=opts.safe,
+                        instrument=opts.instrument, flat=opts.flat,
+                        exact=opts.exact)
+    compiler.compile_to_binary()
+
+    if opts.profile == "-":
+        print(compiler.stats.summary(), file=sys.stderr)
+    elif opts.profile is not None:
+        with open(opts.profile, "w") as f:
+            json.dump(compiler.stats.report(), f, indent=2)
+            f.write("\n")
+    return 0
+
+
+def _programs(paths: List[str]) -> List[str]:
+    """Lists the programs in paths, replacing directories by the `.scm`
+    files in them."""
+    programs = []
+    for path in paths:
+        if os.path.isdir(path):
+            programs += sorted(os.path.join(path, name)
+                               for name in os.listdir(path)
+                               if name.endswith(".scm"))
+        else:
+            programs.append(path)
+    return programs
+
+
+def _batch(opts: argparse.Namespace) -> int:
+    start = time.perf_counter()
+    results = []
+    for result in run_batch(_programs(opts.programs), workers=opts.jobs,
+                            timeout=opts.timeout, work_dir=opts.work_dir,
+                            backend=opts.backend, target=opts.target,
+                            opt_level=opts.opt_level, use_ir=opts.ir,
+                            safe=opts.safe, flat=opts.flat,
+                            exact=opts.exact):
+        print(json.dumps(result._asdict()), flush=True)
+        results.append(result)
+
+    summary = batch_summary(results, time.perf_counter() - start)
+    statuses = ", ".join(f"{count} {status}"
+                         for status, count in summary["statuses"].items())
+    print(f"{summary['programs']} programs in {summary['seconds']:.2f}s "
+          f"({summary['programs_per_second']:.1f}/s): {statuses or 'none'}",
+          file=sys.stderr)
+    return 0 if all(result.status == "ok" for result in results) else 1
+
+
+def _serve(opts: argparse.Namespace) -> int:
+    serve(opts.socket, workers=opts.jobs, timeout=opts.timeout,
+          backend=opts.backend, target=opts.target,
+          opt_level=opts.opt_level, use_ir=opts.ir, safe=opts.safe,
+          flat=opts.flat, exact=opts.exact)
+    return 0
+
+
+def _add_compile_options(args: argparse.ArgumentParser) -> None:
+    """Adds the options of the compiler shared by every command."""
+    args.add_argument("-O", dest="opt_level", type=int, default=0,
+                      help="optimization level")
+    args.add_argument("--backend", default="gcc",
+                      choices=Compiler.backends)
+    args.add_argument("--target", default="x86", choices=list(TARGETS))
+    args.add_argument("--ir", action="store_true",
+                      help="generate code through the IR")
+    args.add_argument("--safe", action="store_true",
+                      help="check the types of operands at runtime")
+    args.add_argument("--flat", action="store_true",
+                      help="read programs into flat arrays and compile "
+                           "them unoptimized, without recursion")
+    args.add_argument("--exact", action="store_true",
+                      help="overflow integers into bignums instead of "
+                           "wrapping around (x86_64 only)")
+
+
+def parser() -> argparse.ArgumentParser:
+    """Builds the parser of the command-line arguments."""
+    args = argparse.ArgumentParser(prog="pasquim",
+                                   description="A Scheme compiler.")
+    commands = args.add_subparsers(dest="command", required=True)
+
+    compile_args = commands.add_parser(
+        "compile", help="compile a program into an executable")
+    compile_args.add_argument("program", help="file holding the program")
+    compile_args.add_argument("-o", "--output", default=".",
+                              help="directory receiving compiled.s and "
+                                   "a.out")
+    _add_compile_options(compile_args)
+    compile_args.add_argument("--instrument",
+                              choices=Instrumentation.modes,
+                              help="count the calls of each primitive, or "
+                                   "their cycles too, as the program runs")
+    compile_args.add_argument("--profile", nargs="?", const="-",
+                              metavar="FILE",
+                              help="report the time and sizes of each phase "
+                                   "of compilation, to stderr or as JSON "
+                                   "to FILE")
+    compile_args.set_defaults(run=_compile)
+
+    batch_args = commands.add_parser(
+        "batch", help="compile and run many programs in parallel")
+    batch_args.add_argument("programs", nargs="+",
+                            help="files holding programs, or directories "
+                                 "of .scm files")
+    batch_args.add_argument("-j", "--jobs", type=int,
+                            help="most programs compiled or run at once; "
+                                 "defaults to the number of processors")
+    batch_args.add_argument("--timeout", type=float,
+                            help="seconds compiling and running each "
+                                 "program may take")
+    batch_args.add_argument("--work-dir",
+                            help="directory to keep the files built for "
+                                 "each program in")
+    _add_compile_options(batch_args)
+    batch_args.set_defaults(run=_batch)
+
+    serve_args = commands.add_parser(
+        "serve", help="serve compile requests on a Unix socket")
+    serve_args.add_argument("--socket", default=default_socket(),
+                            help="path of the socket to listen on")
+    serve_args.add_argument("-j", "--jobs", type=int,
+                            help="most programs compiled or run at once; "
+                                 "defaults to the number of processors")
+    serve_args.add_argument("--timeout", type=float,
+                            help="seconds compiling and running each "
+                                 "program may take, by default")
+    _add_compile_options(serve_args)
+    serve_args.set_defaults(run=_serve)
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    opts = parser().parse_args(argv)
+    return opts.run(opts)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
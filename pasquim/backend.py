@@ -0,0 +1,142 @@
+from typing import Dict, List
+
+from pasquim.emitter import Emitter
+from pasquim.ir import (
+    Function, Label, Operand, Var, branch_ops, is_var, liveness, successors
+)
+from pasquim.primitives import _move_immediate, _set_bool_from_flags
+from pasquim.target import Target
+
+
+"""
+Generates x86 assembly from IR functions.
+
+Every virtual register gets a location for its whole lifetime: the
+accumulator when the next instruction to run consumes it right away,
+otherwise a scratch register of the target, or a stack slot once all of
+them hold live values. Instructions then compute their result in the
+accumulator and store it to the location of their destination, and
+conditional jumps compare their first operand in the accumulator.
+"""
+
+setcc = {"eq": "sete", "lt": "setl"}
+jcc = {"jeq": "je", "jne": "jne", "jlt": "jl", "jge": "jge"}
+
+
+def _next_to_run(func: Function, i: int, following: List[List[int]]) -> int:
+    """Finds the instruction running after i, past jumps and labels, which
+    leave the accumulator alone."""
+    i = following[i][0]
+    while func.instructions[i].op in ("jump", "label"):
+        i = following[i][0]
+    return i
+
+
+def _consumed_next(func: Function, following: List[List[int]]
+                   ) -> Dict[Var, bool]:
+    """Checks, for every register, if it's only read as the first operand
+    of the instruction running right after each definition of it, which
+    loads it into the accumulator."""
+    uses: Dict[Var, int] = {}
+    for instr in func.instructions:
+        for arg in instr.args:
+            if is_var(arg):
+                uses[arg] = uses.get(arg, 0) + 1
+
+    consumed: Dict[Var, bool] = {}
+    for i, instr in enumerate(func.instructions):
+        if instr.dest is None or instr.op == "ret":
+            continue
+        reader = func.instructions[_next_to_run(func, i, following)]
+        consumed[instr.dest] = consumed.get(instr.dest, True) and \
+            uses.get(instr.dest) == 1 and reader.args[:1] == (instr.dest,)
+    return consumed
+
+
+def allocate(func: Function, target: Target) -> Dict[Var, str]:
+    """Assigns a location to every virtual register of func.
+
+    A register is stored where no register live at its definition is, so
+    the operands read for the last time give their location back, since
+    the result is only stored once they have been read. The value of a
+    conditional keeps the location of its first definition.
+
+    Returns:
+        The location of each register, as an assembly operand.
+    """
+    live_out = liveness(func)
+    consumed = _consumed_next(func, successors(func))
+    slots: List[str] = []
+    locations: Dict[Var, str] = {}
+
+    for i, instr in enumerate(func.instructions):
+        if instr.dest is None or instr.dest in locations:
+            continue
+        if instr.dest not in live_out[i] or consumed[instr.dest]:
+            locations[instr.dest] = target.ax
+            continue
+        taken = {locations[var] for var in live_out[i] if var in locations}
+        free = [location for location in [*target.scratch, *slots]
+                if location not in taken]
+        if not free:
+            slots.append(f"{-target.wordsize * (len(slots) + 1)}"
+                         f"({target.sp})")
+            free = slots[-1:]
+        locations[instr.dest] = free[0]
+    return locations
+
+
+def generate(func: Function, out: Emitter) -> None:
+    """Appends the instructions computing func to the emitter `out`.
+
+    The result is left in the accumulator.
+    """
+    t, s = out.target, out.target.suffix
+    locations = allocate(func, t)
+    labels: Dict[Label, str] = {}
+
+    def operand(arg: Operand) -> str:
+        return locations[arg] if is_var(arg) else f"${arg}"
+
+    def load(arg: Operand) -> None:
+        if not is_var(arg):
+            _move_immediate(arg, out)
+        elif locations[arg] != t.ax:
+            out.emit(f"mov{s} {locations[arg]}, {t.ax}")
+
+    def label(name: Label) -> str:
+        if name not in labels:
+            labels[name] = out.label()
+        return labels[name]
+
+    for instr in func.instructions:
+        if instr.op == "const":
+            _move_immediate(instr.args[0], out)
+        elif instr.op == "move":
+            load(instr.args[0])
+        elif instr.op == "label":
+            out.emit(f"{label(instr.args[0])}:")
+            continue
+        elif instr.op == "jump":
+            out.emit(f"jmp {label(instr.args[0])}")
+            continue
+        elif instr.op in branch_ops:
+            first, second, target = instr.args
+            load(first)
+            out.emit(f"cmp{s} {operand(second)}, {t.ax}")
+            out.emit(f"{jcc[instr.op]} {label(target)}")
+            continue
+        elif instr.op == "ret":
+            load(instr.args[0])
+            continue
+        else:
+            first, second = instr.args
+            load(first)
+            if instr.op in setcc:
+                out.emit(f"cmp{s} {operand(second)}, {t.ax}")
+                _set_bool_from_flags(setcc[instr.op], out)
+            else:
+                out.emit(f"{instr.op}{s} {operand(second)}, {t.ax}")
+
+        if locations[instr.dest] != t.ax:
+            out.emit(f"mov{s} {t.ax}, {locations[instr.dest]}")
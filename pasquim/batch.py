@@ -0,0 +1,154 @@
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional
+import os
+import signal
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pasquim.compiler import Compiler
+
+
+"""
+Compiling and running many programs at once.
+
+Each program is compiled and run by a job of its own, in a pool of worker
+processes. Every job builds in a directory of its own, so their
+`compiled.s` and `a.out` never clash, while the runtime and linked binaries
+come from the build cache the workers share.
+
+A job ends with one of these statuses:
+
+    ok       the program ran and exited with status 0
+    failed   the program exited with another status, such as a type error
+             in safe mode
+    error    the program couldn't be read or compiled
+    timeout  compiling and running it took longer than the job's timeout
+"""
+
+
+class JobTimeout(Exception):
+    """Raised in a job that ran out of time."""
+
+
+class JobResult(NamedTuple):
+    """What compiling and running a single program gave.
+
+    `compile_seconds` and `run_seconds` are None when the job didn't get
+    that far, and `exit_code` when the program didn't run to completion.
+    """
+    program: str
+    status: str
+    exit_code: Optional[int]
+    stdout: str
+    error: str
+    compile_seconds: Optional[float]
+    run_seconds: Optional[float]
+
+
+def _on_alarm(signum: int, frame: Any) -> None:
+    raise JobTimeout()
+
+
+def run_job(program: str, work_dir: str, timeout: Optional[float] = None,
+            options: Optional[Dict[str, Any]] = None,
+            source: Optional[str] = None, execute: bool = True) -> JobResult:
+    """Compiles the program in the file `program` into work_dir and runs it.
+
+    Args:
+        program (str): Path of the file holding the program.
+        work_dir (str): Directory receiving compiled.s and a.out.
+        timeout (float, optional): Seconds compiling and running may take
+            together before the job is stopped, killing any tool or
+            program it's waiting on.
+        options (dict, optional): Keyword arguments for `Compiler`.
+        source (str, optional): The program itself, in which case
+            `program` only names it in the result.
+        execute (bool): Whether to run the program once compiled. If not,
+            a job that compiled is ok.
+    """
+    times: List[Optional[float]] = []
+    exit_code, stdout = None, ""
+    previous = signal.getsignal(signal.SIGALRM)
+    start = time.perf_counter()
+    try:
+        if timeout is not None:
+            signal.signal(signal.SIGALRM, _on_alarm)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        if source is None:
+            with open(program) as f:
+                source = f.read()
+        Compiler(work_dir, source, **(options or {})).compile_to_binary()
+        times.append(time.perf_counter() - start)
+        if not execute:
+            return JobResult(program, "ok", None, "", "", times[0], None)
+
+        result = subprocess.run([os.path.join(work_dir, "a.out")],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True,
+                                errors="replace")
+        times.append(time.perf_counter() - start - times[0])
+        exit_code, stdout, error = \
+            result.returncode, result.stdout, result.stderr
+        status = "ok" if exit_code == 0 else "failed"
+    except JobTimeout:
+        status, error = "timeout", f"took longer than {timeout}s"
+    except Exception as e:
+        status, error = "error", f"{type(e).__name__}: {e}"
+    finally:
+        if timeout is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous)
+
+    times += [None] * (2 - len(times))
+    return JobResult(program, status, exit_code, stdout, error, *times)
+
+
+def run_batch(programs: Iterable[str], workers: Optional[int] = None,
+              timeout: Optional[float] = None,
+              work_dir: Optional[str] = None,
+              **options: Any) -> Iterator[JobResult]:
+    """Compiles and runs every program over a pool of processes.
+
+    Results are yielded as jobs finish, which needn't be the order of
+    programs.
+
+    Args:
+        programs (Iterable[str]): Paths of the files holding the programs.
+        workers (int, optional): Most jobs run at once. Defaults to the
+            number of processors.
+        timeout (float, optional): Seconds each job may take.
+        work_dir (str, optional): Directory the jobs build in, one
+            subdirectory per job, which is left in place afterwards. By
+            default, a temporary directory is made and removed at the end.
+        **options: Keyword arguments for the `Compiler` of each job.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        root = work_dir if work_dir is not None else tmp
+        with ProcessPoolExecutor(workers) as pool:
+            jobs = [pool.submit(run_job, program,
+                                os.path.join(root, f"job-{i}"), timeout,
+                                options)
+                    for i, program in enumerate(programs)]
+            for job in as_completed(jobs):
+                yield job.result()
+
+
+def batch_summary(results: List[JobResult], seconds: float) -> Dict[str, Any]:
+    """Sums up a batch that took the given wall time.
+
+    Returns:
+        The number of programs, of each status and per second, and the
+        seconds spent compiling and running over all jobs.
+    """
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[result.status] = statuses.get(result.status, 0) + 1
+    return {
+        "programs": len(results),
+        "statuses": statuses,
+        "seconds": seconds,
+        "programs_per_second": len(results) / seconds if seconds else 0.0,
+        "compile_seconds": sum(r.compile_seconds or 0 for r in results),
+        "run_seconds": sum(r.run_seconds or 0 for r in results),
+    }
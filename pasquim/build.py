@@ -0,0 +1,138 @@
+from typing import Dict, List, Optional, Sequence
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+from pathlib import Path
+
+
+RUNTIME_SOURCE = Path(__file__).parent.joinpath("src", "rts.c")
+DEFAULT_FLAGS = ("-fomit-frame-pointer", "-m32")
+
+
+class BuildError(Exception):
+    """Raised when the C compiler, assembler or linker fails."""
+
+
+def run_tool(cmd: Sequence[str]) -> None:
+    """Runs an external build tool, raising BuildError if it fails."""
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, text=True)
+    except OSError as e:
+        raise BuildError(f"could not run {cmd[0]}: {e}") from e
+
+    if result.returncode != 0:
+        raise BuildError(f"{' '.join(cmd)} failed with exit code "
+                         f"{result.returncode}:\n{result.stderr}")
+
+
+def _digest(*parts: bytes) -> str:
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(len(part).to_bytes(8, 'little'))
+        h.update(part)
+    return h.hexdigest()
+
+
+class BuildCache:
+    """Content-addressed cache for the runtime object and linked binaries.
+
+    The runtime is compiled once per distinct `rts.c` and set of flags, and
+    each binary is stored under a hash of its assembly, the flags and the
+    runtime it was linked against, so repeated builds of the same program
+    skip gcc entirely. Entries are written atomically, so several processes
+    can share one cache directory.
+
+    Args:
+        root (str, optional): Cache directory. Defaults to the
+            `PASQUIM_CACHE_DIR` environment variable, or `pasquim` inside the
+            user's cache directory.
+        cc (str): C compiler driver used to assemble and link.
+    """
+    def __init__(self, root: Optional[str] = None, cc: str = "gcc") -> None:
+        if root is None:
+            root = os.environ.get("PASQUIM_CACHE_DIR")
+        if root is None:
+            base = os.environ.get("XDG_CACHE_HOME",
+                                  Path.home().joinpath(".cache"))
+            root = Path(base).joinpath("pasquim")
+        self.root = Path(root)
+        self.cc = cc
+
+        self.stats: Dict[str, int] = {
+            "runtime_hits": 0, "runtime_misses": 0,
+            "binary_hits": 0, "binary_misses": 0
+        }
+
+    def _store(self, path: Path, cmd: List[str], output: Path) -> None:
+        """Runs cmd, which writes `output`, then moves it to path."""
+        run_tool(cmd)
+        os.replace(output, path)
+
+    def runtime_key(self, flags: Sequence[str]) -> str:
+        """Hash identifying the runtime object for the given flags."""
+        return _digest(RUNTIME_SOURCE.read_bytes(), " ".join(flags).encode())
+
+    def runtime_object(self, flags: Sequence[str] = DEFAULT_FLAGS) -> Path:
+        """Returns the compiled runtime, building it on a cache miss."""
+        path = self.root.joinpath("runtime", f"{self.runtime_key(flags)}.o")
+        if path.exists():
+            self.stats["runtime_hits"] += 1
+            return path
+
+        self.stats["runtime_misses"] += 1
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=path.parent) as tmp:
+            output = Path(tmp).joinpath("rts.o")
+            self._store(path, [self.cc, *flags, "-c", str(RUNTIME_SOURCE),
+                               "-o", str(output)], output)
+        return path
+
+    def _cached_build(self, asm_path: Path, flags: Sequence[str],
+                      link_flags: Sequence[str], suffix: str) -> Path:
+        """Returns asm_path linked with the runtime, building on a miss."""
+        runtime = self.runtime_object(flags)
+        key = _digest(asm_path.read_bytes(), " ".join(flags).encode(),
+                      " ".join(link_flags).encode(), runtime.stem.encode())
+        path = self.root.joinpath("bin", key + suffix)
+
+        if path.exists():
+            self.stats["binary_hits"] += 1
+        else:
+            self.stats["binary_misses"] += 1
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with tempfile.TemporaryDirectory(dir=path.parent) as tmp:
+                binary = Path(tmp).joinpath("a.out")
+                self._store(path, [self.cc, *flags, *link_flags,
+                                   str(asm_path), str(runtime),
+                                   "-o", str(binary)], binary)
+        return path
+
+    def link(self, asm_path: Path, output: Path,
+             flags: Sequence[str] = DEFAULT_FLAGS) -> None:
+        """Assembles asm_path and links it with the runtime into output."""
+        shutil.copy(self._cached_build(asm_path, flags, (), ""), output)
+
+    def shared_library(self, asm_path: Path,
+                       flags: Sequence[str] = DEFAULT_FLAGS) -> Path:
+        """Builds asm_path and the runtime into a shared library.
+
+        The library is returned from the cache directly, named after the
+        hash of its contents, so each distinct program gets its own path
+        and can be loaded next to others in the same process.
+        """
+        return self._cached_build(asm_path, (*flags, "-fPIC"),
+                                  ("-shared",), ".so")
+
+
+_default_cache: Optional[BuildCache] = None
+
+
+def default_cache() -> BuildCache:
+    """Returns the build cache shared by every Compiler in this process."""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = BuildCache()
+    return _default_cache
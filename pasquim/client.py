@@ -0,0 +1,141 @@
+from typing import Any, Dict, List, Optional
+import argparse
+import json
+import os
+import socket
+import sys
+
+
+"""
+Client of the compile server.
+
+Talks to a running `python -m pasquim serve` over its Unix socket, one
+request and one response per line of JSON. It only needs the standard
+library, so it starts much faster than the compiler itself:
+
+    python -m pasquim.client run program.scm
+    python -m pasquim.client compile program.scm -o build -O 1
+    python -m pasquim.client stats
+
+A request is an object with an `op`, one of:
+
+    compile   compiles `program` into the directory `output`
+    run       compiles `program` in a scratch directory and runs it
+    stats     reports what the server did so far, with latency percentiles
+    shutdown  stops the server once running requests are done
+
+Compile and run requests may also give `options`, keyword arguments for
+the `Compiler` overriding the server's, and a `timeout` in seconds. Their
+response is a `JobResult` as a JSON object.
+"""
+
+
+def default_socket() -> str:
+    """The socket the server listens on by default: `PASQUIM_SOCKET`, or
+    `pasquim.sock` in the user's runtime directory or /tmp."""
+    path = os.environ.get("PASQUIM_SOCKET")
+    if path is not None:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir is not None:
+        return os.path.join(runtime_dir, "pasquim.sock")
+    return os.path.join("/tmp", f"pasquim-{os.getuid()}.sock")
+
+
+def request(message: Dict[str, Any],
+            path: Optional[str] = None) -> Dict[str, Any]:
+    """Sends a request to the server at path and returns its response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(path if path is not None else default_socket())
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("rb") as f:
+            line = f.readline()
+    if not line:
+        raise ConnectionError("The server closed the connection.")
+    return json.loads(line)
+
+
+def _options(opts: argparse.Namespace) -> Dict[str, Any]:
+    """The compiler options given on the command line, leaving the rest to
+    the server."""
+    options = {"opt_level": opts.opt_level, "backend": opts.backend,
+               "target": opts.target, "use_ir": opts.ir or None,
+               "safe": opts.safe or None, "flat": opts.flat or None,
+               "exact": opts.exact or None}
+    return {name: value for name, value in options.items()
+            if value is not None}
+
+
+def _job(opts: argparse.Namespace) -> Dict[str, Any]:
+    with open(opts.program) as f:
+        message: Dict[str, Any] = {"op": opts.op, "program": f.read(),
+                                   "options": _options(opts)}
+    if opts.op == "compile":
+        message["output"] = os.path.abspath(opts.output)
+    if opts.timeout is not None:
+        message["timeout"] = opts.timeout
+    return message
+
+
+def parser() -> argparse.ArgumentParser:
+    """Builds the parser of the command-line arguments."""
+    args = argparse.ArgumentParser(prog="pasquim.client",
+                                   description="Sends requests to a "
+                                               "pasquim compile server.")
+    args.add_argument("--socket", default=default_socket(),
+                      help="path of the server's socket")
+    ops = args.add_subparsers(dest="op", required=True)
+
+    for op, description in (("compile", "compile a program"),
+                            ("run", "compile and run a program")):
+        job = ops.add_parser(op, help=description)
+        job.add_argument("program", help="file holding the program")
+        if op == "compile":
+            job.add_argument("-o", "--output", default=".",
+                             help="directory receiving compiled.s and "
+                                  "a.out")
+        job.add_argument("-O", dest="opt_level", type=int,
+                         help="optimization level")
+        job.add_argument("--backend")
+        job.add_argument("--target")
+        job.add_argument("--ir", action="store_true",
+                         help="generate code through the IR")
+        job.add_argument("--safe", action="store_true",
+                         help="check the types of operands at runtime")
+        job.add_argument("--flat", action="store_true",
+                         help="compile without recursion")
+        job.add_argument("--exact", action="store_true",
+                         help="overflow integers into bignums")
+        job.add_argument("--timeout", type=float,
+                         help="seconds the request may take")
+
+    ops.add_parser("stats", help="print the server's statistics")
+    ops.add_parser("shutdown", help="stop the server")
+    return args
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    opts = parser().parse_args(argv)
+    message = _job(opts) if opts.op in ("compile", "run") else \
+        {"op": opts.op}
+    try:
+        response = request(message, opts.socket)
+    except OSError as e:
+        print(f"Can't reach the server at {opts.socket}: {e}",
+              file=sys.stderr)
+        return 1
+
+    if opts.op not in ("compile", "run"):
+        print(json.dumps(response, indent=2))
+        return 0
+    sys.stdout.write(response.get("stdout", ""))
+    if response.get("error"):
+        print(response["error"].rstrip("\n"), file=sys.stderr)
+    if response["status"] in ("ok", "failed") and \
+            response.get("exit_code") is not None:
+        return response["exit_code"]
+    return 0 if response["status"] == "ok" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
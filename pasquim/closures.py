@@ -0,0 +1,174 @@
+from typing import Any, FrozenSet, List, Set
+
+from pasquim.parser import rebuild
+from pasquim.primitives import (
+    is_application, is_primitive_call, is_special_form, parse_lambda,
+    parse_let
+)
+
+
+"""
+Closure conversion.
+
+Turns a program using `lambda`, `letrec` and procedure calls into the
+forms code generation implements:
+
+    (let ((n 1))
+      ((lambda (x) (primcall + x n)) 2))
+
+becomes
+
+    (labels ((lambda0 (code (x) (n) (primcall + x n))))
+      (let ((n 1))
+        (funcall (closure lambda0 n) 2)))
+
+Every lambda is lifted to the code of a label, which takes the values of the
+lambda's free variables, the variables of enclosing scopes it refers to,
+from the closure built where the lambda was. The bindings of `letrec` become
+such closures. Calls in tail position of a procedure become `tail-call`,
+which reuses the frame of the running procedure.
+
+Names of a single character are char literals unless a variable of that name
+is in scope, so only those are free variables.
+"""
+
+Scope = FrozenSet[str]
+
+
+def _names(expr: Any, found: Set[str]) -> Set[str]:
+    """Every string in expr, so that labels don't clash with any."""
+    if isinstance(expr, str):
+        found.add(expr)
+    elif isinstance(expr, list):
+        for sub in expr:
+            _names(sub, found)
+    return found
+
+
+def free_variables(expr: Any, scope: Scope,
+                   bound: Scope = frozenset()) -> List[str]:
+    """Variables of scope that expr refers to, in order of first use.
+
+    Args:
+        scope (Scope): Variables in scope around expr.
+        bound (Scope): Names bound inside expr, shadowing those of scope.
+    """
+    found: List[str] = []
+    _free(expr, scope, bound, found)
+    return found
+
+
+def _free(expr: Any, scope: Scope, bound: Scope, found: List[str]) -> None:
+    if isinstance(expr, str):
+        if expr in scope and expr not in bound and expr not in found:
+            found.append(expr)
+    elif is_primitive_call(expr):
+        for arg in expr[2:]:
+            _free(arg, scope, bound, found)
+    elif is_special_form(expr) and expr[0] in ('let', 'letrec'):
+        bindings, body = parse_let(expr[1:])
+        inner = bound | {name for name, _ in bindings}
+        for _, init in bindings:
+            _free(init, scope, inner if expr[0] == 'letrec' else bound,
+                  found)
+        for body_expr in body:
+            _free(body_expr, scope, inner, found)
+    elif is_special_form(expr) and expr[0] == 'lambda':
+        params, body = parse_lambda(expr[1:])
+        for body_expr in body:
+            _free(body_expr, scope, bound | set(params), found)
+    elif is_special_form(expr) and expr[0] == 'quote':
+        return  # names quoted aren't variables
+    elif isinstance(expr, list):
+        for sub in expr[1:] if is_special_form(expr) else expr:
+            _free(sub, scope, bound, found)
+
+
+class _Converter:
+    def __init__(self, expr: Any) -> None:
+        self.names = _names(expr, set())
+        self.labels: List[list] = []
+        self.count = 0
+        self.converted = False
+
+    def label(self) -> str:
+        """Returns a new label name, which no name of the program is."""
+        while f"lambda{self.count}" in self.names:
+            self.count += 1
+        self.count += 1
+        return f"lambda{self.count - 1}"
+
+    def convert(self, expr: Any, scope: Scope, tail: bool) -> Any:
+        """Converts expr, whose variables in scope are those of scope.
+
+        Args:
+            tail (bool): Whether expr is in tail position of a procedure.
+        """
+        if is_primitive_call(expr):
+            return rebuild(expr, expr[:2] + [self.convert(arg, scope, False)
+                                             for arg in expr[2:]])
+        if is_special_form(expr):
+            return self._convert_form(expr, scope, tail)
+        if is_application(expr):
+            self.converted = True
+            return ['tail-call' if tail else 'funcall'] + \
+                [self.convert(sub, scope, False) for sub in expr]
+        return expr
+
+    def _convert_form(self, expr: list, scope: Scope, tail: bool) -> Any:
+        form, args = expr[0], expr[1:]
+        if form == 'if' and len(args) == 3:
+            return [form, self.convert(args[0], scope, False),
+                    self.convert(args[1], scope, tail),
+                    self.convert(args[2], scope, tail)]
+        if form in ('and', 'or'):
+            return [form] + [self.convert(arg, scope, tail and
+                                          i == len(args) - 1)
+                             for i, arg in enumerate(args)]
+        if form == 'quote':
+            return expr
+        if form == 'lambda':
+            self.converted = True
+            return self.closure(expr, scope)
+        if form in ('let', 'letrec'):
+            bindings, body = parse_let(args)
+            inner = scope | {name for name, _ in bindings}
+            if form == 'letrec':
+                self.converted = True
+                for _, init in bindings:
+                    if not (is_special_form(init) and init[0] == 'lambda'):
+                        raise ValueError("letrec binds names to lambdas.")
+                inits = [self.closure(init, inner) for _, init in bindings]
+            else:
+                inits = [self.convert(init, scope, False)
+                         for _, init in bindings]
+            return [form, [[name, init] for (name, _), init
+                           in zip(bindings, inits)]] + \
+                self._convert_body(body, inner, tail)
+        return [form] + [self.convert(arg, scope, False) for arg in args]
+
+    def _convert_body(self, body: list, scope: Scope, tail: bool) -> list:
+        return [self.convert(expr, scope, tail and i == len(body) - 1)
+                for i, expr in enumerate(body)]
+
+    def closure(self, expr: list, scope: Scope) -> list:
+        """Lifts a lambda to a label, returning the closure replacing it."""
+        params, body = parse_lambda(expr[1:])
+        free = free_variables(body, scope, frozenset(params))
+        label = self.label()
+        code = ['code', params, free] + self._convert_body(
+            body, frozenset(params) | frozenset(free), True)
+        self.labels.append([label, code])
+        return ['closure', label] + free
+
+
+def convert(expr: Any) -> Any:
+    """Closure converts a program.
+
+    Programs without procedures are returned unchanged.
+    """
+    converter = _Converter(expr)
+    body = converter.convert(expr, frozenset(), False)
+    if not converter.converted:
+        return expr
+    return ['labels', converter.labels, body]
@@ -1,14 +1,74 @@
-from typing import Union
-import os
+from typing import Any, Dict, List, Optional, TextIO, Union
+import ctypes
+import sys
 from pathlib import Path
 
-from pasquim.parser import Lexer, Parser
-from pasquim.primitives import compile_expr, wordsize
+from pasquim import closures, flat, ir
+from pasquim.backend import generate
+from pasquim.build import BuildCache, default_cache
+from pasquim.elf import build_executable
+from pasquim.emitter import Emitter
+from pasquim.flat import FlatTree
+from pasquim.inference import TypeChecks
+from pasquim.optimizer import PassManager
+from pasquim.peephole import Peephole
+from pasquim.parser import Reader
+from pasquim.profiling import CompileStats, Instrumentation, program_size
+from pasquim.primitives import (
+    compile_expr, decode_immediate, heap_epilogue, heap_prologue, pair_tag,
+    ptr_mask, str_tag, sym_tag, vec_tag
+)
+from pasquim.target import Target, get_target, host_target
 
 # A Scheme expression, which can be an Atom or List
 Exp = Union[str, int, float, list]
 
 
+class Symbol(str):
+    """A symbol returned by `Compiler.evaluate`, told apart from a string
+    or a char by its type and equal to the str of its name."""
+    def __repr__(self) -> str:
+        return f"Symbol({str.__repr__(self)})"
+
+
+def _decode_value(word: int, heap: int, target: Target,
+                  exact: bool = False) -> Any:
+    """Converts a word returned by `scheme_entry` to a Python object.
+
+    Pairs become tuples, vectors lists and strings str, read from the heap
+    of the loaded library, whose address is heap. Symbols, wherever they
+    are, become `Symbol`. With exact integers, bignums become int, wherever
+    they are.
+    """
+    def read(address: int) -> int:
+        return ctypes.c_ssize_t.from_address(address).value
+
+    tag, address = word & ptr_mask, word & ~ptr_mask
+    w = target.wordsize
+    if tag == sym_tag:
+        length = read(address) >> target.fixnum_shift
+        return Symbol(ctypes.string_at(address + w, length).decode())
+    if exact and tag == target.bignum_tag:
+        length = read(address) >> target.fixnum_shift
+        limbs = ctypes.string_at(address + w, abs(length) * w)
+        value = int.from_bytes(limbs, "little")
+        return -value if length < 0 else value
+    free, space = read(heap), read(heap + 3 * w)
+    if tag not in (pair_tag, vec_tag, str_tag) or \
+            not space <= address < free:
+        return decode_immediate(word, target)
+
+    if tag == pair_tag:
+        return (_decode_value(read(address), heap, target, exact),
+                _decode_value(read(address + w), heap, target, exact))
+    length = read(address) >> target.fixnum_shift
+    if tag == vec_tag:
+        return [_decode_value(read(address + w * (i + 1)), heap, target,
+                              exact)
+                for i in range(length)]
+    return ctypes.string_at(address + w, length).decode("latin-1")
+
+
 class Compiler:
     """A Scheme compiler.
 
@@ -17,14 +77,124 @@ class Compiler:
 
     Args:
         path (str): Path where compiled program will be saved.
-        program (str): Scheme program to be compiled.
+        program (str, optional): Scheme program to be compiled. May be left
+            out when only `compile_many` is used.
+        cache (BuildCache, optional): Cache used to build binaries. Defaults
+            to the cache shared by the whole process.
+        backend (str): How binaries are built: "gcc" assembles and links
+            with the C runtime through gcc, while "builtin" encodes the
+            program itself and writes a static executable with a minimal
+            runtime, without any external toolchain. Only the x86 target is
+            supported by the builtin backend.
+        target (str): Machine to generate code for, either "x86" (32-bit,
+            the default) or "x86_64".
+        opt_level (int): Optimization level. 0 compiles every expression
+            as written, while 1 enables constant folding, algebraic
+            simplification and the folding of type predicates whose value
+            type inference determines.
+        enable (List[str], optional): Optimization passes to run regardless
+            of opt_level.
+        disable (List[str], optional): Optimization passes to skip
+            regardless of opt_level.
+        peephole (bool, optional): Whether to run the peephole optimizer on
+            the generated instructions. Defaults to on from opt_level 1.
+        peephole_stats (bool): Print the number of instructions before and
+            after the peephole optimizer to stderr after each compilation.
+        use_ir (bool): Lower expressions to the linear IR in `pasquim.ir`
+            and generate code from it, instead of generating code straight
+            from the syntax tree. From opt_level 1, the IR is optimized too.
+            Expressions using forms the IR doesn't cover yet, such as
+            procedures or pairs, are still compiled straight from the syntax
+            tree, and so are programs compiled in safe mode.
+        safe (bool): Check the types of the operands of primitives at
+            runtime, so that a wrong one makes the program report it and
+            exit with status 1 instead of computing garbage. Checks that
+            type inference proves always pass are left out, and type
+            predicates are folded as from opt_level 1.
+        type_stats (bool): Print the number of runtime checks generated
+            and removed, and of type predicates folded, to stderr after each
+            compilation.
+        instrument (str, optional): Instrument the calls of primitives, so
+            the program writes how many times each one ran to a profile at
+            exit, as described in `pasquim.profiling`. "counts" only counts
+            the calls, while "cycles" also adds up the cycles each call
+            takes. Like safe mode, it compiles straight from the syntax
+            tree, and it needs the gcc backend.
+        flat (bool): Read programs straight into a `FlatTree`, which takes
+            a fraction of the memory of lists, and generate code from it
+            without optimizing it or recursing, as described in
+            `pasquim.flat`. Programs making procedures are still compiled
+            from lists. Programs nested deeper than `flat.MAX_DEPTH` are
+            compiled from flat trees either way.
+        exact (bool): Make integer arithmetic exact, as described in
+            `pasquim.primitives`: fixnums are still added, multiplied and
+            compared inline, but results that overflow them become bignums
+            instead of wrapping around. Only supported by the x86_64
+            target, whose fixnums leave a tag free. Like safe mode, it
+            compiles straight from the syntax tree, and constant folding is
+            skipped.
+
+    Attributes:
+        stats (CompileStats): Time spent in each phase of the last
+            compilation, from reading the program to building the binary,
+            and the number of tokens, nodes, instructions and bytes each
+            phase handled.
     """
-    def __init__(self, path: str, program: str) -> None:
+    backends = ("gcc", "builtin")
+
+    def __init__(self, path: str, program: Optional[str] = None,
+                 cache: Optional[BuildCache] = None,
+                 backend: str = "gcc", target: str = "x86",
+                 opt_level: int = 0, enable: Optional[List[str]] = None,
+                 disable: Optional[List[str]] = None,
+                 peephole: Optional[bool] = None,
+                 peephole_stats: bool = False, use_ir: bool = False,
+                 safe: bool = False, type_stats: bool = False,
+                 instrument: Optional[str] = None, flat: bool = False,
+                 exact: bool = False) -> None:
+        if backend not in self.backends:
+            raise ValueError(f"Unknown backend {backend}, expected one of "
+                             f"{', '.join(self.backends)}.")
+        self.target = get_target(target)
+        if backend == "builtin" and self.target.name != "x86":
+            raise ValueError("The builtin backend only supports the x86 "
+                             "target.")
+        if instrument is not None and \
+                instrument not in Instrumentation.modes:
+            raise ValueError(f"Unknown instrumentation {instrument}, "
+                             f"expected one of "
+                             f"{', '.join(Instrumentation.modes)}.")
+        if instrument is not None and backend == "builtin":
+            raise ValueError("The builtin backend can't instrument "
+                             "programs.")
+        if exact and self.target.bignum_tag is None:
+            raise ValueError(f"Exact integers need a tag for bignums, which "
+                             f"the {self.target.name} target lacks.")
+
         self.path = self._prep_output(path)
-        parser = Parser(Lexer(program).tokenize())
-        self.program = parser.parse()
+        self.flat = flat
+        self.stats = CompileStats()
+        self.program = self._read(program) if program is not None else None
+        self._read_stats = self.stats  # reading self.program, done once
+        self.cache = cache if cache is not None else default_cache()
+        self.backend = backend
+        self.pass_manager = PassManager(self.target, opt_level,
+                                        enable, disable, safe, exact)
+        if peephole is None:
+            peephole = opt_level >= 1
+        self.peephole = Peephole(self.target) if peephole else None
+        self.peephole_stats = peephole_stats
+        self.opt_level = opt_level
+        self.use_ir = use_ir and not safe and instrument is None and \
+            not exact
+        self.checks = TypeChecks(self.target, safe) \
+            if safe or opt_level >= 1 else None
+        self.type_stats = type_stats
+        self.instrument = instrument
+        self.exact = exact
 
-        self.asm_program = ""
+        self.emitter = Emitter(target=self.target, checks=self.checks,
+                               exact=exact)
 
     @staticmethod
     def _prep_output(path: str) -> Path:
@@ -34,46 +204,358 @@ class Compiler:
 
         return output_path
 
+    def _read(self, program: str) -> Union[Exp, FlatTree]:
+        """Reads program, measuring its size and the time it took."""
+        if self.flat:
+            with self.stats.phase("read"):
+                tree = FlatTree.read(program)
+            self.stats.count("tokens", tree.tokens)
+            self.stats.count("nodes", len(tree))
+            return tree
+
+        with self.stats.phase("read"):
+            expr = Reader(program).read()
+        tokens, nodes = program_size(expr)
+        self.stats.count("tokens", tokens)
+        self.stats.count("nodes", nodes)
+        return expr
+
+    @property
+    def asm_program(self) -> str:
+        """Assembly buffered by the last `compile_program` call.
+
+        Empty when the program was streamed to a file instead.
+        """
+        return self.emitter.getvalue()
+
     def _emit(self, line: str) -> None:
         """Adds a line to the assembly program."""
-        self.asm_program += line + "\n"
+        self.emitter.emit(line)
+
+    def _emit_flat(self, expr: Union[Exp, FlatTree], out: Emitter) -> bool:
+        """Compiles expr into out from a flat tree if it's one already, or
+        if it's too deep to compile recursively.
+
+        Returns:
+            Whether expr was compiled, or must be compiled from lists
+            instead.
+        """
+        if not isinstance(expr, FlatTree):
+            if not flat.deeper_than(expr, flat.MAX_DEPTH):
+                return False
+            expr = FlatTree.from_expr(expr)
+        try:
+            with self.stats.phase("codegen"):
+                flat.generate(expr, -self.target.wordsize, out)
+        except flat.Unsupported:
+            return False
+        return True
+
+    def _emit_expr(self, expr: Union[Exp, FlatTree]) -> None:
+        """Optimizes and compiles a single passed expression."""
+        # only the peephole optimizer needs the whole body at once; otherwise
+        # code goes to the stream as it's generated
+        out = self.emitter.fork() if self.peephole is not None \
+            else self.emitter
+        start = out.count
+        if not self._emit_flat(expr, out):
+            try:
+                self._emit_recursive(expr, out)
+            except RecursionError:
+                tree = expr if isinstance(expr, FlatTree) \
+                    else FlatTree.from_expr(expr)
+                raise ValueError(
+                    f"Expression nested {tree.depth} deep is too deep to "
+                    f"compile: programs making or calling procedures are "
+                    f"compiled recursively, up to Python's recursion limit "
+                    f"of {sys.getrecursionlimit()}.") from None
+        self.stats.count("generated", out.count - start)
+
+        if self.peephole is not None:
+            with self.stats.phase("peephole"):
+                lines = self.peephole.run(out.lines)
+            with self.stats.phase("write"):
+                self.emitter.extend(lines)
+
+    def _emit_recursive(self, expr: Union[Exp, FlatTree],
+                        out: Emitter) -> None:
+        """Optimizes, closure converts and compiles expr into out, walking
+        it recursively."""
+        if isinstance(expr, FlatTree):
+            expr = expr.to_expr()
+        with self.stats.phase("optimize"):
+            expr = self.pass_manager.run(expr)
+        with self.stats.phase("convert"):
+            expr = closures.convert(expr)
+        with self.stats.phase("codegen"):
+            try:
+                func = self._lower(expr) if self.use_ir else None
+            except ir.Unsupported:
+                func = None
+            if func is not None:
+                generate(func, out)
+            else:
+                compile_expr(expr, -self.target.wordsize, out)
+
+    def _lower(self, expr: Exp) -> ir.Function:
+        """Lowers an optimized, closure-converted expression to IR,
+        optimizing it in turn."""
+        func = ir.lower(expr, self.target)
+        if self.opt_level >= 1:
+            func = ir.optimize(func)
+        return func
+
+    def _program_expr(self) -> Exp:
+        """Returns the program as lists, even if it was read flat."""
+        if isinstance(self.program, FlatTree):
+            return self.program.to_expr()
+        return self.program
+
+    def dump_ir(self) -> str:
+        """Returns the program's IR, in textual form."""
+        expr = self.pass_manager.run(self._program_expr())
+        return self._lower(closures.convert(expr)).dump()
+
+    def _start(self, stream: Optional[TextIO]) -> None:
+        """Resets the assembly program and statistics."""
+        instrumentation = Instrumentation(self.instrument == "cycles") \
+            if self.instrument is not None else None
+        self.emitter = Emitter(stream, target=self.target,
+                               checks=self.checks,
+                               instrumentation=instrumentation,
+                               exact=self.exact)
+        self.stats = CompileStats()
+        if self.peephole is not None:
+            self.peephole.reset()
+        if self.checks is not None:
+            self.checks.reset()
+
+    def _emit_symbols(self) -> None:
+        """Emits the symbols quoted by the program, and the table of them
+        the runtime seeds its symbol table with."""
+        symbols = self.emitter.symbols
+        if not symbols:
+            return
+
+        word = self.target.word_directive
+        self._emit(".data")
+        self._emit(".p2align 3")
+        for name, label in symbols.items():
+            chars = name.encode()
+            self._emit(f"{label}:")
+            self._emit(f"{word} {len(chars) << self.target.fixnum_shift}")
+            if chars:
+                self._emit(f".byte {', '.join(map(str, chars))}")
+            self._emit(".p2align 3")
+        self._emit(".globl scheme_symbol_table")
+        self._emit("scheme_symbol_table:")
+        for label in symbols.values():
+            self._emit(f"{word} {label}+{sym_tag}")
+        self._emit(".globl scheme_symbol_count")
+        self._emit("scheme_symbol_count:")
+        self._emit(f".long {len(symbols)}")
 
-    def _emit_expr(self, expr: Exp) -> None:
-        """Compiles a single passed expression."""
+    def _emit_bignums(self) -> None:
+        """Emits the bignums of the integer literals too large for a
+        fixnum, laid out as described in `pasquim.primitives`."""
+        bignums = self.emitter.bignums
+        if not bignums:
+            return
 
-        for i in compile_expr(expr, -wordsize):
-            self._emit(i)
+        t = self.target
+        self._emit(".data")
+        self._emit(".p2align 3")
+        for value, label in bignums.items():
+            magnitude = abs(value)
+            limbs = [(magnitude >> shift) & (2 ** t.bits - 1)
+                     for shift in range(0, magnitude.bit_length(), t.bits)]
+            length = -len(limbs) if value < 0 else len(limbs)
+            self._emit(f"{label}:")
+            self._emit(f"{t.word_directive} {length << t.fixnum_shift}")
+            for limb in limbs:
+                self._emit(f"{t.word_directive} {limb}")
 
-    def compile_program(self) -> None:
-        """Compiles Scheme program to Assembly."""
-        self.asm_program = ""  # reset
+    def _emit_profile(self) -> None:
+        """Emits the counters of instrumented calls, the names of their
+        sites, and whether cycles are counted, for the runtime to write out
+        at exit."""
+        instrumentation = self.emitter.instrumentation
+        if instrumentation is None:
+            return
 
+        word = self.target.word_directive
+        labels = [self.emitter.label() for _ in instrumentation.sites]
+        self._emit(".data")
+        self._emit(".p2align 3")
+        self._emit(".globl scheme_profile_counters")
+        self._emit("scheme_profile_counters:")
+        self._emit(f"{instrumentation.label}:")
+        if instrumentation.sites:
+            self._emit(f".zero {16 * len(instrumentation.sites)}")
+        self._emit(".globl scheme_profile_sites")
+        self._emit("scheme_profile_sites:")
+        for label in labels:
+            self._emit(f"{word} {label}")
+        self._emit(".globl scheme_profile_count")
+        self._emit("scheme_profile_count:")
+        self._emit(f".long {len(instrumentation.sites)}")
+        self._emit(".globl scheme_profile_cycles")
+        self._emit("scheme_profile_cycles:")
+        self._emit(f".long {int(instrumentation.cycles)}")
+        for label, site in zip(labels, instrumentation.sites):
+            self._emit(f"{label}:")
+            self._emit(f".asciz \"{site}\"")
+
+    def _finish(self) -> None:
+        """Writes out the rest of the assembly program."""
+        self._emit_symbols()
+        self._emit_bignums()
+        self._emit_profile()
+        with self.stats.phase("write"):
+            self.emitter.flush()
+        self.stats.count("instructions", len(self.emitter))
+        self.stats.count("bytes", self.emitter.written)
+        if self.peephole_stats and self.peephole is not None:
+            print(self.peephole.summary(), file=sys.stderr)
+        if self.type_stats and self.checks is not None:
+            print(self.checks.summary(), file=sys.stderr)
+
+    def _emit_entry(self, label: str, expr: Exp) -> None:
+        """Emits a C-callable function that evaluates expr."""
         self._emit(".text")
         self._emit(".p2align 4,,15")
-        self._emit(".globl scheme_entry")
-        self._emit("scheme_entry:")
+        self._emit(f".globl {label}")
+        self._emit(f"{label}:")
 
         # handle incoming call from C
-        self._emit("push %esi")
-        self._emit("push %edi")
-        self._emit("push %edx")
+        for register in self.target.callee_saved:
+            self._emit(f"push {register}")
+        heap_prologue(self.emitter)
 
         # program's code
-        self._emit_expr(self.program)
+        self._emit_expr(expr)
 
         # restore state for return to C
-        self._emit("pop %edx")
-        self._emit("pop %edi")
-        self._emit("pop %esi")
+        heap_epilogue(self.emitter)
+        for register in reversed(self.target.callee_saved):
+            self._emit(f"pop {register}")
         self._emit("ret")
 
+        # slow paths, out of the way of the code falling through
+        self.emitter.extend(self.emitter.cold)
+        self.emitter.cold.clear()
+
+    def compile_program(self, stream: Optional[TextIO] = None) -> None:
+        """Compiles Scheme program to Assembly.
+
+        Args:
+            stream (TextIO, optional): If given, the assembly is written to
+                it as it is generated instead of being kept in memory.
+        """
+        self._start(stream)
+        self.stats.add(self._read_stats)
+        self._emit_entry("scheme_entry", self.program)
+        self._finish()
+
+    def compile_batch(self, programs: List[str],
+                      stream: Optional[TextIO] = None) -> None:
+        """Compiles several Scheme programs into a single Assembly file.
+
+        Program `i` becomes the function `scheme_entry_i`, and the table
+        `scheme_entries` together with `scheme_entry_count` lets the runtime
+        dispatch to any of them.
+
+        Args:
+            programs (List[str]): Scheme programs to be compiled.
+            stream (TextIO, optional): If given, the assembly is written to
+                it as it is generated instead of being kept in memory.
+        """
+        self._start(stream)
+
+        for i, program in enumerate(programs):
+            self._emit_entry(f"scheme_entry_{i}", self._read(program))
+
+        word = self.target.word_directive
+        self._emit(".data")
+        self._emit(f".p2align {self.target.wordsize.bit_length() - 1}")
+        self._emit(".globl scheme_entries")
+        self._emit("scheme_entries:")
+        for i in range(len(programs)):
+            self._emit(f"{word} scheme_entry_{i}")
+        self._emit(".globl scheme_entry_count")
+        self._emit("scheme_entry_count:")
+        self._emit(f".long {len(programs)}")
+
+        self._finish()
+
+    def pass_report(self) -> List[Dict[str, Any]]:
+        """Reports how many instructions each enabled pass removed.
+
+        Returns:
+            One row per pass, in the order they ran, with the instruction
+            count of the program before and after the pass.
+        """
+        return self.pass_manager.report(self._program_expr())
+
+    def _build(self, compiled_path: Path) -> None:
+        """Assembles and links compiled_path with the runtime into a.out."""
+        output = self.path.joinpath("a.out")
+        with self.stats.phase("build"):
+            if self.backend == "builtin":
+                with open(compiled_path) as f:
+                    build_executable(f, output)
+            else:
+                self.cache.link(compiled_path, output,
+                                self.target.gcc_flags)
+
     def compile_to_binary(self) -> None:
-        self.compile_program()
+        compiled_path = self.path.joinpath("compiled.s")
+        with open(compiled_path, 'w') as f:
+            self.compile_program(f)
+
+        self._build(compiled_path)
+
+    def compile_many(self, programs: List[str]) -> None:
+        """Compiles several programs into a single batch binary.
+
+        Running the binary without arguments prints the result of every
+        program, one per line and in order; passing an index prints the
+        result of that program only.
+        """
+        compiled_path = self.path.joinpath("compiled.s")
+        with open(compiled_path, 'w') as f:
+            self.compile_batch(programs, f)
+
+        self._build(compiled_path)
+
+    def evaluate(self) -> Any:
+        """Runs the program inside this process and returns its value.
+
+        The program and the runtime are built into a shared library, which
+        is loaded with ctypes so `scheme_entry` can be called directly; the
+        tagged word it returns is decoded into a Python object: pairs become
+        tuples, vectors lists, strings str and symbols `Symbol`. Only works
+        when the target matches the running interpreter. In safe mode, a
+        runtime type error exits the whole process.
+        """
+        if host_target() is not self.target:
+            raise RuntimeError(f"Can't run {self.target.name} code in this "
+                               f"Python process.")
 
         compiled_path = self.path.joinpath("compiled.s")
         with open(compiled_path, 'w') as f:
-            f.write(self.asm_program)
+            self.compile_program(f)
+        with self.stats.phase("build"):
+            library = ctypes.CDLL(str(self.cache.shared_library(
+                compiled_path, self.target.gcc_flags)))
+
+        scheme_heap = library.scheme_heap
+        scheme_heap.argtypes = []
+        scheme_heap.restype = ctypes.c_void_p
+        scheme_entry = library.scheme_entry
+        scheme_entry.argtypes = [ctypes.c_void_p]
+        scheme_entry.restype = ctypes.c_ssize_t
 
-        os.system(f"gcc -fomit-frame-pointer -m32 "
-                  f"{str(compiled_path)} pasquim/src/rts.c "
-                  f"-o {str(self.path.joinpath('a.out'))}")
+        heap = scheme_heap()
+        return _decode_value(scheme_entry(heap), heap, self.target,
+                             self.exact)
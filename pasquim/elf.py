@@ -0,0 +1,94 @@
+from typing import Iterable
+import os
+import struct
+from pathlib import Path
+
+from pasquim.x86 import Assembler
+
+
+"""
+Writes static ELF executables for Linux without an external toolchain.
+
+The compiled program is assembled together with a minimal runtime written in
+assembly (`src/rts_i386.s`), which needs neither libc nor a dynamic loader.
+"""
+
+RUNTIME_SOURCE = Path(__file__).parent.joinpath("src", "rts_i386.s")
+
+BASE_ADDRESS = 0x08048000
+PAGE_SIZE = 0x1000
+
+ELF_HEADER = struct.Struct("<16sHHIIIIIHHHHHH")
+PROGRAM_HEADER = struct.Struct("<IIIIIIII")
+
+ET_EXEC = 2
+EM_386 = 3
+PT_LOAD = 1
+PT_GNU_STACK = 0x6474e551
+PF_X, PF_W, PF_R = 1, 2, 4
+
+
+def _align(value: int, alignment: int) -> int:
+    return value + (-value % alignment)
+
+
+def write_executable(asm: Assembler, path: Path,
+                     entry: str = "_start") -> None:
+    """Lays out the sections of asm and writes them as an ELF executable.
+
+    The text section goes into a read-only executable segment, and every
+    other section is packed into a single writable data segment.
+    """
+    headers_size = ELF_HEADER.size + 3 * PROGRAM_HEADER.size
+    text_offset = _align(headers_size, 16)
+    text = asm.sections[".text"]
+    data_offset = _align(text_offset + len(text), PAGE_SIZE)
+
+    offsets, data_size = {}, 0
+    for name, contents in asm.sections.items():
+        if name != ".text":
+            offsets[name] = data_size = _align(data_size, 16)
+            data_size += len(contents)
+
+    addresses = {".text": BASE_ADDRESS + text_offset}
+    for name, offset in offsets.items():
+        addresses[name] = BASE_ADDRESS + data_offset + offset
+    symbols = asm.link(addresses)
+
+    data = bytearray(data_size)
+    for name, offset in offsets.items():
+        data[offset:offset + len(asm.sections[name])] = asm.sections[name]
+
+    header = ELF_HEADER.pack(
+        b"\x7fELF\x01\x01\x01".ljust(16, b"\x00"),
+        ET_EXEC, EM_386, 1, symbols[entry],
+        ELF_HEADER.size, 0, 0,
+        ELF_HEADER.size, PROGRAM_HEADER.size, 3, 0, 0, 0)
+    segments = [
+        PROGRAM_HEADER.pack(PT_LOAD, 0, BASE_ADDRESS, BASE_ADDRESS,
+                            text_offset + len(text), text_offset + len(text),
+                            PF_R | PF_X, PAGE_SIZE),
+        PROGRAM_HEADER.pack(PT_LOAD, data_offset, BASE_ADDRESS + data_offset,
+                            BASE_ADDRESS + data_offset, len(data), len(data),
+                            PF_R | PF_W, PAGE_SIZE),
+        PROGRAM_HEADER.pack(PT_GNU_STACK, 0, 0, 0, 0, 0, PF_R | PF_W, 16),
+    ]
+
+    image = bytearray(header + b"".join(segments))
+    image.extend(bytes(text_offset - len(image)))
+    image.extend(text)
+    image.extend(bytes(data_offset - len(image)))
+    image.extend(data)
+
+    with open(path, "wb") as f:
+        f.write(image)
+    os.chmod(path, 0o755)
+
+
+def build_executable(asm_lines: Iterable[str], path: Path) -> None:
+    """Assembles a compiled program with the built-in runtime into path."""
+    asm = Assembler()
+    asm.feed(asm_lines)
+    with open(RUNTIME_SOURCE) as f:
+        asm.feed(f)
+    write_executable(asm, path)
@@ -0,0 +1,125 @@
+from typing import (
+    TYPE_CHECKING, Dict, Iterable, Iterator, List, Optional, TextIO
+)
+import itertools
+
+from pasquim.registers import RegisterPool
+from pasquim.target import Target, X86
+
+if TYPE_CHECKING:
+    from pasquim.inference import TypeChecks
+    from pasquim.profiling import Instrumentation
+
+
+class Emitter:
+    """Collects assembly instructions in an append-only buffer.
+
+    When a stream is given, buffered instructions are written to it every
+    `buffer_size` lines and on `flush`, so memory use stays bounded no matter
+    how large the program is. Without a stream, every instruction is kept and
+    can be retrieved with `getvalue`.
+
+    Args:
+        stream (TextIO, optional): File handle receiving the instructions.
+        buffer_size (int): Number of lines held before writing to stream.
+        target (Target): Machine the instructions are generated for.
+        checks (TypeChecks, optional): Type information code generation
+            uses to fold type predicates and to leave out runtime checks.
+            Without it, every expression is compiled as written.
+        instrumentation (Instrumentation, optional): Call sites of the
+            primitives, when calls are instrumented to count how many times
+            they run.
+        exact (bool): Whether integer arithmetic overflows into bignums
+            instead of wrapping around.
+
+    Attributes:
+        registers (RegisterPool): Scratch registers of target that are free
+            at the current point of code generation.
+        symbols (Dict[str, str]): Label of the static symbol object made for
+            each quoted name, shared with forked emitters.
+        bignums (Dict[int, str]): Label of the static bignum made for each
+            integer literal too large for a fixnum, shared likewise.
+        cold (List[str]): Instructions kept out of line, such as the slow
+            paths of exact arithmetic, to be placed after the function
+            being generated. Shared with forked emitters.
+        written (int): Characters of assembly written to stream so far.
+    """
+    def __init__(self, stream: Optional[TextIO] = None,
+                 buffer_size: int = 4096, target: Target = X86,
+                 checks: Optional["TypeChecks"] = None,
+                 instrumentation: Optional["Instrumentation"] = None,
+                 exact: bool = False) -> None:
+        self.stream = stream
+        self.target = target
+        self.checks = checks
+        self.instrumentation = instrumentation
+        self.exact = exact
+        self.registers = RegisterPool(target.scratch)
+        self.buffer_size = buffer_size
+        self.lines: List[str] = []
+        self.count = 0  # total instructions emitted, including flushed ones
+        self.labels: Iterator[int] = itertools.count()
+        self.symbols: Dict[str, str] = {}
+        self.bignums: Dict[int, str] = {}
+        self.cold: List[str] = []
+        self.written = 0
+
+    def emit(self, line: str) -> None:
+        """Appends a single instruction."""
+        self.lines.append(line)
+        self.count += 1
+        if self.stream is not None and len(self.lines) >= self.buffer_size:
+            self.flush()
+
+    def extend(self, lines: Iterable[str]) -> None:
+        """Appends several instructions."""
+        for line in lines:
+            self.emit(line)
+
+    def label(self) -> str:
+        """Returns a new label, unique among those of this emitter."""
+        return f".L{next(self.labels)}"
+
+    def symbol(self, name: str) -> str:
+        """Returns the label of the symbol named name, the same for every
+        use of the name."""
+        if name not in self.symbols:
+            self.symbols[name] = self.label()
+        return self.symbols[name]
+
+    def bignum(self, value: int) -> str:
+        """Returns the label of the static bignum holding value."""
+        if value not in self.bignums:
+            self.bignums[value] = self.label()
+        return self.bignums[value]
+
+    def fork(self) -> "Emitter":
+        """Returns an empty in-memory emitter for the same target, type
+        information, instrumentation and arithmetic.
+
+        Labels it makes never clash with the ones made by this emitter, so
+        its instructions can be added to this emitter afterwards.
+        """
+        forked = Emitter(target=self.target, checks=self.checks,
+                         instrumentation=self.instrumentation,
+                         exact=self.exact)
+        forked.labels = self.labels
+        forked.symbols = self.symbols
+        forked.bignums = self.bignums
+        forked.cold = self.cold
+        return forked
+
+    def flush(self) -> None:
+        """Writes buffered instructions to the stream, if there is one."""
+        if self.stream is not None and self.lines:
+            text = "\n".join(self.lines) + "\n"
+            self.stream.write(text)
+            self.written += len(text)
+            self.lines.clear()
+
+    def getvalue(self) -> str:
+        """Returns the buffered instructions as assembly text."""
+        return "".join(line + "\n" for line in self.lines)
+
+    def __len__(self) -> int:
+        return self.count
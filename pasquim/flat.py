@@ -0,0 +1,551 @@
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+from pasquim.emitter import Emitter
+from pasquim.parser import ATOM, OPEN, QUOTE_MARK, TOKEN_RE, atom
+from pasquim.primitives import (
+    Env, compile_expr, compile_test, immediate_rep
+)
+
+
+"""
+Flat syntax trees, for programs nested too deep to compile recursively.
+
+A `FlatTree` holds an expression in post-order, one node after all of its
+children, in `array` buffers:
+
+    (primcall add1 (primcall + x 1))
+
+    node  op        operand    children
+    0     ATOM      primcall
+    1     ATOM      add1
+    2     ATOM      primcall
+    3     ATOM      +
+    4     ATOM      x
+    5     ATOM      1
+    6     PRIMCALL  +          2 3 4 5
+    7     PRIMCALL  add1       0 1 6
+
+where the operand of an atom is its index in a table of distinct atoms, and
+that of a primitive call the index of its primitive. The subtree of a node
+is the block of nodes ending at it, and the root is the last node.
+
+`generate` walks a tree with an explicit stack instead of recursing, and
+hands every subtree at most `SHALLOW` deep to `compile_expr`. Operands of
+primitives deeper than that are computed first, left to right, each into a
+stack slot; primitives are then compiled with the slots as variables. So
+each level of nesting costs a few array entries of Python memory, and no
+Python stack. Procedures are left to the recursive code generator, since
+they need closure conversion.
+
+`Compiler` reads programs straight into flat trees when asked to, and
+compiles programs nested deeper than `MAX_DEPTH` from flat trees, without
+optimizing them.
+"""
+
+# Subtrees at most this deep are compiled by `compile_expr`
+SHALLOW = 32
+# Programs deeper than this are compiled by `generate`
+MAX_DEPTH = 200
+
+ATOM_NODE, LIST, PRIMCALL, LET, IF, AND, OR, QUOTE = range(8)
+FORMS = {'primcall': PRIMCALL, 'let': LET, 'if': IF, 'and': AND, 'or': OR,
+         'quote': QUOTE}
+
+# How a node is compiled: into the accumulator, or as the condition of the
+# innermost `if` or `and`
+VALUE, TEST = 0, 1
+
+
+class Unsupported(ValueError):
+    """Raised when generating code for a form flat trees don't cover."""
+
+
+def _position(program: str, offset: int) -> str:
+    line = program.count("\n", 0, offset) + 1
+    col = offset - (program.rfind("\n", 0, offset) + 1) + 1
+    return f"line {line}, column {col}"
+
+
+class FlatTree:
+    """An expression encoded in post-order in flat arrays.
+
+    Attributes:
+        ops (array): Opcode of each node: an atom, a primitive call, `let`,
+            `if`, `and`, `or`, `quote`, or any other list.
+        operands (array): Index in atoms of each atom, and of the primitive
+            of each primitive call.
+        depths (array): Depth of each node's subtree, 1 for an atom.
+        starts (array): Node i's children are `kids[starts[i]:starts[i +
+            1]]`.
+        kids (array): Children of every node, in order.
+        atoms (List): Each distinct atom of the expression.
+        procedures (bool): Whether the expression may make procedures, with
+            `lambda` or `letrec`.
+        tokens (int): Number of tokens read, when read from text.
+    """
+    def __init__(self) -> None:
+        self.ops = array('B')
+        self.operands = array('q')
+        self.depths = array('L')
+        self.starts = array('L', [0])
+        self.kids = array('L')
+        self.atoms: List[Any] = []
+        self._atom_index: Dict[Tuple[type, Any], int] = {}
+        self.procedures = False
+        self.tokens = 0
+
+    def __len__(self) -> int:
+        return len(self.ops)
+
+    @property
+    def root(self) -> int:
+        return len(self.ops) - 1
+
+    @property
+    def depth(self) -> int:
+        return self.depths[-1]
+
+    def children(self, node: int) -> array:
+        return self.kids[self.starts[node]:self.starts[node + 1]]
+
+    def atom(self, node: int) -> Any:
+        """The atom at node, which must be an atom."""
+        return self.atoms[self.operands[node]]
+
+    def _add_atom(self, value: Any) -> int:
+        key = (type(value), value)
+        index = self._atom_index.get(key)
+        if index is None:
+            index = self._atom_index[key] = len(self.atoms)
+            self.atoms.append(value)
+        self.ops.append(ATOM_NODE)
+        self.operands.append(index)
+        self.depths.append(1)
+        self.starts.append(len(self.kids))
+        return len(self.ops) - 1
+
+    def _add_list(self, children: Any) -> int:
+        op, operand = LIST, 0
+        if len(children) and self.ops[children[0]] == ATOM_NODE:
+            head = self.atom(children[0])
+            if isinstance(head, str):
+                op = FORMS.get(head, LIST)
+                self.procedures |= head in ('lambda', 'letrec')
+        if op == PRIMCALL:
+            if len(children) >= 2 and self.ops[children[1]] == ATOM_NODE:
+                operand = self.operands[children[1]]
+            else:
+                op = LIST  # left for compile_expr to report
+
+        self.ops.append(op)
+        self.operands.append(operand)
+        self.depths.append(1 + max((self.depths[c] for c in children),
+                                   default=0))
+        self.kids.extend(children)
+        self.starts.append(len(self.kids))
+        return len(self.ops) - 1
+
+    def add_expr(self, expr: Any) -> int:
+        """Adds expr, read as nested lists, returning its node."""
+        stack = [(expr, False)]
+        done: List[int] = []
+        while stack:
+            expr, expanded = stack.pop()
+            if not isinstance(expr, list):
+                done.append(self._add_atom(expr))
+            elif expanded:
+                start = len(done) - len(expr)
+                node = self._add_list(done[start:])
+                del done[start:]
+                done.append(node)
+            else:
+                stack.append((expr, True))
+                stack.extend((sub, False) for sub in reversed(expr))
+        return done[0]
+
+    @classmethod
+    def from_expr(cls, expr: Any) -> "FlatTree":
+        """Encodes an expression read by `Reader`."""
+        tree = cls()
+        tree.add_expr(expr)
+        return tree
+
+    @classmethod
+    def read(cls, program: str) -> "FlatTree":
+        """Reads the first expression of program, like `Reader.read`, but
+        without building any list."""
+        tree = cls()
+        pending = array('L')  # nodes of the lists still open
+        frames = array('L')  # where each open list's nodes start in pending
+        opened = array('L')  # offset of each open list in program
+        quoting = array('B')  # whether each open list is a `'` shorthand
+
+        for match in TOKEN_RE.finditer(program):
+            kind = match.lastindex
+            tree.tokens += 1
+            if kind in (OPEN, QUOTE_MARK):
+                frames.append(len(pending))
+                opened.append(match.start(kind))
+                quoting.append(kind == QUOTE_MARK)
+                if kind == QUOTE_MARK:
+                    pending.append(tree._add_atom("quote"))
+                continue
+            if kind == ATOM:
+                node = tree.add_expr(atom(match.group(ATOM)))
+            elif not frames or quoting[-1]:
+                raise SyntaxError(f"unexpected ) at "
+                                  f"{_position(program, match.start(kind))}")
+            else:
+                node = tree._close(pending, frames, opened, quoting)
+
+            while frames and quoting[-1]:
+                pending.append(node)
+                node = tree._close(pending, frames, opened, quoting)
+            if not frames:
+                return tree
+            pending.append(node)
+
+        if frames and quoting[-1]:
+            raise SyntaxError("unexpected EOF after '")
+        if frames:
+            raise SyntaxError(f"unexpected EOF, unclosed ( at "
+                              f"{_position(program, opened[-1])}")
+        raise SyntaxError('unexpected EOF')
+
+    def _close(self, pending: array, frames: array, opened: array,
+               quoting: array) -> int:
+        """Adds the innermost open list of `read`, returning its node."""
+        start = frames.pop()
+        opened.pop()
+        quoting.pop()
+        node = self._add_list(pending[start:])
+        del pending[start:]
+        return node
+
+    def to_expr(self, node: Optional[int] = None) -> Any:
+        """Decodes the expression at node, the root by default, into nested
+        lists."""
+        if node is None:
+            node = self.root
+        first = node
+        while self.starts[first] != self.starts[first + 1]:
+            first = self.kids[self.starts[first]]
+
+        values: List[Any] = []
+        for i in range(first, node + 1):
+            if self.ops[i] == ATOM_NODE:
+                values.append(self.atom(i))
+            else:
+                start = len(values) - (self.starts[i + 1] - self.starts[i])
+                items = values[start:]
+                del values[start:]
+                values.append(items)
+        return values[0]
+
+
+def deeper_than(expr: Any, depth: int) -> bool:
+    """Checks if expr, read as nested lists, is nested deeper than depth,
+    where an atom is 1 deep."""
+    stack = [(expr, 1)]
+    while stack:
+        expr, level = stack.pop()
+        if level > depth:
+            return True
+        if isinstance(expr, list):
+            stack.extend((sub, level + 1) for sub in expr)
+    return False
+
+
+class _Generator:
+    """Generates code for a flat tree with an explicit stack.
+
+    Each frame of the stack is a node being compiled, the stack index it's
+    compiled at, how far along it is, and whether it's compiled as a value
+    or a test; one entry in each of four arrays. A step of the top frame
+    either asks for a child to be compiled, or finishes the node.
+    """
+    def __init__(self, tree: FlatTree, out: Emitter, env: Optional[Env],
+                 shallow: int) -> None:
+        self.tree = tree
+        self.out = out
+        self.env: Env = dict(env or {})
+        self.shallow = shallow
+        self.nodes, self.sis, self.states, self.modes = \
+            array('q'), array('q'), array('q'), array('B')
+        self.labels: List[str] = []  # of each `if` and `and` being compiled
+        self.shadowed: List[Tuple[str, Optional[str]]] = []
+        self.request: Optional[Tuple[int, int, int]] = None
+        self.steps = {PRIMCALL: self._primcall, LET: self._let, IF: self._if,
+                      AND: self._and, OR: self._or}
+
+    def run(self, si: int) -> None:
+        tree = self.tree
+        self._visit(tree.root, si, VALUE)
+        while True:
+            if self.request is not None:
+                node, si, mode = self.request
+                self.request = None
+                if tree.depths[node] <= self.shallow or \
+                        tree.ops[node] == QUOTE:
+                    self._compile(tree.to_expr(node), si, mode)
+                elif tree.ops[node] in self.steps:
+                    self.nodes.append(node)
+                    self.sis.append(si)
+                    self.states.append(0)
+                    self.modes.append(mode)
+                else:
+                    raise Unsupported(f"Can't compile {tree.to_expr(node)}"
+                                      f" from a flat tree")
+            if not self.nodes:
+                return
+            self.steps[tree.ops[self.nodes[-1]]](
+                self.nodes[-1], self.sis[-1], self.states[-1],
+                self.modes[-1])
+
+    def _visit(self, node: int, si: int, mode: int) -> None:
+        """Asks for node to be compiled before the next step."""
+        self.request = (node, si, mode)
+
+    def _next(self, state: int, node: int, si: int,
+              mode: int = VALUE) -> None:
+        """Moves the top frame to state once node is compiled."""
+        self.states[-1] = state
+        self._visit(node, si, mode)
+
+    def _pop(self) -> None:
+        for stack in (self.nodes, self.sis, self.states, self.modes):
+            stack.pop()
+
+    def _compile(self, expr: Any, si: int, mode: int) -> None:
+        if mode == TEST:
+            compile_test(expr, si, self.out, self.env, self.labels[-2])
+        else:
+            compile_expr(expr, si, self.out, self.env)
+
+    def _slot(self, si: int) -> str:
+        return f"{si}({self.out.target.sp})"
+
+    def _store(self, slot: str) -> None:
+        """Stores the accumulator in slot, of a type unknown to checks."""
+        t = self.out.target
+        self.out.emit(f"mov{t.suffix} {t.ax}, {slot}")
+        if self.out.checks is not None:
+            self.out.checks.forget(slot)
+
+    def _tests(self, node: int) -> bool:
+        """Whether node is compiled as a test, branching on its flags, or
+        as a value compared with #f."""
+        return self.tree.ops[node] == PRIMCALL or \
+            self.tree.depths[node] <= self.shallow
+
+    def _branch_if_false(self, node: int) -> None:
+        """Jumps to the innermost false label if node, compiled as a value,
+        is #f."""
+        if not self._tests(node):
+            t = self.out.target
+            self.out.emit(f"cmp{t.suffix} ${immediate_rep(False)}, {t.ax}")
+            self.out.emit(f"je {self.labels[-2]}")
+
+    def _test_mode(self, node: int) -> int:
+        return TEST if self._tests(node) else VALUE
+
+    def _primcall(self, node: int, si: int, state: int, mode: int) -> None:
+        """Computes the deep operands into slots, one per state, then the
+        call."""
+        tree, w = self.tree, self.out.target.wordsize
+        args = tree.children(node)[2:]
+        deep = [arg for arg in args if tree.depths[arg] > self.shallow]
+        if state > 0:
+            self._store(self._slot(si - (state - 1) * w))
+        if state < len(deep):
+            self._next(state + 1, deep[state], si - state * w)
+            return
+
+        expr = ['primcall', tree.atoms[tree.operands[node]]]
+        slots = []
+        for arg in args:
+            if tree.depths[arg] > self.shallow:
+                slots.append(self._slot(si - len(slots) * w))
+                self.env[slots[-1]] = slots[-1]
+                expr.append(slots[-1])
+            else:
+                expr.append(tree.to_expr(arg))
+        self._compile(expr, si - len(slots) * w, mode)
+        for slot in slots:
+            del self.env[slot]
+        self._pop()
+
+    def _check_let(self, kids: array) -> None:
+        """Checks a let form like `parse_let`, without decoding it."""
+        tree = self.tree
+        if len(kids) < 3 or tree.ops[kids[1]] == ATOM_NODE:
+            raise ValueError("let takes a list of bindings and a body.")
+        for binding in tree.children(kids[1]):
+            items = tree.children(binding) \
+                if tree.ops[binding] != ATOM_NODE else []
+            if len(items) != 2 or tree.ops[items[0]] != ATOM_NODE or \
+                    not isinstance(tree.atom(items[0]), str):
+                raise ValueError(f"Malformed let binding "
+                                 f"{tree.to_expr(binding)}")
+
+    def _let(self, node: int, si: int, state: int, mode: int) -> None:
+        """Computes each binding, one per state, as `compile_let` does, then
+        each expression of the body."""
+        tree, w = self.tree, self.out.target.wordsize
+        kids = tree.children(node)
+        if state == 0:
+            self._check_let(kids)
+        bindings = [tree.children(b) for b in tree.children(kids[1])]
+
+        if state <= len(bindings):
+            if state > 0:
+                slot = self._slot(si - (state - 1) * w)
+                value = bindings[state - 1][1]
+                self._store(slot)
+                if self.out.checks is not None and \
+                        tree.depths[value] <= self.shallow:
+                    self.out.checks.bind(slot, tree.to_expr(value),
+                                         self.env)
+            if state < len(bindings):
+                self._next(state + 1, bindings[state][1], si - state * w)
+                return
+            for i, binding in enumerate(bindings):
+                name = tree.atom(binding[0])
+                self.shadowed.append((name, self.env.get(name)))
+                self.env[name] = self._slot(si - i * w)
+
+        body = kids[2:]
+        i = state - len(bindings)
+        if i < len(body):
+            self._next(state + 1, body[i], si - len(bindings) * w)
+            return
+        for _ in bindings:
+            name, shadowed = self.shadowed.pop()
+            if shadowed is None:
+                del self.env[name]
+            else:
+                self.env[name] = shadowed
+        self._pop()
+
+    def _if(self, node: int, si: int, state: int, mode: int) -> None:
+        kids = self.tree.children(node)
+        if len(kids) != 4:
+            raise ValueError("if takes a test, a consequent and an "
+                             "alternative.")
+        _, test, consequent, alternative = kids
+        if state == 0:
+            self.labels += [self.out.label(), self.out.label()]
+            self._next(1, test, si, self._test_mode(test))
+        elif state == 1:
+            self._branch_if_false(test)
+            self._next(2, consequent, si)
+        elif state == 2:
+            self.out.emit(f"jmp {self.labels[-1]}")
+            self.out.emit(f"{self.labels[-2]}:")
+            self._next(3, alternative, si)
+        else:
+            self.out.emit(f"{self.labels.pop()}:")
+            self.labels.pop()
+            self._pop()
+
+    def _and(self, node: int, si: int, state: int, mode: int) -> None:
+        """Compiles every expression but the last as a test, one per
+        state, like `compile_and`."""
+        args = self.tree.children(node)[1:]
+        if not args:
+            self._compile(['and'], si, mode)
+            self._pop()
+            return
+        if state == 0:
+            self.labels += [self.out.label(), self.out.label()]
+        elif state < len(args):
+            self._branch_if_false(args[state - 1])
+        if state < len(args) - 1:
+            self._next(state + 1, args[state], si,
+                       self._test_mode(args[state]))
+        elif state == len(args) - 1:
+            self._next(state + 1, args[state], si)
+        else:
+            t = self.out.target
+            end, false = self.labels.pop(), self.labels.pop()
+            if len(args) > 1:
+                self.out.emit(f"jmp {end}")
+                self.out.emit(f"{false}:")
+                self.out.emit(f"mov{t.suffix} ${immediate_rep(False)}, "
+                              f"{t.ax}")
+                self.out.emit(f"{end}:")
+            self._pop()
+
+    def _or(self, node: int, si: int, state: int, mode: int) -> None:
+        """Compiles each expression, one per state, like `compile_or`."""
+        t = self.out.target
+        args = self.tree.children(node)[1:]
+        if not args:
+            self._compile(['or'], si, mode)
+            self._pop()
+            return
+        if state == 0:
+            self.labels.append(self.out.label())
+        elif state < len(args):
+            self.out.emit(f"cmp{t.suffix} ${immediate_rep(False)}, {t.ax}")
+            self.out.emit(f"jne {self.labels[-1]}")
+        if state < len(args):
+            self._next(state + 1, args[state], si)
+        else:
+            self.out.emit(f"{self.labels.pop()}:")
+            self._pop()
+
+
+def _compiled_children(tree: FlatTree, node: int) -> List[int]:
+    """The children of a form the generator compiles in turn."""
+    kids = tree.children(node)
+    if tree.ops[node] == PRIMCALL:
+        return list(kids[2:])
+    if tree.ops[node] != LET:
+        return list(kids[1:])
+    if len(kids) < 3 or tree.ops[kids[1]] == ATOM_NODE:
+        return []  # malformed, which the generator reports
+    values = []
+    for binding in tree.children(kids[1]):
+        items = tree.children(binding) \
+            if tree.ops[binding] != ATOM_NODE else []
+        values.extend(items[1:2])
+    return values + list(kids[2:])
+
+
+def _check_forms(tree: FlatTree, shallow: int) -> None:
+    """Raises `Unsupported` if the generator would reach a form deeper than
+    shallow that it can't compile."""
+    stack = [tree.root]
+    while stack:
+        node = stack.pop()
+        if tree.depths[node] <= shallow or tree.ops[node] == QUOTE:
+            continue
+        if tree.ops[node] not in (PRIMCALL, LET, IF, AND, OR):
+            raise Unsupported(f"Can't compile {tree.to_expr(node)} from a "
+                              f"flat tree")
+        stack.extend(_compiled_children(tree, node))
+
+
+def generate(tree: FlatTree, si: int, out: Emitter,
+             env: Optional[Env] = None,
+             shallow: Optional[int] = None) -> None:
+    """Compiles the expression of tree like `compile_expr`, appending its
+    instructions to out, in bounded Python stack.
+
+    Args:
+        shallow (int, optional): Depth of the subtrees compiled by
+            `compile_expr`. Defaults to `SHALLOW`.
+
+    Raises:
+        Unsupported: If the expression makes procedures, or nests forms
+            other than primitive calls, `let`, `if`, `and` and `or` deeper
+            than shallow; before appending any instruction, so out can be
+            a stream.
+    """
+    if tree.procedures:
+        raise Unsupported("Procedures need closure conversion.")
+    shallow = SHALLOW if shallow is None else shallow
+    _check_forms(tree, shallow)
+    _Generator(tree, out, env, shallow).run(si)
@@ -0,0 +1,111 @@
+from typing import Any, Dict, FrozenSet, Iterator, List, Tuple
+import sys
+
+
+"""
+Hash-consed expressions.
+
+A `NodeTable` turns the lists of a parsed expression into immutable `Node`s,
+making a single node for every distinct list, so identical subexpressions
+are one and the same object wherever they appear:
+
+    table = NodeTable()
+    a = table.intern(Reader("(primcall + x 1)").read())
+    b = table.intern(["primcall", "+", "x", 1])
+    assert a is b
+
+Nodes can then be compared, hashed and used as dictionary keys in constant
+time. Names are interned with `sys.intern`, and 1 and #t, equal in Python,
+are kept apart. Source positions are dropped, since lists at different
+places share a node.
+"""
+
+Key = Tuple[Any, ...]
+
+
+class Node:
+    """An immutable list of expressions, made by a `NodeTable`.
+
+    Attributes:
+        items (tuple): The items of the list, with lists as nodes.
+        size (int): Number of nodes in this one, itself included.
+        names (FrozenSet[str]): Every name in the node that may be a
+            variable, which excludes the heads of primitive calls and quoted
+            names.
+    """
+    __slots__ = ("items", "size", "names")
+
+    items: Tuple[Any, ...]
+    size: int
+    names: FrozenSet[str]
+
+    def __init__(self, items: Tuple[Any, ...]) -> None:
+        size, names = 1, set()
+        skip = 2 if items[:1] == ("primcall",) else \
+            len(items) if items[:1] == ("quote",) else 0
+        for i, item in enumerate(items):
+            if isinstance(item, Node):
+                size += item.size
+                names |= item.names
+            elif isinstance(item, str) and i >= skip:
+                names.add(item)
+        object.__setattr__(self, "items", items)
+        object.__setattr__(self, "size", size)
+        object.__setattr__(self, "names", frozenset(names))
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("Nodes are immutable")
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def __getitem__(self, index: int) -> Any:
+        return self.items[index]
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.items)
+
+    def to_list(self) -> list:
+        """Returns the expression as nested lists again."""
+        return [item.to_list() if isinstance(item, Node) else item
+                for item in self.items]
+
+    def __repr__(self) -> str:
+        return f"Node({self.to_list()!r})"
+
+
+def _key(item: Any) -> Any:
+    # tells 1 from True, and leaves nodes to compare by identity
+    return item if isinstance(item, Node) else (type(item), item)
+
+
+class NodeTable:
+    """Makes nodes, returning the same node for lists of the same items.
+
+    Attributes:
+        nodes (Dict[Key, Node]): Every node made, by the items it holds.
+    """
+    def __init__(self) -> None:
+        self.nodes: Dict[Key, Node] = {}
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def node(self, items: List[Any]) -> Node:
+        """Returns the node holding items, whose lists must be nodes of
+        this table already."""
+        items = tuple(sys.intern(item) if isinstance(item, str) else item
+                      for item in items)
+        key = tuple(map(_key, items))
+        found = self.nodes.get(key)
+        if found is None:
+            found = self.nodes[key] = Node(items)
+        return found
+
+    def intern(self, expr: Any) -> Any:
+        """Returns the node for expr, or expr itself if it isn't a list."""
+        if isinstance(expr, str):
+            return sys.intern(expr)
+        if not isinstance(expr, list):
+            return expr
+        return self.node([self.intern(item) for item in expr])
@@ -0,0 +1,373 @@
+from typing import (
+    Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+)
+
+from pasquim.primitives import (
+    Env, bool_mask, bool_tag, char_mask, char_tag, closure_tag, is_immediate,
+    is_primitive_call, is_special_form, pair_tag, parse_let, ptr_mask,
+    str_tag, sym_tag, vec_tag
+)
+from pasquim.target import Target
+
+
+"""
+Static type inference over the syntax tree.
+
+The type of an expression is the set of tags its value may carry: fixnum,
+char, boolean, pair, vector, string, procedure, symbol, or other for words
+none of them describe, which unchecked primitives can compute from operands
+of the wrong type. Code generation uses these types to fold type predicates
+whose answer is known, and in safe mode to leave out the runtime checks of
+operands that always pass.
+
+In safe mode a primitive only returns when its operands have the right
+type, so the result of `(+ x 1)` is a fixnum whatever x is; without the
+checks, it's only known to be one when x is.
+"""
+
+FIXNUM = "fixnum"
+CHAR = "char"
+BOOLEAN = "boolean"
+PAIR = "pair"
+VECTOR = "vector"
+STRING = "string"
+PROCEDURE = "procedure"
+SYMBOL = "symbol"
+OTHER = "other"
+
+Type = FrozenSet[str]
+ANY: Type = frozenset({FIXNUM, CHAR, BOOLEAN, PAIR, VECTOR, STRING,
+                       PROCEDURE, SYMBOL, OTHER})
+
+
+class Signature(NamedTuple):
+    """Types a primitive requires of its operands, and the type it returns.
+
+    Attributes:
+        operands (Tuple[Optional[str], ...]): Type required of each
+            operand, or None for operands of any type.
+        result (Type): Type of the value returned for well typed operands.
+        optional (int): Number of trailing operands that may be left out.
+    """
+    operands: Tuple[Optional[str], ...]
+    result: Type
+    optional: int = 0
+
+
+# Maps a name to the type of the variable it refers to, or None when no
+# variable of that name is in scope
+Lookup = Callable[[str], Optional[Type]]
+
+_fixnum = frozenset({FIXNUM})
+_boolean = frozenset({BOOLEAN})
+
+signatures: Dict[str, Signature] = {
+    'add1': Signature((FIXNUM,), _fixnum),
+    'sub1': Signature((FIXNUM,), _fixnum),
+    'integer?': Signature((None,), _boolean),
+    'zero?': Signature((None,), _boolean),
+    'boolean?': Signature((None,), _boolean),
+    'char?': Signature((None,), _boolean),
+    '+': Signature((FIXNUM, FIXNUM), _fixnum),
+    '-': Signature((FIXNUM, FIXNUM), _fixnum),
+    '*': Signature((FIXNUM, FIXNUM), _fixnum),
+    '=': Signature((None, None), _boolean),
+    '<': Signature((FIXNUM, FIXNUM), _boolean),
+    'char=?': Signature((CHAR, CHAR), _boolean),
+    'pair?': Signature((None,), _boolean),
+    'vector?': Signature((None,), _boolean),
+    'string?': Signature((None,), _boolean),
+    'cons': Signature((None, None), frozenset({PAIR})),
+    'car': Signature((PAIR,), ANY),
+    'cdr': Signature((PAIR,), ANY),
+    'make-vector': Signature((FIXNUM, None), frozenset({VECTOR}), 1),
+    'vector-length': Signature((VECTOR,), _fixnum),
+    'vector-ref': Signature((VECTOR, FIXNUM), ANY),
+    'vector-set!': Signature((VECTOR, FIXNUM, None), ANY),
+    'make-string': Signature((FIXNUM, CHAR), frozenset({STRING}), 1),
+    'string-length': Signature((STRING,), _fixnum),
+    'string-ref': Signature((STRING, FIXNUM), frozenset({CHAR})),
+    'string-set!': Signature((STRING, FIXNUM, CHAR), frozenset({CHAR})),
+    'vector-fill!': Signature((VECTOR, None), frozenset({VECTOR})),
+    'vector-copy': Signature((VECTOR,), frozenset({VECTOR})),
+    'vector-copy!': Signature((VECTOR, FIXNUM, VECTOR), frozenset({VECTOR})),
+    'string-fill!': Signature((STRING, CHAR), frozenset({STRING})),
+    'string-copy': Signature((STRING,), frozenset({STRING})),
+    'string-copy!': Signature((STRING, FIXNUM, STRING), frozenset({STRING})),
+    'string=?': Signature((STRING, STRING), _boolean),
+    'procedure?': Signature((None,), _boolean),
+    'symbol?': Signature((None,), _boolean),
+    'eq?': Signature((None, None), _boolean),
+    'symbol->string': Signature((SYMBOL,), frozenset({STRING})),
+    'string->symbol': Signature((STRING,), frozenset({SYMBOL})),
+}
+
+# Primitives that also check a length or index at runtime, in safe mode
+range_checked = frozenset({'make-vector', 'vector-ref', 'vector-set!',
+                           'make-string', 'string-ref', 'string-set!',
+                           'vector-copy!', 'string-copy!'})
+
+# Tag each type predicate tests for
+predicate_tags: Dict[str, str] = {
+    'integer?': FIXNUM,
+    'boolean?': BOOLEAN,
+    'char?': CHAR,
+    'pair?': PAIR,
+    'vector?': VECTOR,
+    'string?': STRING,
+    'procedure?': PROCEDURE,
+    'symbol?': SYMBOL,
+}
+
+
+def no_variables(name: str) -> Optional[Type]:
+    return None
+
+
+def literal_type(expr: Any) -> Type:
+    if isinstance(expr, bool):
+        return frozenset({BOOLEAN})
+    if isinstance(expr, int):
+        return frozenset({FIXNUM})
+    if isinstance(expr, str):
+        return frozenset({CHAR})
+    return ANY
+
+
+def _scope(bindings: Dict[str, Type], lookup: Lookup) -> Lookup:
+    return lambda name: bindings[name] if name in bindings else lookup(name)
+
+
+def _is_call(expr: Any) -> bool:
+    """Checks if expr calls a known primitive with the right arity."""
+    if not is_primitive_call(expr) or expr[1] not in signatures:
+        return False
+    signature = signatures[expr[1]]
+    return (len(signature.operands) - signature.optional <= len(expr) - 2
+            <= len(signature.operands))
+
+
+def _is_proven(op: str, i: int, arg_type: Type) -> bool:
+    """Checks if operand i of op is known to have the type op requires."""
+    required = signatures[op].operands[i] if op in signatures else None
+    return required is None or arg_type == {required}
+
+
+def _proven_operands(expr: list, lookup: Lookup, safe: bool) -> bool:
+    return all(_is_proven(expr[1], i, infer(arg, lookup, safe))
+               for i, arg in enumerate(expr[2:]))
+
+
+def infer(expr: Any, lookup: Lookup = no_variables,
+          safe: bool = False) -> Type:
+    """Returns the tags the value of expr may carry.
+
+    Args:
+        lookup (Lookup): Types of the variables in scope.
+        safe (bool): Whether primitives check the types of their operands.
+    """
+    if isinstance(expr, str) and lookup(expr) is not None:
+        return lookup(expr)
+    if is_immediate(expr):
+        return literal_type(expr)
+    if _is_call(expr):
+        if safe or _proven_operands(expr, lookup, safe):
+            return signatures[expr[1]].result
+        return ANY
+    if not is_special_form(expr):
+        return ANY
+
+    form, args = expr[0], expr[1:]
+    if form == 'if' and len(args) == 3:
+        return infer(args[1], lookup, safe) | infer(args[2], lookup, safe)
+    if form == 'and' and args:
+        last = infer(args[-1], lookup, safe)
+        return last | {BOOLEAN} if len(args) > 1 else last
+    if form == 'or' and args:
+        return frozenset().union(*(infer(arg, lookup, safe)
+                                   for arg in args))
+    if form in ('and', 'or'):
+        return frozenset({BOOLEAN})
+    if form in ('lambda', 'closure'):
+        return frozenset({PROCEDURE})
+    if form == 'quote' and len(args) == 1:
+        return frozenset({SYMBOL}) if isinstance(args[0], str) \
+            else literal_type(args[0])
+    if form == 'labels' and len(args) == 2:
+        return infer(args[1], lookup, safe)
+    if form in ('let', 'letrec'):
+        try:
+            bindings, body = parse_let(args)
+        except ValueError:
+            return ANY
+        inner = _scope({name: infer(init, lookup, safe)
+                        for name, init in bindings}, lookup)
+        return infer(body[-1], inner, safe)
+    return ANY
+
+
+def can_fail(expr: Any, lookup: Lookup = no_variables,
+             safe: bool = False) -> bool:
+    """Checks if a runtime check may fail while evaluating expr.
+
+    Only programs compiled in safe mode have checks. Malformed expressions,
+    which can't be compiled at all, and calls checking an index or length,
+    count as failing.
+    """
+    if not safe:
+        return False
+    if (isinstance(expr, str) and lookup(expr) is not None) or \
+            is_immediate(expr):
+        return False
+    if is_primitive_call(expr):
+        if not _is_call(expr) or expr[1] in range_checked:
+            return True
+        return (any(can_fail(arg, lookup, safe) for arg in expr[2:]) or
+                not _proven_operands(expr, lookup, safe))
+    if not is_special_form(expr) or expr[0] in ('funcall', 'tail-call'):
+        return True
+    if expr[0] in ('lambda', 'closure'):
+        return False
+    if expr[0] == 'quote':
+        return len(expr) != 2 or isinstance(expr[1], list)
+    if expr[0] == 'labels':
+        return len(expr) != 3 or can_fail(expr[2], lookup, safe)
+    if expr[0] == 'letrec':
+        try:
+            bindings, body = parse_let(expr[1:])
+        except ValueError:
+            return True
+        inner = _scope({name: frozenset({PROCEDURE})
+                        for name, _ in bindings}, lookup)
+        return any(can_fail(e, inner, safe) for e in body)
+    if expr[0] == 'let':
+        try:
+            bindings, body = parse_let(expr[1:])
+        except ValueError:
+            return True
+        inner = _scope({name: infer(init, lookup, safe)
+                        for name, init in bindings}, lookup)
+        return (any(can_fail(init, lookup, safe) for _, init in bindings) or
+                any(can_fail(e, inner, safe) for e in body))
+    return any(can_fail(arg, lookup, safe) for arg in expr[1:])
+
+
+def decide(expr: Any, lookup: Lookup = no_variables,
+           safe: bool = False) -> Optional[bool]:
+    """Returns the value of a type predicate call, when types determine it.
+
+    Calls whose arguments may fail a runtime check are never decided, since
+    evaluating them can't be skipped.
+
+    Returns:
+        True or False, or None if the value is only known at runtime.
+    """
+    if not _is_call(expr) or any(can_fail(arg, lookup, safe)
+                                 for arg in expr[2:]):
+        return None
+
+    op = expr[1]
+    types: List[Type] = [infer(arg, lookup, safe) for arg in expr[2:]]
+    if op in predicate_tags:
+        (arg_type,) = types
+        if arg_type == {predicate_tags[op]}:
+            return True
+        if predicate_tags[op] not in arg_type and OTHER not in arg_type:
+            return False
+    elif op == 'zero?':
+        (arg_type,) = types
+        if FIXNUM not in arg_type and OTHER not in arg_type:
+            return False
+    elif op in ('=', 'eq?'):
+        # words with different tags are never equal
+        if not types[0] & types[1] and OTHER not in types[0] | types[1]:
+            return False
+    return None
+
+
+def type_tags(target: Target) -> Dict[str, Tuple[int, int]]:
+    """Tag bits of the words of each type on target, and their tag."""
+    return {FIXNUM: (target.fixnum_mask, 0), CHAR: (char_mask, char_tag),
+            BOOLEAN: (bool_mask, bool_tag), PAIR: (ptr_mask, pair_tag),
+            VECTOR: (ptr_mask, vec_tag), STRING: (ptr_mask, str_tag),
+            PROCEDURE: (ptr_mask, closure_tag),
+            SYMBOL: (ptr_mask, sym_tag)}
+
+
+class TypeChecks:
+    """Type information used during code generation, and what it saved.
+
+    Args:
+        target (Target): Target code is generated for.
+        safe (bool): Whether primitives check the types of their operands
+            at runtime.
+
+    Attributes:
+        slots (Dict[str, Type]): Type of the variable held by each operand,
+            recorded by `bind` when the variable's value is stored there.
+        emitted (int): Runtime checks generated so far.
+        removed (int): Runtime checks left out, since they always pass.
+        folded (int): Type predicates replaced by their value.
+    """
+    def __init__(self, target: Target, safe: bool = False) -> None:
+        self.safe = safe
+        self.tags = type_tags(target)
+        self.slots: Dict[str, Type] = {}
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears the counts."""
+        self.emitted = 0
+        self.removed = 0
+        self.folded = 0
+
+    def lookup(self, env: Env) -> Lookup:
+        """Types of the variables of env."""
+        return lambda name: self.slots.get(env[name], ANY) \
+            if name in env else None
+
+    def bind(self, operand: str, expr: Any, env: Env) -> None:
+        """Records that operand now holds the value of expr."""
+        self.slots[operand] = infer(expr, self.lookup(env), self.safe)
+
+    def forget(self, operand: str) -> None:
+        """Records that operand holds a value of unknown type."""
+        self.slots.pop(operand, None)
+
+    def needs_check(self, op: str, i: int, expr: Any,
+                    env: Env) -> Optional[Tuple[int, int]]:
+        """Checks if operand i of op, expr, must be checked at runtime.
+
+        Returns:
+            The tag bits to test and the tag they must hold, or None when
+            no check is needed.
+        """
+        if not self.safe or op not in signatures or \
+                signatures[op].operands[i] is None:
+            return None
+        return self._needs(signatures[op].operands[i], expr, env)
+
+    def needs_procedure_check(self, expr: Any,
+                              env: Env) -> Optional[Tuple[int, int]]:
+        """Like `needs_check`, for expr called as a procedure."""
+        return self._needs(PROCEDURE, expr, env) if self.safe else None
+
+    def _needs(self, required: str, expr: Any,
+               env: Env) -> Optional[Tuple[int, int]]:
+        if infer(expr, self.lookup(env), self.safe) == {required}:
+            self.removed += 1
+            return None
+        self.emitted += 1
+        return self.tags[required]
+
+    def decide(self, expr: Any, env: Env) -> Optional[bool]:
+        """Returns the value of a type predicate call, if it's known."""
+        value = decide(expr, self.lookup(env), self.safe)
+        if value is not None:
+            self.folded += 1
+        return value
+
+    def summary(self) -> str:
+        """Describes the checks removed so far, for diagnostics."""
+        return (f"type checks: {self.emitted} emitted, {self.removed} "
+                f"removed; {self.folded} predicates folded")
@@ -0,0 +1,515 @@
+from typing import (
+    Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
+)
+
+from pasquim.primitives import (
+    bool_mask, bool_tag, char_mask, char_shift, char_tag, immediate_rep,
+    is_application, is_immediate, is_primitive_call, is_special_form,
+    is_variable, parse_let, primitive_ops
+)
+from pasquim.target import Target
+
+
+"""
+A linear intermediate representation between Scheme and assembly.
+
+Expressions are lowered to three-address code over virtual registers, where
+every instruction defines at most one register and its operands are either
+registers or constant machine words:
+
+    v0 = and v1, 3
+    v2 = eq v0, 0
+    ret v2
+
+Operations work on raw machine words, so tagging is made explicit during
+lowering and passes don't need to know about Scheme types. The words are
+those of the target the function was lowered for, and constants that don't
+fit an instruction's immediate operand on that target get their own `const`
+instruction. Variables bound by `let` are just names for the operands of
+their values.
+
+`if`, `and` and `or` lower to labels and jumps, which only ever go forward.
+A predicate in test position becomes a single conditional jump comparing
+its operands, like `jge v0, v1, L0`, and never builds the boolean. The
+value of a conditional is a register that each of its branches sets with
+`move`, the only instruction that may define a register more than once.
+Heap objects and procedures aren't covered yet, and lowering a primitive
+working on the heap or a procedure call raises `Unsupported`.
+
+The IR is an opt-in path beside `compile_expr`, which stays the default
+code generator: `Compiler(use_ir=True)` lowers each expression here first,
+and compiles the ones raising `Unsupported` straight from the syntax tree
+instead, as it does every expression in safe, instrumented or exact mode.
+
+Operations:
+
+    const w        the word w
+    add a, b       a + b
+    sub a, b       a - b
+    imul a, b      a * b, keeping the low word
+    and a, b       bitwise and
+    shr a, n       logical shift right by the constant n
+    eq a, b        the boolean a == b
+    lt a, b        the boolean a < b, as signed words
+    move a         a, in the register of a conditional's value
+    label L        marks the position L
+    jump L         continues at L
+    jeq a, b, L    continues at L if a == b
+    jne a, b, L    continues at L if a != b
+    jlt a, b, L    continues at L if a < b, as signed words
+    jge a, b, L    continues at L if a >= b, as signed words
+    ret a          returns a; ends the function
+"""
+
+
+class Label(NamedTuple):
+    name: str
+
+    def __str__(self) -> str:
+        return self.name
+
+
+Var = str
+Operand = Union[Var, int]
+# a comparison, true when `op` holds between the two operands
+Test = Tuple[str, Operand, Operand]
+
+
+class Unsupported(ValueError):
+    """Raised when lowering a form the IR can't represent yet."""
+
+
+class Instr(NamedTuple):
+    op: str
+    dest: Optional[Var]
+    args: Tuple[Operand, ...]
+
+    def __str__(self) -> str:
+        args = ", ".join(str(arg) for arg in self.args)
+        if self.dest is None:
+            return f"{self.op} {args}"
+        return f"{self.dest} = {self.op} {args}"
+
+
+binary_ops = ("add", "sub", "imul", "and", "shr", "eq", "lt")
+commutative_ops = ("add", "imul", "and", "eq")
+# conditional jumps, and the one taken when each of them isn't
+branch_ops = {"jeq": "jne", "jne": "jeq", "jlt": "jge", "jge": "jlt"}
+jump_ops = ("jump", *branch_ops)
+
+
+def is_var(operand: Operand) -> bool:
+    return isinstance(operand, str)
+
+
+class Function:
+    """A sequence of IR instructions ending in `ret`.
+
+    Args:
+        target (Target): Target whose machine words the function computes.
+    """
+    def __init__(self, target: Target) -> None:
+        self.target = target
+        self.instructions: List[Instr] = []
+        self.vars = 0
+        self.labels = 0
+
+    def new_var(self) -> Var:
+        var = f"v{self.vars}"
+        self.vars += 1
+        return var
+
+    def new_label(self) -> Label:
+        label = Label(f"L{self.labels}")
+        self.labels += 1
+        return label
+
+    def emit(self, op: str, *args: Operand) -> Var:
+        """Appends an instruction defining a new register, returning it."""
+        dest = self.new_var()
+        self.instructions.append(Instr(op, dest, args))
+        return dest
+
+    def move(self, dest: Var, value: Operand) -> None:
+        self.instructions.append(Instr("move", dest, (value,)))
+
+    def jump(self, op: str, *args: Union[Operand, Label]) -> None:
+        """Appends a jump, the label being its last operand."""
+        self.instructions.append(Instr(op, None, args))
+
+    def place(self, label: Label) -> None:
+        self.instructions.append(Instr("label", None, (label,)))
+
+    def copy(self) -> "Function":
+        """An empty function for the same target, numbering registers and
+        labels after those of this one."""
+        copied = Function(self.target)
+        copied.vars, copied.labels = self.vars, self.labels
+        return copied
+
+    def dump(self) -> str:
+        """Textual form of the function, one instruction per line."""
+        return "".join(f"{instr}\n" for instr in self.instructions)
+
+    def __str__(self) -> str:
+        return self.dump()
+
+
+# lowering
+def _wrap(word: int, target: Target) -> int:
+    """Wraps a word to a signed integer of the target's word size."""
+    return (word + 2 ** (target.bits - 1)) % 2 ** target.bits \
+        - 2 ** (target.bits - 1)
+
+
+def _constant(word: int, func: Function) -> Operand:
+    """Operand for a constant word, materialized if it's too large."""
+    word = _wrap(word, func.target)
+    if func.target.fits_imm32(word):
+        return word
+    return func.emit("const", word)
+
+
+def _binary(op: str, a: Operand, b: Operand, func: Function) -> Var:
+    if op in commutative_ops and not is_var(a) and is_var(b):
+        a, b = b, a  # keep constants on the right, where x86 takes them
+    return func.emit(op, a, b)
+
+
+def _lower_operands(op: str, args: list, func: Function,
+                    env: Dict[str, Operand]) -> List[Operand]:
+    if op in unary_lowering or op in unary_tests:
+        if len(args) != 1:
+            raise ValueError(f"A single argument should be passed to {op}.")
+    elif len(args) != 2:
+        raise ValueError(f"Two arguments should be passed to {op}.")
+    return [_lower(arg, func, env) for arg in args]
+
+
+def _lower_predicate(expr: list, func: Function, env: Dict[str, Operand]
+                     ) -> Test:
+    """Lowers the operands of a predicate call, returning its test."""
+    op = expr[1]
+    operands = _lower_operands(op, expr[2:], func, env)
+    return {**unary_tests, **binary_tests}[op](*operands, func)
+
+
+def _lower_call(expr: list, func: Function, env: Dict[str, Operand]
+                ) -> Operand:
+    op = expr[1]
+    if op in unary_tests or op in binary_tests:
+        return _binary(*_lower_predicate(expr, func, env), func)
+    if op in unary_lowering:
+        return unary_lowering[op](*_lower_operands(op, expr[2:], func, env),
+                                  func)
+    if op in binary_lowering:
+        return binary_lowering[op](*_lower_operands(op, expr[2:], func, env),
+                                   func)
+    if op in primitive_ops:
+        raise Unsupported(f"Can't lower {op} to IR yet")
+    raise ValueError(f"Unknown primitive {op}")
+
+
+def _lower_test(expr: Any, func: Function, env: Dict[str, Operand],
+                false_label: Label) -> None:
+    """Lowers expr as a condition, jumping to false_label when it's #f.
+
+    Falls through when expr holds. Predicates jump on the comparison of
+    their operands, and never build the boolean.
+    """
+    false = immediate_rep(False)
+    if is_primitive_call(expr) and (expr[1] in unary_tests or
+                                    expr[1] in binary_tests):
+        op, a, b = _lower_predicate(expr, func, env)
+        if op in commutative_ops and not is_var(a) and is_var(b):
+            a, b = b, a
+        func.jump(branch_ops[f"j{op}"], a, b, false_label)
+    elif is_special_form(expr) and expr[0] == 'and':
+        for test in expr[1:]:
+            _lower_test(test, func, env, false_label)
+    elif is_special_form(expr) and len(expr) > 1 and expr[0] == 'or':
+        true_label = func.new_label()
+        for test in expr[1:-1]:
+            next_label = func.new_label()
+            _lower_test(test, func, env, next_label)
+            func.jump("jump", true_label)
+            func.place(next_label)
+        _lower_test(expr[-1], func, env, false_label)
+        func.place(true_label)
+    else:
+        func.jump("jeq", _lower(expr, func, env), false, false_label)
+
+
+def _lower_if(args: list, func: Function, env: Dict[str, Operand]
+              ) -> Operand:
+    if len(args) != 3:
+        raise ValueError("if takes a test, a consequent and an alternative.")
+    test, consequent, alternative = args
+    alternative_label, end_label = func.new_label(), func.new_label()
+    result = func.new_var()
+
+    _lower_test(test, func, env, alternative_label)
+    func.move(result, _lower(consequent, func, env))
+    func.jump("jump", end_label)
+    func.place(alternative_label)
+    func.move(result, _lower(alternative, func, env))
+    func.place(end_label)
+    return result
+
+
+def _lower_and(args: list, func: Function, env: Dict[str, Operand]
+               ) -> Operand:
+    if len(args) <= 1:
+        return _lower(args[0], func, env) if args else \
+            _constant(immediate_rep(True), func)
+    false_label, end_label = func.new_label(), func.new_label()
+    result = func.new_var()
+
+    for test in args[:-1]:
+        _lower_test(test, func, env, false_label)
+    func.move(result, _lower(args[-1], func, env))
+    func.jump("jump", end_label)
+    func.place(false_label)
+    func.move(result, immediate_rep(False))
+    func.place(end_label)
+    return result
+
+
+def _lower_or(args: list, func: Function, env: Dict[str, Operand]
+              ) -> Operand:
+    if len(args) <= 1:
+        return _lower(args[0], func, env) if args else \
+            _constant(immediate_rep(False), func)
+    end_label = func.new_label()
+    result = func.new_var()
+
+    for expr in args[:-1]:
+        func.move(result, _lower(expr, func, env))
+        func.jump("jne", result, immediate_rep(False), end_label)
+    func.move(result, _lower(args[-1], func, env))
+    func.place(end_label)
+    return result
+
+
+def _lower_let(args: list, func: Function, env: Dict[str, Operand]
+               ) -> Operand:
+    bindings, body = parse_let(args)
+    inner = dict(env)
+    for name, expr in bindings:
+        inner[name] = _lower(expr, func, env)
+    for expr in body:
+        result = _lower(expr, func, inner)
+    return result
+
+
+def _lower(expr: Any, func: Function, env: Dict[str, Operand]) -> Operand:
+    if is_variable(expr, env):
+        return env[expr]
+    elif is_immediate(expr) and expr is not None:
+        return _constant(immediate_rep(expr, func.target), func)
+    elif is_special_form(expr) and expr[0] in special_lowering:
+        return special_lowering[expr[0]](expr[1:], func, env)
+    elif is_special_form(expr):
+        raise Unsupported(f"Can't lower {expr[0]} to IR yet")
+    elif is_primitive_call(expr):
+        return _lower_call(expr, func, env)
+    elif is_application(expr):
+        raise Unsupported("Can't lower procedure calls to IR yet")
+    elif isinstance(expr, str):
+        raise ValueError(f"Unbound variable {expr}")
+    raise ValueError(f"Unrecognized expression {str(expr)}")
+
+
+special_lowering: Dict[str, Callable[[list, Function, Dict[str, Operand]],
+                                     Operand]] = {
+    'let': _lower_let,
+    'if': _lower_if,
+    'and': _lower_and,
+    'or': _lower_or,
+}
+
+
+def _tag_test(a: Operand, mask: int, tag: int, func: Function) -> Test:
+    return ("eq", _binary("and", a, mask, func), tag)
+
+
+def _char_equal(a: Operand, b: Operand, func: Function) -> Test:
+    return ("eq", func.emit("shr", a, char_shift),
+            func.emit("shr", b, char_shift))
+
+
+def _mul(a: Operand, b: Operand, func: Function) -> Var:
+    # untag one operand, so the product carries the other one's tag
+    return _binary("imul", func.emit("shr", b, func.target.fixnum_shift), a,
+                   func)
+
+
+unary_lowering = {
+    'add1': lambda a, f: f.emit("add", a, immediate_rep(1, f.target)),
+    'sub1': lambda a, f: f.emit("sub", a, immediate_rep(1, f.target)),
+}
+
+binary_lowering = {
+    '+': lambda a, b, f: _binary("add", a, b, f),
+    '-': lambda a, b, f: f.emit("sub", a, b),
+    '*': _mul,
+}
+
+# predicates, lowered to the comparison they test
+unary_tests = {
+    'integer?': lambda a, f: _tag_test(a, f.target.fixnum_mask, 0, f),
+    'zero?': lambda a, f: ("eq", a, 0),
+    'boolean?': lambda a, f: _tag_test(a, bool_mask, bool_tag, f),
+    'char?': lambda a, f: _tag_test(a, char_mask, char_tag, f),
+}
+
+binary_tests = {
+    '=': lambda a, b, f: ("eq", a, b),
+    'eq?': lambda a, b, f: ("eq", a, b),
+    '<': lambda a, b, f: ("lt", a, b),
+    'char=?': _char_equal,
+}
+
+
+def lower(expr: Any, target: Target) -> Function:
+    """Lowers a Scheme expression to an IR function computing its value."""
+    func = Function(target)
+    result = _lower(expr, func, {})
+    func.instructions.append(Instr("ret", None, (result,)))
+    return func
+
+
+# analysis
+def successors(func: Function) -> List[List[int]]:
+    """Finds the instructions that can run right after each instruction."""
+    positions = {instr.args[0]: i for i, instr in enumerate(func.instructions)
+                 if instr.op == "label"}
+    following: List[List[int]] = []
+    for i, instr in enumerate(func.instructions):
+        if instr.op == "ret":
+            following.append([])
+        elif instr.op == "jump":
+            following.append([positions[instr.args[0]]])
+        elif instr.op in branch_ops:
+            following.append([i + 1, positions[instr.args[-1]]])
+        else:
+            following.append([i + 1])
+    return following
+
+
+def liveness(func: Function) -> List[Set[Var]]:
+    """Computes the registers live after each instruction.
+
+    Since jumps only go forward, a single backward pass over the
+    instructions sees every successor of one before the instruction itself.
+
+    Returns:
+        For each instruction, the registers whose current value is read by
+        some instruction that can run later.
+    """
+    following = successors(func)
+    live_in: List[Set[Var]] = [set() for _ in func.instructions]
+    live_out: List[Set[Var]] = [set() for _ in func.instructions]
+    for i in reversed(range(len(func.instructions))):
+        live_out[i] = set().union(*(live_in[j] for j in following[i]))
+        instr = func.instructions[i]
+        live = live_out[i] - {instr.dest}
+        live.update(arg for arg in instr.args if is_var(arg))
+        live_in[i] = live
+    return live_out
+
+
+# optimization
+def _evaluate(op: str, a: int, b: int, target: Target) -> int:
+    unsigned = 2 ** target.bits
+    return {
+        "add": lambda: a + b,
+        "sub": lambda: a - b,
+        "imul": lambda: a * b,
+        "and": lambda: a & b,
+        "shr": lambda: (a % unsigned) >> b,
+        "eq": lambda: immediate_rep(a == b),
+        "lt": lambda: immediate_rep(a < b),
+    }[op]()
+
+
+def fold_constants(func: Function) -> Function:
+    """Computes instructions whose operands are all constants.
+
+    Registers holding a known constant are replaced by it in every
+    instruction that reads them, when it fits an immediate operand.
+    Conditional jumps comparing two constants become a `jump` when they're
+    taken, and are removed otherwise.
+    """
+    known: Dict[Var, int] = {}
+    folded = func.copy()
+
+    def operand(arg: Operand) -> Operand:
+        return known.get(arg, arg) if is_var(arg) else arg
+
+    for instr in func.instructions:
+        args = tuple(operand(arg) for arg in instr.args)
+        if instr.op in binary_ops and not any(map(is_var, args)):
+            instr = Instr("const", instr.dest,
+                          (_wrap(_evaluate(instr.op, *args, func.target),
+                                 func.target),))
+        elif instr.op in branch_ops and not any(map(is_var, args)):
+            a, b, label = args
+            if {"jeq": a == b, "jne": a != b, "jlt": a < b,
+                    "jge": a >= b}[instr.op]:
+                folded.jump("jump", label)
+            continue
+        else:
+            instr = instr._replace(args=args)
+
+        if instr.op == "const" and func.target.fits_imm32(instr.args[0]):
+            known[instr.dest] = instr.args[0]
+        else:
+            folded.instructions.append(instr)
+    return folded
+
+
+def remove_unreachable(func: Function) -> Function:
+    """Removes instructions no path reaches, jumps to the instruction
+    following them and labels nothing jumps to."""
+    reachable = func.copy()
+    targets: Set[Label] = set()
+    reached = True
+    for instr in func.instructions:
+        if instr.op == "label":
+            reached = reached or instr.args[0] in targets
+        if not reached:
+            continue
+        reachable.instructions.append(instr)
+        if instr.op in jump_ops:
+            targets.add(instr.args[-1])
+        reached = instr.op not in ("jump", "ret")
+
+    instructions = reachable.instructions
+    instructions = [
+        instr for instr, following in zip(instructions, instructions[1:] +
+                                          [Instr("ret", None, ())])
+        if instr.op != "jump" or following != Instr("label", None, instr.args)
+    ]
+    targets = {instr.args[-1] for instr in instructions
+               if instr.op in jump_ops}
+    reachable.instructions = [instr for instr in instructions
+                              if instr.op != "label" or
+                              instr.args[0] in targets]
+    return reachable
+
+
+def eliminate_dead_code(func: Function) -> Function:
+    """Removes instructions defining registers nothing reads."""
+    live_out = liveness(func)
+    kept = func.copy()
+    kept.instructions = [
+        instr for instr, live in zip(func.instructions, live_out)
+        if instr.dest is None or instr.dest in live
+    ]
+    return kept
+
+
+def optimize(func: Function) -> Function:
+    """Runs the IR optimizations."""
+    return eliminate_dead_code(remove_unreachable(fold_constants(func)))
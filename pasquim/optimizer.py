@@ -0,0 +1,517 @@
+from typing import (
+    Any, Callable, Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+)
+
+from pasquim import closures
+from pasquim.emitter import Emitter
+from pasquim.hashcons import Node, NodeTable
+from pasquim.parser import rebuild
+from pasquim.primitives import (
+    bool_mask, bool_tag, char_mask, char_shift, char_tag, compile_expr,
+    decode_immediate, immediate_rep, is_application, is_immediate,
+    is_primitive_call, is_quote, is_special_form, parse_lambda, parse_let
+)
+from pasquim.target import Target
+
+
+"""
+Optimization passes run between parsing and code generation.
+
+A pass is a function taking an expression and the target it will be
+compiled for, and returning an equivalent expression. Passes are registered
+with `register_pass`, together with the lowest optimization level that
+enables them, and run in registration order by a `PassManager`.
+
+Passes must not change what a program prints, down to the exact word the
+unoptimized code would compute, including fixnum wraparound. Passes that may
+also remove a runtime type error, which programs compiled in safe mode
+report, are skipped for those programs, and so are passes relying on
+wraparound or moving arithmetic, which type checks then, for programs
+compiled with exact integers.
+"""
+
+Pass = Callable[[Any, Target], Any]
+
+
+class PassInfo(NamedTuple):
+    name: str
+    run: Pass
+    level: int
+    safe: bool
+    exact: bool = True
+
+
+passes: Dict[str, PassInfo] = {}
+
+
+def register_pass(name: str, level: int = 1, safe: bool = False,
+                  exact: bool = True) -> Callable[[Pass], Pass]:
+    """Registers the decorated function as an optimization pass.
+
+    Args:
+        safe (bool): Whether the pass keeps every runtime type error of
+            programs compiled in safe mode.
+        exact (bool): Whether the pass keeps the results of programs
+            compiled with exact integers, which never wrap around and
+            check the types of the operands of arithmetic.
+    """
+    def decorator(func: Pass) -> Pass:
+        passes[name] = PassInfo(name, func, level, safe, exact)
+        return func
+    return decorator
+
+
+class PassManager:
+    """Runs the optimization passes enabled for a compilation.
+
+    Args:
+        target (Target): Target the optimized program will be compiled for.
+        opt_level (int): Optimization level; every pass registered at this
+            level or below is enabled.
+        enable (List[str], optional): Passes to run regardless of level.
+        disable (List[str], optional): Passes to skip regardless of level.
+        safe (bool): Whether the program is compiled in safe mode, which
+            skips the passes that may remove runtime type errors.
+        exact (bool): Whether the program is compiled with exact integers,
+            which skips the passes relying on wraparound or moving
+            arithmetic.
+    """
+    def __init__(self, target: Target, opt_level: int = 0,
+                 enable: Optional[List[str]] = None,
+                 disable: Optional[List[str]] = None,
+                 safe: bool = False, exact: bool = False) -> None:
+        for name in (enable or []) + (disable or []):
+            if name not in passes:
+                raise ValueError(f"Unknown optimization pass {name}")
+
+        self.target = target
+        self.opt_level = opt_level
+        self.passes = [info for info in passes.values()
+                       if (info.level <= opt_level or
+                           info.name in (enable or [])) and
+                       info.name not in (disable or []) and
+                       (info.safe or not safe) and
+                       (info.exact or not exact)]
+
+    def run(self, expr: Any) -> Any:
+        """Returns expr after running every enabled pass on it."""
+        for info in self.passes:
+            expr = info.run(expr, self.target)
+        return expr
+
+    def count_instructions(self, expr: Any) -> int:
+        """Number of instructions generated for expr."""
+        out = Emitter(target=self.target)
+        compile_expr(closures.convert(expr), -self.target.wordsize, out)
+        return len(out)
+
+    def report(self, expr: Any) -> List[Dict[str, Any]]:
+        """Runs the passes on expr, measuring the effect of each one.
+
+        Returns:
+            For each pass, the number of instructions generated for the
+            expression before and after it ran, and their difference.
+        """
+        rows = []
+        before = self.count_instructions(expr)
+        for info in self.passes:
+            expr = info.run(expr, self.target)
+            after = self.count_instructions(expr)
+            rows.append({"pass": info.name, "before": before,
+                         "after": after, "removed": before - after})
+            before = after
+        return rows
+
+
+Bound = FrozenSet[str]
+
+
+def transform(expr: Any, rewrite: Callable[[Any, Bound], Any],
+              bound: Bound = frozenset()) -> Any:
+    """Rewrites every subexpression of expr, innermost first.
+
+    Args:
+        rewrite: Called with each subexpression, after its own
+            subexpressions were rewritten, and the names of the variables in
+            scope there, which must not be mistaken for char literals.
+        bound: Names of the variables in scope around expr.
+    """
+    if is_primitive_call(expr):
+        expr = rebuild(expr, expr[:2] + [transform(arg, rewrite, bound)
+                                         for arg in expr[2:]])
+    elif is_special_form(expr) and expr[0] in ('let', 'letrec'):
+        try:
+            bindings, body = parse_let(expr[1:])
+        except ValueError:
+            return expr  # left for code generation to report
+        inner = bound | {name for name, _ in bindings}
+        scope = inner if expr[0] == 'letrec' else bound
+        bindings = rebuild(expr[1], [
+            rebuild(binding, [binding[0],
+                              transform(binding[1], rewrite, scope)])
+            for binding in bindings])
+        expr = rebuild(expr, [expr[0], bindings] +
+                       [transform(body_expr, rewrite, inner)
+                        for body_expr in body])
+    elif is_special_form(expr) and expr[0] == 'lambda':
+        try:
+            params, body = parse_lambda(expr[1:])
+        except ValueError:
+            return expr
+        inner = bound | set(params)
+        expr = rebuild(expr, expr[:2] + [transform(body_expr, rewrite, inner)
+                                         for body_expr in body])
+    elif is_special_form(expr) and expr[0] == 'quote':
+        pass  # names quoted aren't variables, nor expressions
+    elif is_special_form(expr):
+        expr = rebuild(expr, expr[:1] + [transform(sub, rewrite, bound)
+                                         for sub in expr[1:]])
+    elif is_application(expr):
+        expr = rebuild(expr, [transform(sub, rewrite, bound)
+                              for sub in expr])
+    return rewrite(expr, bound)
+
+
+# constant folding
+def _signed(word: int, bits: int) -> int:
+    return (word + 2 ** (bits - 1)) % 2 ** bits - 2 ** (bits - 1)
+
+
+def _unsigned(word: int, bits: int) -> int:
+    return word % 2 ** bits
+
+
+def _bool(value: bool) -> int:
+    return immediate_rep(bool(value))
+
+
+# How each primitive transforms the words of its operands, mirroring the
+# instructions it compiles to in primitives.py.
+unary_word_ops: Dict[str, Callable[[Target, int], int]] = {
+    'add1': lambda t, a: a + immediate_rep(1, t),
+    'sub1': lambda t, a: a - immediate_rep(1, t),
+    'integer?': lambda t, a: _bool((a & t.fixnum_mask) == 0),
+    'zero?': lambda t, a: _bool(a == 0),
+    'boolean?': lambda t, a: _bool((a & bool_mask) == bool_tag),
+    'char?': lambda t, a: _bool((a & char_mask) == char_tag),
+}
+
+binary_word_ops: Dict[str, Callable[[Target, int, int], int]] = {
+    '+': lambda t, a, b: a + b,
+    '-': lambda t, a, b: a - b,
+    '*': lambda t, a, b: (_unsigned(b, t.bits) >> t.fixnum_shift) * a,
+    '=': lambda t, a, b: _bool(a == b),
+    'eq?': lambda t, a, b: _bool(a == b),
+    '<': lambda t, a, b: _bool(a < b),
+    'char=?': lambda t, a, b: _bool(
+        _unsigned(a, t.bits) >> char_shift ==
+        _unsigned(b, t.bits) >> char_shift),
+}
+
+word_ops = {**unary_word_ops, **binary_word_ops}
+
+
+def literal_word(expr: Any, target: Target,
+                 bound: Bound = frozenset()) -> Optional[int]:
+    """Returns the word a literal compiles to, or None if not a literal."""
+    if not is_immediate(expr) or expr is None or expr in bound:
+        return None
+    return _signed(immediate_rep(expr, target), target.bits)
+
+
+def word_literal(word: int, target: Target) -> Any:
+    """Returns a literal compiling to exactly word, or None if none does."""
+    word = _signed(word, target.bits)
+    try:
+        value = decode_immediate(word, target)
+    except ValueError:
+        return None
+    return value if literal_word(value, target) == word else None
+
+
+def _fold_call(expr: Any, target: Target, bound: Bound) -> Any:
+    if not is_primitive_call(expr) or expr[1] not in word_ops:
+        return expr
+
+    words = [literal_word(arg, target, bound) for arg in expr[2:]]
+    arity = 1 if expr[1] in unary_word_ops else 2
+    if None in words or len(words) != arity:
+        return expr
+
+    folded = word_literal(word_ops[expr[1]](target, *words), target)
+    if folded is None or folded in bound:  # a variable would shadow it
+        return expr
+    return folded
+
+
+@register_pass("constant-folding", exact=False)
+def fold_constants(expr: Any, target: Target) -> Any:
+    """Evaluates primitive calls whose operands are all literals."""
+    return transform(expr, lambda e, bound: _fold_call(e, target, bound))
+
+
+# algebraic simplification
+def is_pure(expr: Any, bound: Bound = frozenset()) -> bool:
+    """Checks if evaluating expr has no effect besides its result."""
+    if is_immediate(expr) or is_quote(expr) or \
+            (isinstance(expr, str) and expr in bound):
+        return True
+    return (is_primitive_call(expr) and expr[1] in word_ops and
+            all(is_pure(arg, bound) for arg in expr[2:]))
+
+
+def _is_literal(expr: Any, value: int) -> bool:
+    # the same literal, since one too large for a fixnum may wrap around to
+    # its word, but makes a bignum with exact integers
+    return type(expr) is int and expr == value
+
+
+def same_expr(a: Any, b: Any) -> bool:
+    """Checks if two expressions are identical, telling 1 and #t apart."""
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(map(same_expr, a, b))
+    return type(a) is type(b) and a == b
+
+
+def _simplify_call(expr: Any, target: Target, bound: Bound) -> Any:
+    if not is_primitive_call(expr):
+        return expr
+
+    op, args = expr[1], expr[2:]
+    if len(args) == 2:
+        a, b = args
+        if op in ('+', '-') and _is_literal(b, 0):
+            return a  # x + 0 and x - 0 leave the word unchanged
+        if op == '+' and _is_literal(a, 0):
+            return b
+        if op == '*' and _is_literal(b, 1):
+            return a  # the right operand is untagged before multiplying
+        if op == '*' and (_is_literal(a, 0) or _is_literal(b, 0)):
+            if is_pure(a, bound) and is_pure(b, bound):
+                return 0
+        if op in ('-', '=', '<', 'eq?') and same_expr(a, b) and \
+                is_pure(a, bound):
+            return {'-': 0, '=': True, '<': False, 'eq?': True}[op]
+        if op == 'eq?' and is_quote(a) and is_quote(b) and \
+                isinstance(a[1], str) and isinstance(b[1], str):
+            return a[1] == b[1]  # a symbol per name
+    elif len(args) == 1:
+        inverse = {'add1': 'sub1', 'sub1': 'add1'}.get(op)
+        if inverse and is_primitive_call(args[0]) and \
+                args[0][1] == inverse and len(args[0]) == 3:
+            return args[0][2]
+    return expr
+
+
+@register_pass("simplify")
+def simplify(expr: Any, target: Target) -> Any:
+    """Applies algebraic identities that hold for any operand words."""
+    return transform(expr, lambda e, bound: _simplify_call(e, target, bound))
+
+
+# common subexpression elimination
+# Primitives computing a fixnum, worth keeping in a stack slot; predicates
+# are left to compile to a comparison where they're used.
+_ARITHMETIC = ('add1', 'sub1', '+', '-', '*')
+
+# Forms evaluating their first part every time, but the others only on some
+# paths
+_CONDITIONAL = ('if', 'and', 'or')
+
+# Marks impure expressions, which have no node
+_IMPURE = object()
+
+
+class _Eliminator:
+    """Binds repeated pure arithmetic in each scope to a variable.
+
+    Scopes are the whole program, the bodies of `let`, `letrec` and
+    `lambda`, and each part of `if`, `and` and `or` after the first. An
+    expression repeated in a scope is counted there as long as none of its
+    variables are bound again by an inner `let`, and otherwise in the scope
+    of that `let`. Procedures are scopes of their own, so their code never
+    refers to arithmetic done outside them, and so are the parts of
+    conditionals that don't always run, so arithmetic is never computed
+    on a path that wouldn't have computed it.
+    """
+    def __init__(self, expr: Any) -> None:
+        self.table = NodeTable()
+        root = self.table.intern(expr)
+        self.names = set(root.names) if isinstance(root, Node) else set()
+        self.count = 0
+
+    def variable(self) -> str:
+        """Returns a new variable name, which no name of the program is."""
+        while f"cse{self.count}" in self.names:
+            self.count += 1
+        self.count += 1
+        return f"cse{self.count - 1}"
+
+    def walk(self, expr: Any, scope: Bound, rebound: Bound,
+             visit: Callable[[Node, Any], Any]) -> Tuple[Any, Any]:
+        """Walks the part of expr in the current scope, outside procedures.
+
+        Calls visit with the node and expression of every pure arithmetic
+        call none of whose variables are in rebound, and replaces the call
+        with what visit returns.
+
+        Returns:
+            The new expression, and its node or value if it is pure, or
+            `_IMPURE` otherwise.
+        """
+        if is_primitive_call(expr):
+            walked = [self.walk(arg, scope, rebound, visit)
+                      for arg in expr[2:]]
+            expr = rebuild(expr, expr[:2] + [arg for arg, _ in walked])
+            if expr[1] not in word_ops or \
+                    any(pure is _IMPURE for _, pure in walked):
+                return expr, _IMPURE
+            node = self.table.node(expr[:2] + [pure for _, pure in walked])
+            if expr[1] in _ARITHMETIC and not node.names & rebound:
+                expr = visit(node, expr)
+            return expr, node
+        if is_quote(expr):
+            return expr, self.table.intern(expr)
+        if is_immediate(expr) or (isinstance(expr, str) and expr in scope):
+            return expr, self.table.intern(expr)
+        if is_special_form(expr) and expr[0] in ('let', 'letrec'):
+            try:
+                bindings, body = parse_let(expr[1:])
+            except ValueError:
+                return expr, _IMPURE
+            names = {name for name, _ in bindings}
+            inner, renamed = scope | names, rebound | names
+            values_scope, values_rebound = (inner, renamed) \
+                if expr[0] == 'letrec' else (scope, rebound)
+            bindings = rebuild(expr[1], [
+                rebuild(binding, [binding[0], self.walk(
+                    binding[1], values_scope, values_rebound, visit)[0]])
+                for binding in bindings])
+            return rebuild(expr, [expr[0], bindings] + [
+                self.walk(body_expr, inner, renamed, visit)[0]
+                for body_expr in body]), _IMPURE
+        if is_special_form(expr) and expr[0] == 'lambda':
+            return expr, _IMPURE
+        if is_special_form(expr) and expr[0] in _CONDITIONAL and \
+                len(expr) > 1:
+            first = self.walk(expr[1], scope, rebound, visit)[0]
+            return rebuild(expr, [expr[0], first] + expr[2:]), _IMPURE
+        if is_special_form(expr):
+            return rebuild(expr, expr[:1] + [
+                self.walk(sub, scope, rebound, visit)[0]
+                for sub in expr[1:]]), _IMPURE
+        if is_application(expr):
+            return rebuild(expr, [self.walk(sub, scope, rebound, visit)[0]
+                                  for sub in expr]), _IMPURE
+        return expr, _IMPURE
+
+    def _choose(self, counts: Dict[Node, int]) -> List[Node]:
+        """Picks the nodes to compute once, smallest first.
+
+        Computing a node once also computes the calls inside it once, so
+        they only count as repeated if they appear elsewhere too.
+        """
+        chosen = []
+        for node in sorted(counts, key=lambda n: n.size, reverse=True):
+            repeats = counts[node] - 1
+            if repeats < 1:
+                continue
+            chosen.append(node)
+            stack = list(node.items[2:])
+            while stack:
+                item = stack.pop()
+                if isinstance(item, Node):
+                    if item in counts:
+                        counts[item] -= repeats
+                    stack.extend(item.items[2:])
+        return chosen[::-1]
+
+    def _value(self, node: Any, variables: Dict[Node, str]) -> Any:
+        """The expression computing node, using variables for the nodes
+        computed before it."""
+        if not isinstance(node, Node):
+            return node
+        if node in variables:
+            return variables[node]
+        return [self._value(item, variables) for item in node.items]
+
+    def scope(self, body: List[Any], bound: Bound) -> List[Any]:
+        """Eliminates the subexpressions repeated in body, a scope in which
+        the variables in bound are in scope, and in the scopes inside it."""
+        counts: Dict[Node, int] = {}
+
+        def count(node: Node, expr: Any) -> Any:
+            counts[node] = counts.get(node, 0) + 1
+            return expr
+
+        for expr in body:
+            self.walk(expr, bound, frozenset(), count)
+        chosen = self._choose(counts)
+
+        if chosen:
+            variables: Dict[Node, str] = {}
+            bindings = []
+            for node in chosen:
+                value = [self._value(item, variables) for item in node.items]
+                variables[node] = self.variable()
+                bindings.append([variables[node], value])
+
+            def replace(node: Node, expr: Any) -> Any:
+                return variables.get(node, expr)
+
+            body = [self.walk(expr, bound, frozenset(), replace)[0]
+                    for expr in body]
+            # nested, so each binding sees those before it
+            for binding in reversed(bindings):
+                body = [['let', [binding]] + body]
+            bound = bound | set(variables.values())
+
+        return [self.inner_scopes(expr, bound) for expr in body]
+
+    def inner_scopes(self, expr: Any, bound: Bound) -> Any:
+        """Eliminates the subexpressions repeated in each scope inside
+        expr."""
+        if is_primitive_call(expr):
+            return rebuild(expr, expr[:2] + [self.inner_scopes(arg, bound)
+                                             for arg in expr[2:]])
+        if is_special_form(expr) and expr[0] in ('let', 'letrec'):
+            try:
+                bindings, body = parse_let(expr[1:])
+            except ValueError:
+                return expr
+            inner = bound | {name for name, _ in bindings}
+            scope = inner if expr[0] == 'letrec' else bound
+            bindings = rebuild(expr[1], [
+                rebuild(binding, [binding[0],
+                                  self.inner_scopes(binding[1], scope)])
+                for binding in bindings])
+            return rebuild(expr, [expr[0], bindings] +
+                           self.scope(body, inner))
+        if is_special_form(expr) and expr[0] == 'lambda':
+            try:
+                params, body = parse_lambda(expr[1:])
+            except ValueError:
+                return expr
+            return rebuild(expr, expr[:2] + self.scope(body, bound |
+                                                       set(params)))
+        if is_special_form(expr) and expr[0] == 'quote':
+            return expr
+        if is_special_form(expr) and expr[0] in _CONDITIONAL and \
+                len(expr) > 1:
+            return rebuild(expr, [expr[0], self.inner_scopes(expr[1], bound)]
+                           + [self.scope([sub], bound)[0]
+                              for sub in expr[2:]])
+        if is_special_form(expr):
+            return rebuild(expr, expr[:1] + [self.inner_scopes(sub, bound)
+                                             for sub in expr[1:]])
+        if is_application(expr):
+            return rebuild(expr, [self.inner_scopes(sub, bound)
+                                  for sub in expr])
+        return expr
+
+
+@register_pass("cse", exact=False)
+def eliminate_common_subexpressions(expr: Any, target: Target) -> Any:
+    """Computes pure arithmetic repeated in a scope once, binding it to a
+    variable, which keeps it in a stack slot."""
+    return _Eliminator(expr).scope([expr], frozenset())[0]
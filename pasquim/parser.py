@@ -1,9 +1,33 @@
-from typing import List, Union
+from typing import Iterator, List, Union
 import re
 
 # A Scheme expression, which can be an Atom or List
 Exp = Union[str, int, float, list]
 
+# Atom conversions, tried in order; compiled once at import time
+ATOM_TYPES = [
+    (re.compile("-?[0-9]+"), int),
+    (re.compile("#t|#f"), lambda x: True if x == "#t" else False)
+]
+
+# Single regular expression used by the Reader to split program text;
+# the group that matched tells the token kind
+TOKEN_RE = re.compile(r"\s*(?:(\()|(\))|(')|([^\s()']+))")
+OPEN, CLOSE, QUOTE_MARK, ATOM = 1, 2, 3, 4
+
+
+def atom(token: str) -> Union[int, bool, str, list]:
+    """Numbers become numbers; every other token is a symbol.
+
+    `'name` is short for `(quote name)`.
+    """
+    if token.startswith("'") and len(token) > 1:
+        return ["quote", atom(token[1:])]
+    for regexp, func in ATOM_TYPES:
+        if regexp.match(token):
+            return func(token)
+    return token
+
 
 class Lexer:
     """Converts a Scheme program string into a list of tokens.
@@ -53,14 +77,104 @@ class Parser:
         else:
             return self.atom(token)
 
-    def atom(self, token: str) -> Union[int, bool, str]:
+    def atom(self, token: str) -> Union[int, bool, str, list]:
         """Numbers become numbers; every other token is a symbol."""
-        atom_types = [
-            ("-?[0-9]+", int),
-            ("#t|#f", lambda x: True if x == "#t" else False)
-        ]
-
-        for regexp, func in atom_types:
-            if re.match("\\A" + regexp, token):
-                return func(token)
-        return str(token)
+        return atom(token)
+
+
+class SourceList(list):
+    """A list read from source text, remembering where it started.
+
+    Behaves exactly like a plain list, so it compares equal to the output of
+    `Parser`, but also carries the 1-based `line` and `col` of its opening
+    parenthesis.
+    """
+    __slots__ = ("line", "col")
+
+    def __init__(self, line: int = 0, col: int = 0) -> None:
+        super().__init__()
+        self.line = line
+        self.col = col
+
+
+def rebuild(expr: list, items: list) -> list:
+    """Makes a new list like expr, keeping its source position if any."""
+    if isinstance(expr, SourceList):
+        new = SourceList(expr.line, expr.col)
+        new.extend(items)
+        return new
+    return items
+
+
+class Reader:
+    """Reads Scheme expressions straight from a program string.
+
+    Tokenizing and parsing happen in a single linear pass over the text,
+    driven by one regular expression. Nesting is tracked with an explicit
+    stack instead of recursion, so the depth of an expression is only bounded
+    by available memory. Lists are returned as `SourceList` objects holding
+    their position in the program, and `'datum` is read as the plain list
+    `(quote datum)`.
+
+    Args:
+        program (str): The string containing the Scheme program, which may
+            hold any number of top-level expressions.
+    """
+    def __init__(self, program: str) -> None:
+        self.program = program
+
+    def __iter__(self) -> Iterator[Exp]:
+        """Yields each top-level expression as soon as it is complete."""
+        program = self.program
+        stack: List[list] = []
+        line, line_start, scanned = 1, 0, 0
+
+        for match in TOKEN_RE.finditer(program):
+            kind = match.lastindex
+            if kind == ATOM:
+                expr = atom(match.group(ATOM))
+            elif kind == QUOTE_MARK:
+                # a plain list on the stack waits for the datum it quotes
+                stack.append(["quote"])
+                continue
+            else:
+                # only count newlines when a position is actually needed
+                start = match.start(kind)
+                newlines = program.count("\n", scanned, start)
+                if newlines:
+                    line += newlines
+                    line_start = program.rindex("\n", scanned, start) + 1
+                scanned = start
+                col = start - line_start + 1
+
+                if kind == OPEN:
+                    stack.append(SourceList(line, col))
+                    continue
+                elif not stack or not isinstance(stack[-1], SourceList):
+                    raise SyntaxError(
+                        f"unexpected ) at line {line}, column {col}")
+                expr = stack.pop()
+
+            while stack and not isinstance(stack[-1], SourceList):
+                stack[-1].append(expr)
+                expr = stack.pop()
+            if stack:
+                stack[-1].append(expr)
+            else:
+                yield expr
+
+        if stack and not isinstance(stack[-1], SourceList):
+            raise SyntaxError("unexpected EOF after '")
+        if stack:
+            raise SyntaxError(f"unexpected EOF, unclosed ( at line "
+                              f"{stack[-1].line}, column {stack[-1].col}")
+
+    def read(self) -> Exp:
+        """Reads the first expression in the program."""
+        for expr in self:
+            return expr
+        raise SyntaxError('unexpected EOF')
+
+    def read_all(self) -> List[Exp]:
+        """Reads every top-level expression in the program."""
+        return list(self)
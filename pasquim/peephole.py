@@ -0,0 +1,320 @@
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from pasquim.primitives import (
+    bool_shift, bool_tag, immediate_rep, inverse_conditions
+)
+from pasquim.target import Target
+from pasquim.x86 import split_operands
+
+
+"""
+Peephole optimization of generated assembly.
+
+Rules look at a short window of consecutive instructions and return
+instructions to replace it with, or None to leave it alone. They are
+registered with `peephole_rule` and tried in registration order at every
+position of the instruction list, until no rule applies anywhere. Every
+rewrite must shorten the list, which guarantees this terminates.
+
+Labels and directives are never part of a window, since code elsewhere may
+jump to them.
+"""
+
+
+class Instruction(NamedTuple):
+    text: str
+    mnemonic: str
+    operands: Tuple[str, ...]
+
+
+# rewrite(window, flags_live, target), where flags_live tells if anything
+# after the window may read the flags the window leaves behind
+Rewrite = Callable[[List[Instruction], bool, Target], Optional[List[str]]]
+
+
+class Rule(NamedTuple):
+    name: str
+    size: int
+    rewrite: Rewrite
+
+
+rules: Dict[str, Rule] = {}
+
+
+def peephole_rule(name: str, size: int) -> Callable[[Rewrite], Rewrite]:
+    """Registers the decorated function as a rule over size instructions."""
+    def decorator(func: Rewrite) -> Rewrite:
+        rules[name] = Rule(name, size, func)
+        return func
+    return decorator
+
+
+def parse(line: str) -> Optional[Instruction]:
+    """Splits an instruction into mnemonic and operands.
+
+    Returns None for labels and directives.
+    """
+    text = line.strip()
+    if not text or text.endswith(":") or text.startswith("."):
+        return None
+    mnemonic, _, rest = text.partition(" ")
+    operands = tuple(op.strip() for op in split_operands(rest))
+    return Instruction(text, mnemonic, operands)
+
+
+# Instructions by their effect on the flags, without size suffixes.
+FLAG_WRITERS = {"add", "sub", "and", "or", "xor", "cmp", "test", "neg",
+                "sal", "shl", "shr", "sar", "imul"}
+FLAG_NEUTRAL = {"mov", "movabs", "movzbl", "movsbl", "lea", "push", "pop"}
+
+
+def _stem(mnemonic: str) -> str:
+    """Drops the size suffix of a mnemonic, if it has one."""
+    if mnemonic in FLAG_WRITERS or mnemonic in FLAG_NEUTRAL:
+        return mnemonic
+    if mnemonic[-1:] in ("b", "w", "l", "q"):
+        return mnemonic[:-1]
+    return mnemonic
+
+
+def flags_live(instructions: List[Optional[Instruction]], start: int) -> bool:
+    """Checks if code from start on may read the flags set before it.
+
+    The end of the list counts as overwriting them, since the instructions
+    of an expression never leave anything in the flags for its user.
+    """
+    for instruction in instructions[start:]:
+        if instruction is None:
+            return True  # other code may jump to a label and read them
+        stem = _stem(instruction.mnemonic)
+        if stem in FLAG_WRITERS:
+            return False
+        if stem not in FLAG_NEUTRAL:
+            return True  # setcc, jcc, or anything not known to ignore them
+    return False
+
+
+class Peephole:
+    """Applies peephole rules to the instructions of an expression.
+
+    Args:
+        target (Target): Target the instructions were generated for.
+        enable (List[str], optional): Names of the rules to apply. Defaults
+            to every registered rule.
+
+    Attributes:
+        before (int): Number of instructions given to `run` so far.
+        after (int): Number of instructions `run` returned so far.
+        hits (Dict[str, int]): Number of rewrites made by each rule.
+    """
+    def __init__(self, target: Target,
+                 enable: Optional[List[str]] = None) -> None:
+        for name in enable or []:
+            if name not in rules:
+                raise ValueError(f"Unknown peephole rule {name}")
+
+        self.target = target
+        self.rules = [rule for rule in rules.values()
+                      if enable is None or rule.name in enable]
+        self.reset()
+
+    def reset(self) -> None:
+        """Clears the instruction counts."""
+        self.before = 0
+        self.after = 0
+        self.hits: Dict[str, int] = {rule.name: 0 for rule in self.rules}
+
+    def _rewrite(self, instructions: List[Optional[Instruction]],
+                 i: int) -> Optional[Tuple[Rule, List[str]]]:
+        """Tries every rule on the window starting at i."""
+        for rule in self.rules:
+            window = instructions[i:i + rule.size]
+            if len(window) < rule.size or None in window:
+                continue
+            live = flags_live(instructions, i + rule.size)
+            replacement = rule.rewrite(window, live, self.target)
+            if replacement is not None:
+                return rule, replacement
+        return None
+
+    def run(self, lines: Iterable[str]) -> List[str]:
+        """Returns the optimized instructions.
+
+        Args:
+            lines (Iterable[str]): Instructions computing a whole expression,
+                whose flags aren't read after the last one.
+        """
+        lines = list(lines)
+        instructions = [parse(line) for line in lines]
+        self.before += len(lines)
+
+        lookbehind = max((rule.size for rule in self.rules), default=1)
+        i = 0
+        while i < len(lines):
+            match = self._rewrite(instructions, i)
+            if match is None:
+                i += 1
+                continue
+
+            rule, replacement = match
+            self.hits[rule.name] += 1
+            lines[i:i + rule.size] = replacement
+            instructions[i:i + rule.size] = [parse(line)
+                                             for line in replacement]
+            # the new instructions may complete a window starting earlier
+            i = max(0, i - lookbehind + 1)
+
+        self.after += len(lines)
+        return lines
+
+    def summary(self) -> str:
+        """Describes the instructions removed so far, for diagnostics."""
+        hits = ", ".join(f"{name}: {count}"
+                         for name, count in self.hits.items() if count)
+        return (f"peephole: {self.before} -> {self.after} instructions"
+                + (f" ({hits})" if hits else ""))
+
+
+def _immediate(operand: str) -> Optional[int]:
+    """Value of an immediate operand, or None for other operands."""
+    if not operand.startswith("$"):
+        return None
+    try:
+        return int(operand[1:], 0)
+    except ValueError:
+        return None
+
+
+def _is(instruction: Instruction, mnemonic: str, *operands: str) -> bool:
+    return (instruction.mnemonic == mnemonic and
+            instruction.operands == operands)
+
+
+@peephole_rule("redundant-move", 1)
+def redundant_move(window: List[Instruction], live: bool,
+                   t: Target) -> Optional[List[str]]:
+    """mov %x, %x does nothing."""
+    (move,) = window
+    if move.mnemonic == f"mov{t.suffix}" and len(move.operands) == 2 and \
+            move.operands[0] == move.operands[1]:
+        return []
+    return None
+
+
+@peephole_rule("add-zero", 1)
+def add_zero(window: List[Instruction], live: bool,
+             t: Target) -> Optional[List[str]]:
+    """Adding or subtracting 0 only changes the flags."""
+    (op,) = window
+    if op.mnemonic in (f"add{t.suffix}", f"sub{t.suffix}") and not live and \
+            _immediate(op.operands[0]) == 0:
+        return []
+    return None
+
+
+@peephole_rule("store-reload", 2)
+def store_reload(window: List[Instruction], live: bool,
+                 t: Target) -> Optional[List[str]]:
+    """Reading back a value that was just stored leaves it unchanged."""
+    store, load = window
+    mov = f"mov{t.suffix}"
+    if store.mnemonic == mov and len(store.operands) == 2 and \
+            store.operands[0].startswith("%") and \
+            _is(load, mov, store.operands[1], store.operands[0]):
+        return [store.text]
+    return None
+
+
+@peephole_rule("dead-load", 2)
+def dead_load(window: List[Instruction], live: bool,
+              t: Target) -> Optional[List[str]]:
+    """A value loaded into the accumulator and overwritten isn't needed."""
+    first, second = window
+    moves = (f"mov{t.suffix}", "movabsq")
+    if first.mnemonic in moves and first.operands[1:] == (t.ax,) and \
+            second.mnemonic in moves and second.operands[1:] == (t.ax,) and \
+            t.ax not in second.operands[0]:
+        return [second.text]
+    return None
+
+
+@peephole_rule("constant-arithmetic", 2)
+def constant_arithmetic(window: List[Instruction], live: bool,
+                        t: Target) -> Optional[List[str]]:
+    """Adds an immediate to a constant in the accumulator at compile time."""
+    move, op = window
+    value = _immediate(move.operands[0]) if move.operands else None
+    if value is None or live or move.mnemonic not in (f"mov{t.suffix}",
+                                                      "movabsq"):
+        return None
+    if move.operands[1:] != (t.ax,) or op.operands[1:] != (t.ax,):
+        return None
+
+    operand = _immediate(op.operands[0])
+    if operand is None or op.mnemonic not in (f"add{t.suffix}",
+                                              f"sub{t.suffix}"):
+        return None
+    value += operand if op.mnemonic.startswith("add") else -operand
+    value = (value + 2 ** (t.bits - 1)) % 2 ** t.bits - 2 ** (t.bits - 1)
+    mnemonic = f"mov{t.suffix}" if t.fits_imm32(value) else "movabsq"
+    return [f"{mnemonic} ${value}, {t.ax}"]
+
+
+def _boolean_test(window: List[Instruction], mask: Optional[int],
+                  live: bool, t: Target) -> Optional[List[str]]:
+    """Folds a test of a boolean made from the flags into the flags.
+
+    Matches the boolean `set<cc>` computes, followed by a comparison of it
+    (optionally masked) with a constant, the result of which is made into
+    another boolean. Since the first boolean is one of two known words, the
+    comparison's result follows from <cc> or is constant.
+    """
+    s, ax, al = t.suffix, t.ax, t.al
+    first, setcc, shift, tag = window[:4]
+    cmp, clear, test = window[-3:]
+    if live or not (_is(first, f"mov{s}", "$0", ax) and
+                    setcc.operands == (al,) and
+                    setcc.mnemonic[3:] in inverse_conditions and
+                    _is(shift, f"sal{s}", f"${bool_shift}", ax) and
+                    _is(tag, f"or{s}", f"${bool_tag}", ax) and
+                    _is(clear, f"mov{s}", "$0", ax) and
+                    test.mnemonic in ("sete", "setne") and
+                    test.operands == (al,)):
+        return None
+    if cmp.mnemonic != f"cmp{s}" or cmp.operands[1:] != (ax,):
+        return None
+    constant = _immediate(cmp.operands[0])
+    if constant is None:
+        return None
+
+    def result(value):
+        word = immediate_rep(value, t)
+        if mask is not None:
+            word &= mask
+        return (word == constant) == (test.mnemonic == "sete")
+
+    condition = setcc.mnemonic[3:]
+    if result(True) == result(False):
+        return [f"mov{s} ${int(result(True))}, {ax}"]
+    if not result(True):
+        condition = inverse_conditions[condition]
+    return [first.text, f"set{condition} {al}"]
+
+
+@peephole_rule("boolean-test", 7)
+def boolean_test(window: List[Instruction], live: bool,
+                 t: Target) -> Optional[List[str]]:
+    """Folds comparing a boolean made from the flags with a constant."""
+    return _boolean_test(window, None, live, t)
+
+
+@peephole_rule("boolean-tag-test", 8)
+def boolean_tag_test(window: List[Instruction], live: bool,
+                     t: Target) -> Optional[List[str]]:
+    """Folds checking the tag of a boolean made from the flags."""
+    masking = window[4]
+    mask = _immediate(masking.operands[0]) if masking.operands else None
+    if masking.mnemonic != f"and{t.suffix}" or \
+            masking.operands[1:] != (t.ax,) or mask is None:
+        return None
+    return _boolean_test(window, mask, live, t)
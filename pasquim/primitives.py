@@ -1,4 +1,7 @@
-from typing import Any, List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pasquim.emitter import Emitter
+from pasquim.target import Target, X86
 
 
 """
@@ -14,13 +17,19 @@ type            | 31            bit             0
  string pointer | pppppppppppppppppppppppppppp011
  symbol pointer | pppppppppppppppppppppppppppp101
 closure pointer | pppppppppppppppppppppppppppp110
+
+On the x86-64 target words are 64 bits wide, and fixnums use three tag bits
+(`iii...i000`), leaving 61 bits for their value, and the tag `100` is left
+for pointers to bignums, in exact mode. The module-level word and fixnum
+constants below describe the default 32-bit x86 target; code generation
+reads them from `out.target`.
 """
 
-wordsize = 4  # number of bytes used for each word
+wordsize = X86.wordsize  # number of bytes used for each word
 
 # integer
-fixnum_shift = 2
-fixnum_mask = 3
+fixnum_shift = X86.fixnum_shift
+fixnum_mask = X86.fixnum_mask
 
 # bool
 bool_mask = 255
@@ -42,33 +51,119 @@ str_tag = 3
 sym_tag = 5
 closure_tag = 6
 
+# Names of variables in scope, mapped to the operands holding their values
+Env = Dict[str, str]
+
+# Runtime routines reporting an operand of the wrong type, or an index or
+# length out of range, in safe mode
+type_error = "scheme_type_error"
+range_error = "scheme_range_error"
+
+# Runtime routine reporting a procedure called with the wrong number of
+# arguments, in safe mode
+arity_error = "scheme_arity_error"
+
+# Runtime routine collecting garbage when the heap is full
+collector = "scheme_collect"
+
+# Runtime routine returning the symbol named by a string
+intern = "scheme_intern"
+
+# Condition codes that hold exactly when the given one doesn't
+inverse_conditions = {"e": "ne", "ne": "e", "l": "ge", "ge": "l",
+                      "g": "le", "le": "g", "b": "ae", "ae": "b",
+                      "a": "be", "be": "a"}
 
-def immediate_rep(expr: Any):
-    """Converts a Python object to its 32-bit word representation."""
+
+def immediate_rep(expr: Any, target: Target = X86):
+    """Converts a Python object to its word representation on target."""
     if isinstance(expr, bool):
         return (1 << bool_shift) | bool_tag if expr else bool_tag
     elif isinstance(expr, int):
-        return expr << fixnum_shift
+        return expr << target.fixnum_shift
     elif isinstance(expr, str) and len(expr) == 1:
         return (ord(expr) << char_shift) | char_tag
     else:
         NotImplemented
 
 
-def compile_expr(expr: Any, si: int) -> List[str]:
-    if is_immediate(expr):
-        expr = immediate_rep(expr)
-        return [f"movl ${expr}, %eax"]
+def decode_immediate(word: int, target: Target = X86) -> Any:
+    """Converts a word produced by compiled code back to a Python object.
+
+    Args:
+        word (int): The word, as a signed integer.
+        target (Target): Target the word was produced on.
+    """
+    if word & target.fixnum_mask == 0:
+        return word >> target.fixnum_shift
+    elif word & char_mask == char_tag:
+        return chr((word >> char_shift) & 0xff)
+    elif word & bool_mask == bool_tag:
+        return (word >> bool_shift) != 0
+    raise ValueError(f"Can't decode word {word:#x}")
+
+
+def compile_expr(expr: Any, si: int, out: Emitter,
+                 env: Optional[Env] = None) -> None:
+    """Compiles expr, appending its instructions to the emitter `out`.
+
+    The result of the expression is left in the accumulator (`%eax` on x86),
+    and `si` is the stack index of the next free slot below the stack
+    pointer. `env` maps the variables in scope to where their values are.
+    """
+    env = env if env is not None else {}
+    if is_variable(expr, env):
+        out.emit(f"mov{out.target.suffix} {env[expr]}, {out.target.ax}")
+    elif out.exact and _is_bignum(expr, out.target):
+        _move_bignum(expr, out)
+    elif is_immediate(expr):
+        _move_immediate(immediate_rep(expr, out.target), out)
+    elif is_special_form(expr):
+        special_forms[expr[0]](expr[1:], si, out, env)
     elif is_primitive_call(expr):
-        expr.pop(0)
-        primcall_op = expr.pop(0)
-        primcall_args = expr
+        # leave expr untouched, so it can be compiled more than once
+        primcall_op, primcall_args = expr[1], expr[2:]
+        if primcall_op not in primitive_ops:
+            raise ValueError(f"Unknown primitive {primcall_op}")
 
-        return primitive_ops.get(primcall_op)(primcall_args, si)
+        known = _known_predicate(expr, out, env)
+        if known is not None:
+            _move_immediate(immediate_rep(known, out.target), out)
+        elif out.instrumentation is not None:
+            _instrumented(primitive_ops[primcall_op], expr, si, out, env)
+        else:
+            primitive_ops[primcall_op](primcall_args, si, out, env)
+    elif isinstance(expr, str):
+        raise ValueError(f"Unbound variable {expr}")
     else:
         raise ValueError(f"Unrecognized expression {str(expr)}")
 
 
+def _move_immediate(value: int, out: Emitter) -> None:
+    """Loads a word into the accumulator."""
+    t = out.target
+    if t.wordsize == 8:
+        value = (value + 2 ** 63) % 2 ** 64 - 2 ** 63  # wrap to 64 bits
+        if not t.fits_imm32(value):
+            out.emit(f"movabsq ${value}, {t.ax}")
+            return
+    out.emit(f"mov{t.suffix} ${value}, {t.ax}")
+
+
+def _is_bignum(expr: Any, t: Target) -> bool:
+    """Checks if expr is an integer literal too large for a fixnum."""
+    return isinstance(expr, int) and not isinstance(expr, bool) and \
+        not t.fixnum_min <= expr <= t.fixnum_max
+
+
+def _move_bignum(value: int, out: Emitter) -> None:
+    """Loads a pointer to a static bignum holding value into the
+    accumulator."""
+    t = out.target
+    label = out.bignum(value)
+    out.emit(f"lea{t.suffix} {t.address(f'{label}+{t.bignum_tag}')}, {t.ax}")
+
+
 def is_immediate(expr: Any) -> bool:
     """Checks if expr is an immediate value.
 
@@ -79,23 +174,132 @@ def is_immediate(expr: Any) -> bool:
            expr is None)
 
 
+def is_variable(expr: Any, env: Env) -> bool:
+    """Checks if expr refers to a variable in scope.
+
+    Variables shadow character literals with the same name.
+    """
+    return isinstance(expr, str) and expr in env
+
+
 def is_primitive_call(expr: Any) -> bool:
     """Checks if expr is a primitive call."""
     return isinstance(expr, list) and len(expr) > 1 and expr[0] == 'primcall'
 
 
+def is_special_form(expr: Any) -> bool:
+    """Checks if expr is a special form, such as `if` or `let`."""
+    return (isinstance(expr, list) and len(expr) > 0 and
+            isinstance(expr[0], str) and expr[0] in special_forms)
+
+
+def is_application(expr: Any) -> bool:
+    """Checks if expr calls a procedure, such as `(f 1 2)`."""
+    return (isinstance(expr, list) and len(expr) > 0 and
+            not is_special_form(expr) and not is_primitive_call(expr))
+
+
 """
 Primitive operators.
 
 Every operator has a corresponding Python function that
 takes the argument `arg` containing the procedure call's
-arguments, and returns a list of instructions to emmit
-to the assembly program.
+arguments, the stack index `si`, the emitter `out` and the
+environment `env`, and appends the instructions it generates
+to `out`.
+
+Predicates are written as tests, which compare their arguments
+and return the condition code under which the predicate holds,
+leaving the flags set accordingly. They are made into primitives
+returning a boolean by `_predicate`, while `compile_test` jumps
+on their flags directly.
 
 A dict called `primitives` maps the name of the operator
 in Scheme to the corresponding Python function.
 """
 
+Primitive = Callable[[list, int, Emitter, Env], None]
+Test = Callable[[list, int, Emitter, Env], str]
+
+
+def _set_bool_from_flags(setcc: str, out: Emitter) -> None:
+    """Turns the flags of a preceding `cmp` into a boolean."""
+    t, s = out.target, out.target.suffix
+    out.emit(f"mov{s} $0, {t.ax}")            # zero ax, leaving flags alone
+    out.emit(f"{setcc} {t.al}")               # set low bit of ax from flags
+    out.emit(f"sal{s} ${bool_shift}, {t.ax}")  # shift bit up to bool position
+    out.emit(f"or{s} ${bool_tag}, {t.ax}")     # add boolean type tag
+
+
+def _known_predicate(expr: Any, out: Emitter, env: Env) -> Optional[bool]:
+    """Returns the value of a type predicate call when type inference, if
+    enabled for `out`, determines it."""
+    if out.checks is None:
+        return None
+    return out.checks.decide(expr, env)
+
+
+def _is_safe(out: Emitter) -> bool:
+    """Checks if code for `out` checks its operands at runtime."""
+    return out.checks is not None and out.checks.safe
+
+
+def _check_operand(op: str, i: int, expr: Any, operand: str, out: Emitter,
+                   env: Env) -> None:
+    """Checks at runtime that operand i of op has the type op requires.
+
+    Only done in safe mode, and for operands type inference can't vouch
+    for. A wrong operand jumps to the runtime's `scheme_type_error`.
+
+    Args:
+        expr: The operand's expression.
+        operand (str): Where its value is. Only fixnums are checked in
+            place; other values are loaded into the accumulator first,
+            unless they are already there.
+    """
+    required = None if out.checks is None else \
+        out.checks.needs_check(op, i, expr, env)
+    if required is not None and out.exact and op in bignum_routines:
+        # bignums are integers too
+        required = (required[0] & ~out.target.bignum_tag, required[1])
+    if required is not None:
+        _check_tag(required, operand, out)
+
+
+def _check_tag(required: Tuple[int, int], operand: str,
+               out: Emitter) -> None:
+    """Jumps to `scheme_type_error` unless operand has the required tag,
+    given with the bits holding it."""
+    t, s = out.target, out.target.suffix
+    mask, tag = required
+    if operand.startswith("$"):
+        out.emit(f"jmp {type_error}")  # a literal of the wrong type
+        return
+    if tag == 0:
+        out.emit(f"test{s} ${mask}, {operand}")
+        out.emit(f"jne {type_error}")
+        return
+
+    if operand != t.ax:
+        out.emit(f"mov{s} {operand}, {t.ax}")
+    if mask == 255:
+        out.emit(f"cmpb ${tag}, {t.al}")
+        out.emit(f"jne {type_error}")
+    else:
+        # untag in place, so the value is still there once checked
+        out.emit(f"sub{s} ${tag}, {t.ax}")
+        out.emit(f"test{s} ${mask}, {t.ax}")
+        out.emit(f"jne {type_error}")
+        out.emit(f"add{s} ${tag}, {t.ax}")
+
+
+def _predicate(test: Test) -> Primitive:
+    """Makes a primitive returning the boolean a test computes."""
+    def primitive(args: list, si: int, out: Emitter, env: Env) -> None:
+        _set_bool_from_flags(f"set{test(args, si, out, env)}", out)
+    primitive.__doc__ = test.__doc__
+    return primitive
+
 
 # Unary operators
 def _check_unary_args(args: list, op_name: str) -> None:
@@ -103,169 +307,1701 @@ def _check_unary_args(args: list, op_name: str) -> None:
         raise ValueError("A single argument should be passed to {op_name}.")
 
 
-def add1(args: list, si: int) -> List[str]:
+def add1(args: list, si: int, out: Emitter, env: Env) -> None:
     """Adds 1 to a number."""
     _check_unary_args(args, 'add1')
+    t = out.target
 
-    return compile_expr(args[0], si) + [
-        f"addl ${immediate_rep(1)}, %eax"
-    ]
+    compile_expr(args[0], si, out, env)
+    _check_operand('add1', 0, args[0], t.ax, out, env)
+    if out.exact:
+        _exact_add('add1', f"${immediate_rep(1, t)}", si, out)
+        return
+    out.emit(f"add{t.suffix} ${immediate_rep(1, t)}, {t.ax}")
 
 
-def sub1(args: list, si: int) -> List[str]:
+def sub1(args: list, si: int, out: Emitter, env: Env) -> None:
     """Subtracts 1 to a number."""
     _check_unary_args(args, 'sub1')
+    t = out.target
 
-    return compile_expr(args[0], si) + [
-        f"subl ${immediate_rep(1)}, %eax"
-    ]
+    compile_expr(args[0], si, out, env)
+    _check_operand('sub1', 0, args[0], t.ax, out, env)
+    if out.exact:
+        _exact_add('sub1', f"${immediate_rep(1, t)}", si, out)
+        return
+    out.emit(f"sub{t.suffix} ${immediate_rep(1, t)}, {t.ax}")
 
 
-def _is_eax_equal_to(val: Any) -> List[str]:
-    return [
-        f"cmpl ${val}, %eax",         # check eax against val
-        f"movl $0, %eax",             # zero eac, leaving equal flag in place
-        f"sete %al",                  # set low bit of eax if they were equal
-        f"sall ${bool_shift}, %eax",  # shift the bit up to the bool position
-        f"orl ${bool_tag}, %eax"      # add boolean type tag
-    ]
+def _is_eax_equal_to(val: Any, out: Emitter) -> str:
+    t = out.target
+    out.emit(f"cmp{t.suffix} ${val}, {t.ax}")  # check ax against val
+    return "e"
 
 
-def is_integer(args: list, si: int) -> List[str]:
+def is_integer(args: list, si: int, out: Emitter, env: Env) -> str:
     """Checks if value is an integer."""
     _check_unary_args(args, 'integer?')
+    t = out.target
 
-    return (
-        compile_expr(args[0], si) +
-        [f"andl ${fixnum_mask}, %eax"] +
-        _is_eax_equal_to(0)
-    )
+    compile_expr(args[0], si, out, env)
+    mask = t.fixnum_mask & ~t.bignum_tag if out.exact else t.fixnum_mask
+    out.emit(f"and{t.suffix} ${mask}, {t.ax}")
+    return _is_eax_equal_to(0, out)
 
 
-def is_zero(args: list, si: int) -> List[str]:
+def is_zero(args: list, si: int, out: Emitter, env: Env) -> str:
     """Checks if value is the integer zero."""
     _check_unary_args(args, 'zero?')
 
-    return (
-        compile_expr(args[0], si) +
-        _is_eax_equal_to(0)
-    )
+    compile_expr(args[0], si, out, env)
+    return _is_eax_equal_to(0, out)
 
 
-def is_boolean(args: list, si: int) -> List[str]:
+def is_boolean(args: list, si: int, out: Emitter, env: Env) -> str:
     """Checks if value is a boolean."""
     _check_unary_args(args, 'boolean?')
+    t = out.target
 
-    return (
-        compile_expr(args[0], si) +
-        [f"andl ${bool_mask}, %eax"] +
-        _is_eax_equal_to(bool_tag)
-    )
+    compile_expr(args[0], si, out, env)
+    out.emit(f"and{t.suffix} ${bool_mask}, {t.ax}")
+    return _is_eax_equal_to(bool_tag, out)
 
 
-def is_char(args: list, si: int) -> List[str]:
+def is_char(args: list, si: int, out: Emitter, env: Env) -> str:
     """Checks if value is a char."""
     _check_unary_args(args, 'char?')
+    t = out.target
 
-    return (
-        compile_expr(args[0], si) +
-        [f"andl ${char_mask}, %eax"] +
-        _is_eax_equal_to(char_tag)
-    )
+    compile_expr(args[0], si, out, env)
+    out.emit(f"and{t.suffix} ${char_mask}, {t.ax}")
+    return _is_eax_equal_to(char_tag, out)
 
 
 # binary operators
-def add(args: list, si: int) -> List[str]:
+def _literal_word(expr: Any, t: Target, env: Env) -> Optional[int]:
+    """Returns the word a literal compiles to, or None for other exprs.
+
+    Integers too large for a fixnum count as other exprs, since they make
+    bignums in exact mode.
+    """
+    if not is_immediate(expr) or expr is None or is_variable(expr, env) or \
+            _is_bignum(expr, t):
+        return None
+    return (immediate_rep(expr, t) + 2 ** (t.bits - 1)) % 2 ** t.bits \
+        - 2 ** (t.bits - 1)
+
+
+def _direct_operand(expr: Any, t: Target, env: Env) -> Optional[str]:
+    """Returns an operand for expr that needs no code to compute.
+
+    That is the operand holding a variable, or an immediate operand for a
+    literal that fits one.
+    """
+    if is_variable(expr, env):
+        return env[expr]
+    word = _literal_word(expr, t, env)
+    if word is None or not t.fits_imm32(word):
+        return None
+    return f"${word}"
+
+
+def _save_accumulator(si: int, out: Emitter) -> Tuple[str, int]:
+    """Moves the accumulator somewhere the next expression won't clobber.
+
+    A free scratch register is used when there is one, otherwise the value
+    is spilled to the stack slot `si`.
+
+    Returns:
+        The operand now holding the value, and the stack index to compile
+        the next expression with.
+    """
+    t = out.target
+    register = out.registers.acquire()
+    if register is not None:
+        out.emit(f"mov{t.suffix} {t.ax}, {register}")
+        return register, si
+
+    out.emit(f"mov{t.suffix} {t.ax}, {si}({t.sp})")
+    return f"{si}({t.sp})", si - t.wordsize
+
+
+def _release(operand: str, out: Emitter) -> None:
+    """Frees the register behind an operand, once it is no longer used."""
+    if operand in out.registers.live:
+        out.registers.release(operand)
+
+
+def _compile_binary(first: Any, second: Any, si: int, out: Emitter,
+                    env: Env, op: str) -> str:
+    """Compiles second into the accumulator and makes an operand for first.
+
+    Variables and literals are used directly; anything else is compiled
+    before second and kept in a scratch register, or on the stack when every
+    register is taken. Pass the operand to `_release` once it's been used.
+    Both operands are checked to suit the primitive op, which requires the
+    same type of all its operands.
+
+    Returns:
+        The operand holding the value of first.
+    """
+    operand = _direct_operand(first, out.target, env)
+    if operand is not None:
+        _check_operand(op, 0, first, operand, out, env)
+        compile_expr(second, si, out, env)
+        _check_operand(op, 0, second, out.target.ax, out, env)
+        return operand
+
+    compile_expr(first, si, out, env)
+    _check_operand(op, 0, first, out.target.ax, out, env)
+    operand, si = _save_accumulator(si, out)
+    compile_expr(second, si, out, env)
+    _check_operand(op, 0, second, out.target.ax, out, env)
+    return operand
+
+
+"""
+Exact integers.
+
+In exact mode, integers never wrap around: arithmetic whose result doesn't
+fit a fixnum makes a bignum instead, a heap object tagged `bignum_tag`
+
+    bignum  | length | limb 0 | limb 1 | ...
+
+whose length is the number of 64-bit limbs as a fixnum, negated for
+negative numbers, followed by the magnitude, least significant limb first.
+Results that fit a fixnum are always fixnums, so a bignum is never equal to
+a fixnum. Integer literals too large for a fixnum are laid out as static
+bignums in the data section.
+
+Fixnums are still added, subtracted, multiplied and compared inline. A tag
+test, left out for literals, sends other operands to the routine of the
+runtime in `bignum_routines`, and so does a `jo` after the operation, once
+the operation is undone. Both branches fall through in the common case,
+and the calls they lead to are placed out of line, in `Emitter.cold`.
+The routines take both operands, the first root for the collector, since
+they allocate from the heap, and the heap's context.
+"""
+
+# Runtime routines computing the exact result of each primitive, for
+# operands that aren't both fixnums or overflow. `scheme_compare` returns
+# -1, 0 or 1 as its first operand is less than, equal to or greater than the
+# second.
+bignum_routines = {'+': "scheme_add", '-': "scheme_sub", '*': "scheme_mul",
+                   '<': "scheme_compare", '=': "scheme_compare",
+                   'add1': "scheme_add", 'sub1': "scheme_sub"}
+
+
+def _test_fixnums(operands: List[str], slow: str, out: Emitter) -> None:
+    """Jumps to slow unless every operand holds a fixnum.
+
+    Literals are known at compile time, and other operands are tested
+    together when a scratch register is free to combine them.
+    """
+    t, s = out.target, out.target.suffix
+    tested = []
+    for operand in operands:
+        if not operand.startswith("$"):
+            tested.append(operand)
+        elif int(operand[1:]) & t.fixnum_mask:
+            out.emit(f"jmp {slow}")  # a literal of another type
+            return
+
+    register = out.registers.acquire() if len(tested) > 1 else None
+    if register is not None:
+        out.emit(f"mov{s} {tested[0]}, {register}")
+        for operand in tested[1:]:
+            out.emit(f"or{s} {operand}, {register}")
+        tested = [register]
+    for operand in tested:
+        out.emit(f"test{s} ${t.fixnum_mask}, {operand}")
+        out.emit(f"jne {slow}")
+    if register is not None:
+        out.registers.release(register)
+
+
+def _slow_path(op: str, operand: str, si: int, out: Emitter, cold: Emitter,
+               done: str) -> None:
+    """Emits into cold the call of the routine computing op exactly, on
+    the accumulator and operand, and the jump back to done.
+
+    Args:
+        si (int): Stack index of the first free slot, which mustn't hold
+            operand.
+    """
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    saved, si = _save_registers(list(out.registers.live), si, cold)
+    operand = dict(saved).get(operand, operand)
+    roots = f"{si + w}({t.sp})"
+    cold.emit(f"mov{s} {t.hp}, {heap_free * w}({t.ctx})")
+    _call_runtime(bignum_routines[op], [t.ax, operand, f"&{roots}", t.ctx],
+                  si, cold)
+    cold.emit(f"mov{s} {heap_free * w}({t.ctx}), {t.hp}")
+    _restore_registers(saved, cold)
+    if op in ('<', '='):
+        cold.emit(f"cmp{s} $0, {t.ax}")  # flags as for the comparison
+    cold.emit(f"jmp {done}")
+    out.cold.extend(cold.lines)
+
+
+def _free_slot(operand: str, si: int, out: Emitter) -> int:
+    """Returns the stack index of the first free slot, past operand if it
+    was spilled to slot si."""
+    t = out.target
+    return si - t.wordsize if operand == f"{si}({t.sp})" else si
+
+
+def _exact_add(op: str, operand: str, si: int, out: Emitter) -> None:
+    """Adds operand to the accumulator, or subtracts it for `-` and
+    `sub1`, exactly."""
+    t, s = out.target, out.target.suffix
+    instruction, inverse = ("sub", "add") if op in ('-', 'sub1') else \
+        ("add", "sub")
+    slow, overflow, done = out.label(), out.label(), out.label()
+    _test_fixnums([t.ax, operand], slow, out)
+    out.emit(f"{instruction}{s} {operand}, {t.ax}")
+    out.emit(f"jo {overflow}")
+    out.emit(f"{done}:")
+
+    cold = out.fork()
+    cold.emit(f"{overflow}:")
+    cold.emit(f"{inverse}{s} {operand}, {t.ax}")  # back to the operand
+    cold.emit(f"{slow}:")
+    _slow_path(op, operand, _free_slot(operand, si, out), out, cold, done)
+
+
+def _exact_mul(operand: str, si: int, out: Emitter) -> None:
+    """Multiplies the accumulator by operand exactly.
+
+    The product overwrites the accumulator, so its value is first copied
+    to a scratch register, or a stack slot if none is free, for the slow
+    path.
+    """
+    t, s = out.target, out.target.suffix
+    slow, overflow, done = out.label(), out.label(), out.label()
+    si = _free_slot(operand, si, out)
+    kept = out.registers.acquire()
+    if kept is None:
+        kept = f"{si}({t.sp})"
+        si -= t.wordsize
+    # kept before the test, so the slow path saves a value either way
+    out.emit(f"mov{s} {t.ax}, {kept}")
+    _test_fixnums([t.ax, operand], slow, out)
+    factor = int(operand[1:]) >> t.fixnum_shift \
+        if operand.startswith("$") else None
+    if factor is not None and t.fits_imm32(factor):
+        out.emit(f"imul{s} ${factor}, {t.ax}")
+    else:
+        out.emit(f"sar{s} ${t.fixnum_shift}, {t.ax}")
+        out.emit(f"imul{s} {operand}, {t.ax}")
+    out.emit(f"jo {overflow}")
+    out.emit(f"{done}:")
+
+    cold = out.fork()
+    cold.emit(f"{overflow}:")
+    cold.emit(f"mov{s} {kept}, {t.ax}")
+    cold.emit(f"{slow}:")
+    _slow_path('*', operand, si, out, cold, done)
+    _release(kept, out)
+
+
+def add(args: list, si: int, out: Emitter, env: Env) -> None:
     """Adds two numbers and returns results."""
+    t = out.target
+    first, second = args
+    if _direct_operand(second, t, env) is not None:
+        first, second = second, first  # addition commutes
 
-    return (
-        compile_expr(args[0], si) +
-        [f"movl %eax, {si}(%esp)"] +
-        compile_expr(args[1], si - wordsize) +
-        [f"addl {si}(%esp), %eax"]
-    )
+    operand = _compile_binary(first, second, si, out, env, '+')
+    if out.exact:
+        _exact_add('+', operand, si, out)
+    else:
+        out.emit(f"add{t.suffix} {operand}, {t.ax}")
+    _release(operand, out)
 
 
-def sub(args: list, si: int) -> List[str]:
+def sub(args: list, si: int, out: Emitter, env: Env) -> None:
     """Subtracts two numbers and returns results."""
+    t = out.target
+    if out.exact:
+        # the slow path needs the operands in order
+        operand = _compile_binary(args[1], args[0], si, out, env, '-')
+        _exact_add('-', operand, si, out)
+        _release(operand, out)
+        return
+    if (_direct_operand(args[0], t, env) is not None and
+            _direct_operand(args[1], t, env) is None):
+        # compute the operand minus the accumulator as -ax + operand
+        operand = _compile_binary(args[0], args[1], si, out, env, '-')
+        out.emit(f"neg{t.suffix} {t.ax}")
+        out.emit(f"add{t.suffix} {operand}, {t.ax}")
+        return
 
-    return (
-        compile_expr(args[1], si) +
-        [f"movl %eax, {si}(%esp)"] +
-        compile_expr(args[0], si - wordsize) +
-        [f"subl {si}(%esp), %eax"]
-    )
+    operand = _compile_binary(args[1], args[0], si, out, env, '-')
+    out.emit(f"sub{t.suffix} {operand}, {t.ax}")
+    _release(operand, out)
 
 
-def mul(args: list, si: int) -> List[str]:
+def mul(args: list, si: int, out: Emitter, env: Env) -> None:
     """Multiplies two numbers and returns results."""
+    t = out.target
+    if out.exact:
+        first, second = args
+        if _direct_operand(first, t, env) is not None:
+            first, second = second, first  # multiplication commutes
+        operand = _compile_binary(second, first, si, out, env, '*')
+        _exact_mul(operand, si, out)
+        _release(operand, out)
+        return
+    second = _literal_word(args[1], t, env)
+    if second is not None and _direct_operand(args[0], t, env) is None:
+        # untag the literal at compile time instead of shifting at runtime
+        factor = (second % 2 ** t.bits) >> t.fixnum_shift
+        if t.fits_imm32(factor):
+            compile_expr(args[0], si, out, env)
+            _check_operand('*', 0, args[0], t.ax, out, env)
+            _check_operand('*', 1, args[1], f"${second}", out, env)
+            out.emit(f"imul{t.suffix} ${factor}, {t.ax}")
+            return
+
+    operand = _compile_binary(args[0], args[1], si, out, env, '*')
+    out.emit(f"shr{t.suffix} ${t.fixnum_shift}, {t.ax}")
+    out.emit(f"imul{t.suffix} {operand}, {t.ax}")
+    _release(operand, out)
 
-    return (
-        compile_expr(args[0], si) +
-        [f"movl %eax, {si}(%esp)"] +
-        compile_expr(args[1], si - wordsize) +
-        [f"shrl ${fixnum_shift}, %eax",
-         f"imull {si}(%esp), %eax"]
-    )
 
+def _compare(args: list, si: int, out: Emitter, env: Env, op: str,
+             condition: str, swapped_condition: str) -> str:
+    """Compares two values, leaving the result in the flags.
 
-def equal(args: list, si: int) -> List[str]:
+    Args:
+        op (str): The primitive comparing them, which checks their types.
+        condition (str): Condition code for the comparison of args[0]
+            against args[1].
+        swapped_condition (str): The same, with the comparison reversed.
+
+    Returns:
+        The condition code that holds when the comparison does.
+    """
+    t = out.target
+    left, right = args
+    if (_direct_operand(left, t, env) is not None and
+            _direct_operand(right, t, env) is None):
+        left, right, condition = right, left, swapped_condition
+
+    operand = _compile_binary(right, left, si, out, env, op)
+    # equal words are equal integers, and a bignum never equals a fixnum
+    fixnum_literal = any(
+        word is not None and word & t.fixnum_mask == 0
+        for word in (_literal_word(arg, t, env) for arg in args))
+    if out.exact and not (op == '=' and fixnum_literal):
+        slow, done = out.label(), out.label()
+        _test_fixnums([t.ax, operand], slow, out)
+        out.emit(f"cmp{t.suffix} {operand}, {t.ax}")
+        out.emit(f"{done}:")
+        cold = out.fork()
+        cold.emit(f"{slow}:")
+        _slow_path(op, operand, _free_slot(operand, si, out), out, cold,
+                   done)
+    else:
+        out.emit(f"cmp{t.suffix} {operand}, {t.ax}")
+    _release(operand, out)
+    return condition
+
+
+def equal(args: list, si: int, out: Emitter, env: Env) -> str:
     """Checks for equality between two numbers."""
-    return (
-        compile_expr(args[0], si) +
-        [f"movl %eax, {si}(%esp)"] +
-        compile_expr(args[1], si - wordsize) +
-        [f"cmpl %eax, {si}(%esp)",
-         f"movl $0, %eax",
-         f"sete %al",
-         f"sall ${bool_shift}, %eax",
-         f"orl ${bool_tag}, %eax"]
-    )
-
-
-def less_than(args: list, si: int) -> List[str]:
+    return _compare(args, si, out, env, '=', "e", "e")
+
+
+def less_than(args: list, si: int, out: Emitter, env: Env) -> str:
     """Checks if a number is less than another."""
-    return (
-        compile_expr(args[0], si) +
-        [f"movl %eax, {si}(%esp)"] +
-        compile_expr(args[1], si - wordsize) +
-        [f"cmpl %eax, {si}(%esp)",
-         f"movl $0, %eax",
-         f"setl %al",
-         f"sall ${bool_shift}, %eax",
-         f"orl ${bool_tag}, %eax"]
-    )
-
-
-def char_equal(args: list, si: int) -> List[str]:
+    return _compare(args, si, out, env, '<', "l", "g")
+
+
+def char_equal(args: list, si: int, out: Emitter, env: Env) -> str:
     """Checks for equality between two chars."""
-    return (
-        compile_expr(args[0], si) +
-        [f"shrl ${char_shift}, %eax"] +
-        [f"movl %eax, {si}(%esp)"] +
-        compile_expr(args[1], si - wordsize) +
-        [f"shrl ${char_shift}, %eax"] +
-        [f"cmpl %eax, {si}(%esp)",
-         f"movl $0, %eax",
-         f"sete %al",
-         f"sall ${bool_shift}, %eax",
-         f"orl ${bool_tag}, %eax"]
-    )
-
-
-primitive_ops = {
-    # unary
-    'add1': add1,
-    'sub1': sub1,
+    t, s = out.target, out.target.suffix
+    first, second = args
+    if _literal_word(first, t, env) is not None:
+        first, second = second, first
+
+    compile_expr(first, si, out, env)
+    _check_operand('char=?', 0, first, t.ax, out, env)
+    out.emit(f"shr{s} ${char_shift}, {t.ax}")
+
+    word = _literal_word(second, t, env)
+    if word is not None and t.fits_imm32((word % 2 ** t.bits) >> char_shift):
+        _check_operand('char=?', 1, second, f"${word}", out, env)
+        out.emit(f"cmp{s} ${(word % 2 ** t.bits) >> char_shift}, {t.ax}")
+    else:
+        operand, si = _save_accumulator(si, out)
+        compile_expr(second, si, out, env)
+        _check_operand('char=?', 1, second, t.ax, out, env)
+        out.emit(f"shr{s} ${char_shift}, {t.ax}")
+        out.emit(f"cmp{s} {t.ax}, {operand}")
+        _release(operand, out)
+    return "e"
+
+
+"""
+Heap objects.
+
+Pairs, vectors, strings and closures are allocated on a heap the runtime
+provides, by bumping the heap pointer `hp` past them. The runtime passes
+`scheme_entry` a context, which the entry keeps in the register `ctx`:
+
+    0(ctx)   address of the next free byte
+    w(ctx)   end of the heap
+    2w(ctx)  stack pointer of the entry, below which are the stack slots
+
+The entry loads the first into `hp` and stores the third. Objects are
+aligned to 8 bytes and have no header:
+
+    pair    | car | cdr |
+    vector  | length | element 0 | element 1 | ...
+    string  | length | bytes ...
+    closure | length | code | free variable 0 | ...
+
+where the length is a fixnum, counting the code address of a closure as
+an element. An allocation that doesn't fit calls the runtime's
+`scheme_collect`, which copies every object reachable from the stack slots
+in use to a new heap. Values in scratch registers are spilled to the stack
+first, so that they count as roots and get updated.
+"""
+
+# Words of the heap's context
+heap_free, heap_limit, heap_stack = 0, 1, 2
+
+
+def heap_prologue(out: Emitter) -> None:
+    """Loads the heap's context and pointer, and records where the stack
+    slots of an entry start.
+
+    Must follow the pushes of the callee-saved registers.
+    """
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    if t.c_args:
+        out.emit(f"mov{s} {t.c_args[0]}, {t.ctx}")
+    else:
+        out.emit(f"mov{s} {w * (len(t.callee_saved) + 1)}({t.sp}), "
+                 f"{t.ctx}")
+    out.emit(f"mov{s} {heap_free * w}({t.ctx}), {t.hp}")
+    out.emit(f"mov{s} {t.sp}, {heap_stack * w}({t.ctx})")
+
+
+def heap_epilogue(out: Emitter) -> None:
+    """Saves the heap pointer back to the context."""
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    out.emit(f"mov{s} {t.hp}, {heap_free * w}({t.ctx})")
+
+
+def _save_registers(registers: Iterable[str], si: int, out: Emitter
+                    ) -> Tuple[List[Tuple[str, str]], int]:
+    """Saves registers to the stack slots from si on.
+
+    Returns:
+        Each register with its slot, to be passed to `_restore_registers`,
+        and the stack index past the slots.
+    """
+    t = out.target
+    saved = []
+    for register in registers:
+        out.emit(f"mov{t.suffix} {register}, {si}({t.sp})")
+        saved.append((register, f"{si}({t.sp})"))
+        si -= t.wordsize
+    return saved, si
+
+
+def _restore_registers(saved: List[Tuple[str, str]], out: Emitter) -> None:
+    for register, slot in saved:
+        out.emit(f"mov{out.target.suffix} {slot}, {register}")
+
+
+def _call_runtime(function: str, args: List[str], si: int,
+                  out: Emitter) -> None:
+    """Calls a C function of the runtime, which leaves its result in the
+    accumulator.
+
+    Of the registers code generation uses, only `hp` and `ctx` survive the
+    call, so the scratch registers in use must be saved around it.
+
+    Args:
+        args (List[str]): Operands holding the arguments, in order, which
+            can't be scratch registers. `&operand` passes the address of a
+            memory operand instead.
+        si (int): Stack index of the first free slot; the call uses the
+            stack below it.
+    """
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    temporaries = iter(t.c_args or t.scratch)
+    loaded = []
+    for arg in args:
+        if arg.startswith("%") and not t.c_args:
+            loaded.append(arg)
+            continue
+        register = next(temporaries)
+        if arg.startswith("&"):
+            out.emit(f"lea{s} {arg[1:]}, {register}")
+        else:
+            out.emit(f"mov{s} {arg}, {register}")
+        loaded.append(register)
+
+    # procedures nest frames to any depth, so align the stack to 16 bytes
+    # at the call, as C code expects, from wherever it is
+    pushed = 0 if t.c_args else len(args) * w
+    out.emit(f"mov{s} {t.sp}, {t.ax}")
+    out.emit(f"lea{s} {si + w}({t.sp}), {t.sp}")
+    out.emit(f"and{s} $-16, {t.sp}")
+    out.emit(f"sub{s} $16, {t.sp}")
+    out.emit(f"mov{s} {t.ax}, 0({t.sp})")
+    if -pushed % 16:
+        out.emit(f"sub{s} ${-pushed % 16}, {t.sp}")
+    if not t.c_args:
+        for register in reversed(loaded):
+            out.emit(f"push {register}")
+    out.emit(f"call {function}")
+    if pushed:
+        out.emit(f"add{s} ${pushed + -pushed % 16}, {t.sp}")
+    out.emit(f"mov{s} 0({t.sp}), {t.sp}")
+
+
+def _collect_garbage(size: str, si: int, out: Emitter) -> None:
+    """Calls the collector, which leaves room for size bytes at `hp`.
+
+    Args:
+        size (str): Immediate or stack slot holding the number of bytes.
+        si (int): Stack index of the first free slot; slots above it, up to
+            the entry's stack pointer, are the roots.
+    """
+    t, s = out.target, out.target.suffix
+    saved, si = _save_registers(list(out.registers.live), si, out)
+    roots = f"{si + t.wordsize}({t.sp})"
+    _call_runtime(collector, [t.hp, f"&{roots}", t.ctx, size], si, out)
+    out.emit(f"mov{s} {t.ax}, {t.hp}")
+    _restore_registers(saved, out)
+
+
+def _allocate(size: str, si: int, out: Emitter) -> None:
+    """Makes sure size bytes are free at `hp`, collecting garbage if not.
+
+    The caller then fills in the object at `hp` and moves `hp` past it.
+    Clobbers the accumulator.
+
+    Args:
+        size (str): Immediate or stack slot holding the number of bytes,
+            a multiple of 8.
+        si (int): Stack index of the first free slot.
+    """
+    t, s = out.target, out.target.suffix
+    done = out.label()
+    if size.startswith("$"):
+        out.emit(f"lea{s} {size[1:]}({t.hp}), {t.ax}")
+    else:
+        out.emit(f"mov{s} {size}, {t.ax}")
+        out.emit(f"add{s} {t.hp}, {t.ax}")
+    out.emit(f"cmp{s} {heap_limit * t.wordsize}({t.ctx}), {t.ax}")
+    out.emit(f"jbe {done}")
+    _collect_garbage(size, si, out)
+    out.emit(f"{done}:")
+
+
+def _finish_object(tag: int, size: str, out: Emitter) -> None:
+    """Tags the object at `hp` into the accumulator and moves `hp` past it."""
+    t, s = out.target, out.target.suffix
+    out.emit(f"lea{s} {tag}({t.hp}), {t.ax}")
+    out.emit(f"add{s} {size}, {t.hp}")
+
+
+def _compile_operands(op: str, args: list, si: int, out: Emitter,
+                      env: Env) -> Tuple[List[str], int]:
+    """Computes the operands of op, checking their types.
+
+    Variables and literals are used where they are; other operands are
+    computed in order and kept on the stack, where the collector finds them.
+
+    Returns:
+        An operand for each arg, and the stack index past those stored.
+    """
+    t, s = out.target, out.target.suffix
+    operands = []
+    for i, arg in enumerate(args):
+        operand = _direct_operand(arg, t, env)
+        if operand is None:
+            compile_expr(arg, si, out, env)
+            _check_operand(op, i, arg, t.ax, out, env)
+            operand = f"{si}({t.sp})"
+            out.emit(f"mov{s} {t.ax}, {operand}")
+            si -= t.wordsize
+        else:
+            _check_operand(op, i, arg, operand, out, env)
+        operands.append(operand)
+    return operands, si
+
+
+def _store(operand: str, address: str, out: Emitter) -> None:
+    """Copies an operand to memory, through the accumulator if needed."""
+    t, s = out.target, out.target.suffix
+    if not operand.startswith("$"):
+        out.emit(f"mov{s} {operand}, {t.ax}")
+        operand = t.ax
+    out.emit(f"mov{s} {operand}, {address}")
+
+
+def _scratch(si: int, out: Emitter) -> Tuple[str, Optional[str]]:
+    """Takes a scratch register, saving one in use to slot si if none is
+    free.
+
+    Returns:
+        The register, and the slot it was saved to, if any, to be passed to
+        `_release_scratch`.
+    """
+    t = out.target
+    register = out.registers.acquire()
+    if register is not None:
+        return register, None
+    register = t.scratch[0]
+    out.emit(f"mov{t.suffix} {register}, {si}({t.sp})")
+    return register, f"{si}({t.sp})"
+
+
+def _release_scratch(register: str, saved: Optional[str],
+                     out: Emitter) -> None:
+    if saved is None:
+        out.registers.release(register)
+    else:
+        out.emit(f"mov{out.target.suffix} {saved}, {register}")
+
+
+def _check_index(index: str, tag: int, out: Emitter) -> None:
+    """Checks that an index is below the length of the object in the
+    accumulator, in safe mode.
+
+    Both are fixnums, so negative indices compare as too large.
+    """
+    if _is_safe(out):
+        out.emit(f"cmp{out.target.suffix} {-tag}({out.target.ax}), {index}")
+        out.emit(f"jae {range_error}")
+
+
+def _check_length(out: Emitter) -> None:
+    """Checks that the length in the accumulator isn't negative, in safe
+    mode."""
+    if _is_safe(out):
+        out.emit(f"test{out.target.suffix} {out.target.ax}, {out.target.ax}")
+        out.emit(f"jl {range_error}")
+
+
+def _object_size(length: Any, operand: str, element_shift: int, si: int,
+                 out: Emitter, env: Env) -> Tuple[str, int]:
+    """Makes an operand for the size of a vector or string, in bytes.
+
+    Args:
+        length: The expression giving the number of elements.
+        operand (str): Where the value of length is.
+        element_shift (int): Log2 of the number of bytes per element.
+
+    Returns:
+        The operand, and the stack index past it.
+    """
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    if isinstance(length, int) and not isinstance(length, bool) and \
+            not is_variable(length, env) and 0 <= length < 2 ** 24:
+        return f"${((length << element_shift) + w + 7) & -8}", si
+
+    out.emit(f"mov{s} {operand}, {t.ax}")
+    _check_length(out)
+    out.emit(f"sar{s} ${t.fixnum_shift - element_shift}, {t.ax}")
+    out.emit(f"add{s} ${w + 7}, {t.ax}")
+    out.emit(f"and{s} $-8, {t.ax}")
+    out.emit(f"mov{s} {t.ax}, {si}({t.sp})")
+    return f"{si}({t.sp})", si - w
+
+
+def _check_arity(args: list, op: str, arity: int, optional: int = 0) -> None:
+    if not arity - optional <= len(args) <= arity:
+        raise ValueError(f"Wrong number of arguments passed to {op}.")
+
+
+def is_procedure(args: list, si: int, out: Emitter, env: Env) -> str:
+    """Checks if value is a procedure."""
+    return _has_pointer_tag(args, si, out, env, 'procedure?', closure_tag)
+
+
+def is_pair(args: list, si: int, out: Emitter, env: Env) -> str:
+    """Checks if value is a pair."""
+    return _has_pointer_tag(args, si, out, env, 'pair?', pair_tag)
+
+
+def is_vector(args: list, si: int, out: Emitter, env: Env) -> str:
+    """Checks if value is a vector."""
+    return _has_pointer_tag(args, si, out, env, 'vector?', vec_tag)
+
+
+def is_string(args: list, si: int, out: Emitter, env: Env) -> str:
+    """Checks if value is a string."""
+    return _has_pointer_tag(args, si, out, env, 'string?', str_tag)
+
+
+def _has_pointer_tag(args: list, si: int, out: Emitter, env: Env, op: str,
+                     tag: int) -> str:
+    _check_unary_args(args, op)
+    compile_expr(args[0], si, out, env)
+    out.emit(f"and{out.target.suffix} ${ptr_mask}, {out.target.ax}")
+    return _is_eax_equal_to(tag, out)
+
+
+def cons(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Makes a pair of two values."""
+    _check_arity(args, 'cons', 2)
+    t, w = out.target, out.target.wordsize
+    operands, si = _compile_operands('cons', args, si, out, env)
+    size = f"${(2 * w + 7) & -8}"
+
+    _allocate(size, si, out)
+    for i, operand in enumerate(operands):
+        _store(operand, f"{i * w}({t.hp})", out)
+    _finish_object(pair_tag, size, out)
+
+
+def car(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Returns the first value of a pair."""
+    _check_unary_args(args, 'car')
+    t = out.target
+    compile_expr(args[0], si, out, env)
+    _check_operand('car', 0, args[0], t.ax, out, env)
+    out.emit(f"mov{t.suffix} {-pair_tag}({t.ax}), {t.ax}")
+
+
+def cdr(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Returns the second value of a pair."""
+    _check_unary_args(args, 'cdr')
+    t = out.target
+    compile_expr(args[0], si, out, env)
+    _check_operand('cdr', 0, args[0], t.ax, out, env)
+    out.emit(f"mov{t.suffix} {t.wordsize - pair_tag}({t.ax}), {t.ax}")
+
+
+def _length(op: str, tag: int, args: list, si: int, out: Emitter,
+            env: Env) -> None:
+    _check_unary_args(args, op)
+    t = out.target
+    compile_expr(args[0], si, out, env)
+    _check_operand(op, 0, args[0], t.ax, out, env)
+    out.emit(f"mov{t.suffix} {-tag}({t.ax}), {t.ax}")
+
+
+def make_vector(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Makes a vector of a given length, filled with a value or 0."""
+    _check_arity(args, 'make-vector', 2, optional=1)
+    t, w = out.target, out.target.wordsize
+    (length, fill), si = _compile_operands(
+        'make-vector', [args[0], args[1] if len(args) > 1 else 0],
+        si, out, env)
+    size, si = _object_size(args[0], length, w.bit_length() - 1, si, out,
+                            env)
+
+    _allocate(size, si, out)
+    _store(length, f"0({t.hp})", out)
+    saved, si = _save_string_registers(si, out)
+    _fill(length, fill, f"{w}({t.hp})", w.bit_length() - 1, out)
+    _restore_registers(saved, out)
+    _finish_object(vec_tag, size, out)
+
+
+def vector_length(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Returns the number of elements of a vector."""
+    _length('vector-length', vec_tag, args, si, out, env)
+
+
+def _element(op: str, tag: int, args: list, si: int, out: Emitter,
+             env: Env) -> Tuple[List[str], int, str, Optional[str]]:
+    """Loads an object into the accumulator and an index into a register,
+    checking it.
+
+    Returns:
+        The operands of args, the stack index past them, and the register
+        and saved slot to pass to `_release_scratch`.
+    """
+    t, s = out.target, out.target.suffix
+    operands, si = _compile_operands(op, args, si, out, env)
+    register, saved = _scratch(si, out)
+    out.emit(f"mov{s} {operands[1]}, {register}")
+    out.emit(f"mov{s} {operands[0]}, {t.ax}")
+    _check_index(register, tag, out)
+    return operands, si, register, saved
+
+
+def vector_ref(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Returns the element of a vector at an index."""
+    _check_arity(args, 'vector-ref', 2)
+    t, w = out.target, out.target.wordsize
+    _, si, register, saved = _element('vector-ref', vec_tag, args, si, out,
+                                      env)
+    out.emit(f"mov{t.suffix} {w - vec_tag}({t.ax},{register}), {t.ax}")
+    _release_scratch(register, saved, out)
+
+
+def vector_set(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Replaces the element of a vector at an index, returning the value."""
+    _check_arity(args, 'vector-set!', 3)
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    operands, si, register, saved = _element('vector-set!', vec_tag, args,
+                                             si, out, env)
+    out.emit(f"lea{s} {w - vec_tag}({t.ax},{register}), {register}")
+    out.emit(f"mov{s} {operands[2]}, {t.ax}")
+    out.emit(f"mov{s} {t.ax}, 0({register})")
+    _release_scratch(register, saved, out)
+
+
+def make_string(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Makes a string of a given length, filled with a char or spaces."""
+    _check_arity(args, 'make-string', 2, optional=1)
+    t, w = out.target, out.target.wordsize
+    (length, fill), si = _compile_operands(
+        'make-string', [args[0], args[1] if len(args) > 1 else ' '],
+        si, out, env)
+    size, si = _object_size(args[0], length, 0, si, out, env)
+
+    _allocate(size, si, out)
+    _store(length, f"0({t.hp})", out)
+    saved, si = _save_string_registers(si, out)
+    _fill(length, fill, f"{w}({t.hp})", 0, out)
+    _restore_registers(saved, out)
+    _finish_object(str_tag, size, out)
+
+
+def string_length(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Returns the number of chars of a string."""
+    _length('string-length', str_tag, args, si, out, env)
+
+
+def string_ref(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Returns the char of a string at an index."""
+    _check_arity(args, 'string-ref', 2)
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    _, si, register, saved = _element('string-ref', str_tag, args, si, out,
+                                      env)
+    out.emit(f"sar{s} ${t.fixnum_shift}, {register}")
+    out.emit(f"movzb{s} {w - str_tag}({t.ax},{register}), {t.ax}")
+    out.emit(f"sal{s} ${char_shift}, {t.ax}")
+    out.emit(f"or{s} ${char_tag}, {t.ax}")
+    _release_scratch(register, saved, out)
+
+
+def string_set(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Replaces the char of a string at an index, returning the char."""
+    _check_arity(args, 'string-set!', 3)
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    operands, si, register, saved = _element('string-set!', str_tag, args,
+                                             si, out, env)
+    out.emit(f"sar{s} ${t.fixnum_shift}, {register}")
+    out.emit(f"lea{s} {w - str_tag}({t.ax},{register}), {register}")
+    out.emit(f"mov{s} {operands[2]}, {t.ax}")
+    out.emit(f"shr{s} ${char_shift}, {t.ax}")
+    out.emit(f"movb {t.al}, 0({register})")
+    out.emit(f"sal{s} ${char_shift}, {t.ax}")
+    out.emit(f"or{s} ${char_tag}, {t.ax}")
+    _release_scratch(register, saved, out)
+
+
+"""
+Bulk operations.
+
+Filling, copying and comparing vectors and strings as a whole is done by
+the string instructions (`rep stos`, `rep movs` and `repe cmps`), which
+take their count, source and destination in the fixed registers `cx`, `si`
+and `di`. Those of them holding temporaries are saved to the stack around
+the operation.
+"""
+
+
+def _save_string_registers(si: int, out: Emitter
+                           ) -> Tuple[List[Tuple[str, str]], int]:
+    """Saves the registers used by string instructions that are in use.
+
+    Returns:
+        Each saved register with its stack slot, to be passed to
+        `_restore_registers`, and the stack index past the slots.
+    """
+    t = out.target
+    return _save_registers([register for register in (t.cx, t.si, t.di)
+                            if register in out.registers.live], si, out)
+
+
+def _string_op(name: str, element_shift: int, t: Target) -> str:
+    """Names the string instruction acting on elements of the given size."""
+    return f"{name}{'b' if element_shift == 0 else t.suffix}"
+
+
+def _fill(length: str, fill: str, address: str, element_shift: int,
+          out: Emitter) -> None:
+    """Stores a value in every element of a vector or string.
+
+    Clobbers the accumulator and the string registers.
+
+    Args:
+        length (str): Operand holding the number of elements, a fixnum.
+        fill (str): Operand holding the value, a char for strings.
+        address (str): Memory operand for the first element.
+        element_shift (int): Log2 of the number of bytes per element.
+    """
+    t, s = out.target, out.target.suffix
+    out.emit(f"mov{s} {length}, {t.cx}")
+    out.emit(f"sar{s} ${t.fixnum_shift}, {t.cx}")
+    out.emit(f"lea{s} {address}, {t.di}")
+    out.emit(f"mov{s} {fill}, {t.ax}")
+    if element_shift == 0:
+        out.emit(f"shr{s} ${char_shift}, {t.ax}")
+    out.emit(f"rep {_string_op('stos', element_shift, t)}")
+
+
+def _fill_object(op: str, tag: int, element_shift: int, args: list, si: int,
+                 out: Emitter, env: Env) -> None:
+    _check_arity(args, op, 2)
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    (obj, fill), si = _compile_operands(op, args, si, out, env)
+    saved, si = _save_string_registers(si, out)
+    out.emit(f"mov{s} {obj}, {t.ax}")
+    _fill(f"{-tag}({t.ax})", fill, f"{w - tag}({t.ax})", element_shift, out)
+    out.emit(f"mov{s} {obj}, {t.ax}")
+    _restore_registers(saved, out)
+
+
+def _copy_object(op: str, tag: int, element_shift: int, args: list, si: int,
+                 out: Emitter, env: Env, copy_tag: Optional[int] = None
+                 ) -> None:
+    """Makes a new object with the elements of the object tagged tag.
+
+    Args:
+        copy_tag (int, optional): Tag of the new object, if not tag.
+    """
+    _check_unary_args(args, op)
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    (source,), si = _compile_operands(op, args, si, out, env)
+    length = f"{si}({t.sp})"
+    out.emit(f"mov{s} {source}, {t.ax}")
+    out.emit(f"mov{s} {-tag}({t.ax}), {t.ax}")
+    out.emit(f"mov{s} {t.ax}, {length}")
+    size, si = _object_size(None, length, element_shift, si - w, out, env)
+
+    _allocate(size, si, out)
+    _store(length, f"0({t.hp})", out)
+    saved, si = _save_string_registers(si, out)
+    out.emit(f"mov{s} {length}, {t.cx}")
+    out.emit(f"sar{s} ${t.fixnum_shift}, {t.cx}")
+    out.emit(f"mov{s} {source}, {t.si}")
+    out.emit(f"add{s} ${w - tag}, {t.si}")
+    out.emit(f"lea{s} {w}({t.hp}), {t.di}")
+    out.emit(f"rep {_string_op('movs', element_shift, t)}")
+    _restore_registers(saved, out)
+    _finish_object(tag if copy_tag is None else copy_tag, size, out)
+
+
+def _copy_into(op: str, tag: int, element_shift: int, args: list, si: int,
+               out: Emitter, env: Env) -> None:
+    """Copies every element of an object into another one from an index on.
+
+    The objects may be the same, so the copy runs backwards when the
+    destination starts after the source.
+    """
+    _check_arity(args, op, 3)
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    (destination, at, source), si = _compile_operands(op, args, si, out, env)
+    saved, si = _save_string_registers(si, out)
+    out.emit(f"mov{s} {destination}, {t.ax}")
+    out.emit(f"mov{s} {source}, {t.si}")
+    out.emit(f"mov{s} {-tag}({t.si}), {t.cx}")
+    if _is_safe(out):
+        # the index can't be past the room left after the source's elements
+        out.emit(f"mov{s} {-tag}({t.ax}), {t.di}")
+        out.emit(f"sub{s} {t.cx}, {t.di}")
+        out.emit(f"jl {range_error}")
+        out.emit(f"cmp{s} {at}, {t.di}")
+        out.emit(f"jb {range_error}")
+
+    out.emit(f"mov{s} {at}, {t.di}")
+    if t.fixnum_shift != element_shift:
+        out.emit(f"sar{s} ${t.fixnum_shift - element_shift}, {t.di}")
+    out.emit(f"lea{s} {w - tag}({t.ax},{t.di}), {t.di}")
+    out.emit(f"add{s} ${w - tag}, {t.si}")
+    out.emit(f"sar{s} ${t.fixnum_shift}, {t.cx}")
+
+    instruction = f"rep {_string_op('movs', element_shift, t)}"
+    size = 1 << element_shift
+    forward, done = out.label(), out.label()
+    out.emit(f"cmp{s} {t.si}, {t.di}")
+    out.emit(f"jbe {forward}")
+    out.emit(f"lea{s} {-size}({t.si},{t.cx},{size}), {t.si}")
+    out.emit(f"lea{s} {-size}({t.di},{t.cx},{size}), {t.di}")
+    out.emit("std")
+    out.emit(instruction)
+    out.emit("cld")
+    out.emit(f"jmp {done}")
+    out.emit(f"{forward}:")
+    out.emit(instruction)
+    out.emit(f"{done}:")
+    _restore_registers(saved, out)
+
+
+def vector_fill(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Stores a value in every element of a vector, returning the vector."""
+    _fill_object('vector-fill!', vec_tag, out.target.fixnum_shift, args, si,
+                 out, env)
+
+
+def vector_copy(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Makes a new vector with the elements of a vector."""
+    _copy_object('vector-copy', vec_tag, out.target.fixnum_shift, args, si,
+                 out, env)
+
+
+def vector_copy_into(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(vector-copy! to at from) copies the elements of from into to,
+    starting at index at, and returns to."""
+    _copy_into('vector-copy!', vec_tag, out.target.fixnum_shift, args, si,
+               out, env)
+
+
+def string_fill(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Stores a char in every position of a string, returning the string."""
+    _fill_object('string-fill!', str_tag, 0, args, si, out, env)
+
+
+def string_copy(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Makes a new string with the chars of a string."""
+    _copy_object('string-copy', str_tag, 0, args, si, out, env)
+
+
+def string_copy_into(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(string-copy! to at from) copies the chars of from into to, starting
+    at index at, and returns to."""
+    _copy_into('string-copy!', str_tag, 0, args, si, out, env)
+
+
+def string_equal(args: list, si: int, out: Emitter, env: Env) -> str:
+    """Checks if two strings have the same chars."""
+    _check_arity(args, 'string=?', 2)
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    (first, second), si = _compile_operands('string=?', args, si, out, env)
+    saved, si = _save_string_registers(si, out)
+    done = out.label()
+    out.emit(f"mov{s} {first}, {t.si}")
+    out.emit(f"mov{s} {second}, {t.di}")
+    out.emit(f"mov{s} {-str_tag}({t.si}), {t.cx}")
+    out.emit(f"cmp{s} {-str_tag}({t.di}), {t.cx}")
+    out.emit(f"jne {done}")
+    # leaves the flags of the last comparison, or of sar when empty
+    out.emit(f"sar{s} ${t.fixnum_shift}, {t.cx}")
+    out.emit(f"lea{s} {w - str_tag}({t.si}), {t.si}")
+    out.emit(f"lea{s} {w - str_tag}({t.di}), {t.di}")
+    out.emit("repe cmpsb")
+    out.emit(f"{done}:")
+    _restore_registers(saved, out)
+    return "e"
+
+
+"""
+Symbols.
+
+`(quote name)`, or `'name`, is the symbol called name. Symbols are laid out
+like strings, but are never mutated and live outside the heap, so they
+don't move:
+
+    symbol  | length | bytes ...
+
+The names quoted in a program are made into symbols once, at compile time,
+in the data section, listed by the table `scheme_symbol_table` of
+`scheme_symbol_count` entries. The runtime's `scheme_intern` looks names up
+in a hash table seeded with them, making symbols for new names, so that
+there is a single symbol per name and `eq?` compares them as words.
+"""
+
+
+def is_quote(expr: Any) -> bool:
+    """Checks if expr quotes a name or an immediate."""
+    return (is_special_form(expr) and expr[0] == 'quote' and
+            len(expr) == 2 and not isinstance(expr[1], list) and
+            expr[1] is not None)
+
+
+def compile_quote(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(quote datum), where datum is a name or an immediate."""
+    _check_arity(args, 'quote', 1)
+    t = out.target
+    datum = args[0]
+    if isinstance(datum, str):
+        label = out.symbol(datum)
+        out.emit(f"lea{t.suffix} {t.address(f'{label}+{sym_tag}')}, {t.ax}")
+    elif is_immediate(datum) and datum is not None:
+        _move_immediate(immediate_rep(datum, t), out)
+    else:
+        raise ValueError(f"Only names and immediates can be quoted, not "
+                         f"{datum}")
+
+
+def is_symbol(args: list, si: int, out: Emitter, env: Env) -> str:
+    """Checks if value is a symbol."""
+    return _has_pointer_tag(args, si, out, env, 'symbol?', sym_tag)
+
+
+def is_eq(args: list, si: int, out: Emitter, env: Env) -> str:
+    """Checks if two values are the same word: the same symbol or object,
+    or equal immediates."""
+    _check_arity(args, 'eq?', 2)
+    return _compare(args, si, out, env, 'eq?', "e", "e")
+
+
+def symbol_to_string(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Makes a new string with the chars of a symbol's name."""
+    _copy_object('symbol->string', sym_tag, 0, args, si, out, env, str_tag)
+
+
+def string_to_symbol(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Returns the symbol named by the chars of a string."""
+    _check_unary_args(args, 'string->symbol')
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    compile_expr(args[0], si, out, env)
+    _check_operand('string->symbol', 0, args[0], t.ax, out, env)
+    string = f"{si}({t.sp})"
+    out.emit(f"mov{s} {t.ax}, {string}")
+    saved, si = _save_registers(list(out.registers.live), si - w, out)
+    _call_runtime(intern, [string], si, out)
+    _restore_registers(saved, out)
+
+
+"""
+Instrumentation.
+
+When the emitter has an `Instrumentation`, each call of a primitive adds 1
+to a counter of its own as it starts, and when cycles are measured, adds
+the cycles the call took, operands included, to another. Both are 64-bit
+words in the data section, updated with `add` and `adc` on x86.
+
+The time stamp counter read with `rdtsc` at the start of a call is kept in
+stack slots while the call runs, since calls nest. It is shifted so each
+slot holds a word with the tag of a fixnum, which the collector leaves
+alone. The flags a predicate leaves behind don't survive reading the
+counter again, so predicates measured for cycles make a boolean and test
+it instead of branching on their flags.
+"""
+
+
+def _add_to_counter(counter: str, low: str, high: str,
+                    out: Emitter) -> None:
+    """Adds a 64-bit value to counter, given as the operands holding its
+    low and high words; only low is used on x86-64."""
+    t = out.target
+    if t.wordsize == 8:
+        out.emit(f"addq {low}, {t.address(counter)}")
+    else:
+        out.emit(f"addl {low}, {counter}")
+        out.emit(f"adcl {high}, {counter}+4")
+
+
+def _count_call(expr: list, out: Emitter) -> int:
+    """Counts a run of the primitive call expr, returning its site."""
+    site = out.instrumentation.site(expr[1], expr)
+    _add_to_counter(out.instrumentation.calls(site), "$1", "$0", out)
+    return site
+
+
+def _measures_cycles(out: Emitter) -> bool:
+    return out.instrumentation is not None and out.instrumentation.cycles
+
+
+def _read_clock(out: Emitter) -> None:
+    """Reads the time stamp counter into the accumulator, shifted left by
+    the fixnum shift, or into the accumulator and `dx` on x86, masked and
+    shifted to have the tag of fixnums. Clobbers `dx`."""
+    t = out.target
+    out.emit("rdtsc")
+    if t.wordsize == 8:
+        out.emit("shlq $32, %rdx")
+        out.emit("orq %rdx, %rax")
+        out.emit(f"shlq ${t.fixnum_shift}, %rax")
+    else:
+        out.emit(f"andl $-{1 << t.fixnum_shift}, %eax")
+        out.emit(f"sall ${t.fixnum_shift}, %edx")
+
+
+def _instrumented(primitive: Primitive, expr: list, si: int, out: Emitter,
+                  env: Env) -> None:
+    """Compiles the call expr of primitive, counting its runs, and its
+    cycles when they are measured."""
+    site = _count_call(expr, out)
+    if not out.instrumentation.cycles:
+        primitive(expr[2:], si, out, env)
+        return
+
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    # the 64-bit count takes one slot on x86-64 and two on x86
+    start = [f"{si - i * w}({t.sp})" for i in range(8 // w)]
+    si -= len(start) * w
+    out.emit(f"mov{s} {t.dx}, {si}({t.sp})")
+    _read_clock(out)
+    for register, slot in zip([t.ax, t.dx], start):
+        out.emit(f"mov{s} {register}, {slot}")
+    out.emit(f"mov{s} {si}({t.sp}), {t.dx}")
+
+    primitive(expr[2:], si, out, env)
+
+    saved, _ = _save_registers([t.ax, t.dx], si, out)
+    _read_clock(out)
+    if w == 8:
+        out.emit(f"subq {start[0]}, %rax")
+        out.emit(f"shrq ${t.fixnum_shift}, %rax")
+    else:
+        # the high words are shifted, so a borrow takes 1 off 4 times their
+        # difference, which the shift back floors to the difference less 1
+        out.emit(f"subl {start[0]}, %eax")
+        out.emit(f"sbbl {start[1]}, %edx")
+        out.emit(f"sarl ${t.fixnum_shift}, %edx")
+    _add_to_counter(out.instrumentation.cycle_count(site), t.ax, t.dx, out)
+    _restore_registers(saved, out)
+
+
+predicate_ops: Dict[str, Test] = {
     'integer?': is_integer,
     'zero?': is_zero,
     'boolean?': is_boolean,
     'char?': is_char,
+    '=': equal,
+    '<': less_than,
+    'char=?': char_equal,
+    'pair?': is_pair,
+    'vector?': is_vector,
+    'string?': is_string,
+    'string=?': string_equal,
+    'procedure?': is_procedure,
+    'symbol?': is_symbol,
+    'eq?': is_eq,
+}
+
+primitive_ops: Dict[str, Primitive] = {
+    # unary
+    'add1': add1,
+    'sub1': sub1,
+    'integer?': _predicate(is_integer),
+    'zero?': _predicate(is_zero),
+    'boolean?': _predicate(is_boolean),
+    'char?': _predicate(is_char),
     # binary
     '+': add,
     '-': sub,
     '*': mul,
-    '=': equal,
-    '<': less_than,
-    'char=?': char_equal
+    '=': _predicate(equal),
+    '<': _predicate(less_than),
+    'char=?': _predicate(char_equal),
+    # heap objects
+    'pair?': _predicate(is_pair),
+    'vector?': _predicate(is_vector),
+    'string?': _predicate(is_string),
+    'cons': cons,
+    'car': car,
+    'cdr': cdr,
+    'make-vector': make_vector,
+    'vector-length': vector_length,
+    'vector-ref': vector_ref,
+    'vector-set!': vector_set,
+    'make-string': make_string,
+    'string-length': string_length,
+    'string-ref': string_ref,
+    'string-set!': string_set,
+    # bulk operations
+    'vector-fill!': vector_fill,
+    'vector-copy': vector_copy,
+    'vector-copy!': vector_copy_into,
+    'string-fill!': string_fill,
+    'string-copy': string_copy,
+    'string-copy!': string_copy_into,
+    'string=?': _predicate(string_equal),
+    # procedures
+    'procedure?': _predicate(is_procedure),
+    # symbols
+    'symbol?': _predicate(is_symbol),
+    'eq?': _predicate(is_eq),
+    'symbol->string': symbol_to_string,
+    'string->symbol': string_to_symbol,
+}
+
+
+"""
+Special forms.
+
+Like primitives, every special form is compiled by a Python
+function taking the rest of the form, the stack index `si`, the
+emitter `out` and the environment `env`. Only `#f` counts as false.
+"""
+
+
+def compile_test(expr: Any, si: int, out: Emitter, env: Env,
+                 false_label: str) -> None:
+    """Compiles expr as a condition, jumping to false_label when it's #f.
+
+    Falls through when expr holds. Predicates branch on the flags of their
+    comparison, and never build the boolean.
+    """
+    t = out.target
+    known = _known_predicate(expr, out, env) \
+        if is_primitive_call(expr) and expr[1] in predicate_ops else None
+    if known is not None:
+        if not known:
+            out.emit(f"jmp {false_label}")
+    elif is_primitive_call(expr) and expr[1] in predicate_ops and \
+            not _measures_cycles(out):
+        if out.instrumentation is not None:
+            _count_call(expr, out)
+        condition = predicate_ops[expr[1]](expr[2:], si, out, env)
+        out.emit(f"j{inverse_conditions[condition]} {false_label}")
+    elif is_special_form(expr) and expr[0] == 'and':
+        for test in expr[1:]:
+            compile_test(test, si, out, env, false_label)
+    elif is_special_form(expr) and len(expr) > 1 and expr[0] == 'or':
+        true_label = out.label()
+        for test in expr[1:-1]:
+            next_label = out.label()
+            compile_test(test, si, out, env, next_label)
+            out.emit(f"jmp {true_label}")
+            out.emit(f"{next_label}:")
+        compile_test(expr[-1], si, out, env, false_label)
+        out.emit(f"{true_label}:")
+    elif _literal_word(expr, t, env) is not None:
+        if expr is False:
+            out.emit(f"jmp {false_label}")
+    else:
+        compile_expr(expr, si, out, env)
+        out.emit(f"cmp{t.suffix} ${immediate_rep(False)}, {t.ax}")
+        out.emit(f"je {false_label}")
+
+
+def compile_if(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(if test consequent alternative)"""
+    if len(args) != 3:
+        raise ValueError("if takes a test, a consequent and an alternative.")
+    test, consequent, alternative = args
+    alternative_label, end_label = out.label(), out.label()
+
+    compile_test(test, si, out, env, alternative_label)
+    compile_expr(consequent, si, out, env)
+    out.emit(f"jmp {end_label}")
+    out.emit(f"{alternative_label}:")
+    compile_expr(alternative, si, out, env)
+    out.emit(f"{end_label}:")
+
+
+def compile_and(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(and expr ...), the last value if no expr is #f."""
+    t = out.target
+    if not args:
+        _move_immediate(immediate_rep(True), out)
+        return
+
+    false_label, end_label = out.label(), out.label()
+    for test in args[:-1]:
+        compile_test(test, si, out, env, false_label)
+    compile_expr(args[-1], si, out, env)
+    if len(args) > 1:
+        out.emit(f"jmp {end_label}")
+        out.emit(f"{false_label}:")
+        out.emit(f"mov{t.suffix} ${immediate_rep(False)}, {t.ax}")
+        out.emit(f"{end_label}:")
+
+
+def compile_or(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(or expr ...), the first value that isn't #f."""
+    t = out.target
+    if not args:
+        _move_immediate(immediate_rep(False), out)
+        return
+
+    end_label = out.label()
+    for expr in args[:-1]:
+        compile_expr(expr, si, out, env)
+        out.emit(f"cmp{t.suffix} ${immediate_rep(False)}, {t.ax}")
+        out.emit(f"jne {end_label}")
+    compile_expr(args[-1], si, out, env)
+    out.emit(f"{end_label}:")
+
+
+def parse_let(args: list) -> Tuple[list, list]:
+    """Splits a let form into its bindings and body, checking both."""
+    if len(args) < 2 or not isinstance(args[0], list):
+        raise ValueError("let takes a list of bindings and a body.")
+    bindings, body = args[0], args[1:]
+    for binding in bindings:
+        if not (isinstance(binding, list) and len(binding) == 2 and
+                isinstance(binding[0], str)):
+            raise ValueError(f"Malformed let binding {binding}")
+    return bindings, body
+
+
+def compile_let(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(let ((name expr) ...) body ...)
+
+    Each value is stored in the stack slot at `si`, and the body is compiled
+    with the stack index moved past them.
+    """
+    t = out.target
+    bindings, body = parse_let(args)
+
+    inner = dict(env)
+    for name, expr in bindings:
+        compile_expr(expr, si, out, env)  # bindings don't see each other
+        out.emit(f"mov{t.suffix} {t.ax}, {si}({t.sp})")
+        if out.checks is not None:
+            out.checks.bind(f"{si}({t.sp})", expr, env)
+        inner[name] = f"{si}({t.sp})"
+        si -= t.wordsize
+
+    for expr in body:
+        compile_expr(expr, si, out, inner)
+
+
+def parse_lambda(args: list) -> Tuple[list, list]:
+    """Splits a lambda form into its parameters and body, checking both."""
+    if len(args) < 2 or not isinstance(args[0], list) or \
+            not all(isinstance(param, str) for param in args[0]):
+        raise ValueError("lambda takes a list of parameters and a body.")
+    if len(set(args[0])) != len(args[0]):
+        raise ValueError(f"Repeated parameter in {args[0]}")
+    return args[0], args[1:]
+
+
+"""
+Procedures.
+
+`pasquim.closures` converts every `lambda` into a closure over code at a
+label, and gives the code the values of the lambda's free variables
+through the closure. Converted programs look like:
+
+    (labels ((label (code (param ...) (free ...) body ...)) ...) expr)
+
+where `(closure label var ...)` makes a closure over the code at label
+with the values of the free variables, `(funcall f arg ...)` calls the
+closure f and `(tail-call f arg ...)` calls it in place of the running
+procedure.
+
+A call stores the closure and the arguments below the stack slot `si`,
+then moves the stack pointer so that `call` leaves the return address in
+that slot. The callee copies its free variables below the arguments, so
+that, like `let` bindings, all its variables are in stack slots:
+
+    0(sp)               return address
+    -w(sp)              closure
+    -2w(sp)             argument 0
+    ...
+    -(2 + n)w(sp)       free variable 0
+    ...
+
+Callers save the scratch registers in use. A tail call moves its closure
+and arguments up over those of the running procedure and jumps to the
+code, so that the stack doesn't grow. In safe mode, callers pass the number
+of arguments in `cx`, and a callee given a wrong number jumps to the
+runtime's `scheme_arity_error`.
+"""
+
+
+def _variable(name: Any, env: Env) -> str:
+    """Returns the operand holding a variable in scope."""
+    if not is_variable(name, env):
+        raise ValueError(f"Unbound variable {name}")
+    return env[name]
+
+
+def compile_lambda(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(lambda (param ...) body ...)"""
+    raise ValueError("lambda must be closure converted first, with "
+                     "pasquim.closures.convert.")
+
+
+def _make_closure(label: str, free: List[str], si: int,
+                  out: Emitter) -> None:
+    """Allocates a closure over the code at label, holding the values of
+    the operands free, into the accumulator."""
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    size = f"${((2 + len(free)) * w + 7) & -8}"
+    _allocate(size, si, out)
+    out.emit(f"mov{s} ${(1 + len(free)) << t.fixnum_shift}, 0({t.hp})")
+    out.emit(f"lea{s} {t.address(label)}, {t.ax}")
+    out.emit(f"mov{s} {t.ax}, {w}({t.hp})")
+    for j, operand in enumerate(free):
+        _store(operand, f"{(2 + j) * w}({t.hp})", out)
+    _finish_object(closure_tag, size, out)
+
+
+def compile_closure(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(closure label var ...)"""
+    if not args:
+        raise ValueError("closure takes a label and free variables.")
+    _make_closure(_variable(args[0], env),
+                  [_variable(name, env) for name in args[1:]], si, out)
+
+
+def compile_letrec(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(letrec ((name (closure label var ...)) ...) body ...)
+
+    The closures are allocated and bound first, and their free variables
+    filled in once every name is bound, so they can refer to each other.
+    """
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    bindings, body = parse_let(args)
+
+    inner = dict(env)
+    for name, init in bindings:
+        if is_special_form(init) and init[0] == 'lambda':
+            compile_lambda(init[1:], si, out, env)
+        if not (is_special_form(init) and init[0] == 'closure' and
+                len(init) > 1):
+            raise ValueError("letrec binds names to procedures.")
+        _make_closure(_variable(init[1], env), ["$0"] * (len(init) - 2),
+                      si, out)
+        out.emit(f"mov{s} {t.ax}, {si}({t.sp})")
+        if out.checks is not None:
+            out.checks.bind(f"{si}({t.sp})", init, env)
+        inner[name] = f"{si}({t.sp})"
+        si -= w
+
+    for name, init in bindings:
+        if len(init) == 2:
+            continue
+        register, saved = _scratch(si, out)
+        out.emit(f"mov{s} {inner[name]}, {register}")
+        for j, var in enumerate(init[2:]):
+            _store(_variable(var, inner),
+                   f"{(2 + j) * w - closure_tag}({register})", out)
+        _release_scratch(register, saved, out)
+
+    for expr in body:
+        compile_expr(expr, si, out, inner)
+
+
+def _compile_code(label: str, code: Any, out: Emitter, env: Env) -> None:
+    """Compiles the code of a procedure, starting at label.
+
+    Args:
+        code: A `(code (param ...) (free ...) body ...)` form.
+        env (Env): The labels in scope.
+    """
+    if not (isinstance(code, list) and len(code) > 3 and
+            code[0] == 'code' and isinstance(code[2], list)):
+        raise ValueError(f"Malformed code {code}")
+    params, body = parse_lambda(code[1:2] + code[3:])
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+
+    out.emit(f"{label}:")
+    if _is_safe(out):
+        out.emit(f"cmp{s} ${len(params)}, {t.cx}")
+        out.emit(f"jne {arity_error}")
+    inner = dict(env)
+    si = -2 * w
+    for name in params:
+        inner[name] = f"{si}({t.sp})"
+        si -= w
+    if code[2]:
+        out.emit(f"mov{s} {-w}({t.sp}), {t.ax}")
+    for j, name in enumerate(code[2]):
+        out.emit(f"mov{s} {(2 + j) * w - closure_tag}({t.ax}), {t.cx}")
+        out.emit(f"mov{s} {t.cx}, {si}({t.sp})")
+        inner[name] = f"{si}({t.sp})"
+        si -= w
+    if out.checks is not None:
+        for name in params + code[2]:
+            out.checks.forget(inner[name])
+
+    for expr in body:
+        compile_expr(expr, si, out, inner)
+    out.emit("ret")
+
+
+def compile_labels(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(labels ((label (code (param ...) (free ...) body ...)) ...) expr)
+
+    The code is placed ahead of expr, which jumps over it.
+    """
+    if len(args) != 2 or not isinstance(args[0], list) or not all(
+            isinstance(binding, list) and len(binding) == 2 and
+            isinstance(binding[0], str) for binding in args[0]):
+        raise ValueError("labels takes a list of code bindings and a body.")
+    labels = {name: out.label() for name, _ in args[0]}
+    end = out.label()
+
+    out.emit(f"jmp {end}")
+    for name, code in args[0]:
+        _compile_code(labels[name], code, out, labels)
+    out.emit(f"{end}:")
+    compile_expr(args[1], si, out, {**env, **labels})
+
+
+def _compile_arguments(args: list, si: int, out: Emitter, env: Env) -> None:
+    """Computes a closure and the arguments to call it with into the stack
+    slots from si down, checking the closure in safe mode."""
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    if not args:
+        raise ValueError("A call takes a procedure and its arguments.")
+    for i, arg in enumerate(args):
+        compile_expr(arg, si - i * w, out, env)
+        if i == 0 and out.checks is not None:
+            required = out.checks.needs_procedure_check(arg, env)
+            if required is not None:
+                _check_tag(required, t.ax, out)
+        out.emit(f"mov{s} {t.ax}, {si - i * w}({t.sp})")
+
+
+def compile_funcall(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(funcall f arg ...)"""
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    live = list(out.registers.live)
+    for register in live:
+        out.emit(f"mov{s} {register}, {si}({t.sp})")
+        si -= w
+
+    # the slot of the return address is a root until the call fills it
+    out.emit(f"mov{s} $0, {si}({t.sp})")
+    _compile_arguments(args, si - w, out, env)
+    out.emit(f"mov{s} {si - w}({t.sp}), {t.ax}")
+    if _is_safe(out):
+        out.emit(f"mov{s} ${len(args) - 1}, {t.cx}")
+    if si + w:
+        out.emit(f"sub{s} ${-(si + w)}, {t.sp}")
+    out.emit(f"call *{w - closure_tag}({t.ax})")
+    if si + w:
+        out.emit(f"add{s} ${-(si + w)}, {t.sp}")
+
+    for register in reversed(live):
+        si += w
+        out.emit(f"mov{s} {si}({t.sp}), {register}")
+
+
+def compile_tail_call(args: list, si: int, out: Emitter, env: Env) -> None:
+    """(tail-call f arg ...)
+
+    Only valid in tail position of a procedure's code, where the frame of
+    the running procedure is no longer needed.
+    """
+    t, s, w = out.target, out.target.suffix, out.target.wordsize
+    _compile_arguments(args, si, out, env)
+    # the slots moved to are never below the ones still to be moved
+    for i in range(len(args)):
+        if si - i * w != -(i + 1) * w:
+            out.emit(f"mov{s} {si - i * w}({t.sp}), {t.ax}")
+            out.emit(f"mov{s} {t.ax}, {-(i + 1) * w}({t.sp})")
+    out.emit(f"mov{s} {-w}({t.sp}), {t.ax}")
+    if _is_safe(out):
+        out.emit(f"mov{s} ${len(args) - 1}, {t.cx}")
+    out.emit(f"jmp *{w - closure_tag}({t.ax})")
+
+
+special_forms: Dict[str, Primitive] = {
+    'if': compile_if,
+    'and': compile_and,
+    'or': compile_or,
+    'let': compile_let,
+    'lambda': compile_lambda,
+    'letrec': compile_letrec,
+    'labels': compile_labels,
+    'closure': compile_closure,
+    'funcall': compile_funcall,
+    'tail-call': compile_tail_call,
+    'quote': compile_quote,
 }
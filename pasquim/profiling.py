@@ -0,0 +1,192 @@
+from typing import Any, Dict, Iterator, List, Tuple
+import time
+from contextlib import contextmanager
+
+from pasquim.parser import SourceList
+
+
+"""
+Measurements of compilation, and of compiled programs.
+
+A program goes through the following phases, each timed separately:
+
+    read       tokenizing and parsing the program text
+    optimize   the optimization passes on the syntax tree
+    convert    closure conversion
+    codegen    generating instructions, through the IR or straight from
+               the syntax tree
+    peephole   the peephole optimizer
+    write      adding instructions to the assembly program, writing it out
+               to `compiled.s` when streaming
+    build      assembling and linking into a binary, by gcc or the builtin
+               backend
+
+Phases that didn't run are left out of reports.
+
+Compiled programs can be instrumented too, so that each call of a
+primitive counts how many times it runs, and optionally how many cycles it
+takes. The counters are laid out in the data section of the program, and
+the runtime writes them to the file named by the `PASQUIM_PROFILE`
+environment variable, or `pasquim.prof`, when the program exits:
+
+    site            calls   cycles
+    + 1:12          100     1540
+    vector-ref 3:5  100     2310
+
+Each line is a call site, named after its primitive and, when the program
+was read from text, the line and column of the call.
+"""
+
+PHASES = ("read", "optimize", "convert", "codegen", "peephole", "write",
+          "build")
+
+
+def program_size(expr: Any) -> Tuple[int, int]:
+    """Numbers of tokens and of nodes of an expression read by `Reader`.
+
+    Every list and every atom is a node. A list read from parentheses took
+    two tokens besides those of its items, while one made from a `'`, which
+    is a plain list, took that token and those of the quoted datum.
+    """
+    tokens = nodes = 0
+    stack = [(expr, True)]
+    while stack:
+        expr, read = stack.pop()
+        nodes += 1
+        if isinstance(expr, list):
+            source = isinstance(expr, SourceList)
+            if read:
+                tokens += 2 if source else 1
+            stack.extend((sub, read and (source or i > 0))
+                         for i, sub in enumerate(expr))
+        elif read:
+            tokens += 1
+    return tokens, nodes
+
+
+class CompileStats:
+    """Wall time and sizes of each phase of the last compilation.
+
+    Attributes:
+        seconds (Dict[str, float]): Wall time spent in each phase that
+            ran.
+        counts (Dict[str, int]): Tokens and nodes read, instructions
+            generated before the peephole optimizer and in the final
+            assembly program, and bytes of assembly written out.
+    """
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = {}
+        self.counts: Dict[str, int] = {
+            "tokens": 0, "nodes": 0, "generated": 0, "instructions": 0,
+            "bytes": 0
+        }
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """Adds the time spent in the with block to the given phase."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """Adds seconds to the time spent in the given phase."""
+        self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int) -> None:
+        """Adds n to the given count."""
+        self.counts[name] += n
+
+    def add(self, other: "CompileStats") -> None:
+        """Adds the measurements of other to these."""
+        for name, seconds in other.seconds.items():
+            self.add_time(name, seconds)
+        for name, n in other.counts.items():
+            self.count(name, n)
+
+    @property
+    def total(self) -> float:
+        """Seconds spent in every phase."""
+        return sum(self.seconds.values())
+
+    def report(self) -> Dict[str, Any]:
+        """Returns the measurements as a dictionary ready for JSON, with
+        the seconds of each phase that ran, the counts, and the throughput
+        of reading and generating code."""
+        seconds = {phase: self.seconds[phase] for phase in PHASES
+                   if phase in self.seconds}
+        rates = {}
+        if self.seconds.get("read"):
+            rates["nodes_read_per_second"] = \
+                self.counts["nodes"] / self.seconds["read"]
+        if self.seconds.get("codegen"):
+            rates["instructions_per_second"] = \
+                self.counts["generated"] / self.seconds["codegen"]
+        return {"seconds": seconds, "total_seconds": self.total,
+                "counts": dict(self.counts), "rates": rates}
+
+    def summary(self) -> str:
+        """Describes the measurements as a table, for diagnostics."""
+        total = self.total
+        lines = [f"{'phase':<10} {'ms':>10} {'%':>6}"]
+        for phase, seconds in self.report()["seconds"].items():
+            share = seconds / total * 100 if total else 0.0
+            lines.append(f"{phase:<10} {seconds * 1e3:>10.3f} {share:>6.1f}")
+        lines.append(f"{'total':<10} {total * 1e3:>10.3f}")
+        lines.append(", ".join(f"{count} {name}"
+                               for name, count in self.counts.items()))
+        return "\n".join(lines)
+
+
+class Instrumentation:
+    """The call sites of primitives in an instrumented program.
+
+    Code generation adds a site for every call it instruments, and
+    addresses the site's counters with `calls` and `cycles`.
+
+    Args:
+        cycles (bool): Whether calls also add up the cycles they take, read
+            from the time stamp counter before and after each one.
+
+    Attributes:
+        sites (List[str]): Name of each site, in order.
+    """
+    modes = ("counts", "cycles")
+    label = ".Lprofile"  # the counters, two 64-bit words per site
+
+    def __init__(self, cycles: bool = False) -> None:
+        self.cycles = cycles
+        self.sites: List[str] = []
+
+    def site(self, op: str, expr: Any) -> int:
+        """Adds a site calling op, returning its index."""
+        if isinstance(expr, SourceList):
+            op = f"{op} {expr.line}:{expr.col}"
+        self.sites.append(op)
+        return len(self.sites) - 1
+
+    def calls(self, site: int) -> str:
+        """Symbol of the counter of the times site ran."""
+        return f"{self.label}+{16 * site}"
+
+    def cycle_count(self, site: int) -> str:
+        """Symbol of the counter of the cycles site took."""
+        return f"{self.label}+{16 * site + 8}"
+
+
+def read_profile(path: str) -> List[Dict[str, Any]]:
+    """Reads the counters an instrumented program wrote at exit.
+
+    Returns:
+        One row per site, in the order of the file, with the site's name,
+        its calls, and its cycles if they were counted.
+    """
+    with open(path) as f:
+        header = f.readline().rstrip("\n").split("\t")
+        rows = []
+        for line in f:
+            values = line.rstrip("\n").split("\t")
+            rows.append({column: value if column == "site" else int(value)
+                         for column, value in zip(header, values)})
+    return rows
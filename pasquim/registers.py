@@ -0,0 +1,37 @@
+from typing import Iterable, List, Optional
+
+
+class RegisterPool:
+    """Hands out scratch registers to hold temporaries during codegen.
+
+    Registers are allocated while compiling one operand of a primitive and
+    released right after the primitive uses them, so the pool follows the
+    nesting of expressions like a stack. When every register is taken,
+    `acquire` returns None and callers spill to the stack instead.
+
+    Args:
+        registers (Iterable[str]): Registers available for allocation, in
+            order of preference.
+    """
+    def __init__(self, registers: Iterable[str]) -> None:
+        self.registers = tuple(registers)
+        self.free: List[str] = list(reversed(self.registers))
+        self.live: List[str] = []  # allocated registers, oldest first
+
+        self.allocations = 0
+        self.spills = 0
+
+    def acquire(self) -> Optional[str]:
+        """Takes a free register, or returns None if there is none left."""
+        if not self.free:
+            self.spills += 1
+            return None
+        register = self.free.pop()
+        self.live.append(register)
+        self.allocations += 1
+        return register
+
+    def release(self, register: str) -> None:
+        """Gives back a register taken with `acquire`."""
+        self.live.remove(register)
+        self.free.append(register)
@@ -0,0 +1,243 @@
+from typing import Any, Deque, Dict, Iterable, List, Optional
+import asyncio
+import functools
+import json
+import math
+import os
+import shutil
+import signal
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from pasquim.batch import run_job
+from pasquim.build import default_cache
+from pasquim.client import default_socket
+from pasquim.target import get_target
+
+
+"""
+A compile server, keeping the compiler loaded between programs.
+
+    python -m pasquim serve -j 4
+
+listens on a Unix socket for the requests described in `pasquim.client`.
+Jobs run over a pool of worker processes forked from the server, so they
+start with `pasquim` imported and the runtime object already built, and
+the size of the pool caps how many compilers and gcc run at once. Requests
+from any number of connections are taken concurrently, and wait for a
+worker when all are busy; each connection gets its responses in the order
+of its requests. When a worker dies, the pool is replaced by a fresh one,
+so the requests after it are served again.
+
+The stats request reports the latency of each op, from the request coming
+in to its response going out, as percentiles over the last `SAMPLES`
+requests.
+"""
+
+# Most latencies kept per op for percentiles
+SAMPLES = 10000
+PERCENTILES = (50, 90, 99)
+OPTIONS = {"backend", "target", "opt_level", "use_ir", "safe", "flat",
+           "instrument", "exact"}
+
+
+class RequestError(ValueError):
+    """Raised for a malformed request."""
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """The nearest-rank p-th percentile of samples, sorted ascending."""
+    return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)]
+
+
+def _warm(targets: Iterable[str]) -> None:
+    """Builds the runtime for targets in the build cache, if missing."""
+    for target in targets:
+        default_cache().runtime_object(get_target(target).gcc_flags)
+
+
+class CompileServer:
+    """Serves compile and run requests on a Unix socket.
+
+    Args:
+        path (str, optional): Path of the socket. Defaults to
+            `client.default_socket()`.
+        workers (int, optional): Most jobs run at once. Defaults to the
+            number of processors.
+        timeout (float, optional): Seconds a job may take, unless its
+            request gives another timeout.
+        **options: Keyword arguments for the `Compiler` of each job,
+            which requests may override.
+
+    Attributes:
+        stats (Dict[str, Any]): Requests served, by op and status.
+    """
+    def __init__(self, path: Optional[str] = None,
+                 workers: Optional[int] = None,
+                 timeout: Optional[float] = None, **options: Any) -> None:
+        self._check_options(options)
+        self.path = path if path is not None else default_socket()
+        self.workers = workers if workers is not None else os.cpu_count()
+        self.timeout = timeout
+        self.options = options
+        self.stats: Dict[str, Any] = {"requests": 0, "active": 0,
+                                      "ops": {}, "statuses": {}}
+        self._latencies: Dict[str, Deque[float]] = {}
+        self._jobs = 0
+        self._started = time.monotonic()
+        self._stopped: Optional[asyncio.Event] = None
+
+    @staticmethod
+    def _check_options(options: Any) -> None:
+        if not isinstance(options, dict):
+            raise RequestError("Options must be a JSON object.")
+        unknown = set(options) - OPTIONS
+        if unknown:
+            raise RequestError(f"Unknown options "
+                               f"{', '.join(sorted(unknown))}, expected "
+                               f"some of {', '.join(sorted(OPTIONS))}.")
+
+    async def serve(self) -> None:
+        """Serves requests until a shutdown request, SIGTERM or SIGINT."""
+        self._stopped = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(signum, self._stopped.set)
+
+        with tempfile.TemporaryDirectory() as scratch:
+            self._scratch, self._pool = scratch, self._new_pool()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            server = await asyncio.start_unix_server(self._connection,
+                                                     self.path)
+            try:
+                await self._stopped.wait()
+            finally:
+                server.close()
+                await server.wait_closed()
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                self._pool.shutdown()
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        """Builds the runtime, if missing, then starts a pool of workers,
+        which find it built."""
+        if self.options.get("backend", "gcc") == "gcc":
+            _warm({self.options.get("target", "x86")})
+        return ProcessPoolExecutor(self.workers)
+
+    async def _connection(self, reader: asyncio.StreamReader,
+                          writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                response = await self.handle(line)
+                writer.write(json.dumps(response).encode() + b"\n")
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, line: bytes) -> Dict[str, Any]:
+        """Serves a single request, given as a line of JSON."""
+        start = time.perf_counter()
+        self.stats["requests"] += 1
+        self.stats["active"] += 1
+        op = "invalid"
+        try:
+            message = json.loads(line)
+            if not isinstance(message, dict):
+                raise RequestError("A request must be a JSON object.")
+            op = message.get("op")
+            if op in ("compile", "run"):
+                response = await self._job(message)
+            elif op == "stats":
+                response = self.report()
+            elif op == "shutdown":
+                self._stopped.set()
+                response = {"status": "ok"}
+            else:
+                raise RequestError(f"Unknown op {op}, expected one of "
+                                   f"compile, run, stats, shutdown.")
+        except Exception as e:
+            # malformed requests, and jobs whose worker failed
+            op = op if op in ("compile", "run") else "invalid"
+            response = {"status": "error",
+                        "error": f"{type(e).__name__}: {e}"}
+        finally:
+            self.stats["active"] -= 1
+
+        ops, statuses = self.stats["ops"], self.stats["statuses"]
+        ops[op] = ops.get(op, 0) + 1
+        status = response.get("status", "ok")
+        statuses[status] = statuses.get(status, 0) + 1
+        self._latencies.setdefault(op, deque(maxlen=SAMPLES)) \
+            .append(time.perf_counter() - start)
+        return response
+
+    async def _job(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Compiles, and maybe runs, the program of a request in a worker."""
+        program = message.get("program")
+        if not isinstance(program, str):
+            raise RequestError("Compile and run requests need a program.")
+        options = message.get("options", {})
+        self._check_options(options)
+        options = {**self.options, **options}
+        timeout = message.get("timeout", self.timeout)
+        if timeout is not None and (
+                not isinstance(timeout, (int, float)) or
+                isinstance(timeout, bool) or not 0 < timeout < math.inf):
+            raise RequestError("A timeout must be a positive number of "
+                               "seconds.")
+
+        self._jobs += 1
+        execute = message["op"] == "run"
+        if execute:
+            work_dir = os.path.join(self._scratch, f"job-{self._jobs}")
+        elif isinstance(message.get("output"), str):
+            work_dir = message["output"]
+        else:
+            raise RequestError("Compile requests need an output directory.")
+
+        job = functools.partial(run_job, f"request-{self._jobs}", work_dir,
+                                timeout, options, source=program,
+                                execute=execute)
+        pool = self._pool
+        try:
+            result = await asyncio.get_running_loop() \
+                .run_in_executor(pool, job)
+        except BrokenProcessPool:
+            # every job of a broken pool fails; only the first replaces it
+            if self._pool is pool:
+                pool.shutdown(wait=False)
+                self._pool = self._new_pool()
+            raise
+        finally:
+            if execute:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        return result._asdict()
+
+    def report(self) -> Dict[str, Any]:
+        """Returns the statistics, with the latency of each op in seconds.
+        """
+        latency = {}
+        for op, samples in self._latencies.items():
+            ordered = sorted(samples)
+            latency[op] = {"count": len(ordered), "max": ordered[-1],
+                           **{f"p{p}": percentile(ordered, p)
+                              for p in PERCENTILES}}
+        return {**self.stats, "status": "ok", "workers": self.workers,
+                "uptime": time.monotonic() - self._started,
+                "latency": latency}
+
+
+def serve(path: Optional[str] = None, workers: Optional[int] = None,
+          timeout: Optional[float] = None, **options: Any) -> None:
+    """Runs a `CompileServer` until it's asked to shut down."""
+    asyncio.run(CompileServer(path, workers, timeout, **options).serve())
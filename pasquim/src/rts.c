@@ -1,9 +1,25 @@
+#include <inttypes.h>
+#include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
+#include <string.h>
+#include <time.h>
 
+// a Scheme value, as wide as a machine word
+typedef intptr_t ptr;
+
+#if defined(__x86_64__)
+#define FIXNUM_MASK     7
+#define FIXNUM_SHIFT    3
+#define SCHEME_CALL
+// the tag fixnums leave free, for bignums
+#define BIGNUM_TAG      4
+#else
 #define FIXNUM_MASK     3
-#define FIXNUM_TAG      0
 #define FIXNUM_SHIFT    2
+#define SCHEME_CALL     __attribute__((__cdecl__))
+#endif
+#define FIXNUM_TAG      0
 
 #define CHAR_MASK       0xff
 #define CHAR_SHIFT      8
@@ -13,10 +29,534 @@
 #define BOOL_SHIFT      8
 #define BOOL_TAG        15
 
-void show(int x) {
+#define PTR_MASK        7
+#define PAIR_TAG        1
+#define VEC_TAG         2
+#define STR_TAG         3
+#define SYM_TAG         5
+#define CLOSURE_TAG     6
+
+// Objects are aligned to this many bytes
+#define ALIGNMENT       8
+#define DEFAULT_HEAP_SIZE (4 << 20)
+
+// The heap compiled code allocates pairs, vectors, strings and closures
+// from. A pointer to it is passed to `scheme_entry`, which reads and updates
+// the first three fields; objects are laid out as described in
+// primitives.py.
+struct heap {
+    char *free;             // next free byte
+    char *limit;            // end of the space objects are allocated in
+    char *stack;            // stack pointer of the running entry, below
+                            // which are the stack slots of compiled code
+    char *space;            // start of that space
+    char *other;            // the other semispace, which live objects are
+                            // copied to when collecting
+    size_t size;            // bytes in each semispace
+    unsigned char *tags;    // tag of the object copied to each
+                            // ALIGNMENT bytes of `other`, since objects
+                            // have no header
+    char *copy;             // next free byte of `other` while collecting
+
+    unsigned long collections;
+    unsigned long long bytes_copied;
+    double pause;           // seconds spent collecting
+};
+
+static struct heap heap;
+
+static void *allocate_or_exit(size_t size) {
+    void *memory = malloc(size);
+    if(memory == NULL) {
+        fflush(stdout);
+        fprintf(stderr, "error: out of memory\n");
+        exit(1);
+    }
+    return memory;
+}
+
+static void print_gc_stats(void) {
+    fprintf(stderr, "gc: %lu collections, %llu bytes copied, %.3f ms paused\n",
+            heap.collections, heap.bytes_copied, heap.pause * 1000);
+}
+
+// Counters of the calls of primitives in a program compiled with
+// instrumentation, two for each call site: the times it ran, and when
+// `scheme_profile_cycles` is set, the cycles it took, operands included.
+struct site_counters {
+    uint64_t calls;
+    uint64_t cycles;
+};
+
+__attribute__((weak))
+extern struct site_counters scheme_profile_counters[]
+    asm ("scheme_profile_counters");
+__attribute__((weak))
+extern const char *scheme_profile_sites[] asm ("scheme_profile_sites");
+__attribute__((weak))
+extern int scheme_profile_count asm ("scheme_profile_count");
+__attribute__((weak))
+extern int scheme_profile_cycles asm ("scheme_profile_cycles");
+
+// Writes the counters of every site, one per line, to the file named by
+// PASQUIM_PROFILE, or pasquim.prof.
+static void write_profile(void) {
+    const char *path = getenv("PASQUIM_PROFILE");
+    if(path == NULL) {
+        path = "pasquim.prof";
+    }
+    FILE *f = fopen(path, "w");
+    if(f == NULL) {
+        fprintf(stderr, "error: can't write profile to %s\n", path);
+        return;
+    }
+    fprintf(f, scheme_profile_cycles ? "site\tcalls\tcycles\n"
+                                     : "site\tcalls\n");
+    for(int i = 0; i < scheme_profile_count; i++) {
+        fprintf(f, "%s\t%" PRIu64, scheme_profile_sites[i],
+                scheme_profile_counters[i].calls);
+        if(scheme_profile_cycles) {
+            fprintf(f, "\t%" PRIu64, scheme_profile_counters[i].cycles);
+        }
+        fprintf(f, "\n");
+    }
+    fclose(f);
+}
+
+// Returns the heap, setting it up on the first call. Each semispace has
+// PASQUIM_HEAP_SIZE bytes, and the collector's statistics are printed to
+// stderr at exit when PASQUIM_GC_STATS is set. Instrumented programs write
+// their profile at exit.
+struct heap *scheme_heap(void) {
+    if(heap.space == NULL) {
+        const char *size = getenv("PASQUIM_HEAP_SIZE");
+        heap.size = size != NULL ? strtoull(size, NULL, 0) : 0;
+        if(heap.size < 64) {
+            heap.size = size != NULL ? 64 : DEFAULT_HEAP_SIZE;
+        }
+        heap.size &= ~(size_t)(ALIGNMENT - 1);
+        heap.space = allocate_or_exit(heap.size);
+        heap.other = allocate_or_exit(heap.size);
+        heap.tags = allocate_or_exit(heap.size / ALIGNMENT);
+        heap.free = heap.space;
+        heap.limit = heap.space + heap.size;
+        if(getenv("PASQUIM_GC_STATS") != NULL) {
+            atexit(print_gc_stats);
+        }
+        if(&scheme_profile_count != NULL) {
+            atexit(write_profile);
+        }
+    }
+    return &heap;
+}
+
+static size_t align(size_t bytes) {
+    return (bytes + ALIGNMENT - 1) & ~(size_t)(ALIGNMENT - 1);
+}
+
+static int is_object(ptr x) {
+    ptr tag = x & PTR_MASK;
+#ifdef BIGNUM_TAG
+    if(tag == BIGNUM_TAG) {
+        return 1;
+    }
+#endif
+    return tag == PAIR_TAG || tag == VEC_TAG || tag == STR_TAG ||
+        tag == CLOSURE_TAG;
+}
+
+static ptr *untag(ptr x) {
+    return (ptr *)(x & ~(ptr)PTR_MASK);
+}
+
+// Checks if x points to an object allocated in the heap, and not to just
+// any memory: unchecked primitives can make words of any tag.
+static int in_heap(ptr x) {
+    char *address = (char *)untag(x);
+    return is_object(x) && address >= heap.space && address < heap.free;
+}
+
+static size_t object_size(ptr tag, ptr *object) {
+    size_t length = (size_t)(object[0] >> FIXNUM_SHIFT);
+    switch(tag) {
+    case PAIR_TAG:
+        return align(2 * sizeof(ptr));
+    case VEC_TAG:
+    case CLOSURE_TAG:
+        return align((1 + length) * sizeof(ptr));
+#ifdef BIGNUM_TAG
+    case BIGNUM_TAG:
+        // the length of a negative bignum is negated
+        length = (size_t)labs(object[0] >> FIXNUM_SHIFT);
+        return align((1 + length) * sizeof(ptr));
+#endif
+    default:
+        return align(sizeof(ptr) + length);
+    }
+}
+
+// Copies the object x points to into `other`, unless it was copied
+// already, and returns its new address. Other words are left alone.
+static ptr forward(struct heap *h, ptr x) {
+    if(!is_object(x)) {
+        return x;
+    }
+    ptr *object = untag(x);
+    if((char *)object < h->space || (char *)object >= h->free) {
+        return x;
+    }
+
+    // a copied object's first word is replaced by its new address
+    ptr first = object[0];
+    if(is_object(first) && (char *)untag(first) >= h->other &&
+            (char *)untag(first) < h->other + h->size) {
+        return first;
+    }
+
+    ptr tag = x & PTR_MASK;
+    size_t size = object_size(tag, object);
+    memcpy(h->copy, object, size);
+    h->tags[(h->copy - h->other) / ALIGNMENT] = (unsigned char)tag;
+    object[0] = (ptr)h->copy + tag;
+    h->copy += size;
+    h->bytes_copied += size;
+    return object[0];
+}
+
+// Copies every object reachable from the words in [roots, end) to `other`,
+// scanning the copies breadth first, then swaps the semispaces.
+static void collect(struct heap *h, ptr *roots, ptr *end) {
+    h->copy = h->other;
+    for(ptr *root = roots; root < end; root++) {
+        *root = forward(h, *root);
+    }
+
+    char *scan = h->other;
+    while(scan < h->copy) {
+        ptr tag = h->tags[(scan - h->other) / ALIGNMENT];
+        ptr *object = (ptr *)scan;
+        if(tag == PAIR_TAG) {
+            object[0] = forward(h, object[0]);
+            object[1] = forward(h, object[1]);
+        } else if(tag == VEC_TAG || tag == CLOSURE_TAG) {
+            // a closure's code address isn't in the heap, so it's kept
+            ptr length = object[0] >> FIXNUM_SHIFT;
+            for(ptr i = 1; i <= length; i++) {
+                object[i] = forward(h, object[i]);
+            }
+        }
+        scan += object_size(tag, object);
+    }
+
+    char *space = h->space;
+    h->space = h->other;
+    h->other = space;
+    h->free = h->copy;
+    h->limit = h->space + h->size;
+}
+
+// Moves the live objects to semispaces of a new size.
+static void resize(struct heap *h, size_t size, ptr *roots, ptr *end) {
+    free(h->other);
+    free(h->tags);
+    h->size = size;
+    h->other = allocate_or_exit(size);
+    h->tags = allocate_or_exit(size / ALIGNMENT);
+    collect(h, roots, end);
+    free(h->other);
+    h->other = allocate_or_exit(size);
+}
+
+static double seconds(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec * 1e-9;
+}
+
+// Compiled code calls this when there's no room for an object of `bytes`
+// bytes in the heap h. Live objects are those reachable from the stack
+// slots in [roots, h->stack). Returns the new heap pointer, with at least
+// `bytes` bytes free, and updates the limit of h.
+__attribute__((visibility("hidden"), force_align_arg_pointer)) SCHEME_CALL
+ptr *scheme_collect(ptr *hp, ptr *roots, struct heap *h, uintptr_t bytes)
+    asm ("scheme_collect");
+
+ptr *scheme_collect(ptr *hp, ptr *roots, struct heap *h, uintptr_t bytes) {
+    ptr *end = (ptr *)h->stack;
+    double start = seconds();
+    h->free = (char *)hp;
+    collect(h, roots, end);
+    if((uintptr_t)(h->limit - h->free) < bytes) {
+        // grow, keeping the heap at most half full
+        size_t size = h->size;
+        while(size < 2 * (h->free - h->space + bytes)) {
+            if(size > SIZE_MAX / 2) {
+                fflush(stdout);
+                fprintf(stderr, "error: out of memory\n");
+                exit(1);
+            }
+            size *= 2;
+        }
+        resize(h, size, roots, end);
+    }
+    h->collections++;
+    h->pause += seconds() - start;
+    return (ptr *)h->free;
+}
+
+// Symbols made by `string->symbol` are allocated from chunks of this many
+// bytes, or of their own size when larger
+#define SYMBOL_CHUNK_SIZE (64 << 10)
+
+struct chunk {
+    char *start, *end;      // the bytes holding symbols
+    char *limit;            // end of the chunk
+};
+
+// Every symbol, in an open addressing hash table keyed by name. The table
+// is seeded with the symbols quoted by the program, which the compiler lays
+// out in its data section, and grows with those `scheme_intern` makes.
+// Symbols never move, nor are they collected.
+struct symbols {
+    ptr *slots;             // tagged symbols, 0 for free slots
+    size_t capacity;        // number of slots, a power of two
+    size_t count;           // slots in use, at most half of them
+    char *first, *last;     // bounds of the program's symbols
+    struct chunk *chunks;   // memory the other symbols are allocated from
+    size_t nchunks;
+};
+
+static struct symbols symbols;
+
+// The program's symbols, defined by compiled code that quotes any name.
+__attribute__((weak))
+extern ptr scheme_symbol_table[] asm ("scheme_symbol_table");
+__attribute__((weak))
+extern int scheme_symbol_count asm ("scheme_symbol_count");
+
+static size_t symbol_length(ptr symbol) {
+    return (size_t)(untag(symbol)[0] >> FIXNUM_SHIFT);
+}
+
+static const char *symbol_name(ptr symbol) {
+    return (const char *)(untag(symbol) + 1);
+}
+
+// FNV-1a
+static size_t hash_name(const char *name, size_t length) {
+    uint32_t hash = 2166136261u;
+    for(size_t i = 0; i < length; i++) {
+        hash = (hash ^ (unsigned char)name[i]) * 16777619u;
+    }
+    return hash;
+}
+
+// Returns the slot holding the symbol of the given name, or the free slot
+// it belongs in.
+static ptr *find_symbol(const char *name, size_t length) {
+    size_t mask = symbols.capacity - 1;
+    for(size_t i = hash_name(name, length) & mask; ; i = (i + 1) & mask) {
+        ptr symbol = symbols.slots[i];
+        if(symbol == 0 || (symbol_length(symbol) == length &&
+                memcmp(symbol_name(symbol), name, length) == 0)) {
+            return &symbols.slots[i];
+        }
+    }
+}
+
+// Moves the symbols to a table of the given number of slots.
+static void rehash_symbols(size_t capacity) {
+    ptr *slots = symbols.slots;
+    size_t old_capacity = symbols.capacity;
+    symbols.slots = allocate_or_exit(capacity * sizeof(ptr));
+    memset(symbols.slots, 0, capacity * sizeof(ptr));
+    symbols.capacity = capacity;
+    for(size_t i = 0; i < old_capacity; i++) {
+        if(slots[i] != 0) {
+            *find_symbol(symbol_name(slots[i]), symbol_length(slots[i])) =
+                slots[i];
+        }
+    }
+    free(slots);
+}
+
+static void insert_symbol(ptr symbol) {
+    if(2 * (symbols.count + 1) > symbols.capacity) {
+        rehash_symbols(2 * symbols.capacity);
+    }
+    *find_symbol(symbol_name(symbol), symbol_length(symbol)) = symbol;
+    symbols.count++;
+}
+
+// Seeds the table with the program's symbols, on first use.
+static void init_symbols(void) {
+    if(symbols.slots != NULL) {
+        return;
+    }
+    rehash_symbols(1024);
+    if(&scheme_symbol_count != NULL && scheme_symbol_count > 0) {
+        // laid out one after the other, right before the table
+        symbols.first = (char *)untag(scheme_symbol_table[0]);
+        symbols.last = (char *)scheme_symbol_table;
+        for(int i = 0; i < scheme_symbol_count; i++) {
+            insert_symbol(scheme_symbol_table[i]);
+        }
+    }
+}
+
+static ptr make_symbol(const char *name, size_t length) {
+    size_t size = align(sizeof(ptr) + length);
+    struct chunk *chunk = symbols.chunks + symbols.nchunks - 1;
+    if(symbols.nchunks == 0 || (size_t)(chunk->limit - chunk->end) < size) {
+        size_t bytes = size > SYMBOL_CHUNK_SIZE ? size : SYMBOL_CHUNK_SIZE;
+        struct chunk *chunks = realloc(symbols.chunks, (symbols.nchunks + 1)
+                                       * sizeof(struct chunk));
+        if(chunks == NULL) {
+            fflush(stdout);
+            fprintf(stderr, "error: out of memory\n");
+            exit(1);
+        }
+        symbols.chunks = chunks;
+        chunk = &chunks[symbols.nchunks++];
+        chunk->start = chunk->end = allocate_or_exit(bytes);
+        chunk->limit = chunk->start + bytes;
+    }
+
+    ptr *object = (ptr *)chunk->end;
+    chunk->end += size;
+    object[0] = (ptr)(length << FIXNUM_SHIFT);
+    memcpy(object + 1, name, length);
+    return (ptr)object + SYM_TAG;
+}
+
+// Checks if x is a symbol, and not just any word tagged like one.
+static int is_symbol(ptr x) {
+    char *address = (char *)untag(x);
+    if((x & PTR_MASK) != SYM_TAG) {
+        return 0;
+    }
+    init_symbols();
+    if(address >= symbols.first && address < symbols.last) {
+        return 1;
+    }
+    for(size_t i = 0; i < symbols.nchunks; i++) {
+        if(address >= symbols.chunks[i].start &&
+                address < symbols.chunks[i].end) {
+            return 1;
+        }
+    }
+    return 0;
+}
+
+// Compiled code calls this for `string->symbol`, with a string of the
+// heap. Returns the symbol of that name, making it if there is none yet.
+__attribute__((visibility("hidden"), force_align_arg_pointer)) SCHEME_CALL
+ptr scheme_intern(ptr string) asm ("scheme_intern");
+
+ptr scheme_intern(ptr string) {
+    init_symbols();
+    ptr *object = untag(string);
+    size_t length = (size_t)(object[0] >> FIXNUM_SHIFT);
+    const char *name = (const char *)(object + 1);
+    ptr symbol = *find_symbol(name, length);
+    if(symbol == 0) {
+        symbol = make_symbol(name, length);
+        insert_symbol(symbol);
+    }
+    return symbol;
+}
+
+static void show_string(ptr *object) {
+    ptr length = object[0] >> FIXNUM_SHIFT;
+    const unsigned char *chars = (const unsigned char *)(object + 1);
+    putchar('"');
+    for(ptr i = 0; i < length; i++) {
+        if(chars[i] == '"' || chars[i] == '\\') {
+            putchar('\\');
+        }
+        putchar(chars[i]);
+    }
+    putchar('"');
+}
+
+#ifdef BIGNUM_TAG
+// Bignums are made by exact arithmetic, once a result is too large for a
+// fixnum: a header with the number of 64-bit limbs, as a fixnum negated for
+// negative numbers, followed by the limbs of the magnitude, least
+// significant first. Results that fit a fixnum are always fixnums.
+
+// The magnitude of an integer, and its sign.
+struct integer {
+    int negative;
+    size_t length;
+    const uint64_t *limbs;
+    uint64_t small;         // the limb of a fixnum, which limbs points to
+};
+
+// Reads a fixnum or bignum into n, returning 0 for other words.
+static int load_integer(ptr x, struct integer *n) {
+    if((x & FIXNUM_MASK) == FIXNUM_TAG) {
+        ptr value = x >> FIXNUM_SHIFT;
+        n->negative = value < 0;
+        n->small = value < 0 ? -(uint64_t)value : (uint64_t)value;
+        n->length = n->small != 0;
+        n->limbs = &n->small;
+        return 1;
+    }
+    if((x & PTR_MASK) == BIGNUM_TAG) {
+        ptr *object = untag(x);
+        ptr length = object[0] >> FIXNUM_SHIFT;
+        n->negative = length < 0;
+        n->length = (size_t)labs(length);
+        n->limbs = (const uint64_t *)(object + 1);
+        return 1;
+    }
+    return 0;
+}
+
+// Prints the digits of a bignum, dividing a copy of its limbs by 10^19.
+static void show_bignum(ptr *object) {
+    const uint64_t base = 10000000000000000000ULL;
+    ptr header = object[0] >> FIXNUM_SHIFT;
+    size_t length = (size_t)labs(header);
+    uint64_t *limbs = allocate_or_exit(length * sizeof(uint64_t));
+    uint64_t *digits = allocate_or_exit(2 * length * sizeof(uint64_t));
+    memcpy(limbs, object + 1, length * sizeof(uint64_t));
+
+    size_t count = 0;
+    while(length > 0) {
+        unsigned __int128 remainder = 0;
+        for(size_t i = length; i-- > 0;) {
+            unsigned __int128 part = (remainder << 64) | limbs[i];
+            limbs[i] = (uint64_t)(part / base);
+            remainder = part % base;
+        }
+        digits[count++] = (uint64_t)remainder;
+        while(length > 0 && limbs[length - 1] == 0) {
+            length--;
+        }
+    }
+
+    if(header < 0) {
+        putchar('-');
+    }
+    printf("%" PRIu64, count > 0 ? digits[count - 1] : 0);
+    for(size_t i = count - 1; count > 0 && i-- > 0;) {
+        printf("%019" PRIu64, digits[i]);
+    }
+    free(limbs);
+    free(digits);
+}
+#endif
+
+void show(ptr x) {
     if((x & FIXNUM_MASK) == FIXNUM_TAG) {
         // integer
-        printf("%d", x >> FIXNUM_SHIFT);
+        printf("%" PRIdPTR, x >> FIXNUM_SHIFT);
+#ifdef BIGNUM_TAG
+    } else if((x & PTR_MASK) == BIGNUM_TAG) {
+        show_bignum(untag(x));
+#endif
     } else if((x & CHAR_MASK) == CHAR_TAG) {
         // character
         printf("#\\%c", (char)(x >> CHAR_SHIFT));
@@ -27,14 +567,287 @@ void show(int x) {
         } else {
             printf("#f");
         }
+    } else if(in_heap(x) && (x & PTR_MASK) == PAIR_TAG) {
+        // pair, shown as a list when the cdr is another pair
+        printf("(");
+        show(untag(x)[0]);
+        for(x = untag(x)[1]; in_heap(x) && (x & PTR_MASK) == PAIR_TAG;
+                x = untag(x)[1]) {
+            printf(" ");
+            show(untag(x)[0]);
+        }
+        printf(" . ");
+        show(x);
+        printf(")");
+    } else if(in_heap(x) && (x & PTR_MASK) == VEC_TAG) {
+        ptr *object = untag(x);
+        printf("#(");
+        for(ptr i = 1; i <= object[0] >> FIXNUM_SHIFT; i++) {
+            if(i > 1) {
+                printf(" ");
+            }
+            show(object[i]);
+        }
+        printf(")");
+    } else if(in_heap(x) && (x & PTR_MASK) == STR_TAG) {
+        show_string(untag(x));
+    } else if(in_heap(x) && (x & PTR_MASK) == CLOSURE_TAG) {
+        printf("#<procedure>");
+    } else if(is_symbol(x)) {
+        fwrite(symbol_name(x), 1, symbol_length(x), stdout);
     }
 }
 
-__attribute__((__cdecl__))
-extern int scheme_entry() asm ("scheme_entry");
+// Compiled code jumps here when a primitive gets an operand of the wrong
+// type, in safe mode. Hidden, so shared libraries can reach it without the
+// PLT, and realigning the stack, which generated code doesn't keep aligned.
+__attribute__((noreturn, visibility("hidden"), force_align_arg_pointer))
+void scheme_type_error(void) asm ("scheme_type_error");
+
+void scheme_type_error(void) {
+    fflush(stdout);
+    fprintf(stderr, "error: wrong type of argument\n");
+    exit(1);
+}
+
+// Likewise for an index or length out of range.
+__attribute__((noreturn, visibility("hidden"), force_align_arg_pointer))
+void scheme_range_error(void) asm ("scheme_range_error");
+
+void scheme_range_error(void) {
+    fflush(stdout);
+    fprintf(stderr, "error: index out of range\n");
+    exit(1);
+}
+
+// Likewise for a procedure called with the wrong number of arguments.
+__attribute__((noreturn, visibility("hidden"), force_align_arg_pointer))
+void scheme_arity_error(void) asm ("scheme_arity_error");
+
+void scheme_arity_error(void) {
+    fflush(stdout);
+    fprintf(stderr, "error: wrong number of arguments\n");
+    exit(1);
+}
+
+#ifdef BIGNUM_TAG
+static int compare_magnitudes(const struct integer *a,
+                              const struct integer *b) {
+    if(a->length != b->length) {
+        return a->length < b->length ? -1 : 1;
+    }
+    for(size_t i = a->length; i-- > 0;) {
+        if(a->limbs[i] != b->limbs[i]) {
+            return a->limbs[i] < b->limbs[i] ? -1 : 1;
+        }
+    }
+    return 0;
+}
+
+// Adds the magnitudes of a and b into r, which has room for one limb more
+// than the longer, and returns the number of limbs.
+static size_t add_magnitudes(const struct integer *a,
+                             const struct integer *b, uint64_t *r) {
+    if(a->length < b->length) {
+        const struct integer *longer = b;
+        b = a;
+        a = longer;
+    }
+    uint64_t carry = 0;
+    for(size_t i = 0; i < a->length; i++) {
+        unsigned __int128 sum = (unsigned __int128)a->limbs[i] + carry +
+            (i < b->length ? b->limbs[i] : 0);
+        r[i] = (uint64_t)sum;
+        carry = (uint64_t)(sum >> 64);
+    }
+    r[a->length] = carry;
+    return a->length + 1;
+}
+
+// Subtracts the magnitude of b from the larger one of a into r.
+static size_t subtract_magnitudes(const struct integer *a,
+                                  const struct integer *b, uint64_t *r) {
+    uint64_t borrow = 0;
+    for(size_t i = 0; i < a->length; i++) {
+        uint64_t limb = i < b->length ? b->limbs[i] : 0;
+        uint64_t difference = a->limbs[i] - limb - borrow;
+        borrow = a->limbs[i] < limb || (a->limbs[i] == limb && borrow);
+        r[i] = difference;
+    }
+    return a->length;
+}
+
+// Multiplies the magnitudes of a and b into r, which has room for the
+// limbs of both and is zeroed.
+static size_t multiply_magnitudes(const struct integer *a,
+                                  const struct integer *b, uint64_t *r) {
+    for(size_t i = 0; i < a->length; i++) {
+        uint64_t carry = 0;
+        for(size_t j = 0; j < b->length; j++) {
+            unsigned __int128 product =
+                (unsigned __int128)a->limbs[i] * b->limbs[j] + r[i + j] +
+                carry;
+            r[i + j] = (uint64_t)product;
+            carry = (uint64_t)(product >> 64);
+        }
+        r[i + b->length] = carry;
+    }
+    return a->length + b->length;
+}
+
+// Returns the integer with the given sign and magnitude: a fixnum when it
+// fits one, or else a new bignum, collecting garbage from the stack slots
+// in [roots, h->stack) if the heap is full.
+static ptr make_integer(struct heap *h, ptr *roots, int negative,
+                        const uint64_t *limbs, size_t length) {
+    while(length > 0 && limbs[length - 1] == 0) {
+        length--;
+    }
+    uint64_t limit = (uint64_t)1 << (63 - FIXNUM_SHIFT);
+    if(length == 0) {
+        return 0;
+    }
+    if(length == 1 && (limbs[0] < limit || (negative && limbs[0] == limit))) {
+        uint64_t word = limbs[0] << FIXNUM_SHIFT;
+        return (ptr)(negative ? -word : word);
+    }
+
+    size_t bytes = align((1 + length) * sizeof(ptr));
+    if((size_t)(h->limit - h->free) < bytes) {
+        h->free = (char *)scheme_collect((ptr *)h->free, roots, h, bytes);
+    }
+    ptr *object = (ptr *)h->free;
+    h->free += bytes;
+    uint64_t header = (uint64_t)length << FIXNUM_SHIFT;
+    object[0] = (ptr)(negative ? -header : header);
+    memcpy(object + 1, limbs, length * sizeof(uint64_t));
+    return (ptr)object + BIGNUM_TAG;
+}
+
+// a + b, or a - b when subtract is set.
+static ptr add_integers(ptr a, ptr b, int subtract, ptr *roots,
+                        struct heap *h) {
+    struct integer x, y;
+    if(!load_integer(a, &x) || !load_integer(b, &y)) {
+        scheme_type_error();
+    }
+    if(subtract) {
+        y.negative = !y.negative;
+    }
+
+    size_t length = (x.length > y.length ? x.length : y.length) + 1;
+    uint64_t *r = allocate_or_exit(length * sizeof(uint64_t));
+    int negative = x.negative;
+    if(x.negative == y.negative) {
+        length = add_magnitudes(&x, &y, r);
+    } else if(compare_magnitudes(&x, &y) >= 0) {
+        length = subtract_magnitudes(&x, &y, r);
+    } else {
+        length = subtract_magnitudes(&y, &x, r);
+        negative = y.negative;
+    }
+    ptr result = make_integer(h, roots, negative, r, length);
+    free(r);
+    return result;
+}
+
+// Compiled code in exact mode calls these when an operand isn't a fixnum,
+// or the result overflows one. They take any integers, reporting other
+// operands as a type error, and return a normalized integer, allocating
+// bignums from the heap h like `scheme_collect`.
+__attribute__((visibility("hidden"), force_align_arg_pointer))
+ptr scheme_add(ptr a, ptr b, ptr *roots, struct heap *h) asm ("scheme_add");
+
+ptr scheme_add(ptr a, ptr b, ptr *roots, struct heap *h) {
+    return add_integers(a, b, 0, roots, h);
+}
+
+__attribute__((visibility("hidden"), force_align_arg_pointer))
+ptr scheme_sub(ptr a, ptr b, ptr *roots, struct heap *h) asm ("scheme_sub");
+
+ptr scheme_sub(ptr a, ptr b, ptr *roots, struct heap *h) {
+    return add_integers(a, b, 1, roots, h);
+}
+
+__attribute__((visibility("hidden"), force_align_arg_pointer))
+ptr scheme_mul(ptr a, ptr b, ptr *roots, struct heap *h) asm ("scheme_mul");
+
+ptr scheme_mul(ptr a, ptr b, ptr *roots, struct heap *h) {
+    struct integer x, y;
+    if(!load_integer(a, &x) || !load_integer(b, &y)) {
+        scheme_type_error();
+    }
+    size_t length = x.length + y.length;
+    uint64_t *r = calloc(length + 1, sizeof(uint64_t));
+    if(r == NULL) {
+        allocate_or_exit(SIZE_MAX);
+    }
+    length = multiply_magnitudes(&x, &y, r);
+    ptr result = make_integer(h, roots, x.negative != y.negative, r, length);
+    free(r);
+    return result;
+}
+
+// Returns -1, 0 or 1 as a is less than, equal to or greater than b, which
+// are compared as words unless both are integers.
+__attribute__((visibility("hidden"), force_align_arg_pointer))
+ptr scheme_compare(ptr a, ptr b, ptr *roots, struct heap *h)
+    asm ("scheme_compare");
+
+ptr scheme_compare(ptr a, ptr b, ptr *roots, struct heap *h) {
+    (void)roots;
+    (void)h;
+    struct integer x, y;
+    if(!load_integer(a, &x) || !load_integer(b, &y)) {
+        return (a > b) - (a < b);
+    }
+    if(x.negative != y.negative) {
+        return x.negative ? -1 : 1;
+    }
+    int order = compare_magnitudes(&x, &y);
+    return x.negative ? -order : order;
+}
+#endif
+
+typedef ptr (*scheme_entry_t)(struct heap *) SCHEME_CALL;
+
+// A regular binary defines `scheme_entry`, while a batch binary built with
+// `Compiler.compile_many` defines the `scheme_entries` table instead.
+__attribute__((weak)) SCHEME_CALL
+extern ptr scheme_entry(struct heap *) asm ("scheme_entry");
+__attribute__((weak))
+extern scheme_entry_t scheme_entries[] asm ("scheme_entries");
+__attribute__((weak))
+extern int scheme_entry_count asm ("scheme_entry_count");
+
+int run_batch(int argc, const char **argv) {
+    if(argc > 1) {
+        // run a single program, chosen by its index
+        char *end;
+        long i = strtol(argv[1], &end, 10);
+        if(end == argv[1] || *end != '\0' || i < 0 ||
+           i >= scheme_entry_count) {
+            fprintf(stderr, "no program with index %s\n", argv[1]);
+            return 1;
+        }
+        show(scheme_entries[i](scheme_heap()));
+        printf("\n");
+        return 0;
+    }
+
+    for(int i = 0; i < scheme_entry_count; i++) {
+        show(scheme_entries[i](scheme_heap()));
+        printf("\n");
+    }
+    return 0;
+}
 
 int main(int argc, const char **argv) {
-    int val = scheme_entry();
+    if(&scheme_entry_count != NULL) {
+        return run_batch(argc, argv);
+    }
+
+    ptr val = scheme_entry(scheme_heap());
     show(val);
     printf("\n");
     return 0;
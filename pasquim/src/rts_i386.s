@@ -0,0 +1,793 @@
+# Minimal runtime used by the built-in backend on 32-bit x86 Linux.
+#
+# It mirrors rts.c without depending on libc: `_start` calls the compiled
+# program, prints its result with `scheme_show` and exits through the
+# `int $0x80` system call interface. Batch binaries, which define the
+# `scheme_entries` table, run every program or only the one whose index is
+# given as the first argument.
+#
+# The heap is set up with `brk`, with PASQUIM_HEAP_SIZE bytes per semispace,
+# and `scheme_collect` is a Cheney collector like the one of rts.c. Unlike
+# that one, it never grows the heap, and it keeps no statistics. Likewise,
+# the table of symbols `scheme_intern` keeps has a fixed size.
+
+.weak scheme_entry
+.weak scheme_entries
+.weak scheme_entry_count
+.weak scheme_symbol_table
+.weak scheme_symbol_count
+
+.text
+.globl _start
+_start:
+    call __rts_heap_init
+    movl $scheme_entry_count, %eax
+    testl %eax, %eax
+    jnz __rts_batch
+
+    push $__rts_heap
+    call scheme_entry
+    addl $4, %esp
+    call scheme_show
+    xorl %ebx, %ebx
+    jmp __rts_exit
+
+__rts_batch:
+    cmpl $1, 0(%esp)            # argc
+    jg __rts_batch_one
+
+    xorl %esi, %esi             # preserved by scheme_entry_i
+__rts_batch_loop:
+    cmpl scheme_entry_count, %esi
+    jge __rts_batch_done
+    push $__rts_heap
+    call *scheme_entries(,%esi,4)
+    addl $4, %esp
+    call scheme_show
+    incl %esi
+    jmp __rts_batch_loop
+__rts_batch_done:
+    xorl %ebx, %ebx
+    jmp __rts_exit
+
+__rts_batch_one:
+    movl 8(%esp), %esi          # argv[1]
+    xorl %eax, %eax
+    movzbl 0(%esi), %ecx
+    testl %ecx, %ecx
+    jz __rts_bad_index
+__rts_parse_index:
+    movzbl 0(%esi), %ecx
+    testl %ecx, %ecx
+    jz __rts_run_one
+    subl $48, %ecx              # '0'
+    cmpl $9, %ecx
+    ja __rts_bad_index
+    imull $10, %eax
+    addl %ecx, %eax
+    incl %esi
+    jmp __rts_parse_index
+__rts_run_one:
+    cmpl scheme_entry_count, %eax
+    jae __rts_bad_index
+    push $__rts_heap
+    call *scheme_entries(,%eax,4)
+    addl $4, %esp
+    call scheme_show
+    xorl %ebx, %ebx
+    jmp __rts_exit
+
+__rts_bad_index:
+    movl $4, %eax               # write(2, message, length)
+    movl $2, %ebx
+    movl $__rts_bad_index_message, %ecx
+    movl $22, %edx
+    int $0x80
+    movl $1, %ebx
+
+__rts_exit:
+    movl $1, %eax               # exit(%ebx)
+    int $0x80
+
+# Compiled code jumps here when a primitive gets an operand of the wrong
+# type, in safe mode.
+.globl scheme_type_error
+scheme_type_error:
+    movl $4, %eax               # write(2, message, length)
+    movl $2, %ebx
+    movl $__rts_type_error_message, %ecx
+    movl $30, %edx
+    int $0x80
+    movl $1, %ebx
+    jmp __rts_exit
+
+# Likewise for a procedure called with the wrong number of arguments.
+.globl scheme_arity_error
+scheme_arity_error:
+    movl $__rts_arity_error_message, %ecx
+    movl $33, %edx
+    jmp __rts_fail
+
+# Likewise for an index or length out of range.
+.globl scheme_range_error
+scheme_range_error:
+    movl $__rts_range_error_message, %ecx
+    movl $26, %edx
+    jmp __rts_fail
+
+__rts_heap_exhausted:
+    movl $__rts_heap_exhausted_message, %ecx
+    movl $22, %edx
+
+__rts_fail:
+    movl $4, %eax               # write(2, %ecx, %edx)
+    movl $2, %ebx
+    int $0x80
+    movl $1, %ebx
+    jmp __rts_exit
+
+# Reserves both semispaces and the tag map of the heap after the program's
+# data, reading their size from the environment. Called first thing from
+# `_start`, so the environment follows argv on the stack.
+__rts_heap_init:
+    push %ebx
+    push %esi
+    push %edi
+    movl 16(%esp), %ecx         # argc
+    leal 24(%esp,%ecx,4), %esi  # envp
+    movl $4194304, %ebx         # default size
+__rts_env_next:
+    movl 0(%esi), %edi
+    testl %edi, %edi
+    jz __rts_env_done
+    addl $4, %esi
+    movl $__rts_heap_size_name, %edx
+__rts_env_compare:
+    movzbl 0(%edx), %eax
+    testl %eax, %eax
+    jz __rts_env_found
+    movzbl 0(%edi), %ecx
+    cmpl %eax, %ecx
+    jne __rts_env_next
+    incl %edx
+    incl %edi
+    jmp __rts_env_compare
+__rts_env_found:
+    xorl %ebx, %ebx
+__rts_env_digit:
+    movzbl 0(%edi), %ecx
+    subl $48, %ecx              # '0'
+    cmpl $9, %ecx
+    ja __rts_env_parsed
+    imull $10, %ebx
+    addl %ecx, %ebx
+    incl %edi
+    jmp __rts_env_digit
+__rts_env_parsed:
+    cmpl $64, %ebx
+    jae __rts_env_done
+    movl $64, %ebx
+__rts_env_done:
+    andl $-8, %ebx
+    movl %ebx, %esi             # bytes per semispace
+
+    movl $45, %eax              # brk(0), the current break
+    xorl %ebx, %ebx
+    int $0x80
+    addl $7, %eax
+    andl $-8, %eax
+    movl %eax, %edi             # start of the heap
+    movl %esi, %ebx             # brk(heap + 2 * size + size / 8)
+    shrl $3, %ebx
+    addl %esi, %ebx
+    addl %esi, %ebx
+    addl %edi, %ebx
+    movl $45, %eax
+    int $0x80
+    cmpl %ebx, %eax
+    jb __rts_heap_exhausted
+
+    movl %edi, __rts_heap       # free
+    movl %edi, __rts_heap+12    # space
+    movl %esi, __rts_heap+20    # size
+    addl %esi, %edi
+    movl %edi, __rts_heap+4     # limit
+    movl %edi, __rts_heap+16    # other
+    addl %esi, %edi
+    movl %edi, __rts_heap+24    # tags
+    pop %edi
+    pop %esi
+    pop %ebx
+    ret
+
+# ptr *scheme_collect(ptr *hp, ptr *roots, struct heap *h, uintptr_t bytes)
+#
+# Copies the objects reachable from the words in [roots, h->stack) to the
+# other semispace, scanning the copies breadth first, and swaps the
+# semispaces. Returns the new heap pointer, h being the only heap.
+.globl scheme_collect
+scheme_collect:
+    push %ebx
+    push %esi
+    push %edi
+    push %ebp
+    movl 20(%esp), %eax
+    movl %eax, __rts_heap       # free
+    movl __rts_heap+16, %eax
+    movl %eax, __rts_heap+28    # copy
+    movl 24(%esp), %esi
+__rts_gc_root:
+    cmpl __rts_heap+8, %esi     # stack
+    jae __rts_gc_scan_start
+    movl 0(%esi), %eax
+    call __rts_forward
+    movl %eax, 0(%esi)
+    addl $4, %esi
+    jmp __rts_gc_root
+
+__rts_gc_scan_start:
+    movl __rts_heap+16, %esi    # scan
+__rts_gc_scan:
+    cmpl __rts_heap+28, %esi
+    jae __rts_gc_flip
+    movl %esi, %ecx             # look up the tag of the object at scan
+    subl __rts_heap+16, %ecx
+    shrl $3, %ecx
+    addl __rts_heap+24, %ecx
+    movzbl 0(%ecx), %ecx
+    cmpl $1, %ecx               # PAIR_TAG
+    je __rts_gc_scan_pair
+    movl 0(%esi), %edi          # length, as a fixnum
+    cmpl $2, %ecx               # VEC_TAG
+    je __rts_gc_scan_vector
+    cmpl $6, %ecx               # CLOSURE_TAG, scanned like a vector
+    je __rts_gc_scan_vector
+    sarl $2, %edi               # a string's bytes
+    jmp __rts_gc_scan_next
+
+__rts_gc_scan_pair:
+    movl 0(%esi), %eax
+    call __rts_forward
+    movl %eax, 0(%esi)
+    movl 4(%esi), %eax
+    call __rts_forward
+    movl %eax, 4(%esi)
+    addl $8, %esi
+    jmp __rts_gc_scan
+
+__rts_gc_scan_vector:
+    movl %edi, %ebp             # offset of the last element
+__rts_gc_scan_element:
+    testl %ebp, %ebp
+    jle __rts_gc_scan_next
+    movl 0(%esi,%ebp), %eax
+    call __rts_forward
+    movl %eax, 0(%esi,%ebp)
+    subl $4, %ebp
+    jmp __rts_gc_scan_element
+__rts_gc_scan_next:
+    addl $11, %edi              # 4 bytes of length, aligned to 8
+    andl $-8, %edi
+    addl %edi, %esi
+    jmp __rts_gc_scan
+
+__rts_gc_flip:
+    movl __rts_heap+12, %eax
+    movl __rts_heap+16, %ecx
+    movl %ecx, __rts_heap+12    # space
+    movl %eax, __rts_heap+16    # other
+    movl __rts_heap+28, %eax
+    movl %eax, __rts_heap       # free
+    addl __rts_heap+20, %ecx
+    movl %ecx, __rts_heap+4     # limit
+    subl %eax, %ecx
+    cmpl 32(%esp), %ecx
+    jb __rts_heap_exhausted
+    pop %ebp
+    pop %edi
+    pop %esi
+    pop %ebx
+    ret
+
+# Returns in %eax the new address of the object %eax points to, copying it
+# unless that was done already. Other words are returned unchanged. Keeps
+# %esi, %edi and %ebp.
+__rts_forward:
+    movl %eax, %ecx
+    andl $7, %ecx               # tag
+    movl $1, %edx
+    shll %cl, %edx
+    testl $78, %edx             # PAIR_TAG, VEC_TAG, STR_TAG or CLOSURE_TAG
+    jz __rts_forward_done
+    movl %eax, %edx
+    subl %ecx, %edx             # the object
+    cmpl __rts_heap+12, %edx
+    jb __rts_forward_done
+    cmpl __rts_heap, %edx
+    jae __rts_forward_done
+
+    movl 0(%edx), %ebx          # a copied object holds its new address
+    push %ecx
+    movl %ebx, %ecx
+    andl $7, %ecx
+    movl $1, %eax
+    shll %cl, %eax
+    pop %ecx
+    testl $78, %eax
+    jz __rts_forward_copy
+    movl %ebx, %eax
+    andl $-8, %eax
+    subl __rts_heap+16, %eax
+    cmpl __rts_heap+20, %eax
+    jae __rts_forward_copy
+    movl %ebx, %eax
+__rts_forward_done:
+    ret
+
+__rts_forward_copy:
+    movl $8, %ebx               # size of a pair
+    cmpl $1, %ecx
+    je __rts_forward_size
+    movl 0(%edx), %ebx
+    cmpl $3, %ecx               # STR_TAG, whose length counts bytes
+    jne __rts_forward_align
+    sarl $2, %ebx
+__rts_forward_align:
+    addl $11, %ebx
+    andl $-8, %ebx
+__rts_forward_size:
+    push %esi
+    push %edi
+    movl %edx, %esi
+    movl __rts_heap+28, %edi    # the copy
+    movl %edi, %eax             # record its tag
+    subl __rts_heap+16, %eax
+    shrl $3, %eax
+    addl __rts_heap+24, %eax
+    movb %cl, 0(%eax)
+    addl %ebx, __rts_heap+28
+    addl %edi, %ecx             # the new address
+    xorl %edx, %edx
+__rts_forward_word:
+    movl 0(%esi,%edx), %eax
+    movl %eax, 0(%edi,%edx)
+    addl $4, %edx
+    cmpl %ebx, %edx
+    jb __rts_forward_word
+    movl %ecx, 0(%esi)
+    movl %ecx, %eax
+    pop %edi
+    pop %esi
+    ret
+
+# ptr scheme_intern(ptr string)
+#
+# Returns the symbol named by the chars of string, making it unless there
+# is one already. Symbols are kept in a hash table of __RTS_SYMBOL_SLOTS
+# slots, seeded with the program's `scheme_symbol_table`, and those made
+# here are allocated after it. Both are reserved with `brk` on first use
+# and never grow.
+.globl scheme_intern
+scheme_intern:
+    push %ebx
+    push %esi
+    push %edi
+    push %ebp
+    call __rts_symbols_init
+    movl 20(%esp), %esi
+    movl -3(%esi), %ecx         # length, as a fixnum
+    sarl $2, %ecx
+    addl $1, %esi               # the chars
+    call __rts_symbol_find
+    testl %eax, %eax
+    jnz __rts_intern_done
+
+    movl __rts_symbols+8, %eax  # allocate the symbol
+    leal 11(%ecx), %edx         # 4 bytes of length, aligned to 8
+    andl $-8, %edx
+    addl %eax, %edx
+    cmpl __rts_symbols+12, %edx
+    ja __rts_symbols_exhausted
+    movl %edx, __rts_symbols+8
+    incl __rts_symbols+4
+    cmpl $32768, __rts_symbols+4   # half the slots
+    ja __rts_symbols_exhausted
+    movl %ecx, %edx
+    shll $2, %edx
+    movl %edx, 0(%eax)
+    leal 5(%eax), %edx          # SYM_TAG
+    movl %edx, 0(%edi)
+    leal 4(%eax), %edi
+    rep movsb
+    movl %edx, %eax
+__rts_intern_done:
+    pop %ebp
+    pop %edi
+    pop %esi
+    pop %ebx
+    ret
+
+__rts_symbols_exhausted:
+    movl $__rts_symbols_exhausted_message, %ecx
+    movl $24, %edx
+    jmp __rts_fail
+
+# Reserves the symbol table and the space for symbols after the heap, and
+# inserts the program's symbols, unless that was done already.
+__rts_symbols_init:
+    cmpl $0, __rts_symbols
+    jne __rts_symbols_ready
+    movl $45, %eax              # brk(0), the current break
+    xorl %ebx, %ebx
+    int $0x80
+    addl $7, %eax
+    andl $-8, %eax
+    movl %eax, %edi
+    leal 1310720(%edi), %ebx    # 65536 slots, then 1 MB of symbols
+    movl $45, %eax
+    int $0x80
+    cmpl %ebx, %eax
+    jb __rts_symbols_exhausted
+    movl %edi, __rts_symbols    # slots
+    addl $262144, %edi
+    movl %edi, __rts_symbols+8  # free
+    movl %ebx, __rts_symbols+12 # limit
+
+    movl $scheme_symbol_count, %eax
+    testl %eax, %eax
+    jz __rts_symbols_ready
+    movl scheme_symbol_count, %eax
+    movl %eax, __rts_symbols+4  # count
+    xorl %ebp, %ebp
+__rts_symbols_seed:
+    cmpl scheme_symbol_count, %ebp
+    jge __rts_symbols_ready
+    movl scheme_symbol_table(,%ebp,4), %esi
+    movl -5(%esi), %ecx
+    sarl $2, %ecx
+    subl $1, %esi
+    call __rts_symbol_find
+    movl scheme_symbol_table(,%ebp,4), %eax
+    movl %eax, 0(%edi)
+    incl %ebp
+    jmp __rts_symbols_seed
+__rts_symbols_ready:
+    ret
+
+# Looks up the %ecx chars at %esi. Returns the symbol of that name in %eax,
+# or 0 if there is none, and in %edi its slot, or the free slot it belongs
+# in. Keeps %ecx, %esi and %ebp.
+__rts_symbol_find:
+    push %ebp
+    movl $2166136261, %eax      # FNV-1a
+    xorl %edx, %edx
+__rts_hash_byte:
+    cmpl %ecx, %edx
+    jae __rts_hash_done
+    movzbl 0(%esi,%edx), %ebx
+    xorl %ebx, %eax
+    imull $16777619, %eax
+    incl %edx
+    jmp __rts_hash_byte
+__rts_hash_done:
+    movl %eax, %ebp
+__rts_probe:
+    andl $65535, %ebp
+    movl __rts_symbols, %edi
+    leal 0(%edi,%ebp,4), %edi
+    movl 0(%edi), %eax
+    testl %eax, %eax
+    jz __rts_probe_done
+    movl -5(%eax), %edx         # compare lengths, then chars
+    sarl $2, %edx
+    cmpl %ecx, %edx
+    jne __rts_probe_next
+    xorl %edx, %edx
+__rts_probe_char:
+    cmpl %ecx, %edx
+    jae __rts_probe_done
+    movb 0(%esi,%edx), %bl
+    cmpb -1(%eax,%edx), %bl
+    jne __rts_probe_next
+    incl %edx
+    jmp __rts_probe_char
+__rts_probe_next:
+    incl %ebp
+    jmp __rts_probe
+__rts_probe_done:
+    pop %ebp
+    ret
+
+# Writes %edx bytes at %ecx to stdout.
+__rts_write:
+    push %ebx
+    movl $4, %eax
+    movl $1, %ebx
+    int $0x80
+    pop %ebx
+    ret
+
+# Prints the value in %eax followed by a newline.
+scheme_show:
+    call __rts_show_value
+    movl $__rts_newline, %ecx
+    movl $1, %edx
+    jmp __rts_write
+
+# Prints the value in %eax. Keeps %ebx, %esi, %edi and %ebp.
+__rts_show_value:
+    movl %eax, %ecx
+    andl $7, %ecx
+    cmpl $6, %ecx               # CLOSURE_TAG
+    je __rts_show_procedure
+    cmpl $5, %ecx               # SYM_TAG
+    je __rts_show_symbol
+    decl %ecx                   # 0 for pairs, 1 for vectors, 2 for strings
+    cmpl $2, %ecx
+    ja __rts_show_atom
+    movl %eax, %edx
+    andl $-8, %edx
+    cmpl __rts_heap+12, %edx    # only follow pointers into the heap
+    jb __rts_show_atom
+    cmpl __rts_heap, %edx
+    jae __rts_show_atom
+    push %esi
+    push %edi
+    movl %edx, %esi
+    cmpl $1, %ecx
+    je __rts_show_vector
+    ja __rts_show_string
+
+    movl $__rts_open, %ecx
+    movl $1, %edx
+    call __rts_write
+__rts_show_pair:
+    movl 0(%esi), %eax
+    call __rts_show_value
+    movl 4(%esi), %eax          # continue with the cdr if it's a pair
+    movl %eax, %ecx
+    andl $7, %ecx
+    cmpl $1, %ecx
+    jne __rts_show_dotted
+    movl %eax, %edx
+    andl $-8, %edx
+    cmpl __rts_heap+12, %edx
+    jb __rts_show_dotted
+    cmpl __rts_heap, %edx
+    jae __rts_show_dotted
+    movl %edx, %esi
+    movl $__rts_dot, %ecx       # " "
+    movl $1, %edx
+    call __rts_write
+    jmp __rts_show_pair
+__rts_show_dotted:
+    push %eax
+    movl $__rts_dot, %ecx       # " . "
+    movl $3, %edx
+    call __rts_write
+    pop %eax
+    call __rts_show_value
+    jmp __rts_show_close
+
+__rts_show_vector:
+    movl $__rts_vector_open, %ecx
+    movl $2, %edx
+    call __rts_write
+    movl 0(%esi), %edi          # address of the last element
+    addl %esi, %edi
+    addl $4, %esi
+__rts_show_element:
+    cmpl %edi, %esi
+    ja __rts_show_close
+    movl 0(%esi), %eax
+    call __rts_show_value
+    cmpl %edi, %esi
+    jae __rts_show_next
+    movl $__rts_dot, %ecx       # " "
+    movl $1, %edx
+    call __rts_write
+__rts_show_next:
+    addl $4, %esi
+    jmp __rts_show_element
+
+__rts_show_string:
+    movl $__rts_quote, %ecx
+    movl $1, %edx
+    call __rts_write
+    movl 0(%esi), %edi          # end of the chars
+    sarl $2, %edi
+    addl $4, %esi
+    addl %esi, %edi
+__rts_show_char_of_string:
+    cmpl %edi, %esi
+    jae __rts_show_string_end
+    movzbl 0(%esi), %eax
+    cmpl $34, %eax              # '"'
+    je __rts_show_escape
+    cmpl $92, %eax              # '\\'
+    jne __rts_show_plain
+__rts_show_escape:
+    movl $__rts_backslash, %ecx
+    movl $1, %edx
+    call __rts_write
+__rts_show_plain:
+    movl %esi, %ecx
+    movl $1, %edx
+    call __rts_write
+    incl %esi
+    jmp __rts_show_char_of_string
+__rts_show_string_end:
+    movl $__rts_quote, %ecx
+    movl $1, %edx
+    call __rts_write
+    pop %edi
+    pop %esi
+    ret
+
+__rts_show_close:
+    movl $__rts_close, %ecx
+    movl $1, %edx
+    call __rts_write
+    pop %edi
+    pop %esi
+    ret
+
+__rts_show_procedure:
+    andl $-8, %eax
+    cmpl __rts_heap+12, %eax
+    jb __rts_show_nothing
+    cmpl __rts_heap, %eax
+    jae __rts_show_nothing
+    movl $__rts_procedure, %ecx
+    movl $12, %edx
+    jmp __rts_write
+__rts_show_nothing:
+    ret
+
+__rts_show_symbol:
+    andl $-8, %eax
+    movl $scheme_symbol_count, %ecx
+    testl %ecx, %ecx
+    jz __rts_show_made_symbol
+    movl scheme_symbol_table, %ecx  # the program's symbols come first
+    andl $-8, %ecx
+    cmpl %ecx, %eax
+    jb __rts_show_made_symbol
+    cmpl $scheme_symbol_table, %eax
+    jb __rts_show_name
+__rts_show_made_symbol:
+    movl __rts_symbols, %ecx
+    testl %ecx, %ecx
+    jz __rts_show_nothing
+    addl $262144, %ecx          # past the slots
+    cmpl %ecx, %eax
+    jb __rts_show_nothing
+    cmpl __rts_symbols+8, %eax
+    jae __rts_show_nothing
+__rts_show_name:
+    movl 0(%eax), %edx
+    sarl $2, %edx
+    leal 4(%eax), %ecx
+    jmp __rts_write
+
+# Prints an immediate value; words of no type print nothing.
+__rts_show_atom:
+    push %ebx
+    push %esi
+    push %edi
+    subl $32, %esp
+    leal 32(%esp), %edi         # the text is built backwards from here
+
+    movl %eax, %ecx
+    andl $3, %ecx               # FIXNUM_MASK
+    jz __rts_show_fixnum
+    movl %eax, %ecx
+    andl $255, %ecx
+    cmpl $7, %ecx               # CHAR_TAG
+    je __rts_show_char
+    cmpl $15, %ecx              # BOOL_TAG
+    je __rts_show_bool
+    jmp __rts_show_write
+
+__rts_show_fixnum:
+    sarl $2, %eax
+    movl %eax, %esi             # remember the sign
+    testl %eax, %eax
+    jns __rts_show_digits
+    negl %eax
+__rts_show_digits:
+    movl $10, %ecx
+__rts_show_digit:
+    xorl %edx, %edx
+    divl %ecx
+    addl $48, %edx
+    decl %edi
+    movb %dl, 0(%edi)
+    testl %eax, %eax
+    jnz __rts_show_digit
+    testl %esi, %esi
+    jns __rts_show_write
+    decl %edi
+    movb $45, 0(%edi)           # '-'
+    jmp __rts_show_write
+
+__rts_show_char:
+    shrl $8, %eax
+    decl %edi
+    movb %al, 0(%edi)
+    decl %edi
+    movb $92, 0(%edi)           # '\\'
+    decl %edi
+    movb $35, 0(%edi)           # '#'
+    jmp __rts_show_write
+
+__rts_show_bool:
+    shrl $8, %eax
+    movb $102, %cl              # 'f'
+    testl %eax, %eax
+    jz __rts_show_bool_char
+    movb $116, %cl              # 't'
+__rts_show_bool_char:
+    decl %edi
+    movb %cl, 0(%edi)
+    decl %edi
+    movb $35, 0(%edi)           # '#'
+
+__rts_show_write:
+    movl $4, %eax               # write(1, %edi, length)
+    movl $1, %ebx
+    movl %edi, %ecx
+    leal 32(%esp), %edx
+    subl %edi, %edx
+    int $0x80
+    addl $32, %esp
+    pop %edi
+    pop %esi
+    pop %ebx
+    ret
+
+.data
+__rts_bad_index_message:
+.ascii "no program with index\n"
+__rts_type_error_message:
+.ascii "error: wrong type of argument\n"
+__rts_range_error_message:
+.ascii "error: index out of range\n"
+__rts_arity_error_message:
+.ascii "error: wrong number of arguments\n"
+__rts_heap_exhausted_message:
+.ascii "error: heap exhausted\n"
+__rts_symbols_exhausted_message:
+.ascii "error: too many symbols\n"
+__rts_heap_size_name:
+.asciz "PASQUIM_HEAP_SIZE="
+__rts_newline:
+.ascii "\n"
+__rts_open:
+.ascii "("
+__rts_close:
+.ascii ")"
+__rts_dot:
+.ascii " . "
+__rts_vector_open:
+.byte 35, 40                    # "#("
+__rts_quote:
+.ascii "\""
+__rts_backslash:
+.ascii "\\"
+__rts_procedure:
+.byte 35                        # "#"
+.ascii "<procedure>"
+
+# The heap's free pointer and limit, read and updated by compiled code, and
+# the stack pointer of the running entry, followed by the start of the
+# space allocated from, the other semispace, the size of each, the tag map
+# of the other semispace and, while collecting, the next free byte there.
+.p2align 2
+__rts_heap:
+.long 0, 0, 0, 0, 0, 0, 0, 0
+
+# The slots of the symbol table, the number of symbols, and the next free
+# byte and end of the space symbols are made in.
+__rts_symbols:
+.long 0, 0, 0, 0
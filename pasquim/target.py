@@ -0,0 +1,124 @@
+from typing import Dict, Optional, Tuple
+import ctypes
+import platform
+
+
+class Target:
+    """Describes a machine that Scheme programs can be compiled to.
+
+    Holds the size of a machine word, the fixnum tagging scheme that follows
+    from it, and the registers and mnemonics code generation uses.
+
+    Args:
+        name (str): Name used to select the target.
+        wordsize (int): Number of bytes in a machine word.
+        fixnum_shift (int): Number of tag bits below a fixnum's value.
+        registers (Dict[str, str]): Register names by role: `ax` holds the
+            result of every expression, `al` is its lowest byte, `sp` is
+            the stack pointer and `hp` the heap pointer, reserved for the
+            address of the next free heap word, while `ctx` holds the
+            address of the heap's context. `cx`, `si` and `di` are the
+            count, source and destination of string instructions, and `dx`
+            receives the high half of the time stamp counter.
+        callee_saved (Tuple[str, ...]): Registers `scheme_entry` preserves
+            for its caller.
+        scratch (Tuple[str, ...]): Registers the register allocator may
+            hand out for temporaries, in order of preference.
+        c_args (Tuple[str, ...]): Registers taking the arguments of C
+            functions, in order; empty when they are pushed on the stack.
+        gcc_flags (Tuple[str, ...]): Flags gcc needs to build for target.
+        bignum_tag (int, optional): Pointer tag of bignums, when the tag
+            bits leave one for them, which exact integers need.
+    """
+    def __init__(self, name: str, wordsize: int, fixnum_shift: int,
+                 registers: Dict[str, str], callee_saved: Tuple[str, ...],
+                 scratch: Tuple[str, ...], c_args: Tuple[str, ...],
+                 gcc_flags: Tuple[str, ...],
+                 bignum_tag: Optional[int] = None) -> None:
+        self.name = name
+        self.wordsize = wordsize
+        self.bits = wordsize * 8
+        self.fixnum_shift = fixnum_shift
+        self.fixnum_mask = (1 << fixnum_shift) - 1
+        self.fixnum_bits = self.bits - fixnum_shift
+        self.fixnum_min = -2 ** (self.fixnum_bits - 1)
+        self.fixnum_max = 2 ** (self.fixnum_bits - 1) - 1
+        self.suffix = "l" if wordsize == 4 else "q"
+        self.word_directive = ".long" if wordsize == 4 else ".quad"
+
+        self.ax = registers["ax"]
+        self.al = registers["al"]
+        self.sp = registers["sp"]
+        self.hp = registers["hp"]
+        self.ctx = registers["ctx"]
+        self.cx = registers["cx"]
+        self.si = registers["si"]
+        self.di = registers["di"]
+        self.dx = registers["dx"]
+        self.callee_saved = callee_saved
+        self.scratch = scratch
+        self.c_args = c_args
+        self.gcc_flags = gcc_flags
+        self.bignum_tag = bignum_tag
+
+    def fits_imm32(self, value: int) -> bool:
+        """Checks if value can be an immediate operand of most instructions.
+
+        32-bit targets accept any 32-bit pattern, while x86-64 sign extends
+        32-bit immediates to the full word.
+        """
+        if self.wordsize == 4:
+            return -2 ** 31 <= value < 2 ** 32
+        return -2 ** 31 <= value < 2 ** 31
+
+    def address(self, symbol: str) -> str:
+        """Memory operand addressing symbol, for `lea`.
+
+        On x86-64 it's relative to `%rip`, so code stays position
+        independent.
+        """
+        return f"{symbol}(%rip)" if self.wordsize == 8 else symbol
+
+    def __repr__(self) -> str:
+        return f"Target({self.name!r})"
+
+
+X86 = Target(
+    "x86", wordsize=4, fixnum_shift=2,
+    registers={"ax": "%eax", "al": "%al", "sp": "%esp", "hp": "%ebp",
+               "ctx": "%ebx", "cx": "%ecx", "si": "%esi", "di": "%edi",
+               "dx": "%edx"},
+    callee_saved=("%esi", "%edi", "%edx", "%ebp", "%ebx"),
+    scratch=("%ecx", "%edx", "%esi", "%edi"),
+    c_args=(),
+    gcc_flags=("-fomit-frame-pointer", "-m32"))
+
+X86_64 = Target(
+    "x86_64", wordsize=8, fixnum_shift=3,
+    registers={"ax": "%rax", "al": "%al", "sp": "%rsp", "hp": "%r12",
+               "ctx": "%r13", "cx": "%rcx", "si": "%rsi", "di": "%rdi",
+               "dx": "%rdx"},
+    callee_saved=("%rbx", "%rbp", "%r12", "%r13", "%r14", "%r15"),
+    scratch=("%rcx", "%rdx", "%rsi", "%rdi", "%r8", "%r9", "%r10", "%r11"),
+    c_args=("%rdi", "%rsi", "%rdx", "%rcx", "%r8", "%r9"),
+    gcc_flags=("-fomit-frame-pointer",), bignum_tag=4)
+
+TARGETS = {target.name: target for target in (X86, X86_64)}
+
+
+def get_target(name: str) -> Target:
+    """Looks up a target by name."""
+    try:
+        return TARGETS[name]
+    except KeyError:
+        raise ValueError(f"Unknown target {name}, expected one of "
+                         f"{', '.join(TARGETS)}.") from None
+
+
+def host_target() -> Optional[Target]:
+    """Returns the target matching the running Python interpreter, if any."""
+    if platform.machine().lower() not in ("x86_64", "amd64", "i386", "i486",
+                                          "i586", "i686", "x86"):
+        return None
+    wordsize = ctypes.sizeof(ctypes.c_void_p)
+    return X86_64 if wordsize == X86_64.wordsize else X86
@@ -0,0 +1,554 @@
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
+import re
+
+
+"""
+A small x86 assembler for the AT&T syntax emitted by the compiler.
+
+It understands the instructions used by `primitives.py` and the built-in
+runtime, plus the few directives the compiler writes, and picks the same
+encodings as the GNU assembler where a choice exists (other than always
+using 32-bit displacements for jumps and calls), so its output can be
+cross-checked against `as`.
+"""
+
+
+class AssemblerError(Exception):
+    """Raised for instructions or operands the assembler can't encode."""
+
+
+REGISTERS = {
+    32: ["eax", "ecx", "edx", "ebx", "esp", "ebp", "esi", "edi"],
+    8: ["al", "cl", "dl", "bl", "ah", "ch", "dh", "bh"],
+}
+REGISTER_NUMBERS = {name: (num, size)
+                    for size, names in REGISTERS.items()
+                    for num, name in enumerate(names)}
+
+CONDITION_CODES = {
+    "o": 0, "no": 1, "b": 2, "c": 2, "nae": 2, "ae": 3, "nb": 3, "nc": 3,
+    "e": 4, "z": 4, "ne": 5, "nz": 5, "be": 6, "na": 6, "a": 7, "nbe": 7,
+    "s": 8, "ns": 9, "p": 10, "pe": 10, "np": 11, "po": 11,
+    "l": 12, "nge": 12, "ge": 13, "nl": 13, "le": 14, "ng": 14,
+    "g": 15, "nle": 15
+}
+
+# two-operand arithmetic, by the /digit used in their ModRM byte
+ALU_OPS = {"add": 0, "or": 1, "adc": 2, "sbb": 3,
+           "and": 4, "sub": 5, "xor": 6, "cmp": 7}
+SHIFT_OPS = {"rol": 0, "ror": 1, "shl": 4, "sal": 4, "shr": 5, "sar": 7}
+UNARY_OPS = {"not": 2, "neg": 3, "mul": 4, "div": 6, "idiv": 7}
+NO_OPERANDS = {"ret": b"\xc3", "cdq": b"\x99", "cltd": b"\x99",
+               "nop": b"\x90", "hlt": b"\xf4", "rdtsc": b"\x0f\x31",
+               "cld": b"\xfc", "std": b"\xfd",
+               "movsb": b"\xa4", "movsl": b"\xa5", "cmpsb": b"\xa6",
+               "cmpsl": b"\xa7", "stosb": b"\xaa", "stosl": b"\xab"}
+# prefixes repeating the string instruction that follows them
+PREFIXES = {"rep": 0xf3, "repe": 0xf3, "repz": 0xf3,
+            "repne": 0xf2, "repnz": 0xf2}
+
+
+class Reg(NamedTuple):
+    num: int
+    size: int
+
+
+class Imm(NamedTuple):
+    value: int
+    symbol: Optional[str] = None
+
+
+class Mem(NamedTuple):
+    disp: int = 0
+    base: Optional[int] = None
+    index: Optional[int] = None
+    scale: int = 1
+    symbol: Optional[str] = None
+
+
+class Label(NamedTuple):
+    """A branch target, or an indirect one when `target` is an operand."""
+    symbol: Optional[str] = None
+    target: Union[Reg, Mem, None] = None
+
+
+Operand = Union[Reg, Imm, Mem, Label]
+
+
+class Fixup(NamedTuple):
+    section: str
+    offset: int
+    symbol: str
+    relative: bool  # pc-relative to the end of the 4-byte field
+    addend: int = 0
+
+
+MEM_RE = re.compile(r"^(?P<disp>[^(]*)\((?P<base>%\w+)?"
+                    r"(?:,(?P<index>%\w+)(?:,(?P<scale>\d))?)?\)$")
+
+
+def _number(text: str) -> int:
+    return int(text, 0)
+
+
+def _disp(text: str) -> Tuple[int, Optional[str]]:
+    """Parses a displacement, which may be a number or symbol[+-number]."""
+    text = text.strip()
+    if not text:
+        return 0, None
+    match = re.match(r"^([A-Za-z_.$][\w.$]*)\s*(?:([+-])\s*(\w+))?$", text)
+    if match:
+        symbol, sign, addend = match.groups()
+        offset = _number(addend) * (-1 if sign == "-" else 1) if sign else 0
+        return offset, symbol
+    return _number(text), None
+
+
+def _register(text: str) -> Reg:
+    try:
+        return Reg(*REGISTER_NUMBERS[text.lstrip("%")])
+    except KeyError:
+        raise AssemblerError(f"unknown register {text}")
+
+
+def parse_operand(text: str) -> Operand:
+    """Parses a single AT&T operand."""
+    text = text.strip()
+    if text.startswith("*"):
+        target = parse_operand(text[1:])
+        if isinstance(target, Label):
+            target = Mem(0, symbol=target.symbol)
+        return Label(target=target)
+    if text.startswith("$"):
+        value, symbol = _disp(text[1:])
+        return Imm(value, symbol)
+    if text.startswith("%"):
+        return _register(text)
+
+    match = MEM_RE.match(text.replace(" ", ""))
+    if match:
+        disp, symbol = _disp(match.group("disp"))
+        base = match.group("base")
+        index = match.group("index")
+        return Mem(disp,
+                   _register(base).num if base else None,
+                   _register(index).num if index else None,
+                   int(match.group("scale") or 1),
+                   symbol)
+    disp, symbol = _disp(text)
+    if symbol is not None and disp == 0:
+        return Label(symbol)
+    return Mem(disp, symbol=symbol)
+
+
+def split_operands(text: str) -> List[str]:
+    """Splits an operand list on commas outside of parentheses."""
+    operands, depth, current = [], 0, ""
+    for char in text:
+        if char == "," and depth == 0:
+            operands.append(current)
+            current = ""
+            continue
+        depth += (char == "(") - (char == ")")
+        current += char
+    if current.strip():
+        operands.append(current)
+    return operands
+
+
+def _fits_int8(value: int) -> bool:
+    return -128 <= value <= 127
+
+
+def _imm32(value: int) -> bytes:
+    # like `as`, silently keep the low 32 bits of larger values
+    return (value & 0xffffffff).to_bytes(4, "little")
+
+
+class Assembler:
+    """Assembles AT&T syntax x86 code into sections of machine code.
+
+    Lines are fed in order with `feed`; labels may be used before they are
+    defined. References to symbols are recorded as `Fixup`s, which are
+    resolved once section addresses are known by `link`.
+    """
+    def __init__(self) -> None:
+        self.sections: Dict[str, bytearray] = {".text": bytearray(),
+                                               ".data": bytearray()}
+        self.section = ".text"
+        self.symbols: Dict[str, Tuple[str, int]] = {}
+        self.weak: set = set()
+        self.fixups: List[Fixup] = []
+
+    @property
+    def code(self) -> bytearray:
+        return self.sections[self.section]
+
+    def feed(self, lines: Iterable[str]) -> None:
+        """Assembles each line of assembly text."""
+        for line in lines:
+            self.assemble_line(line)
+
+    def assemble_line(self, line: str) -> None:
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            return
+        if line.endswith(":"):
+            label = line[:-1]
+            if label in self.symbols:
+                raise AssemblerError(f"symbol {label} is already defined")
+            self.symbols[label] = (self.section, len(self.code))
+            return
+
+        mnemonic, _, rest = line.partition(" ")
+        if mnemonic in PREFIXES:
+            self.code.append(PREFIXES[mnemonic])
+            mnemonic, _, rest = rest.strip().partition(" ")
+        if mnemonic.startswith("."):
+            self.directive(mnemonic, rest.strip())
+        else:
+            operands = [parse_operand(op) for op in split_operands(rest)]
+            try:
+                self.instruction(mnemonic, operands)
+            except AssemblerError as e:
+                raise AssemblerError(f"{e} in `{line}`") from None
+
+    # directives
+    def directive(self, name: str, args: str) -> None:
+        if name in (".text", ".data"):
+            self.section = name
+        elif name == ".section":
+            self.section = args.split(",")[0].strip()
+            self.sections.setdefault(self.section, bytearray())
+        elif name == ".globl":
+            pass  # everything is linked into a single executable
+        elif name == ".weak":
+            self.weak.add(args)
+        elif name in (".p2align", ".balign"):
+            align = _number(split_operands(args)[0])
+            align = 1 << align if name == ".p2align" else align
+            fill = b"\x90" if self.section == ".text" else b"\x00"
+            self.code.extend(fill * (-len(self.code) % align))
+        elif name == ".long":
+            for value in split_operands(args):
+                offset, symbol = _disp(value)
+                if symbol:
+                    self.fixups.append(Fixup(self.section, len(self.code),
+                                             symbol, False, offset))
+                self.code.extend(_imm32(offset))
+        elif name == ".byte":
+            for value in split_operands(args):
+                self.code.append(_number(value) & 0xff)
+        elif name == ".zero":
+            self.code.extend(bytes(_number(args)))
+        elif name in (".ascii", ".asciz"):
+            text = args.strip()[1:-1].encode().decode("unicode_escape")
+            self.code.extend(text.encode("latin-1"))
+            if name == ".asciz":
+                self.code.append(0)
+        else:
+            raise AssemblerError(f"unsupported directive {name}")
+
+    # encoding helpers
+    def _emit(self, *parts: bytes) -> None:
+        for part in parts:
+            self.code.extend(part)
+
+    def _modrm(self, reg: int, rm: Union[Reg, Mem]) -> None:
+        """Emits the ModRM byte, plus SIB and displacement, for rm."""
+        if isinstance(rm, Reg):
+            self.code.append(0xc0 | reg << 3 | rm.num)
+            return
+
+        if rm.base is None and rm.index is None:
+            # absolute address
+            self.code.append(0x05 | reg << 3)
+            self._disp32(rm)
+            return
+
+        if rm.symbol is not None or rm.base is None:
+            mod = 2
+        elif rm.disp == 0 and rm.base != 5:
+            mod = 0
+        elif _fits_int8(rm.disp):
+            mod = 1
+        else:
+            mod = 2
+
+        if rm.index is None and rm.base != 4:
+            self.code.append(mod << 6 | reg << 3 | rm.base)
+        else:
+            index = 4 if rm.index is None else rm.index
+            if index == 4 and rm.index is not None:
+                raise AssemblerError("%esp can't be used as an index")
+            scale = {1: 0, 2: 1, 4: 2, 8: 3}[rm.scale]
+            if rm.base is None:
+                # index without a base always takes a 32-bit displacement
+                self.code.append(0x04 | reg << 3)
+                self.code.append(scale << 6 | index << 3 | 5)
+                self._disp32(rm)
+                return
+            self.code.append(mod << 6 | reg << 3 | 4)
+            self.code.append(scale << 6 | index << 3 | rm.base)
+
+        if mod == 1:
+            self.code.append(rm.disp & 0xff)
+        elif mod == 2:
+            self._disp32(rm)
+
+    def _disp32(self, op: Union[Mem, Imm]) -> None:
+        value = op.value if isinstance(op, Imm) else op.disp
+        if op.symbol is not None:
+            self.fixups.append(Fixup(self.section, len(self.code),
+                                     op.symbol, False, value))
+            value = 0
+        self.code.extend(_imm32(value))
+
+    def _rel32(self, symbol: str) -> None:
+        self.fixups.append(Fixup(self.section, len(self.code), symbol, True))
+        self.code.extend(bytes(4))
+
+    @staticmethod
+    def _split_mnemonic(mnemonic: str) -> Tuple[str, Optional[int]]:
+        """Separates an operand size suffix from the mnemonic."""
+        stem, suffix = mnemonic[:-1], mnemonic[-1:]
+        if suffix in ("l", "b") and (
+                stem in ALU_OPS or stem in SHIFT_OPS or stem in UNARY_OPS or
+                stem in ("mov", "push", "pop", "imul", "test", "lea",
+                         "inc", "dec", "call", "jmp", "xchg")):
+            return stem, 32 if suffix == "l" else 8
+        return mnemonic, None
+
+    @staticmethod
+    def _size(size: Optional[int], operands: List[Operand]) -> int:
+        for op in operands:
+            if isinstance(op, Reg):
+                if size is not None and size != op.size:
+                    raise AssemblerError("operand size mismatch")
+                return op.size
+        return size or 32
+
+    def instruction(self, mnemonic: str, ops: List[Operand]) -> None:
+        name, suffix = self._split_mnemonic(mnemonic)
+        if name not in ("jmp", "call") and not (
+                name[0] == "j" and name[1:] in CONDITION_CODES):
+            # outside of branches, a bare symbol is a memory operand
+            ops = [Mem(0, symbol=op.symbol)
+                   if isinstance(op, Label) and op.target is None else op
+                   for op in ops]
+        # the count of a shift may be %cl, whatever the operand size
+        size = self._size(suffix, ops[-1:] if name in SHIFT_OPS else ops)
+        wide = size != 8  # selects the 32-bit form of byte/dword opcodes
+
+        if name in NO_OPERANDS and not ops:
+            self._emit(NO_OPERANDS[name])
+
+        elif name == "mov" and len(ops) == 2:
+            src, dst = ops
+            if isinstance(src, Imm) and isinstance(dst, Reg):
+                self.code.append((0xb8 if wide else 0xb0) | dst.num)
+                if wide:
+                    self._disp32(src)
+                else:
+                    self.code.append(src.value & 0xff)
+            elif isinstance(src, Imm):
+                self._emit(b"\xc7" if wide else b"\xc6")
+                self._modrm(0, dst)
+                if wide:
+                    self._disp32(src)
+                else:
+                    self.code.append(src.value & 0xff)
+            elif isinstance(src, Reg):
+                self._emit(b"\x89" if wide else b"\x88")
+                self._modrm(src.num, dst)
+            elif isinstance(dst, Reg):
+                self._emit(b"\x8b" if wide else b"\x8a")
+                self._modrm(dst.num, src)
+            else:
+                raise AssemblerError("invalid operands for mov")
+
+        elif name in ALU_OPS and len(ops) == 2:
+            op = ALU_OPS[name]
+            src, dst = ops
+            if isinstance(src, Imm):
+                if not wide:
+                    if dst == Reg(0, 8):
+                        self.code.append(op << 3 | 4)
+                    else:
+                        self._emit(b"\x80")
+                        self._modrm(op, dst)
+                    self.code.append(src.value & 0xff)
+                elif src.symbol is None and _fits_int8(src.value):
+                    self._emit(b"\x83")
+                    self._modrm(op, dst)
+                    self.code.append(src.value & 0xff)
+                elif dst == Reg(0, 32):
+                    self.code.append(op << 3 | 5)
+                    self._disp32(src)
+                else:
+                    self._emit(b"\x81")
+                    self._modrm(op, dst)
+                    self._disp32(src)
+            elif isinstance(src, Reg):
+                self.code.append(op << 3 | (1 if wide else 0))
+                self._modrm(src.num, dst)
+            elif isinstance(dst, Reg):
+                self.code.append(op << 3 | (3 if wide else 2))
+                self._modrm(dst.num, src)
+            else:
+                raise AssemblerError(f"invalid operands for {name}")
+
+        elif name == "test" and len(ops) == 2:
+            src, dst = ops
+            if isinstance(src, Imm):
+                if dst == Reg(0, size):
+                    self.code.append(0xa9 if wide else 0xa8)
+                else:
+                    self._emit(b"\xf7" if wide else b"\xf6")
+                    self._modrm(0, dst)
+                if wide:
+                    self._disp32(src)
+                else:
+                    self.code.append(src.value & 0xff)
+            elif isinstance(src, Reg):
+                self._emit(b"\x85" if wide else b"\x84")
+                self._modrm(src.num, dst)
+            else:
+                raise AssemblerError("invalid operands for test")
+
+        elif name in SHIFT_OPS and len(ops) in (1, 2):
+            op = SHIFT_OPS[name]
+            count, dst = ops if len(ops) == 2 else (Imm(1), ops[0])
+            if count == Reg(1, 8):
+                self._emit(b"\xd3" if wide else b"\xd2")
+                self._modrm(op, dst)
+            elif isinstance(count, Imm) and count.value == 1:
+                self._emit(b"\xd1" if wide else b"\xd0")
+                self._modrm(op, dst)
+            elif isinstance(count, Imm):
+                self._emit(b"\xc1" if wide else b"\xc0")
+                self._modrm(op, dst)
+                self.code.append(count.value & 0xff)
+            else:
+                raise AssemblerError(f"invalid shift count for {name}")
+
+        elif name in UNARY_OPS and len(ops) == 1:
+            self._emit(b"\xf7" if wide else b"\xf6")
+            self._modrm(UNARY_OPS[name], ops[0])
+
+        elif name in ("inc", "dec") and len(ops) == 1:
+            if wide and isinstance(ops[0], Reg):
+                self.code.append((0x40 if name == "inc" else 0x48)
+                                 | ops[0].num)
+            else:
+                self._emit(b"\xff" if wide else b"\xfe")
+                self._modrm(0 if name == "inc" else 1, ops[0])
+
+        elif name == "imul" and len(ops) in (2, 3):
+            if isinstance(ops[0], Imm):
+                imm, src = ops[0], ops[1]
+                dst = ops[2] if len(ops) == 3 else ops[1]
+                if _fits_int8(imm.value):
+                    self._emit(b"\x6b")
+                    self._modrm(dst.num, src)
+                    self.code.append(imm.value & 0xff)
+                else:
+                    self._emit(b"\x69")
+                    self._modrm(dst.num, src)
+                    self._disp32(imm)
+            else:
+                src, dst = ops
+                self._emit(b"\x0f\xaf")
+                self._modrm(dst.num, src)
+
+        elif name == "lea" and len(ops) == 2:
+            src, dst = ops
+            self._emit(b"\x8d")
+            self._modrm(dst.num, src)
+
+        elif name in ("movzbl", "movsbl") and len(ops) == 2:
+            self._emit(b"\x0f\xb6" if name == "movzbl" else b"\x0f\xbe")
+            self._modrm(ops[1].num, ops[0])
+
+        elif name == "xchg" and len(ops) == 2:
+            first, second = ops
+            if Reg(0, 32) in ops and isinstance(first, Reg) and \
+                    isinstance(second, Reg):
+                self.code.append(0x90 | (first.num or second.num))
+            else:
+                self._emit(b"\x87")
+                self._modrm(first.num, second)
+
+        elif name == "push" and len(ops) == 1:
+            op = ops[0]
+            if isinstance(op, Reg):
+                self.code.append(0x50 | op.num)
+            elif isinstance(op, Imm):
+                if op.symbol is None and _fits_int8(op.value):
+                    self._emit(b"\x6a", bytes([op.value & 0xff]))
+                else:
+                    self._emit(b"\x68")
+                    self._disp32(op)
+            else:
+                self._emit(b"\xff")
+                self._modrm(6, op)
+
+        elif name == "pop" and len(ops) == 1:
+            if isinstance(ops[0], Reg):
+                self.code.append(0x58 | ops[0].num)
+            else:
+                self._emit(b"\x8f")
+                self._modrm(0, ops[0])
+
+        elif name in ("jmp", "call") and len(ops) == 1:
+            target = ops[0]
+            if not isinstance(target, Label):
+                raise AssemblerError(f"invalid target for {name}")
+            if target.target is not None:
+                self._emit(b"\xff")
+                self._modrm(4 if name == "jmp" else 2, target.target)
+            else:
+                self._emit(b"\xe9" if name == "jmp" else b"\xe8")
+                self._rel32(target.symbol)
+
+        elif name.startswith("j") and name[1:] in CONDITION_CODES:
+            if len(ops) != 1 or not isinstance(ops[0], Label):
+                raise AssemblerError(f"invalid target for {name}")
+            self._emit(bytes([0x0f, 0x80 | CONDITION_CODES[name[1:]]]))
+            self._rel32(ops[0].symbol)
+
+        elif name.startswith("set") and name[3:] in CONDITION_CODES:
+            self._emit(bytes([0x0f, 0x90 | CONDITION_CODES[name[3:]]]))
+            self._modrm(0, ops[0])
+
+        elif name.startswith("cmov") and name[4:] in CONDITION_CODES:
+            self._emit(bytes([0x0f, 0x40 | CONDITION_CODES[name[4:]]]))
+            self._modrm(ops[1].num, ops[0])
+
+        elif name == "int" and len(ops) == 1:
+            self._emit(b"\xcd", bytes([ops[0].value & 0xff]))
+
+        else:
+            raise AssemblerError(f"unsupported instruction {mnemonic}")
+
+    def link(self, addresses: Dict[str, int]) -> Dict[str, int]:
+        """Resolves every fixup, given the load address of each section.
+
+        Returns:
+            The absolute address of every symbol.
+        """
+        symbols = {name: addresses[section] + offset
+                   for name, (section, offset) in self.symbols.items()}
+        for name in self.weak:
+            symbols.setdefault(name, 0)
+
+        for fixup in self.fixups:
+            if fixup.symbol not in symbols:
+                raise AssemblerError(f"undefined symbol {fixup.symbol}")
+            value = symbols[fixup.symbol] + fixup.addend
+            if fixup.relative:
+                value -= addresses[fixup.section] + fixup.offset + 4
+            self.sections[fixup.section][fixup.offset:fixup.offset + 4] = \
+                _imm32(value & 0xffffffff)
+
+        return symbols
@@ -0,0 +1,31 @@
+import os
+from subprocess import run, PIPE
+
+from pasquim.compiler import Compiler
+from tests.environment import BACKEND, TARGET
+
+"""
+Running programs compiled with the backend and target of the tests.
+"""
+
+TEMP_FOLDER = "tmp"
+
+
+def outputs(path, programs, env=None, **options):
+    """Compiles programs into a single binary, in the work directory path
+    under `TEMP_FOLDER`, and returns what running it prints, one line per
+    program.
+
+    Args:
+        path (str): Work directory, named after what the test compiles so
+            that no two tests share one.
+        programs (List[str]): Scheme programs to be compiled.
+        env (Dict[str, str], optional): Variables added to the environment
+            the binary runs in.
+        **options: Keyword arguments for the `Compiler`.
+    """
+    path = os.path.join(TEMP_FOLDER, path, "")
+    Compiler(path, backend=BACKEND, target=TARGET,
+             **options).compile_many(programs)
+    return run(path + "a.out", stdout=PIPE,
+               env={**os.environ, **(env or {})}).stdout
@@ -0,0 +1,12 @@
+import os
+
+
+"""
+Build settings the tests compile programs with, taken from the environment.
+
+`PASQUIM_BACKEND` picks the backend ("gcc" or "builtin") and
+`PASQUIM_TARGET` the target ("x86" or "x86_64").
+"""
+
+BACKEND = os.environ.get("PASQUIM_BACKEND", "gcc")
+TARGET = os.environ.get("PASQUIM_TARGET", "x86")
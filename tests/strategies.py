@@ -0,0 +1,60 @@
+from hypothesis import strategies as st
+
+
+FIXNUM_RANGE = [-2 ** 29, 2 ** 29 - 1]
+
+LEAVES = (st.integers(-64, 64).map(str) |
+          st.integers(*FIXNUM_RANGE).map(str) |
+          st.sampled_from(['#t', '#f', 'a', 'z']))
+
+UNARY_OPS = ['add1', 'sub1', 'integer?', 'zero?', 'boolean?', 'char?']
+BINARY_OPS = ['+', '-', '*', '=', '<', 'char=?']
+
+# `a` also shadows the char literal
+NAMES = ['x', 'y', 'a', 'count']
+
+
+def _let(bindings, body):
+    return ("(let (" + " ".join(f"({name} {expr})" for name, expr in bindings)
+            + f") {body})")
+
+
+def primitive_programs(leaves=LEAVES, max_leaves=12):
+    """Random programs nesting primitive calls, typed or not."""
+    unary = st.sampled_from(UNARY_OPS)
+    binary = st.sampled_from(BINARY_OPS)
+
+    def extend(children):
+        return (st.tuples(unary, children).map(
+                    lambda t: f"(primcall {t[0]} {t[1]})") |
+                st.tuples(binary, children, children).map(
+                    lambda t: f"(primcall {t[0]} {t[1]} {t[2]})"))
+    return st.recursive(leaves, extend, max_leaves=max_leaves)
+
+
+def programs(conditionals=True, max_leaves=12):
+    """Random programs using variables, `let` and, optionally, `if`, `and`
+    and `or`, besides primitive calls.
+
+    Every variable is bound by an outer `let`, and inner ones rebind them.
+    """
+    calls = primitive_programs(LEAVES | st.sampled_from(NAMES), max_leaves)
+
+    def extend(children):
+        bindings = st.lists(st.tuples(st.sampled_from(NAMES), children),
+                            min_size=1, max_size=2, unique_by=lambda b: b[0])
+        forms = st.tuples(bindings, children).map(lambda t: _let(*t))
+        if conditionals:
+            forms |= st.tuples(children, children, children).map(
+                lambda t: f"(if {t[0]} {t[1]} {t[2]})")
+            forms |= st.tuples(st.sampled_from(['and', 'or']),
+                               st.lists(children, max_size=3)).map(
+                lambda t: f"({t[0]} {' '.join(t[1])})")
+        return forms | st.tuples(st.sampled_from(BINARY_OPS),
+                                 children, children).map(
+            lambda t: f"(primcall {t[0]} {t[1]} {t[2]})")
+
+    body = st.recursive(calls, extend, max_leaves=max_leaves)
+    outer = st.lists(LEAVES, min_size=len(NAMES), max_size=len(NAMES))
+    return st.tuples(outer, body).map(
+        lambda t: _let(zip(NAMES, t[0]), t[1]))
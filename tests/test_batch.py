@@ -0,0 +1,115 @@
+import io
+import json
+import os
+import signal
+from contextlib import redirect_stdout, redirect_stderr
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pasquim.__main__ import main
+from pasquim.batch import batch_summary, run_batch, run_job
+from tests.environment import BACKEND, TARGET
+
+
+LOOP = "(letrec ((f (lambda (n) (f (primcall add1 n))))) (f 0))"
+
+
+class TestBatch(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.programs = []
+        for i in range(8):
+            self.programs.append(self._write(f"add-{i}.scm",
+                                             f"(primcall + {i} 40)"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _write(self, name, program):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w") as f:
+            f.write(program)
+        return path
+
+    def _run(self, programs, **kwargs):
+        return list(run_batch(programs, backend=BACKEND, target=TARGET,
+                              **kwargs))
+
+    def test_results(self):
+        results = self._run(self.programs, workers=4)
+        assert sorted(r.program for r in results) == sorted(self.programs)
+        for result in results:
+            i = int(result.program.split("-")[-1].split(".")[0])
+            assert result.status == "ok"
+            assert result.exit_code == 0
+            assert result.stdout == f"{i + 40}\n"
+            assert result.compile_seconds > 0
+            assert result.run_seconds > 0
+
+    def test_unique_work_dirs(self):
+        work_dir = os.path.join(self.tmp.name, "work")
+        self._run(self.programs, workers=4, work_dir=work_dir)
+        assert len(os.listdir(work_dir)) == len(self.programs)
+        for job in os.listdir(work_dir):
+            assert os.path.exists(os.path.join(work_dir, job, "a.out"))
+
+    def test_errors(self):
+        unknown = self._write("unknown.scm", "(primcall frobnicate 1)")
+        type_error = self._write("type.scm", "(primcall car 1)")
+        missing = os.path.join(self.tmp.name, "missing.scm")
+        results = {r.program: r
+                   for r in self._run([unknown, type_error, missing],
+                                      safe=True)}
+        assert results[unknown].status == "error"
+        assert "frobnicate" in results[unknown].error
+        assert results[type_error].status == "failed"
+        assert results[type_error].exit_code != 0
+        assert results[missing].status == "error"
+        assert results[missing].compile_seconds is None
+
+    def test_timeout(self):
+        loop = self._write("loop.scm", LOOP)
+        results = self._run([loop] + self.programs[:2], timeout=2)
+        statuses = {r.program: r.status for r in results}
+        assert statuses[loop] == "timeout"
+        assert statuses[self.programs[0]] == "ok"
+
+    def test_job_restores_alarm(self):
+        result = run_job(self.programs[0], os.path.join(self.tmp.name, "j"),
+                         timeout=30,
+                         options={"backend": BACKEND, "target": TARGET})
+        assert result.status == "ok"
+        assert signal.getitimer(signal.ITIMER_REAL) == (0.0, 0.0)
+
+    def test_bad_timeout(self):
+        handler = signal.getsignal(signal.SIGALRM)
+        for timeout in (-1, "abc"):
+            result = run_job(self.programs[0],
+                             os.path.join(self.tmp.name, "j"),
+                             timeout=timeout,
+                             options={"backend": BACKEND, "target": TARGET})
+            assert result.status == "error"
+            assert signal.getsignal(signal.SIGALRM) is handler
+
+    def test_summary(self):
+        results = self._run(self.programs[:3])
+        summary = batch_summary(results, 2.0)
+        assert summary["programs"] == 3
+        assert summary["statuses"] == {"ok": 3}
+        assert summary["programs_per_second"] == 1.5
+        assert summary["compile_seconds"] > 0
+
+    def test_command_line(self):
+        self._write("loop.scm", LOOP)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            status = main(["batch", self.tmp.name, "-j", "4", "--timeout",
+                           "2", "--backend", BACKEND, "--target", TARGET])
+        assert status == 1
+        lines = [json.loads(line)
+                 for line in stdout.getvalue().splitlines()]
+        assert len(lines) == 9
+        assert sum(line["status"] == "ok" for line in lines) == 8
+        assert "9 programs in" in stderr.getvalue()
+        assert "8 ok, 1 timeout" in stderr.getvalue() or \
+            "1 timeout, 8 ok" in stderr.getvalue()
@@ -0,0 +1,48 @@
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+import pytest
+from subprocess import run, PIPE
+
+from pasquim.build import BuildCache, BuildError
+from pasquim.compiler import Compiler
+from tests.environment import TARGET
+
+
+TEMP_FOLDER = "tmp"
+
+
+class TestBuildCache(TestCase):
+    def setUp(self):
+        self.tmp = TemporaryDirectory()
+        self.cache = BuildCache(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_repeated_compile_hits_cache(self):
+        for _ in range(2):
+            Compiler(TEMP_FOLDER, "(primcall add1 41)",
+                     cache=self.cache, target=TARGET).compile_to_binary()
+            results = run(TEMP_FOLDER+"/a.out", stdout=PIPE)
+            assert results.stdout == b"42\n"
+
+        assert self.cache.stats == {
+            "runtime_hits": 1, "runtime_misses": 1,
+            "binary_hits": 1, "binary_misses": 1
+        }
+
+    def test_runtime_shared_between_programs(self):
+        for program in ("1", "2"):
+            Compiler(TEMP_FOLDER, program,
+                     cache=self.cache, target=TARGET).compile_to_binary()
+
+        assert self.cache.stats["runtime_misses"] == 1
+        assert self.cache.stats["binary_misses"] == 2
+
+    def test_build_error(self):
+        asm = Path(self.tmp.name).joinpath("broken.s")
+        asm.write_text("not an instruction\n")
+
+        with pytest.raises(BuildError):
+            self.cache.link(asm, Path(self.tmp.name).joinpath("a.out"))
@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+from pasquim.closures import convert, free_variables
+from pasquim.parser import Reader
+
+
+def _convert(program):
+    return convert(Reader(program).read())
+
+
+class TestFreeVariables(TestCase):
+    def test_order_of_first_use(self):
+        expr = Reader("(primcall + y (primcall + x y))").read()
+        assert free_variables(expr, frozenset({"x", "y", "z"})) == ["y", "x"]
+
+    def test_bound_names(self):
+        expr = Reader("(let ((x 1)) (primcall + x y))").read()
+        assert free_variables(expr, frozenset({"x", "y"})) == ["y"]
+        expr = Reader("(lambda (y) (primcall + x y))").read()
+        assert free_variables(expr, frozenset({"x", "y"})) == ["x"]
+
+    def test_char_literals(self):
+        # a name out of scope is a char literal
+        expr = Reader("(primcall char=? a b)").read()
+        assert free_variables(expr, frozenset({"b"})) == ["b"]
+
+    def test_quoted_names(self):
+        expr = Reader("(primcall eq? 'x y)").read()
+        assert free_variables(expr, frozenset({"x", "y"})) == ["y"]
+
+
+class TestConvert(TestCase):
+    def test_without_procedures(self):
+        expr = Reader("(let ((x 1)) (primcall add1 x))").read()
+        assert convert(expr) is expr
+
+    def test_lambda(self):
+        assert _convert("(let ((n 1)) ((lambda (x) (primcall + x n)) 2))") \
+            == ['labels',
+                [['lambda0', ['code', ['x'], ['n'], ['primcall', '+', 'x',
+                                                     'n']]]],
+                ['let', [['n', 1]],
+                 ['funcall', ['closure', 'lambda0', 'n'], 2]]]
+
+    def test_nested_lambdas(self):
+        labels, body = _convert("(lambda (x) (lambda (y) x))")[1:]
+        assert body == ['closure', 'lambda0']
+        assert dict(labels) == {
+            'lambda0': ['code', ['x'], [], ['closure', 'lambda1', 'x']],
+            'lambda1': ['code', ['y'], ['x'], 'x']}
+
+    def test_letrec(self):
+        labels, body = _convert("(letrec ((f (lambda () (g))) "
+                                "(g (lambda () (f)))) (f))")[1:]
+        assert body == ['letrec', [['f', ['closure', 'lambda0', 'g']],
+                                   ['g', ['closure', 'lambda1', 'f']]],
+                        ['funcall', 'f']]
+        assert dict(labels)['lambda0'] == ['code', [], ['g'],
+                                           ['tail-call', 'g']]
+
+    def test_tail_positions(self):
+        labels = _convert("(lambda (f) (if (f) (let ((x (f))) (f x)) "
+                          "(and (f) (or (f) (f)))))")[1]
+        code = labels[0][1]
+        assert code[3] == [
+            'if', ['funcall', 'f'],
+            ['let', [['x', ['funcall', 'f']]], ['tail-call', 'f', 'x']],
+            ['and', ['funcall', 'f'],
+             ['or', ['funcall', 'f'], ['tail-call', 'f']]]]
+
+    def test_top_level_calls_return(self):
+        assert _convert("((lambda () 1))")[2] == \
+            ['funcall', ['closure', 'lambda0']]
+
+    def test_fresh_labels(self):
+        labels = _convert("(let ((lambda0 1)) (lambda () lambda0))")[1]
+        assert labels[0][0] == 'lambda1'
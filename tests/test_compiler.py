@@ -1,15 +1,22 @@
-from typing import Type
+from typing import List, Type
+import os
 
 from unittest import TestCase
 import pytest
 from hypothesis import settings, given, example, assume, strategies as st
 from subprocess import run, PIPE
 
-from pasquim.compiler import Compiler
+from pasquim.compiler import Compiler, Symbol
+from pasquim.emitter import Emitter
+from pasquim.parser import Reader
+from pasquim.primitives import compile_expr, immediate_rep
+from pasquim.target import get_target, host_target
+from tests.environment import BACKEND, TARGET
 
 
 TEMP_FOLDER = "tmp"
 INT_RANGE = [-2 ** 29, 2 ** 29 + 1]  # 30-bits
+FIXNUM_RANGE = [-2 ** 29, 2 ** 29 - 1]
 CHAR_RANGE = {
     # ASCII, but only consider letters and underscores
     'min_codepoint': 0, 'max_codepoint': 127,
@@ -22,7 +29,7 @@ settings.load_profile("test")
 
 def _compile_and_check(program: str, output: str) -> None:
     """Compiles program and checks if output matches expectation."""
-    compiler = Compiler(TEMP_FOLDER, program)
+    compiler = Compiler(TEMP_FOLDER, program, backend=BACKEND, target=TARGET)
     compiler.compile_to_binary()
 
     results = run(TEMP_FOLDER+"/a.out", stdout=PIPE)
@@ -31,16 +38,26 @@ def _compile_and_check(program: str, output: str) -> None:
 
 def _compile_and_compare(program_x: str, program_y: str) -> None:
     """Compiles two programs and checks if outputs match."""
-    Compiler(TEMP_FOLDER+'/x/', program_x).compile_to_binary()
-    Compiler(TEMP_FOLDER+'/y/', program_y).compile_to_binary()
+    for path, program in (('/x/', program_x), ('/y/', program_y)):
+        Compiler(TEMP_FOLDER+path, program,
+                 backend=BACKEND, target=TARGET).compile_to_binary()
 
     results_x = run(TEMP_FOLDER+"/x/a.out", stdout=PIPE)
     results_y = run(TEMP_FOLDER+"/y/a.out", stdout=PIPE)
     assert results_x.stdout == results_y.stdout
 
 
+def _compile_many_and_check(programs: List[str], outputs: List[str]) -> None:
+    """Compiles programs into one batch binary and checks every output."""
+    Compiler(TEMP_FOLDER+'/batch/',
+             backend=BACKEND, target=TARGET).compile_many(programs)
+
+    results = run(TEMP_FOLDER+"/batch/a.out", stdout=PIPE)
+    assert results.stdout.decode('UTF-8').splitlines() == outputs
+
+
 def _check_exception(program: str, error: Type[BaseException]) -> None:
-    compiler = Compiler(TEMP_FOLDER, program)
+    compiler = Compiler(TEMP_FOLDER, program, backend=BACKEND, target=TARGET)
 
     with pytest.raises(error):
         compiler.compile_to_binary()
@@ -247,3 +264,550 @@ class TestBinaryPrimitives(TestCase):
     def test_equal_char_false(self, x, y):
         assume(x != y)
         _compile_and_check(f"(primcall char=? {x} {y})", "#f")
+
+
+class TestBatch(TestCase):
+    @given(st.lists(st.integers(*FIXNUM_RANGE), min_size=1, max_size=500))
+    def test_integers(self, xs):
+        _compile_many_and_check([f"{x}" for x in xs], [f"{x}" for x in xs])
+
+    @given(st.lists(st.tuples(st.integers(*FIXNUM_RANGE),
+                              st.integers(*FIXNUM_RANGE)), min_size=1))
+    def test_less_than(self, pairs):
+        _compile_many_and_check(
+            [f"(primcall < {x} {y})" for x, y in pairs],
+            ["#t" if x < y else "#f" for x, y in pairs])
+
+    def test_single_program(self):
+        programs = ["(primcall add1 41)", "#t", "(primcall char? a)"]
+        Compiler(TEMP_FOLDER+'/batch/',
+                 backend=BACKEND, target=TARGET).compile_many(programs)
+
+        results = run([TEMP_FOLDER+"/batch/a.out", "1"], stdout=PIPE)
+        assert results.stdout == b"#t\n"
+
+        for index in ["3", "-1", "1x", "", "one"]:
+            results = run([TEMP_FOLDER+"/batch/a.out", index], stdout=PIPE,
+                          stderr=PIPE)
+            assert results.returncode == 1
+            assert results.stderr.startswith(b"no program with index")
+
+
+@pytest.mark.skipif(host_target() is None, reason="not an x86 host")
+class TestEvaluate(TestCase):
+    def _evaluate(self, program):
+        return Compiler(TEMP_FOLDER, program,
+                        target=host_target().name).evaluate()
+
+    @given(st.integers(*FIXNUM_RANGE), st.integers(*FIXNUM_RANGE))
+    def test_integer(self, x, y):
+        int_sum = x + y
+        assume(FIXNUM_RANGE[0] <= int_sum <= FIXNUM_RANGE[1])
+        assert self._evaluate(f"(primcall + {x} {y})") == int_sum
+
+    def test_immediates(self):
+        assert self._evaluate("#t") is True
+        assert self._evaluate("(primcall zero? 1)") is False
+        assert self._evaluate("z") == "z"
+
+    def test_heap_objects(self):
+        assert self._evaluate("(primcall cons 1 (primcall cons a #t))") == \
+            (1, ('a', True))
+        assert self._evaluate("(primcall make-vector 2 (primcall "
+                              "make-string 3 q))") == ["qqq", "qqq"]
+
+    def test_symbols(self):
+        value = self._evaluate("(primcall cons 'abc (primcall string->symbol "
+                               "(primcall make-string 2 q)))")
+        assert value == (Symbol("abc"), Symbol("qq"))
+        assert all(isinstance(symbol, Symbol) for symbol in value)
+        assert not isinstance(self._evaluate("z"), Symbol)
+
+    def test_other_target(self):
+        other = "x86" if host_target().name == "x86_64" else "x86_64"
+        with pytest.raises(RuntimeError):
+            Compiler(TEMP_FOLDER, "1", target=other).evaluate()
+
+
+def _arithmetic(depth):
+    """Random arithmetic programs on small numbers, with their values."""
+    leaf = st.integers(-8, 8).map(lambda x: (f"{x}", x))
+    if depth == 0:
+        return leaf
+
+    def call(op, x, y):
+        value = {'+': x[1] + y[1], '-': x[1] - y[1], '*': x[1] * y[1]}[op]
+        return f"(primcall {op} {x[0]} {y[0]})", value
+    sub = _arithmetic(depth - 1)
+    return leaf | st.builds(call, st.sampled_from('+-*'), sub, sub)
+
+
+class TestRegisterAllocation(TestCase):
+    @given(_arithmetic(4))
+    def test_nested_arithmetic(self, program):
+        source, value = program
+        _compile_and_check(source, f"{value}")
+
+    def test_more_operands_than_registers(self):
+        # right-leaning nesting keeps every left operand live at once
+        program, value = "0", 0
+        for x in range(1, 21):
+            program = f"(primcall - (primcall add1 {x}) {program})"
+            value = x + 1 - value
+        _compile_and_check(program, f"{value}")
+
+    def test_keeps_operands_out_of_memory(self):
+        program = ("(primcall * (primcall + (primcall add1 1) 2) "
+                   "(primcall - (primcall sub1 9) (primcall add1 3)))")
+        target = get_target(TARGET)
+        out = Emitter(target=target)
+        compile_expr(Reader(program).read(), -target.wordsize, out)
+
+        two = immediate_rep(2, target)
+        assert "(%" not in out.getvalue()
+        assert f"add{target.suffix} ${two}, {target.ax}" in out.getvalue()
+        assert out.registers.live == []
+
+
+class TestConditionals(TestCase):
+    @given(st.integers(*FIXNUM_RANGE), st.integers(*FIXNUM_RANGE))
+    def test_if(self, x, y):
+        _compile_and_check(f"(if (primcall < {x} {y}) a b)",
+                           "#\\a" if x < y else "#\\b")
+
+    def test_only_false_is_false(self):
+        _compile_many_and_check(
+            ["(if #f 1 2)", "(if #t 1 2)", "(if 0 1 2)", "(if a 1 2)",
+             "(if (primcall zero? 0) 1 2)", "(if (primcall + 1 1) 1 2)"],
+            ["2", "1", "1", "1", "1", "1"])
+
+    def test_and(self):
+        _compile_many_and_check(
+            ["(and)", "(and 1)", "(and 1 2 3)", "(and 1 #f 3)",
+             "(and (primcall < 1 2) (primcall char? a))"],
+            ["#t", "1", "3", "#f", "#t"])
+
+    def test_or(self):
+        _compile_many_and_check(
+            ["(or)", "(or #f)", "(or #f 2 3)", "(or #f #f)",
+             "(or (primcall < 2 1) (primcall char? 1))"],
+            ["#f", "#f", "2", "#f", "#f"])
+
+    @given(st.integers(-8, 8), st.integers(-8, 8), st.integers(-8, 8))
+    def test_nested_tests(self, x, y, z):
+        program = (f"(if (or (and (primcall < {x} {y}) (primcall < {y} {z}))"
+                   f" (primcall = {x} {z})) #t #f)")
+        _compile_and_check(program,
+                           "#t" if (x < y < z) or x == z else "#f")
+
+    def test_fused_compare_and_branch(self):
+        compiler = Compiler(TEMP_FOLDER,
+                            "(if (primcall < (primcall add1 1) 3) 1 2)",
+                            backend=BACKEND, target=TARGET)
+        compiler.compile_program()
+
+        # the test jumps on the comparison, without building a boolean
+        assert "setl" not in compiler.asm_program
+        assert "jge .L" in compiler.asm_program
+
+    def test_malformed_if(self):
+        _check_exception("(if #t 1)", ValueError)
+
+
+class TestLet(TestCase):
+    @given(st.integers(-2 ** 20, 2 ** 20), st.integers(-8, 8))
+    def test_let(self, x, y):
+        _compile_and_check(f"(let ((x {x}) (y {y})) (primcall - x y))",
+                           f"{x - y}")
+
+    def test_shadowing(self):
+        _compile_many_and_check(
+            ["(let ((x 1)) (let ((x (primcall add1 x)) (y x)) "
+             "(primcall + x y)))",
+             "(let ((x 1)) (primcall + (let ((x 10)) x) x))"],
+            ["3", "11"])
+
+    def test_shadows_char_literals(self):
+        _compile_many_and_check(
+            ["(let ((a 5)) a)", "(let ((a 5)) b)",
+             "(let ((a 5)) (primcall char? a))"],
+            ["5", "#\\b", "#f"])
+
+    def test_body_sequence(self):
+        _compile_and_check("(let ((x 2)) (primcall add1 x) (primcall * x x))",
+                           "4")
+
+    def test_inside_operands(self):
+        # bindings must not clobber a left operand spilled to the stack
+        program = "(primcall + (primcall add1 1) (let ((x 3)) x))"
+        for _ in range(12):
+            program = (f"(primcall - (let ((y 1)) (primcall add1 y)) "
+                       f"{program})")
+        value = 5
+        for _ in range(12):
+            value = 2 - value
+        _compile_and_check(program, f"{value}")
+
+    def test_unbound_variable(self):
+        _check_exception("(primcall add1 count)", ValueError)
+        _check_exception("(let ((x 1)) y1)", ValueError)
+
+    def test_malformed_let(self):
+        _check_exception("(let (x 1) x)", ValueError)
+        _check_exception("(let ((x 1)))", ValueError)
+
+
+def _garbage_program(n: int) -> str:
+    """Builds the list (n-1 ... 1 0 . 0) while allocating lots of garbage,
+    keeping a vector pointing to every partial list alive."""
+    body = "l"
+    for i in reversed(range(n)):
+        body = (f"(let ((l (primcall cons {i} l))) "
+                f"(let ((v (primcall make-vector 5 l))) "
+                f"(primcall make-string 200 x) "
+                f"(primcall car (primcall vector-ref v 4)) {body}))")
+    return f"(let ((l 0)) {body})"
+
+
+def _run_with_heap(path: str, size: int, stats: bool = False):
+    env = dict(os.environ, PASQUIM_HEAP_SIZE=str(size))
+    if stats:
+        env["PASQUIM_GC_STATS"] = "1"
+    return run(path + "/a.out", stdout=PIPE, stderr=PIPE, env=env)
+
+
+class TestHeap(TestCase):
+    def test_pairs(self):
+        _compile_many_and_check(
+            ["(primcall cons 1 2)", "(primcall cons 1 (primcall cons a #t))",
+             "(primcall car (primcall cons 1 2))",
+             "(primcall cdr (primcall cons 1 2))",
+             "(let ((p (primcall cons 1 2))) (primcall cons p p))"],
+            ["(1 . 2)", "(1 #\\a . #t)", "1", "2", "((1 . 2) 1 . 2)"])
+
+    def test_vectors(self):
+        _compile_many_and_check(
+            ["(primcall make-vector 3 7)", "(primcall make-vector 0)",
+             "(let ((n 2)) (primcall make-vector n a))",
+             "(let ((v (primcall make-vector 3 0))) "
+             "(primcall vector-set! v 1 (primcall cons 1 2)) v)",
+             "(primcall vector-ref (primcall make-vector 2 #t) 1)",
+             "(primcall vector-length (primcall make-vector 5))"],
+            ["#(7 7 7)", "#()", "#(#\\a #\\a)", "#(0 (1 . 2) 0)", "#t",
+             "5"])
+
+    def test_strings(self):
+        _compile_many_and_check(
+            ["(primcall make-string 3 x)", "(primcall make-string 2)",
+             "(let ((s (primcall make-string 3 x))) "
+             "(primcall string-set! s 1 y) s)",
+             "(primcall string-ref (primcall make-string 9 q) 8)",
+             "(primcall string-length (primcall make-string 9))"],
+            ['"xxx"', '"  "', '"xyx"', "#\\q", "9"])
+
+    def test_predicates(self):
+        _compile_many_and_check(
+            ["(primcall pair? (primcall cons 1 2))",
+             "(primcall vector? (primcall cons 1 2))",
+             "(primcall string? (primcall make-string 1))",
+             "(primcall vector? 2)"],
+            ["#t", "#f", "#t", "#f"])
+
+    def test_bulk_vectors(self):
+        _compile_many_and_check(
+            ["(primcall vector-fill! (primcall make-vector 3 0) #t)",
+             "(primcall vector-copy (primcall make-vector 2 a))",
+             "(primcall vector-copy (primcall make-vector 0))",
+             "(let ((v (primcall make-vector 4 0))) "
+             "(primcall vector-copy! v 1 (primcall make-vector 2 9)))",
+             "(let ((v (primcall make-vector 2 1))) "
+             "(primcall vector-set! (primcall vector-copy v) 0 2) v)"],
+            ["#(#t #t #t)", "#(#\\a #\\a)", "#()", "#(0 9 9 0)",
+             "#(1 1)"])
+
+    def test_bulk_strings(self):
+        _compile_many_and_check(
+            ["(primcall string-fill! (primcall make-string 3) z)",
+             "(primcall string-copy (primcall make-string 5 q))",
+             "(let ((s (primcall make-string 5 a))) "
+             "(primcall string-copy! s 3 (primcall make-string 2 b)))",
+             "(primcall string=? (primcall make-string 3 a) "
+             "(primcall make-string 3 a))",
+             "(primcall string=? (primcall make-string 3 a) "
+             "(primcall make-string 2 a))",
+             "(let ((s (primcall make-string 3 a))) "
+             "(let ((t (primcall string-copy s))) "
+             "(primcall string-set! t 2 b) (primcall string=? s t)))",
+             "(if (primcall string=? (primcall make-string 0) "
+             "(primcall make-string 0)) 1 2)"],
+            ['"zzz"', '"qqqqq"', '"aaabb"', "#t", "#f", "#f", "1"])
+
+    def test_copies_between_neighbours(self):
+        # the copy runs backwards when the destination is above the source
+        _compile_many_and_check(
+            ["(let ((v (primcall make-vector 2 0))) "
+             "(primcall vector-set! v 0 1) "
+             "(primcall vector-copy! (primcall make-vector 3 5) 0 v))",
+             "(let ((s (primcall make-string 3 a))) "
+             "(primcall string-set! s 2 b) "
+             "(primcall string-copy! (primcall make-string 4 c) 1 s))",
+             "(let ((v (primcall make-vector 2 7))) "
+             "(primcall vector-copy! v 0 v))"],
+            ["#(1 0 5)", '"caab"', "#(7 7)"])
+
+    def test_bulk_operations_keep_registers(self):
+        # the left operand of = stays in a register the copy and fill use
+        _compile_and_check(
+            "(let ((s (primcall make-string 3 a))) (primcall = "
+            "(primcall string-length (primcall string-copy s)) "
+            "(primcall vector-length (primcall vector-fill! "
+            "(primcall make-vector 3) 1))))", "#t")
+
+    def test_collection(self):
+        Compiler(TEMP_FOLDER, _garbage_program(50), backend=BACKEND,
+                 target=TARGET).compile_to_binary()
+        expected = "(" + " ".join(map(str, range(49, -1, -1))) + " . 0)\n"
+        for size in (8192, 16384, 2 ** 22):
+            results = _run_with_heap(TEMP_FOLDER, size)
+            assert results.returncode == 0
+            assert results.stdout.decode() == expected
+
+    def test_pointers_in_registers_survive_collection(self):
+        # the left operand of = is kept in a register while the right one
+        # allocates, so it must be updated when p moves
+        n = 3 if TARGET == "x86_64" else 7  # fill 48 bytes of the heap
+        Compiler(TEMP_FOLDER, f"(let ((j (primcall make-vector {n})) "
+                 "(p (primcall cons 1 2))) (primcall = (primcall car "
+                 "(primcall cons p 0)) (primcall car (primcall cons p 1))))",
+                 backend=BACKEND, target=TARGET).compile_to_binary()
+        assert _run_with_heap(TEMP_FOLDER, 64).stdout == b"#t\n"
+
+    @pytest.mark.skipif(BACKEND == "builtin",
+                        reason="the built-in runtime doesn't grow the heap")
+    def test_growth_and_stats(self):
+        Compiler(TEMP_FOLDER, _garbage_program(50), backend=BACKEND,
+                 target=TARGET).compile_to_binary()
+        results = _run_with_heap(TEMP_FOLDER, 64, stats=True)
+        assert results.stdout.decode().startswith("(49 48 47")
+        assert results.stderr.startswith(b"gc: ")
+        assert b" 0 collections" not in results.stderr
+
+    def test_wrong_arity(self):
+        _check_exception("(primcall cons 1)", ValueError)
+        _check_exception("(primcall make-vector 1 2 3)", ValueError)
+
+
+class TestProcedures(TestCase):
+    def test_calls(self):
+        _compile_many_and_check(
+            ["((lambda (x) (primcall + x 1)) 41)",
+             "((lambda () 7))",
+             "((lambda (x y z) (primcall - x (primcall - y z))) 10 5 1)",
+             "(let ((n 1)) ((lambda (x) (primcall + x n)) 2))",
+             "(let ((f (lambda (x) (lambda (y) (primcall cons x y))))) "
+             "((f 1) 2))",
+             "(lambda (x) x)",
+             "(primcall procedure? (lambda () 1))",
+             "(let ((f (lambda (a) a))) (primcall procedure? (f 1)))"],
+            ["42", "7", "6", "3", "(1 . 2)", "#<procedure>", "#t", "#f"])
+
+    def test_letrec(self):
+        _compile_many_and_check(
+            ["(letrec ((fact (lambda (n) (if (primcall zero? n) 1 "
+             "(primcall * n (fact (primcall sub1 n))))))) (fact 10))",
+             "(letrec ((even (lambda (n) (if (primcall zero? n) #t "
+             "(odd (primcall sub1 n))))) (odd (lambda (n) (if (primcall "
+             "zero? n) #f (even (primcall sub1 n)))))) (even 11))",
+             "(let ((k 3)) (letrec ((f (lambda (n) (if (primcall < n k) "
+             "(f (primcall add1 n)) n)))) (f 0)))"],
+            ["3628800", "#f", "3"])
+
+    def test_calls_keep_registers(self):
+        # the left operands stay in scratch registers across the calls
+        _compile_and_check(
+            "(let ((f (lambda (x) (primcall * x x)))) (primcall + (f 2) "
+            "(primcall + (f 3) (primcall + (f 4) (f 5)))))", "54")
+
+    def test_tail_calls_run_in_constant_space(self):
+        # far more iterations than the stack could hold frames for
+        _compile_and_check(
+            "(letrec ((loop (lambda (i acc) (if (primcall zero? i) acc "
+            "(loop (primcall sub1 i) (primcall + acc 2)))))) "
+            "(loop 10000000 0))", "20000000")
+        _compile_and_check(
+            "(letrec ((f (lambda (n) (if (primcall zero? n) 0 (g n 1)))) "
+            "(g (lambda (n m) (and #t (f (primcall - n m)))))) "
+            "(f 10000000))", "0")
+
+    def test_collection_during_calls(self):
+        Compiler(TEMP_FOLDER, "(letrec ((build (lambda (n acc) (if (primcall"
+                 " zero? n) acc (build (primcall sub1 n) (primcall cons n "
+                 "(let ((v (primcall make-vector 4 acc))) (primcall "
+                 "vector-ref v 3)))))))) (build 40 0))",
+                 backend=BACKEND, target=TARGET).compile_to_binary()
+        results = _run_with_heap(TEMP_FOLDER, 1024)
+        expected = "(" + " ".join(map(str, range(1, 41))) + " . 0)\n"
+        assert results.stdout.decode() == expected
+
+    def test_malformed_procedures(self):
+        _check_exception("(lambda x x)", ValueError)
+        _check_exception("(lambda (x x) x)", ValueError)
+        _check_exception("(lambda (x))", ValueError)
+        _check_exception("(letrec ((f 1)) f)", ValueError)
+
+
+class TestSymbols(TestCase):
+    def test_quote(self):
+        _compile_many_and_check(
+            ["'foo", "(quote bar)", "(quote a)", "'1", "(primcall cons 'x "
+             "(primcall cons 'longer-name '|#\\\"|))",
+             "(primcall symbol? 'x)", "(primcall symbol? (primcall "
+             "symbol->string 'x))", "(let ((x 1)) 'x)"],
+            ["foo", "bar", "a", "1", '(x longer-name . |#\\"|)', "#t", "#f",
+             "x"])
+
+    def test_eq(self):
+        _compile_many_and_check(
+            ["(primcall eq? 'foo 'foo)", "(primcall eq? 'foo 'bar)",
+             "(let ((x 'foo)) (primcall eq? x 'foo))",
+             "(primcall eq? (primcall symbol->string 'foo) "
+             "(primcall symbol->string 'foo))",
+             "(primcall eq? 1 1)"],
+            ["#t", "#f", "#t", "#f", "#t"])
+
+    def test_names_laid_out_once(self):
+        compiler = Compiler(TEMP_FOLDER, backend=BACKEND, target=TARGET)
+        compiler.compile_batch(["(primcall cons 'same 'same)",
+                                "(primcall cons 'same 'other)"])
+        asm = compiler.asm_program
+        assert asm.count("scheme_symbol_table:") == 1
+        assert "scheme_symbol_count:\n.long 2\n" in asm
+
+    def test_strings_and_symbols(self):
+        _compile_many_and_check(
+            ["(primcall symbol->string 'hello)",
+             "(primcall string->symbol (primcall make-string 3 z))",
+             "(primcall eq? 'hello (primcall string->symbol (primcall "
+             "symbol->string 'hello)))",
+             "(let ((s (primcall make-string 2 q))) (primcall eq? "
+             "(primcall string->symbol s) (primcall string->symbol "
+             "(primcall string-copy s))))",
+             "(let ((s (primcall make-string 2 q))) (let ((a (primcall "
+             "string->symbol s))) (primcall string-set! s 0 r) (primcall "
+             "cons a (primcall string->symbol s))))",
+             "(primcall string->symbol (primcall make-string 0 z))"],
+            ['"hello"', "zzz", "#t", "#t", "(qq . rq)", ""])
+
+    def test_interning_keeps_registers(self):
+        _compile_and_check(
+            "(let ((s (primcall make-string 1 a))) (primcall + 1 (primcall "
+            "+ 2 (if (primcall symbol? (primcall string->symbol s)) 3 0))))",
+            "6")
+
+    def test_many_symbols(self):
+        # names of one to 1000 chars, all different, interned thrice
+        _compile_and_check(
+            "(letrec ((intern (lambda (n) (primcall string->symbol (primcall"
+            " make-string n x)))) (loop (lambda (n) (if (primcall zero? n) "
+            "#t (and (primcall eq? (intern n) (intern n)) (primcall symbol? "
+            "(intern n)) (loop (primcall sub1 n))))))) (loop 1000))", "#t")
+
+    def test_malformed_quote(self):
+        _check_exception("(quote)", ValueError)
+        _check_exception("(quote a b)", ValueError)
+        _check_exception("(quote (a b))", ValueError)
+
+
+def _run_safe(program: str):
+    Compiler(TEMP_FOLDER, program, backend=BACKEND, target=TARGET,
+             safe=True).compile_to_binary()
+    return run(TEMP_FOLDER+"/a.out", stdout=PIPE, stderr=PIPE)
+
+
+class TestSafeMode(TestCase):
+    def test_well_typed(self):
+        for program, output in [
+                ("(primcall * (primcall add1 2) (primcall - 9 4))", b"15\n"),
+                ("(let ((x a)) (primcall char=? x a))", b"#t\n"),
+                ("(let ((x (if (primcall zero? 0) 1 a))) (primcall - 3 x))",
+                 b"2\n")]:
+            results = _run_safe(program)
+            assert (results.returncode, results.stdout) == (0, output)
+
+    def test_wrong_types(self):
+        for program in ["(primcall add1 #t)", "(primcall + 1 a)",
+                        "(let ((x 1) (y a)) (primcall < x y))",
+                        "(let ((x 1)) (primcall char=? a x))",
+                        "(primcall * (primcall add1 1) (if #f 1 #f))"]:
+            results = _run_safe(program)
+            assert results.returncode == 1
+            assert results.stdout == b""
+            assert results.stderr == b"error: wrong type of argument\n"
+
+    def test_heap_errors(self):
+        for program, error in [
+                ("(primcall car 1)", b"error: wrong type of argument\n"),
+                ("(primcall vector-length (primcall cons 1 2))",
+                 b"error: wrong type of argument\n"),
+                ("(primcall string-set! (primcall make-string 2) 0 1)",
+                 b"error: wrong type of argument\n"),
+                ("(primcall vector-ref (primcall make-vector 2) 2)",
+                 b"error: index out of range\n"),
+                ("(let ((i -1)) (primcall string-ref (primcall make-string "
+                 "2) i))", b"error: index out of range\n"),
+                ("(primcall make-vector -1)", b"error: index out of range\n"),
+                ("(primcall vector-copy! (primcall make-vector 2) 1 "
+                 "(primcall make-vector 2))", b"error: index out of range\n"),
+                ("(primcall string-copy! (primcall make-string 2) -1 "
+                 "(primcall make-string 1))", b"error: index out of range\n"),
+                ("(primcall string=? (primcall make-string 1) 1)",
+                 b"error: wrong type of argument\n")]:
+            results = _run_safe(program)
+            assert (results.returncode, results.stderr) == (1, error)
+
+    def test_procedure_errors(self):
+        for program, error in [
+                ("(let ((f 1)) (f 2))", b"error: wrong type of argument\n"),
+                ("((lambda (x) x))", b"error: wrong number of arguments\n"),
+                ("(letrec ((f (lambda (n) (f n n)))) (f 1))",
+                 b"error: wrong number of arguments\n")]:
+            results = _run_safe(program)
+            assert (results.returncode, results.stderr) == (1, error)
+        assert _run_safe("((lambda (x) x) 1)").stdout == b"1\n"
+
+    def test_symbol_errors(self):
+        for program in ["(primcall symbol->string (primcall make-string 1))",
+                        "(primcall string->symbol 'name)"]:
+            results = _run_safe(program)
+            assert (results.returncode, results.stderr) == \
+                (1, b"error: wrong type of argument\n")
+        assert _run_safe("(primcall symbol->string 'name)").stdout == \
+            b'"name"\n'
+
+    def test_proven_checks_removed(self):
+        compiler = Compiler(TEMP_FOLDER, "(let ((x 3)) (primcall + x "
+                            "(primcall add1 (primcall * x x))))",
+                            target=TARGET, safe=True)
+        compiler.compile_program()
+        assert "scheme_type_error" not in compiler.asm_program
+        assert (compiler.checks.emitted, compiler.checks.removed) == (0, 5)
+
+    def test_checks_results_once(self):
+        # after (add1 x) checks x, its result is known to be a fixnum
+        compiler = Compiler(TEMP_FOLDER, "(let ((x (if #t 1 a))) (primcall "
+                            "sub1 (primcall add1 x)))",
+                            target=TARGET, safe=True)
+        compiler.compile_program()
+        assert compiler.asm_program.count("jne scheme_type_error") == 1
+        assert (compiler.checks.emitted, compiler.checks.removed) == (1, 1)
+
+    def test_folded_predicates(self):
+        for safe in (True, False):
+            compiler = Compiler(TEMP_FOLDER, "(let ((x (primcall add1 1))) "
+                                "(if (primcall char? x) 1 (primcall "
+                                "integer? (primcall + x 2))))",
+                                target=TARGET, safe=safe, opt_level=1)
+            compiler.compile_program()
+            assert compiler.checks.folded == 2
+            assert f"${immediate_rep(True, get_target(TARGET))}," in \
+                compiler.asm_program
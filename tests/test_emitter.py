@@ -0,0 +1,33 @@
+from io import StringIO
+from unittest import TestCase
+
+from pasquim.emitter import Emitter
+
+
+class TestEmitter(TestCase):
+    def test_buffered(self):
+        out = Emitter()
+        out.emit("movl $4, %eax")
+        out.extend(["addl $4, %eax", "ret"])
+
+        assert len(out) == 3
+        assert out.getvalue() == "movl $4, %eax\naddl $4, %eax\nret\n"
+
+    def test_streamed(self):
+        stream = StringIO()
+        out = Emitter(stream, buffer_size=2)
+        out.extend(f"line {i}" for i in range(5))
+
+        assert len(out.lines) == 1  # the rest was already written
+        out.flush()
+        assert stream.getvalue() == "".join(f"line {i}\n" for i in range(5))
+        assert len(out) == 5
+
+    def test_labels(self):
+        out = Emitter()
+        labels = [out.label() for _ in range(3)]
+        assert len(set(labels)) == 3
+
+        forked = out.fork()
+        assert forked.target is out.target
+        assert forked.label() not in labels + [out.label()]
@@ -0,0 +1,180 @@
+import math
+from subprocess import run, PIPE
+from unittest import TestCase
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from pasquim.compiler import Compiler
+from pasquim.emitter import Emitter
+from pasquim.parser import Reader
+from pasquim.primitives import compile_expr
+from pasquim.target import X86_64, host_target
+from tests.binaries import outputs
+from tests.environment import BACKEND, TARGET
+
+
+TEMP_FOLDER = "tmp"
+FIXNUM_MAX = 2 ** 60 - 1
+FIXNUM_MIN = -2 ** 60
+
+settings.register_profile("test", deadline=None)
+settings.load_profile("test")
+
+needs_bignums = pytest.mark.skipif(
+    TARGET != "x86_64" or BACKEND != "gcc",
+    reason="exact integers need the x86_64 target and gcc backend")
+
+FACT = ("(fact (lambda (n) (if (primcall = n 0) 1 "
+        "(primcall * n (fact (primcall sub1 n))))))")
+
+# Integers around the fixnum range and past 64 bits
+INTEGERS = (st.integers(-64, 64) |
+            st.integers(FIXNUM_MAX - 4, FIXNUM_MAX + 4) |
+            st.integers(FIXNUM_MIN - 4, FIXNUM_MIN + 4) |
+            st.integers(-2 ** 200, 2 ** 200))
+
+
+def _binary(op, a, b):
+    value = {'+': a[1] + b[1], '-': a[1] - b[1], '*': a[1] * b[1]}[op]
+    return f"(primcall {op} {a[0]} {b[0]})", value
+
+
+def _unary(op, a):
+    return f"(primcall {op} {a[0]})", a[1] + (1 if op == 'add1' else -1)
+
+
+def _expressions(max_leaves=8):
+    """Random arithmetic on integers, with the value Python computes."""
+    def extend(children):
+        return (st.tuples(st.sampled_from(['+', '-', '*']), children,
+                          children).map(lambda t: _binary(*t)) |
+                st.tuples(st.sampled_from(['add1', 'sub1']),
+                          children).map(lambda t: _unary(*t)))
+    leaves = INTEGERS.map(lambda n: (str(n), n))
+    return st.recursive(leaves, extend, max_leaves=max_leaves)
+
+
+def _outputs(path, programs, **options):
+    return outputs(path, programs, exact=True,
+                   **options).decode().splitlines()
+
+
+class TestExactMode(TestCase):
+    def test_needs_bignum_tag(self):
+        with pytest.raises(ValueError, match="bignums"):
+            Compiler(TEMP_FOLDER, "1", target="x86", exact=True)
+
+    def test_fast_path(self):
+        out = Emitter(target=X86_64, exact=True)
+        compile_expr(Reader("(let ((x 1)) (primcall + x 2))").read(), -8,
+                     out)
+        add = out.lines.index("addq $16, %rax")
+        assert out.lines[add - 2] == "testq $7, %rax"
+        assert out.lines[add - 1].startswith("jne ")
+        assert out.lines[add + 1].startswith("jo ")
+        assert not any("call" in line for line in out.lines)
+        assert any("scheme_add" in line for line in out.cold)
+
+    def test_slow_paths_follow_the_entry(self):
+        compiler = Compiler(TEMP_FOLDER + "/asm/", "(primcall * 3 4)",
+                            target="x86_64", exact=True)
+        compiler.compile_program()
+        lines = compiler.asm_program.splitlines()
+        assert lines.index("ret") < lines.index("call scheme_mul")
+
+    def test_constant_folding_is_skipped(self):
+        compiler = Compiler(TEMP_FOLDER, "(primcall + 1 2)", target="x86_64",
+                            opt_level=1, exact=True)
+        names = [info.name for info in compiler.pass_manager.passes]
+        assert "constant-folding" not in names
+        assert "cse" not in names
+        assert "simplify" in names
+
+
+@needs_bignums
+class TestExactIntegers(TestCase):
+    def test_overflow(self):
+        programs = [
+            f"(primcall + {FIXNUM_MAX} 1)",
+            f"(primcall - {FIXNUM_MIN} 1)",
+            f"(primcall * {FIXNUM_MAX} {FIXNUM_MAX})",
+            f"(let ((x {FIXNUM_MAX})) (primcall add1 x))",
+            f"(let ((x {FIXNUM_MIN})) (primcall sub1 x))",
+            f"(let ((x {FIXNUM_MAX}) (y 3)) (primcall * y x))",
+            f"(primcall - (primcall + {FIXNUM_MAX} 1) 1)",
+            "(primcall * 4294967296 4294967296)",
+        ]
+        assert _outputs("exact-overflow", programs) == [
+            str(FIXNUM_MAX + 1), str(FIXNUM_MIN - 1), str(FIXNUM_MAX ** 2),
+            str(FIXNUM_MAX + 1), str(FIXNUM_MIN - 1), str(3 * FIXNUM_MAX),
+            str(FIXNUM_MAX), str(2 ** 64)]
+
+    def test_literals_and_comparisons(self):
+        big = 123456789012345678901234567890
+        programs = [
+            str(big), str(-big),
+            f"(primcall < {big} {big + 1})",
+            f"(primcall < {-big} 1)",
+            f"(primcall = {big} {big})",
+            f"(primcall = (primcall + {FIXNUM_MAX} 1) {FIXNUM_MAX + 1})",
+            f"(primcall = {big} 1)",
+            f"(primcall integer? {big})",
+            f"(primcall zero? (primcall - {big} {big}))",
+            f"(primcall cons {big} (primcall vector-length "
+            f"(primcall make-vector 2 {big})))",
+        ]
+        assert _outputs("exact-literals", programs) == [
+            str(big), str(-big), "#t", "#t", "#t", "#t", "#f", "#t", "#t",
+            f"({big} . 2)"]
+
+    def test_collection(self):
+        program = (f"(letrec ({FACT} (loop (lambda (i acc) "
+                   f"(if (primcall = i 0) acc (loop (primcall sub1 i) "
+                   f"(primcall cons (fact 40) acc)))))) "
+                   f"(primcall car (loop 200 #f)))")
+        lines = _outputs("exact-collect", [program],
+                         env={"PASQUIM_HEAP_SIZE": "4096"})
+        assert lines == [str(math.factorial(40))]
+
+    def test_guarded_arithmetic(self):
+        # the multiplications would fail on #t if moved before the test
+        program = ("(let ((x #t)) (if (primcall integer? x) "
+                   "(primcall + (primcall * x 2) (primcall * x 2)) 0))")
+        for opt_level in (0, 1):
+            assert _outputs(f"exact-guarded-O{opt_level}", [program],
+                            opt_level=opt_level) == ["0"]
+
+    def test_type_errors(self):
+        for safe in (False, True):
+            path = TEMP_FOLDER + f"/errors-{safe}/"
+            Compiler(path, "(primcall + 1 #t)", target=TARGET, exact=True,
+                     safe=safe).compile_to_binary()
+            results = run(path + "a.out", stdout=PIPE, stderr=PIPE)
+            assert results.returncode == 1
+            assert b"wrong type" in results.stderr
+
+    @pytest.mark.skipif(host_target() is not X86_64,
+                        reason="runs x86_64 code in process")
+    def test_evaluate(self):
+        compiler = Compiler(TEMP_FOLDER + "/evaluate/",
+                            f"(primcall cons (primcall * {FIXNUM_MAX} -4) 1)",
+                            target="x86_64", exact=True)
+        assert compiler.evaluate() == (FIXNUM_MAX * -4, 1)
+
+    @given(st.lists(_expressions(), min_size=1, max_size=20),
+           st.sampled_from([0, 1]))
+    def test_random_arithmetic(self, expressions, opt_level):
+        programs = [program for program, _ in expressions]
+        assert _outputs("exact-random", programs, opt_level=opt_level) == \
+            [str(value) for _, value in expressions]
+
+    @given(st.lists(st.tuples(st.sampled_from(['<', '=']), _expressions(4),
+                              _expressions(4)), min_size=1, max_size=20))
+    def test_random_comparisons(self, comparisons):
+        programs = [f"(primcall {op} {a[0]} {b[0]})"
+                    for op, a, b in comparisons]
+        expected = [a[1] < b[1] if op == '<' else a[1] == b[1]
+                    for op, a, b in comparisons]
+        assert _outputs("exact-compare", programs) == \
+            ["#t" if value else "#f" for value in expected]
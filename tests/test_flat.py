@@ -0,0 +1,177 @@
+from io import StringIO
+from unittest import TestCase, mock
+
+import pytest
+from hypothesis import given, settings, strategies as st
+
+from pasquim import flat
+from pasquim.compiler import Compiler
+from pasquim.emitter import Emitter
+from pasquim.flat import FlatTree, Unsupported, deeper_than, generate
+from pasquim.parser import Reader
+from pasquim.primitives import compile_expr
+from pasquim.profiling import program_size
+from pasquim.target import get_target
+from tests.binaries import outputs
+from tests.environment import BACKEND, TARGET
+from tests.strategies import programs
+
+
+TEMP_FOLDER = "tmp"
+
+settings.register_profile("test", deadline=None)
+settings.load_profile("test")
+
+PROGRAMS = [
+    "42",
+    "#t",
+    "(primcall add1 (primcall + x 1))",
+    "(let ((x 1) (y 'a)) (if (and x #t (primcall < x 2)) (or #f y) 'b))",
+    "(let ((x (let ((x 2)) (primcall * x x)))) (primcall - x 1))",
+    "(if (or) (and) (quote a))",
+    "(let ((x 'a)) (if x 'c '#t))",
+]
+
+
+def _nested(depth, inner="0"):
+    return "(primcall add1 " * depth + inner + ")" * depth
+
+
+def _lets(depth):
+    return "(let ((x (primcall add1 x))) " * depth + "x" + ")" * depth
+
+
+def _lines(program, **kwargs):
+    out = Emitter(target=get_target(TARGET))
+    generate(FlatTree.read(program), -out.target.wordsize, out, **kwargs)
+    return out.lines
+
+
+class TestFlatTree(TestCase):
+    def test_round_trip(self):
+        for program in PROGRAMS:
+            tree = FlatTree.read(program)
+            expr = Reader(program).read()
+            assert tree.to_expr() == expr
+            assert FlatTree.from_expr(expr).to_expr() == expr
+            assert (tree.tokens, len(tree)) == program_size(expr)
+
+    def test_depth(self):
+        tree = FlatTree.read(_nested(3))
+        assert tree.depth == 4
+        assert deeper_than(Reader(_nested(3)).read(), 3)
+        assert not deeper_than(Reader(_nested(3)).read(), 4)
+
+    def test_atoms_are_shared(self):
+        tree = FlatTree.read("(primcall + (primcall + x x) x)")
+        assert tree.atoms.count("x") == 1
+
+    def test_very_deep(self):
+        tree = FlatTree.read(_nested(100000))
+        assert tree.depth == 100001
+        again = FlatTree.from_expr(tree.to_expr())
+        assert (again.ops, again.kids) == (tree.ops, tree.kids)
+
+    def test_syntax_errors(self):
+        with pytest.raises(SyntaxError, match="line 2, column 3"):
+            FlatTree.read("(primcall add1\n  (primcall + 1 2")
+        with pytest.raises(SyntaxError, match="line 1, column 1"):
+            FlatTree.read(")")
+        with pytest.raises(SyntaxError):
+            FlatTree.read("")
+        with pytest.raises(SyntaxError):
+            FlatTree.read("(f ')")
+        with pytest.raises(SyntaxError):
+            FlatTree.read("'")
+
+
+class TestGenerate(TestCase):
+    def test_shallow_programs_match(self):
+        for program in PROGRAMS:
+            out = Emitter(target=get_target(TARGET))
+            compile_expr(Reader(program).read(), -out.target.wordsize, out)
+            assert _lines(program) == out.lines
+
+    def test_deep_programs_need_no_recursion(self):
+        with mock.patch("sys.getrecursionlimit", return_value=100):
+            lines = _lines(_nested(5000))
+        assert len(lines) > 5000
+
+    def test_procedures_are_unsupported(self):
+        with pytest.raises(Unsupported):
+            _lines("(let ((f (lambda (x) x))) (f 1))")
+        with pytest.raises(Unsupported):
+            _lines(_nested(300, "(letrec ((f (lambda () 1))) (f))"))
+
+    def test_unsupported_before_output(self):
+        out = Emitter(target=get_target(TARGET))
+        program = f"(if (primcall zero? 0) (g {_nested(300)}) 0)"
+        tree = FlatTree.read(_nested(10, program))
+        with pytest.raises(Unsupported):
+            generate(tree, -out.target.wordsize, out, shallow=1)
+        assert out.lines == []
+
+    def test_errors_match(self):
+        for program in ["(let (x) x)", "(let ((x 1 2)) x)",
+                        "(primcall frobnicate 1)"]:
+            with pytest.raises(Exception) as expected:
+                compile_expr(Reader(program).read(), -8,
+                             Emitter(target=get_target(TARGET)))
+            with pytest.raises(expected.type):
+                _lines(program, shallow=1)
+
+    def test_empty_forms(self):
+        for program in ["(let ((x 1)) (and))", "(let ((x 1)) (or))"]:
+            out = Emitter(target=get_target(TARGET))
+            compile_expr(Reader(program).read(), -out.target.wordsize, out)
+            assert _lines(program, shallow=1) == out.lines
+
+
+class TestCompile(TestCase):
+    def test_deep_programs(self):
+        programs = [_nested(20000), f"(let ((x 0)) {_lets(5000)})"]
+        assert outputs("flat-deep", programs) == b"20000\n5000\n"
+        assert outputs("flat-deep-flat", programs[:1], flat=True) == \
+            b"20000\n"
+
+    def test_deep_arguments(self):
+        programs = [
+            f"(primcall + {_nested(1000)} {_nested(2000, '1')})",
+            f"(if (primcall = {_nested(500)} 500) {_nested(400)} #f)",
+        ]
+        assert outputs("flat-arguments", programs) == b"3001\n400\n"
+
+    def test_procedures_fall_back(self):
+        program = "(letrec ((f (lambda (x) (primcall add1 x)))) (f 1))"
+        assert outputs("flat-procedures", [program], flat=True) == b"2\n"
+
+    def test_deep_procedures(self):
+        program = f"(let ((f (lambda (x) x))) {_nested(3000, '(f 0)')})"
+        compiler = Compiler(TEMP_FOLDER + "/deep-procs/", program,
+                            backend=BACKEND, target=TARGET)
+        with pytest.raises(ValueError, match="nested 3003 deep"):
+            compiler.compile_program()
+
+    def test_streamed(self):
+        stream = StringIO()
+        compiler = Compiler(TEMP_FOLDER + "/streamed/", _nested(20000),
+                            backend=BACKEND, target=TARGET)
+        with mock.patch.object(Emitter, "fork", side_effect=AssertionError):
+            compiler.compile_program(stream)
+        assert stream.getvalue().count("\n") > 20000
+
+    def test_stats(self):
+        compiler = Compiler(TEMP_FOLDER + "/stats/", _nested(10),
+                            backend=BACKEND, target=TARGET, flat=True)
+        compiler.compile_program()
+        report = compiler.stats.report()
+        tokens, nodes = program_size(Reader(_nested(10)).read())
+        assert report["counts"]["tokens"] == tokens
+        assert report["counts"]["nodes"] == nodes
+        assert "optimize" not in report["seconds"]
+
+    @given(st.lists(programs(), min_size=1, max_size=10))
+    def test_random_programs(self, programs):
+        expected = outputs("flat-random-lists", programs)
+        with mock.patch.object(flat, "SHALLOW", 1):
+            assert outputs("flat-random", programs, flat=True) == expected
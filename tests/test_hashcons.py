@@ -0,0 +1,46 @@
+from unittest import TestCase
+import pytest
+
+from pasquim.hashcons import Node, NodeTable
+from pasquim.parser import Reader
+
+
+class TestNodeTable(TestCase):
+    def setUp(self):
+        self.table = NodeTable()
+
+    def test_identical_lists_share_a_node(self):
+        a = self.table.intern(Reader("(primcall + (primcall * x 2) 1)").read())
+        b = self.table.intern(["primcall", "+", ["primcall", "*", "x", 2], 1])
+        assert a is b
+        assert a[2] is self.table.intern(["primcall", "*", "x", 2])
+        assert len(self.table) == 2
+
+    def test_booleans_are_not_fixnums(self):
+        one = self.table.intern(["primcall", "add1", 1])
+        true = self.table.intern(["primcall", "add1", True])
+        assert one is not true
+        assert true.to_list() == ["primcall", "add1", True]
+
+    def test_shared_subtrees(self):
+        expr = self.table.intern([["f", "x"], ["f", "x"], ["g", ["f", "x"]]])
+        assert expr[0] is expr[1] is expr[2][1]
+        assert expr.size == 5
+        assert len(self.table) == 3
+
+    def test_names(self):
+        node = self.table.intern(
+            Reader("(let ((a (primcall + b 1))) (primcall eq? a 'c))").read())
+        assert node.names == {"let", "a", "b"}
+
+    def test_atoms(self):
+        assert self.table.intern(5) == 5
+        assert self.table.intern("x") == "x"
+        assert len(self.table) == 0
+
+    def test_immutable(self):
+        node = self.table.intern(["f", "x"])
+        with pytest.raises(AttributeError):
+            node.items = ("g",)
+        assert isinstance(node, Node)
+        assert list(node) == ["f", "x"]
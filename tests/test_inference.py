@@ -0,0 +1,173 @@
+from unittest import TestCase
+from hypothesis import settings, given, strategies as st
+from subprocess import run, PIPE
+
+from pasquim.compiler import Compiler
+from pasquim.inference import (
+    ANY, BOOLEAN, CHAR, FIXNUM, OTHER, PAIR, PROCEDURE, STRING, SYMBOL,
+    VECTOR, can_fail, decide, infer
+)
+from pasquim.parser import Reader
+from tests.binaries import outputs
+from tests.environment import BACKEND, TARGET
+from tests.strategies import programs
+
+
+TEMP_FOLDER = "tmp"
+
+settings.register_profile("test", deadline=None)
+settings.load_profile("test")
+
+
+def _infer(program, safe=False):
+    return infer(Reader(program).read(), safe=safe)
+
+
+def _decide(program, safe=False):
+    return decide(Reader(program).read(), safe=safe)
+
+
+def _type_of_output(line):
+    """Type of a value, as printed by the runtime."""
+    if line in ("#t", "#f"):
+        return BOOLEAN
+    if line.startswith("#\\"):
+        return CHAR
+    if line == "#<procedure>":
+        return PROCEDURE
+    if line.startswith(("(", "#(", '"')):
+        return {"(": PAIR, "#": VECTOR, '"': STRING}[line[0]]
+    return FIXNUM if line else OTHER  # words of no type print nothing
+
+
+class TestInfer(TestCase):
+    def test_literals(self):
+        assert _infer("1") == {FIXNUM}
+        assert _infer("#t") == {BOOLEAN}
+        assert _infer("a") == {CHAR}
+
+    def test_primitives(self):
+        assert _infer("(primcall + 1 (primcall add1 2))") == {FIXNUM}
+        assert _infer("(primcall char? 1)") == {BOOLEAN}
+
+    def test_wrong_operands(self):
+        assert _infer("(primcall + 1 a)") == ANY
+        # in safe mode, the primitive only returns with the right operands
+        assert _infer("(primcall + 1 a)", safe=True) == {FIXNUM}
+
+    def test_special_forms(self):
+        assert _infer("(if #t 1 a)") == {FIXNUM, CHAR}
+        assert _infer("(and 1 a)") == {BOOLEAN, CHAR}
+        assert _infer("(or 1 a)") == {FIXNUM, CHAR}
+        assert _infer("(let ((a 1)) a)") == {FIXNUM}
+        assert _infer("(let ((x 1)) (let ((x a) (y x)) y))") == {FIXNUM}
+
+    def test_heap_objects(self):
+        assert _infer("(primcall cons 1 2)") == {PAIR}
+        assert _infer("(primcall make-vector 2)") == {VECTOR}
+        assert _infer("(primcall string-ref (primcall make-string 2) 0)") \
+            == {CHAR}
+        assert _infer("(primcall car (primcall cons 1 2))") == ANY
+        assert _infer("(primcall vector-length 1)") == ANY
+        assert _infer("(primcall vector-length 1)", safe=True) == {FIXNUM}
+
+    def test_bulk_operations(self):
+        assert _infer("(primcall string-copy (primcall make-string 2))") \
+            == {STRING}
+        assert _infer("(primcall vector-fill! (primcall make-vector 1) a)") \
+            == {VECTOR}
+        assert _infer("(primcall string=? (primcall make-string 1) "
+                      "(primcall make-string 1))") == {BOOLEAN}
+        assert _infer("(primcall vector-copy 1)") == ANY
+
+    def test_malformed(self):
+        assert _infer("(primcall add1 1 2)") == ANY
+        assert _infer("(let (x 1) x)") == ANY
+        assert _infer("(if 1 2)") == ANY
+
+
+class TestDecide(TestCase):
+    def test_predicates(self):
+        assert _decide("(primcall integer? (primcall * 2 3))") is True
+        assert _decide("(primcall boolean? (primcall char=? a b))") is True
+        assert _decide("(primcall char? (if #t 1 #f))") is False
+        assert _decide("(primcall zero? a)") is False
+        assert _decide("(primcall = 1 #t)") is False
+
+    def test_unknown(self):
+        assert _decide("(primcall integer? (if #t 1 #f))") is None
+        assert _decide("(primcall zero? 1)") is None
+        assert _decide("(primcall = 1 2)") is None
+        # words computed from wrong operands may carry any tag
+        assert _decide("(primcall char? (primcall + 1 a))") is None
+
+    def test_pointer_predicates(self):
+        assert _decide("(primcall pair? (primcall cons 1 2))") is True
+        assert _decide("(primcall string? (primcall make-vector 1))") is \
+            False
+        assert _decide("(primcall = (primcall cons 1 2) 3)") is False
+        assert _decide("(primcall vector? (primcall car (primcall cons 1 "
+                       "2)))") is None
+
+    def test_procedures(self):
+        assert _infer("(lambda (x) x)") == {PROCEDURE}
+        assert _infer("((lambda (x) x) 1)") == ANY
+        assert _infer("(letrec ((f (lambda () (f)))) f)") == {PROCEDURE}
+        assert _decide("(primcall procedure? (lambda () 1))") is True
+        assert _decide("(primcall procedure? 1)") is False
+        assert not can_fail(Reader("(lambda () (primcall car 1))").read(),
+                            safe=True)
+        assert can_fail(Reader("((lambda () 1))").read(), safe=True)
+
+    def test_symbols(self):
+        assert _infer("'a") == {SYMBOL}
+        assert _infer("(primcall string->symbol (primcall make-string 1))") \
+            == {SYMBOL}
+        assert _decide("(primcall symbol? 'a)") is True
+        assert _decide("(primcall symbol? 1)") is False
+        assert _decide("(primcall eq? 1 'a)") is False
+        assert not can_fail(Reader("'a").read(), safe=True)
+
+    def test_range_checks_may_fail(self):
+        program = "(primcall vector-ref (primcall make-vector 1) 0)"
+        assert not can_fail(Reader(program).read())
+        assert can_fail(Reader(program).read(), safe=True)
+        program = ("(primcall string-copy! (primcall make-string 1) 0 "
+                   "(primcall make-string 1))")
+        assert can_fail(Reader(program).read(), safe=True)
+
+    def test_failing_arguments(self):
+        program = "(primcall integer? (primcall + 1 a))"
+        assert can_fail(Reader(program).read()[2], safe=True)
+        assert _decide(program, safe=True) is None
+        assert _decide("(primcall boolean? (primcall < 1 2))",
+                       safe=True) is True
+
+
+class TestSoundness(TestCase):
+    """The value a program prints must have one of its inferred types."""
+
+    @given(st.lists(programs(), min_size=1, max_size=10))
+    def test_random_programs(self, programs):
+        # chars print as a raw byte, which needn't be valid UTF-8
+        lines = [line.decode("latin-1") for line in
+                 outputs("inference-soundness", programs).splitlines()]
+        for program, line in zip(programs, lines):
+            assert _type_of_output(line) in _infer(program)
+
+    @given(st.lists(programs(), min_size=1, max_size=5))
+    def test_safe_mode(self, programs):
+        safe = f"{TEMP_FOLDER}/inference-safe/"
+        Compiler(safe, backend=BACKEND, target=TARGET, opt_level=1,
+                 safe=True).compile_many(programs)
+        expected = outputs("inference-unsafe", programs).splitlines()
+        for i, program in enumerate(programs):
+            results = run([safe + "a.out", str(i)], stdout=PIPE, stderr=PIPE)
+            if results.returncode == 0:
+                # checks never fail for programs that type inference proves
+                # well typed, and well typed programs print the same
+                assert results.stdout.splitlines() == [expected[i]]
+                line = results.stdout.decode("latin-1").strip()
+                assert _type_of_output(line) in _infer(program, safe=True)
+            else:
+                assert can_fail(Reader(program).read(), safe=True)
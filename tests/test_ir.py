@@ -0,0 +1,212 @@
+from unittest import TestCase
+import pytest
+from hypothesis import settings, given, strategies as st
+
+from pasquim import ir
+from pasquim.backend import allocate, generate
+from pasquim.compiler import Compiler
+from pasquim.emitter import Emitter
+from pasquim.parser import Reader
+from pasquim.primitives import immediate_rep
+from pasquim.target import X86, X86_64
+from tests.binaries import outputs
+from tests.environment import TARGET
+from tests.strategies import programs
+
+
+TEMP_FOLDER = "tmp"
+
+settings.register_profile("test", deadline=None)
+settings.load_profile("test")
+
+
+def _lower(program, target=X86):
+    return ir.lower(Reader(program).read(), target)
+
+
+class TestLowering(TestCase):
+    def test_dump(self):
+        func = _lower("(primcall + (primcall add1 1) (primcall * 2 3))")
+        assert func.dump() == (
+            "v0 = add 4, 4\n"
+            "v1 = shr 12, 2\n"
+            "v2 = imul v1, 8\n"
+            "v3 = add v0, v2\n"
+            "ret v3\n"
+        )
+
+    def test_tag_checks(self):
+        assert _lower("(primcall char? a)", X86_64).dump() == (
+            "v0 = and 24839, 255\n"
+            "v1 = eq v0, 7\n"
+            "ret v1\n"
+        )
+
+    def test_constants_on_the_right(self):
+        func = _lower("(primcall = 1 (primcall add1 2))")
+        assert str(func.instructions[1]) == "v1 = eq v0, 4"
+        # subtraction doesn't commute
+        func = _lower("(primcall - 1 (primcall add1 2))")
+        assert str(func.instructions[1]) == "v1 = sub 4, v0"
+
+    def test_large_constants(self):
+        func = _lower("(primcall + 1 1152921504606846975)", X86_64)
+        assert func.instructions[0] == ir.Instr(
+            "const", "v0", (1152921504606846975 * 8,))
+
+    def test_errors(self):
+        with pytest.raises(ValueError):
+            _lower("(primcall add1 1 2)")
+        with pytest.raises(ValueError):
+            _lower("(primcall + 1)")
+        with pytest.raises(ValueError):
+            _lower("(primcall frobnicate 1)")
+
+
+class TestAnalysis(TestCase):
+    def test_liveness(self):
+        func = _lower("(primcall + (primcall add1 1) (primcall sub1 3))")
+        assert ir.liveness(func) == [{"v0"}, {"v0", "v1"}, {"v2"}, set()]
+
+    def test_fold_constants(self):
+        func = ir.fold_constants(
+            _lower("(primcall < (primcall add1 1) (primcall sub1 4))"))
+        assert func.dump() == "ret 271\n"
+
+    def test_fold_wraps_around(self):
+        func = ir.fold_constants(_lower("(primcall add1 536870911)"))
+        assert func.dump() == f"ret {-2 ** 31}\n"
+
+    def test_dead_code(self):
+        func = ir.Function(X86)
+        unused = func.emit("add", 4, 4)
+        result = func.emit("sub", 8, 4)
+        func.instructions.append(ir.Instr("ret", None, (result,)))
+        func = ir.eliminate_dead_code(func)
+        assert unused not in [instr.dest for instr in func.instructions]
+        assert len(func.instructions) == 2
+
+
+class TestBackend(TestCase):
+    def test_accumulator(self):
+        func = _lower("(primcall add1 (primcall add1 1))")
+        assert set(allocate(func, X86).values()) == {"%eax"}
+
+    def test_spills(self):
+        # right-leaning nesting keeps every left operand live at once
+        program = "0"
+        for x in range(len(X86.scratch) + 2):
+            program = f"(primcall + (primcall add1 {x}) {program})"
+        locations = allocate(_lower(program), X86).values()
+        assert set(X86.scratch) <= set(locations)
+        assert "-4(%esp)" in locations
+
+    def test_generate(self):
+        out = Emitter(target=X86)
+        generate(_lower("(primcall - 1 (primcall add1 2))"), out)
+        assert out.lines == ["movl $8, %eax", "addl $4, %eax",
+                             "movl %eax, %ecx", "movl $4, %eax",
+                             "subl %ecx, %eax"]
+
+
+class TestDifferential(TestCase):
+    """Code generated through the IR must print exactly what code generated
+    straight from the syntax tree does."""
+
+    @given(st.lists(programs(), min_size=1, max_size=10))
+    def test_random_programs(self, programs):
+        expected = outputs("ir-random-tree", programs)
+        assert outputs("ir-random", programs, use_ir=True) == expected
+        assert outputs("ir-random-O1", programs, use_ir=True,
+                       opt_level=1) == expected
+
+    def test_conditionals(self):
+        programs = ["(if (primcall < 1 2) 3 4)", "(and 1 #f 2)",
+                    "(or #f (primcall add1 5))",
+                    "(let ((x 7)) (if (or (primcall zero? x) (primcall < x 3))"
+                    " 1 (if (and (primcall integer? x) x) x 2)))"]
+        for opt_level in (0, 1):
+            assert outputs(f"ir-conditionals-O{opt_level}", programs,
+                           use_ir=True, opt_level=opt_level) == \
+                b"3\n#f\n6\n7\n"
+
+    def test_procedures(self):
+        programs = [
+            "(letrec ((f (lambda (n acc) (if (primcall zero? n) acc "
+            "(f (primcall sub1 n) (primcall + acc n)))))) (f 10 0))",
+            "(let ((x 5)) (letrec ((add (lambda (y) (primcall + x y)))) "
+            "(add (primcall add1 x))))",
+        ]
+        for opt_level in (0, 1):
+            assert outputs(f"ir-procedures-O{opt_level}", programs,
+                           use_ir=True, opt_level=opt_level) == b"55\n11\n"
+
+    def test_falls_back_to_the_syntax_tree(self):
+        program = "(primcall car (primcall cons 1 (primcall add1 2)))"
+        with pytest.raises(ir.Unsupported):
+            _lower(program)
+        asm = []
+        for use_ir in (False, True):
+            compiler = Compiler(f"{TEMP_FOLDER}/asm/", program, target=TARGET,
+                                use_ir=use_ir)
+            compiler.compile_program()
+            asm.append(compiler.asm_program)
+        assert asm[0] == asm[1]
+        assert not Compiler(TEMP_FOLDER, "1", use_ir=True, safe=True).use_ir
+
+
+class TestLet(TestCase):
+    def test_variables_name_operands(self):
+        func = _lower("(let ((x (primcall add1 1)) (a 2)) (primcall + x a))")
+        assert func.dump() == (
+            "v0 = add 4, 4\n"
+            "v1 = add v0, 8\n"
+            "ret v1\n"
+        )
+
+
+class TestConditionals(TestCase):
+    def test_fused_branch(self):
+        func = _lower("(let ((x (primcall add1 1))) "
+                      "(if (primcall < x 8) x 1))")
+        assert func.dump() == (
+            "v0 = add 4, 4\n"
+            "jge v0, 32, L0\n"
+            "v1 = move v0\n"
+            "jump L1\n"
+            "label L0\n"
+            "v1 = move 4\n"
+            "label L1\n"
+            "ret v1\n"
+        )
+
+    def test_values_as_tests(self):
+        func = _lower("(let ((x 1)) (if (or x (and)) 1 2))")
+        assert [str(instr) for instr in func.instructions[:4]] == [
+            f"jeq 4, {immediate_rep(False)}, L3", "jump L2", "label L3",
+            "label L2"]
+
+    def test_liveness(self):
+        func = _lower("(let ((x (primcall add1 1)) (y (primcall sub1 1))) "
+                      "(if (primcall zero? x) y 1))")
+        live = ir.liveness(func)
+        # y is live on the path to the consequent only
+        assert str(func.instructions[2]) == "jne v0, 0, L0"
+        assert live[2] == {"v1"}
+        assert live[-2] == {"v2"}
+
+    def test_fold_branches(self):
+        func = ir.optimize(_lower("(if (primcall < 1 2) (primcall add1 3) 5)"))
+        assert func.dump() == "v0 = move 16\nret v0\n"
+        func = ir.optimize(_lower("(if (and 1 #f) 3 (primcall add1 4))"))
+        assert func.dump() == "v0 = move 20\nret v0\n"
+
+    def test_generate(self):
+        out = Emitter(target=X86)
+        generate(_lower("(let ((x (primcall add1 1))) "
+                        "(if (primcall < x 8) x 1))"), out)
+        assert out.lines == ["movl $4, %eax", "addl $4, %eax",
+                             "movl %eax, %ecx", "movl %ecx, %eax",
+                             "cmpl $32, %eax", "jge .L0",
+                             "movl %ecx, %eax", "jmp .L1", ".L0:",
+                             "movl $4, %eax", ".L1:"]
@@ -0,0 +1,254 @@
+from unittest import TestCase
+import pytest
+from hypothesis import settings, given, strategies as st
+
+from pasquim.compiler import Compiler
+from pasquim.optimizer import (
+    PassManager, eliminate_common_subexpressions, fold_constants, simplify
+)
+from pasquim.parser import Reader
+from pasquim.target import X86, X86_64
+from tests.binaries import outputs
+from tests.environment import TARGET
+from tests.strategies import programs
+
+
+TEMP_FOLDER = "tmp"
+
+settings.register_profile("test", deadline=None)
+settings.load_profile("test")
+
+
+def _read(program):
+    return Reader(program).read()
+
+
+def _fold(program, target=X86):
+    return fold_constants(_read(program), target)
+
+
+def _simplify(program, target=X86):
+    return simplify(_read(program), target)
+
+
+def _cse(program, target=X86):
+    return eliminate_common_subexpressions(_read(program), target)
+
+
+class TestConstantFolding(TestCase):
+    def test_arithmetic(self):
+        assert _fold("(primcall + 1 2)") == 3
+        assert _fold("(primcall - 1 2)") == -1
+        assert _fold("(primcall * 6 7)") == 42
+        assert _fold("(primcall add1 (primcall sub1 5))") == 5
+
+    def test_nested(self):
+        assert _fold("(primcall * (primcall + 1 2) (primcall - 10 4))") == 18
+
+    def test_predicates(self):
+        assert _fold("(primcall = 3 3)") is True
+        assert _fold("(primcall < 3 2)") is False
+        assert _fold("(primcall integer? a)") is False
+        assert _fold("(primcall char? a)") is True
+        assert _fold("(primcall zero? 0)") is True
+        assert _fold("(primcall char=? a b)") is False
+
+    def test_wraparound(self):
+        # fixnums wrap around exactly like the generated code does
+        assert _fold("(primcall add1 536870911)") == -2 ** 29
+        assert _fold("(primcall add1 1152921504606846975)",
+                     X86_64) == -2 ** 60
+        assert _fold("(primcall * 65536 65536)") == 0
+
+    def test_keeps_operands_without_literal(self):
+        # (+ #t 1) computes a word no literal compiles to
+        assert _fold("(primcall + #t 1)") == ['primcall', '+', True, 1]
+
+    def test_wrong_arity(self):
+        assert _fold("(primcall add1 1 2)") == ['primcall', 'add1', 1, 2]
+        assert _fold("(primcall +)") == ['primcall', '+']
+
+
+class TestSimplify(TestCase):
+    X = "(primcall add1 (primcall add1 7))"
+
+    def test_identities(self):
+        x = _read(self.X)
+        assert _simplify(f"(primcall + {self.X} 0)") == x
+        assert _simplify(f"(primcall + 0 {self.X})") == x
+        assert _simplify(f"(primcall - {self.X} 0)") == x
+        assert _simplify(f"(primcall * {self.X} 1)") == x
+
+    def test_left_multiplication_by_one_is_kept(self):
+        program = f"(primcall * 1 {self.X})"
+        assert _simplify(program) == _read(program)
+
+    def test_same_operands(self):
+        assert _simplify(f"(primcall - {self.X} {self.X})") == 0
+        assert _simplify(f"(primcall = {self.X} {self.X})") is True
+        assert _simplify(f"(primcall < {self.X} {self.X})") is False
+        assert _simplify("(primcall = 1 #t)") == ['primcall', '=', 1, True]
+
+    def test_inverse_calls(self):
+        assert _simplify("(primcall sub1 (primcall add1 a))") == 'a'
+
+    def test_multiplication_by_zero(self):
+        assert _simplify(f"(primcall * {self.X} 0)") == 0
+        assert _simplify(f"(primcall * 0 {self.X})") == 0
+
+
+class TestCommonSubexpressions(TestCase):
+    X = "(primcall * x y)"
+
+    def test_repeated(self):
+        assert _cse(f"(primcall + {self.X} {self.X})") == \
+            ['let', [['cse0', _read(self.X)]], ['primcall', '+', 'cse0',
+                                                'cse0']]
+
+    def test_largest_first(self):
+        program = (f"(primcall + (primcall sub1 {self.X}) "
+                   f"(primcall - (primcall sub1 {self.X}) {self.X}))")
+        assert _cse(program) == \
+            ['let', [['cse0', _read(self.X)]],
+             ['let', [['cse1', ['primcall', 'sub1', 'cse0']]],
+              ['primcall', '+', 'cse1', ['primcall', '-', 'cse1', 'cse0']]]]
+
+    def test_only_arithmetic(self):
+        for program in ["(primcall + (primcall < x y) (primcall < x y))",
+                        "(primcall + (primcall car p) (primcall car p))",
+                        f"(primcall + {self.X})"]:
+            assert _cse(program) == _read(program)
+
+    def test_fresh_names(self):
+        program = f"(let ((cse0 1)) (primcall + {self.X} {self.X}))"
+        assert _cse(program)[1] == [['cse1', _read(self.X)]]
+
+    def test_shadowed_variables(self):
+        program = ("(let ((x 1)) (primcall + (primcall * x x) "
+                   "(let ((x 2)) (primcall * x x))))")
+        assert _cse(program) == _read(program)
+        program = ("(let ((x 1)) (primcall + (primcall * x x) "
+                   "(let ((y 2)) (primcall - (primcall * x x) "
+                   "(primcall add1 y) (primcall add1 y)))))")
+        assert _cse(program) == \
+            ['let', [['x', 1]],
+             ['let', [['cse0', ['primcall', '*', 'x', 'x']]],
+              ['primcall', '+', 'cse0', ['let', [['y', 2]],
+               ['let', [['cse1', ['primcall', 'add1', 'y']]],
+                ['primcall', '-', 'cse0', 'cse1', 'cse1']]]]]]
+
+    def test_procedures(self):
+        program = f"(let ((f (lambda (x) {self.X}))) (primcall + {self.X} 1))"
+        assert _cse(program) == _read(program)
+        assert _cse("(lambda (a) (primcall + (primcall add1 a) "
+                    "(primcall add1 a)))") == \
+            ['lambda', ['a'], ['let', [['cse0', ['primcall', 'add1', 'a']]],
+                               ['primcall', '+', 'cse0', 'cse0']]]
+
+    def test_quotes(self):
+        program = "(primcall eq? (quote (primcall add1 a)) 'b)"
+        assert _cse(program) == _read(program)
+
+    def test_conditionals(self):
+        # only computed when the test holds, so not before it
+        program = (f"(if (primcall integer? x) "
+                   f"(primcall + {self.X} {self.X}) 0)")
+        assert _cse(program) == \
+            ['if', ['primcall', 'integer?', 'x'],
+             ['let', [['cse0', _read(self.X)]],
+              ['primcall', '+', 'cse0', 'cse0']], 0]
+        for program in [f"(if b {self.X} {self.X})",
+                        f"(primcall + {self.X} (if b {self.X} 0))",
+                        f"(and b {self.X} {self.X})",
+                        f"(or b {self.X} {self.X})"]:
+            assert _cse(program) == _read(program)
+        # the test always runs
+        assert _cse(f"(primcall + {self.X} (if {self.X} 1 0))") == \
+            ['let', [['cse0', _read(self.X)]],
+             ['primcall', '+', 'cse0', ['if', 'cse0', 1, 0]]]
+
+    def test_compiles_once(self):
+        program = f"(let ((x 6) (y 7)) (primcall + {self.X} {self.X}))"
+        compiler = Compiler(TEMP_FOLDER, program, target=TARGET,
+                            opt_level=1)
+        compiler.compile_program()
+        assert compiler.asm_program.count("imul") == 1
+
+
+class TestPassManager(TestCase):
+    def test_levels(self):
+        assert PassManager(X86).passes == []
+        names = [info.name for info in PassManager(X86, 1).passes]
+        assert names == ['constant-folding', 'simplify', 'cse']
+
+    def test_enable_disable(self):
+        manager = PassManager(X86, 1, disable=['simplify'])
+        assert [info.name for info in manager.passes] == ['constant-folding',
+                                                          'cse']
+        manager = PassManager(X86, 0, enable=['simplify'])
+        assert [info.name for info in manager.passes] == ['simplify']
+
+    def test_safe_mode(self):
+        # folding (+ a 64) to b would lose the type error it raises
+        assert PassManager(X86, 1, safe=True).passes == []
+
+    def test_unknown_pass(self):
+        with pytest.raises(ValueError):
+            PassManager(X86, enable=['inline-everything'])
+
+    def test_report(self):
+        compiler = Compiler(TEMP_FOLDER, "(primcall + 1 (primcall * 2 3))",
+                            target=TARGET, opt_level=1)
+        report = compiler.pass_report()
+        assert [row['pass'] for row in report] == ['constant-folding',
+                                                   'simplify', 'cse']
+        assert report[0]['after'] == 1
+        assert report[0]['removed'] == report[0]['before'] - 1
+        assert report[1]['removed'] == 0
+
+
+class TestDifferential(TestCase):
+    """Optimized and unoptimized code must print exactly the same."""
+
+    @given(st.lists(programs(), min_size=1, max_size=10))
+    def test_random_programs(self, programs):
+        assert outputs("optimizer-O0", programs, opt_level=0) == \
+            outputs("optimizer-O1", programs, opt_level=1)
+
+
+class TestScopes(TestCase):
+    def test_variables_are_not_literals(self):
+        program = "(let ((a 1)) (primcall char? a))"
+        assert _fold(program) == _read(program)
+        assert _fold("(let ((a 1)) (primcall char? b))") == \
+            ['let', [['a', 1]], True]
+
+    def test_bindings_see_outer_scope(self):
+        assert _fold("(let ((a (primcall char? a))) a)") == \
+            ['let', [['a', True]], 'a']
+
+    def test_folded_char_not_captured(self):
+        # folding to the char a inside the scope of variable a is wrong
+        program = "(let ((a 1)) (primcall sub1 (primcall add1 a)))"
+        assert _simplify(program) == ['let', [['a', 1]], 'a']
+        assert _fold("(primcall - b 64)") == 'a'  # 64 is 256 as a word
+        program = "(let ((a 1)) (primcall - b 64))"
+        assert _fold(program) == _read(program)
+
+    def test_procedures(self):
+        program = "(lambda (a) (primcall char? a))"
+        assert _fold(program) == _read(program)
+        program = "(letrec ((a (lambda () (primcall char? a)))) (a))"
+        assert _fold(program) == _read(program)
+        assert _fold("(f (primcall add1 1) (lambda (b) a))") == \
+            ['f', 2, ['lambda', ['b'], 'a']]
+
+    def test_quotes(self):
+        assert _fold("(let ((x 1)) 'x)") == ['let', [['x', 1]], ['quote', 'x']]
+        assert _simplify("(primcall eq? 'a 'a)") is True
+        assert _simplify("(primcall eq? 'a 'b)") is False
+
+    def test_conditionals(self):
+        assert _fold("(if (primcall < 1 2) (primcall + 1 1) 0)") == \
+            ['if', True, 2, 0]
+        assert _simplify("(and (primcall - x x) b)") == ['and', 0, 'b']
@@ -1,6 +1,6 @@
 from unittest import TestCase
 
-from pasquim.parser import Lexer, Parser
+from pasquim.parser import Lexer, Parser, Reader
 
 
 class TestParserCircle(TestCase):
@@ -32,3 +32,58 @@ class TestParserBool(TestCase):
         output = ['logior', True, False]
 
         assert Parser(Lexer(self.program).tokenize()).parse() == output
+
+
+class TestReader(TestCase):
+    def test_matches_parser(self):
+        program = "(begin (define r 10) (* pi (* r r)))"
+
+        assert (Reader(program).read() ==
+                Parser(Lexer(program).tokenize()).parse())
+
+    def test_atom(self):
+        assert Reader("  -42 ").read() == -42
+        assert Reader("#t").read() is True
+
+    def test_quote(self):
+        assert Reader("'foo").read() == ['quote', 'foo']
+        assert Reader("(f 'a '(b 'c) ''d)").read() == \
+            ['f', ['quote', 'a'], ['quote', ['b', ['quote', 'c']]],
+             ['quote', ['quote', 'd']]]
+        assert Reader("' foo'bar").read_all() == \
+            [['quote', 'foo'], ['quote', 'bar']]
+
+    def test_quote_without_datum(self):
+        with self.assertRaises(SyntaxError):
+            Reader("(f ')").read()
+        with self.assertRaises(SyntaxError):
+            Reader("'").read()
+
+    def test_multiple_forms(self):
+        forms = Reader("(primcall add1 1)\n2 (a (b))").read_all()
+
+        assert forms == [['primcall', 'add1', 1], 2, ['a', ['b']]]
+
+    def test_positions(self):
+        form = Reader("1\n  (a\n (b c))").read_all()[1]
+
+        assert (form.line, form.col) == (2, 3)
+        assert (form[1].line, form[1].col) == (3, 2)
+
+    def test_deep_nesting(self):
+        depth = 100000
+        expr = Reader("(" * depth + ")" * depth).read()
+
+        for _ in range(depth - 1):
+            expr = expr[0]
+        assert expr == []
+
+    def test_unexpected_close(self):
+        with self.assertRaises(SyntaxError):
+            Reader("(a))").read_all()
+
+    def test_unexpected_eof(self):
+        with self.assertRaises(SyntaxError):
+            Reader("(a (b)").read()
+        with self.assertRaises(SyntaxError):
+            Reader("   ").read()
@@ -0,0 +1,123 @@
+import io
+from contextlib import redirect_stderr
+
+from unittest import TestCase
+import pytest
+from hypothesis import settings, given, strategies as st
+from subprocess import run, PIPE
+
+from pasquim.compiler import Compiler
+from pasquim.peephole import Peephole
+from pasquim.target import X86, X86_64
+from tests.binaries import outputs
+from tests.environment import BACKEND, TARGET
+from tests.strategies import programs
+
+
+TEMP_FOLDER = "tmp"
+
+settings.register_profile("test", deadline=None)
+settings.load_profile("test")
+
+
+def _optimize(lines, target=X86):
+    return Peephole(target).run(lines)
+
+
+def _boolean(setcc, target=X86):
+    s, ax = target.suffix, target.ax
+    return [f"mov{s} $0, {ax}", f"{setcc} %al",
+            f"sal{s} $8, {ax}", f"or{s} $15, {ax}"]
+
+
+class TestRules(TestCase):
+    def test_redundant_move(self):
+        assert _optimize(["movl %ecx, %ecx", "addl $4, %eax"]) == \
+            ["addl $4, %eax"]
+
+    def test_add_zero(self):
+        assert _optimize(["movl %ecx, %eax", "addl $0, %eax"]) == \
+            ["movl %ecx, %eax"]
+        # the flags of the addition are read by the next instruction
+        lines = ["addl $0, %eax", "jo overflow"]
+        assert _optimize(lines) == lines
+
+    def test_store_reload(self):
+        assert _optimize(["movl %eax, -4(%esp)", "movl -4(%esp), %eax"]) == \
+            ["movl %eax, -4(%esp)"]
+        assert _optimize(["movq %rax, %rcx", "movq %rcx, %rax"], X86_64) == \
+            ["movq %rax, %rcx"]
+
+    def test_dead_load(self):
+        assert _optimize(["movl $4, %eax", "movl %ecx, %eax"]) == \
+            ["movl %ecx, %eax"]
+        lines = ["movl $4, %eax", "movl -4(%esp,%eax), %eax"]
+        assert _optimize(lines) == lines
+
+    def test_constant_arithmetic(self):
+        assert _optimize(["movl $20, %eax", "addl $4, %eax",
+                          "subl $8, %eax"]) == ["movl $16, %eax"]
+        assert _optimize(["movl $2147483644, %eax", "addl $4, %eax"]) == \
+            ["movl $-2147483648, %eax"]
+        assert _optimize(["movq $2147483640, %rax", "addq $8, %rax"],
+                         X86_64) == ["movabsq $2147483648, %rax"]
+
+    def test_labels_are_barriers(self):
+        lines = ["movl $20, %eax", "L1:", "addl $4, %eax"]
+        assert _optimize(lines) == lines
+
+    def test_boolean_compared_with_constant(self):
+        for target in (X86, X86_64):
+            s, ax = target.suffix, target.ax
+            test = [f"mov{s} $0, {ax}", "sete %al"]
+            # (= (< x y) #t) is (< x y)
+            assert _optimize(_boolean("setl", target) +
+                             [f"cmp{s} $271, {ax}"] + test, target) == \
+                [f"mov{s} $0, {ax}", "setl %al"]
+            # (= (< x y) #f) is (not (< x y))
+            assert _optimize(_boolean("setl", target) +
+                             [f"cmp{s} $15, {ax}"] + test, target) == \
+                [f"mov{s} $0, {ax}", "setge %al"]
+            # (zero? (< x y)) is always #f
+            assert _optimize(_boolean("setl", target) +
+                             [f"cmp{s} $0, {ax}"] + test, target) == \
+                [f"mov{s} $0, {ax}"]
+
+    def test_boolean_tag_checked(self):
+        # (boolean? (= x y)) is always #t
+        assert _optimize(_boolean("sete") +
+                         ["andl $255, %eax", "cmpl $15, %eax",
+                          "movl $0, %eax", "sete %al"]) == ["movl $1, %eax"]
+
+    def test_selected_rules(self):
+        lines = ["movl $20, %eax", "addl $0, %eax"]
+        assert Peephole(X86, enable=['add-zero']).run(lines) == \
+            ["movl $20, %eax"]
+        with pytest.raises(ValueError):
+            Peephole(X86, enable=['no-such-rule'])
+
+    def test_counts(self):
+        peephole = Peephole(X86)
+        peephole.run(["movl $20, %eax", "addl $4, %eax", "addl $0, %eax"])
+        assert (peephole.before, peephole.after) == (3, 1)
+        assert peephole.hits['constant-arithmetic'] == 2
+        assert peephole.summary().startswith("peephole: 3 -> 1 instructions")
+
+
+class TestDifferential(TestCase):
+    """Binaries built with and without the peephole optimizer must print
+    exactly the same."""
+
+    @given(st.lists(programs(), min_size=1, max_size=10))
+    def test_random_programs(self, programs):
+        assert outputs("peephole-off", programs, peephole=False) == \
+            outputs("peephole-on", programs, peephole=True)
+
+    def test_stats(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            Compiler(TEMP_FOLDER, "(primcall boolean? (primcall < 1 2))",
+                     backend=BACKEND, target=TARGET, peephole=True,
+                     peephole_stats=True).compile_to_binary()
+        assert "boolean-tag-test: 1" in stderr.getvalue()
+        assert run(TEMP_FOLDER + "/a.out", stdout=PIPE).stdout == b"#t\n"
@@ -0,0 +1,212 @@
+import io
+import json
+import os
+from contextlib import redirect_stderr
+
+from unittest import TestCase
+import pytest
+from hypothesis import settings, given
+from subprocess import run, PIPE
+
+from pasquim.__main__ import main
+from pasquim.compiler import Compiler
+from pasquim.parser import Reader
+from pasquim.profiling import (
+    CompileStats, Instrumentation, program_size, read_profile
+)
+from tests.environment import BACKEND, TARGET
+from tests.strategies import programs
+
+
+TEMP_FOLDER = "tmp"
+PROFILE = os.path.join(TEMP_FOLDER, "pasquim.prof")
+
+settings.register_profile("test", deadline=None)
+settings.load_profile("test")
+
+needs_gcc = pytest.mark.skipif(BACKEND != "gcc",
+                               reason="instrumentation needs the gcc backend")
+
+
+def _run_instrumented(program, instrument, path=TEMP_FOLDER, **kwargs):
+    """Runs program instrumented, returning its output and profile."""
+    Compiler(path, program, target=TARGET, instrument=instrument,
+             **kwargs).compile_to_binary()
+    result = run(os.path.join(path, "a.out"), stdout=PIPE,
+                 env={**os.environ, "PASQUIM_PROFILE": PROFILE})
+    return result.stdout, read_profile(PROFILE)
+
+
+class TestProgramSize(TestCase):
+    def test_tokens_and_nodes(self):
+        assert program_size(Reader("(primcall + 1 (f))").read()) == (8, 6)
+        assert program_size(Reader("7").read()) == (1, 1)
+
+    def test_quote_shorthand(self):
+        assert program_size(Reader("(f 'a)").read()) == (5, 5)
+        assert program_size(Reader("(f (quote a))").read()) == (7, 5)
+        assert program_size(Reader("'(a b)").read()) == (5, 5)
+
+    def test_deep_nesting(self):
+        depth = 100000
+        expr = Reader("(" * depth + ")" * depth).read()
+        assert program_size(expr) == (2 * depth, depth)
+
+
+class TestCompileStats(TestCase):
+    def test_add(self):
+        stats, other = CompileStats(), CompileStats()
+        stats.add_time("read", 1.0)
+        other.add_time("read", 0.5)
+        other.add_time("build", 2.0)
+        other.count("nodes", 3)
+        stats.add(other)
+        assert stats.seconds == {"read": 1.5, "build": 2.0}
+        assert stats.counts["nodes"] == 3
+        assert stats.total == 3.5
+
+    def test_report_orders_phases(self):
+        stats = CompileStats()
+        stats.add_time("write", 1.0)
+        stats.add_time("read", 1.0)
+        stats.count("nodes", 10)
+        report = stats.report()
+        assert list(report["seconds"]) == ["read", "write"]
+        assert report["rates"] == {"nodes_read_per_second": 10.0}
+
+
+class TestCompilerStats(TestCase):
+    program = "(let ((x (primcall + 1 2))) (primcall * x x))"
+
+    def test_phases(self):
+        compiler = Compiler(TEMP_FOLDER, self.program, backend=BACKEND,
+                            target=TARGET, opt_level=1)
+        compiler.compile_to_binary()
+        stats = compiler.stats
+        assert set(stats.seconds) == {"read", "optimize", "convert",
+                                      "codegen", "peephole", "write", "build"}
+        assert stats.counts["tokens"] == 20
+        assert stats.counts["nodes"] == 15
+        assert stats.counts["instructions"] == len(compiler.emitter)
+        with open(os.path.join(TEMP_FOLDER, "compiled.s")) as f:
+            assert stats.counts["bytes"] == len(f.read())
+        assert run(TEMP_FOLDER + "/a.out", stdout=PIPE).stdout == b"9\n"
+
+    def test_repeated_compilations(self):
+        compiler = Compiler(TEMP_FOLDER, self.program, target=TARGET)
+        compiler.compile_program()
+        first = dict(compiler.stats.counts)
+        compiler.compile_program()
+        assert compiler.stats.counts == first
+        assert "build" not in compiler.stats.seconds
+
+    def test_batch(self):
+        compiler = Compiler(TEMP_FOLDER, target=TARGET)
+        compiler.compile_batch(["(f 1)", "2"])
+        assert compiler.stats.counts["tokens"] == 5
+
+
+class TestInstrumentationSites(TestCase):
+    def test_names(self):
+        instrumentation = Instrumentation()
+        assert instrumentation.site("car", Reader("(primcall car x)").read())\
+            == 0
+        assert instrumentation.site("+", ["primcall", "+", 1, 2]) == 1
+        assert instrumentation.sites == ["car 1:1", "+"]
+        assert instrumentation.calls(1) == ".Lprofile+16"
+        assert instrumentation.cycle_count(1) == ".Lprofile+24"
+
+    def test_unknown_mode(self):
+        with pytest.raises(ValueError):
+            Compiler(TEMP_FOLDER, "1", instrument="seconds")
+        with pytest.raises(ValueError):
+            Compiler(TEMP_FOLDER, "1", backend="builtin", instrument="counts")
+
+    def test_off_leaves_code_unchanged(self):
+        program = "(primcall + 1 (primcall car (primcall cons 2 3)))"
+        compilers = [Compiler(TEMP_FOLDER, program, target=TARGET,
+                              instrument=instrument)
+                     for instrument in (None, "counts")]
+        for compiler in compilers:
+            compiler.compile_program()
+        plain, instrumented = (c.asm_program for c in compilers)
+        assert "scheme_profile" not in plain
+        assert "scheme_profile" in instrumented
+
+
+@needs_gcc
+class TestInstrumentation(TestCase):
+    program = ("(let ((v (primcall make-vector 3 0)))\n"
+               "  (letrec ((loop (lambda (i) (if (primcall < i 3) "
+               "(let ((u (primcall vector-set! v i (primcall * i i)))) "
+               "(loop (primcall add1 i))) v))))\n"
+               "    (loop 0)))")
+
+    def test_counts(self):
+        output, profile = _run_instrumented(self.program, "counts")
+        assert output == b"#(0 1 4)\n"
+        assert {row["site"]: row["calls"] for row in profile} == {
+            "make-vector 1:10": 1, "< 2:34": 4, "vector-set! 2:60": 3,
+            "* 2:86": 3, "add1 2:112": 3}
+        assert all("cycles" not in row for row in profile)
+
+    def test_cycles(self):
+        output, profile = _run_instrumented(self.program, "cycles",
+                                            opt_level=1)
+        assert output == b"#(0 1 4)\n"
+        assert [row["calls"] for row in profile] == [4, 3, 3, 3, 1]
+        assert all(row["cycles"] > 0 for row in profile)
+
+    def test_collections_during_calls(self):
+        # the start of each call is on the stack when the collector runs
+        program = ("(letrec ((loop (lambda (i acc) (if (primcall zero? i) "
+                   "(primcall car acc) (loop (primcall sub1 i) (primcall "
+                   "cons (primcall make-vector 4 i) acc)))))) "
+                   "(primcall vector-length (loop 1000 #f)))")
+        Compiler(TEMP_FOLDER, program, target=TARGET,
+                 instrument="cycles").compile_to_binary()
+        result = run(TEMP_FOLDER + "/a.out", stdout=PIPE,
+                     env={**os.environ, "PASQUIM_PROFILE": PROFILE,
+                          "PASQUIM_HEAP_SIZE": "1024"})
+        assert result.stdout == b"4\n"
+        assert {row["site"].split()[0]: row["calls"]
+                for row in read_profile(PROFILE)}["cons"] == 1000
+
+    @given(programs())
+    def test_random_programs(self, program):
+        Compiler(TEMP_FOLDER, program, target=TARGET).compile_to_binary()
+        plain = run(TEMP_FOLDER + "/a.out", stdout=PIPE).stdout
+        for instrument in Instrumentation.modes:
+            assert _run_instrumented(program, instrument,
+                                     TEMP_FOLDER + "/i")[0] == plain
+
+
+class TestCommandLine(TestCase):
+    def setUp(self):
+        os.makedirs(TEMP_FOLDER, exist_ok=True)
+        self.program = os.path.join(TEMP_FOLDER, "program.scm")
+        with open(self.program, "w") as f:
+            f.write("(primcall add1 41)")
+
+    def _compile(self, *args):
+        return main(["compile", self.program, "-o", TEMP_FOLDER,
+                     "--backend", BACKEND, "--target", TARGET, *args])
+
+    def test_compile(self):
+        assert self._compile() == 0
+        assert run(TEMP_FOLDER + "/a.out", stdout=PIPE).stdout == b"42\n"
+
+    def test_profile_summary(self):
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            self._compile("--profile")
+        assert "codegen" in stderr.getvalue()
+        assert "5 tokens, 4 nodes" in stderr.getvalue()
+
+    def test_profile_json(self):
+        report = os.path.join(TEMP_FOLDER, "profile.json")
+        self._compile("-O", "1", "--profile", report)
+        with open(report) as f:
+            profile = json.load(f)
+        assert profile["counts"]["nodes"] == 4
+        assert profile["seconds"]["build"] > 0
@@ -0,0 +1,194 @@
+import asyncio
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from pasquim import client
+from pasquim.server import CompileServer, percentile
+from tests.environment import BACKEND, TARGET
+
+
+LOOP = "(letrec ((f (lambda (n) (f (primcall add1 n))))) (f 0))"
+
+
+class TestServer(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmp = TemporaryDirectory()
+        cls.socket = os.path.join(cls.tmp.name, "pasquim.sock")
+        cls.server = subprocess.Popen(
+            [sys.executable, "-m", "pasquim", "serve", "--socket",
+             cls.socket, "-j", "2", "--backend", BACKEND, "--target",
+             TARGET])
+        deadline = time.monotonic() + 60
+        while not os.path.exists(cls.socket):
+            assert cls.server.poll() is None, "server exited"
+            assert time.monotonic() < deadline, "server didn't start"
+            time.sleep(0.05)
+
+    @classmethod
+    def tearDownClass(cls):
+        if cls.server.poll() is None:
+            cls.server.terminate()
+            cls.server.wait(30)
+        cls.tmp.cleanup()
+
+    def _request(self, message):
+        return client.request(message, self.socket)
+
+    def _run(self, program, **message):
+        return self._request({"op": "run", "program": program, **message})
+
+    def test_run(self):
+        result = self._run("(primcall + 1 41)")
+        assert result["status"] == "ok"
+        assert result["stdout"] == "42\n"
+        assert result["compile_seconds"] > 0
+
+    def test_compile(self):
+        output = os.path.join(self.tmp.name, "build")
+        result = self._request({"op": "compile", "output": output,
+                                "program": "(primcall add1 6)"})
+        assert result["status"] == "ok"
+        assert result["run_seconds"] is None
+        run = subprocess.run([os.path.join(output, "a.out")],
+                             stdout=subprocess.PIPE, text=True)
+        assert run.stdout == "7\n"
+
+    def test_concurrent_requests(self):
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(
+                lambda i: self._run(f"(primcall * {i} 2)"), range(16)))
+        assert [r["stdout"] for r in results] == \
+            [f"{i * 2}\n" for i in range(16)]
+
+    def test_options(self):
+        result = self._run("(primcall car 1)", options={"safe": True})
+        assert result["status"] == "failed"
+        result = self._run("1", options={"frobnicate": True})
+        assert result["status"] == "error"
+        assert "frobnicate" in result["error"]
+
+    def test_errors(self):
+        assert self._request({"op": "frobnicate"})["status"] == "error"
+        assert self._request({"op": "compile", "program": "1"})["status"] \
+            == "error"
+        result = self._run("(primcall frobnicate 1)")
+        assert result["status"] == "error"
+        assert "frobnicate" in result["error"]
+
+    def test_timeout(self):
+        result = self._run(LOOP, timeout=1)
+        assert result["status"] == "timeout"
+        assert self._run("5")["stdout"] == "5\n"
+
+    def test_bad_timeouts(self):
+        errors = self._request({"op": "stats"})["statuses"].get("error", 0)
+        for timeout in ("abc", -1, 0, True):
+            result = self._run("5", timeout=timeout)
+            assert result["status"] == "error"
+            assert "timeout" in result["error"]
+        stats = self._request({"op": "stats"})
+        assert stats["statuses"]["error"] >= errors + 4
+
+    def test_stats(self):
+        self._run("1")
+        stats = self._request({"op": "stats"})
+        assert stats["workers"] == 2
+        assert stats["ops"]["run"] >= 1
+        latency = stats["latency"]["run"]
+        assert 0 < latency["p50"] <= latency["p90"] <= latency["p99"] \
+            <= latency["max"]
+
+    def test_client(self):
+        path = os.path.join(self.tmp.name, "program.scm")
+        with open(path, "w") as f:
+            f.write("(primcall - 50 8)")
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            status = client.main(["--socket", self.socket, "run", path])
+        assert status == 0
+        assert stdout.getvalue() == "42\n"
+
+        stdout = io.StringIO()
+        with redirect_stdout(stdout):
+            client.main(["--socket", self.socket, "stats"])
+        assert json.loads(stdout.getvalue())["requests"] >= 1
+
+    def test_client_without_server(self):
+        missing = os.path.join(self.tmp.name, "missing.sock")
+        assert client.main(["--socket", missing, "stats"]) == 1
+
+
+class TestShutdown(TestCase):
+    def test_shutdown(self):
+        with TemporaryDirectory() as tmp:
+            socket = os.path.join(tmp, "pasquim.sock")
+            server = subprocess.Popen(
+                [sys.executable, "-m", "pasquim", "serve", "--socket",
+                 socket, "-j", "1", "--backend", BACKEND, "--target",
+                 TARGET])
+            deadline = time.monotonic() + 60
+            while not os.path.exists(socket):
+                assert time.monotonic() < deadline
+                time.sleep(0.05)
+            assert client.request({"op": "shutdown"}, socket)["status"] \
+                == "ok"
+            assert server.wait(30) == 0
+            assert not os.path.exists(socket)
+
+
+class _BrokenPool(Executor):
+    def submit(self, fn, *args, **kwargs):
+        raise BrokenProcessPool("a worker died")
+
+
+def test_worker_errors():
+    with TemporaryDirectory() as tmp:
+        server = CompileServer(os.path.join(tmp, "pasquim.sock"),
+                               workers=1, backend=BACKEND, target=TARGET)
+        server._scratch, server._pool = tmp, _BrokenPool()
+        line = json.dumps({"op": "run", "program": "1"}).encode()
+        response = asyncio.run(server.handle(line))
+    assert response["status"] == "error"
+    assert "a worker died" in response["error"]
+    assert server.stats["ops"] == {"run": 1}
+    assert server.stats["statuses"] == {"error": 1}
+    assert server.stats["active"] == 0
+    server._pool.shutdown()
+
+
+def test_worker_crash():
+    with TemporaryDirectory() as tmp:
+        server = CompileServer(os.path.join(tmp, "pasquim.sock"),
+                               workers=1, backend=BACKEND, target=TARGET)
+        server._scratch, server._pool = tmp, server._new_pool()
+        crashed = server._pool
+        try:
+            crashed.submit(os._exit, 1).result()
+        except BrokenProcessPool:
+            pass
+        line = json.dumps({"op": "run", "program": "1"}).encode()
+        first = asyncio.run(server.handle(line))
+        second = asyncio.run(server.handle(line))
+        server._pool.shutdown()
+    assert first["status"] == "error"
+    assert server._pool is not crashed
+    assert second["status"] == "ok"
+    assert second["stdout"] == "1\n"
+
+
+def test_percentile():
+    samples = [float(i) for i in range(1, 101)]
+    assert percentile(samples, 50) == 50.0
+    assert percentile(samples, 99) == 99.0
+    assert percentile(samples, 100) == 100.0
+    assert percentile([3.0], 90) == 3.0
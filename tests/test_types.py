@@ -3,6 +3,7 @@ from hypothesis import settings, given, strategies as st
 
 from pasquim import primitives
 from pasquim.primitives import immediate_rep
+from pasquim.target import X86_64
 
 
 INT_RANGE = [-2 ** 29, 2 ** 29 + 1]  # 30-bits
@@ -36,3 +37,16 @@ class TestRepresentation(TestCase):
     def test_bool(self):
         assert immediate_rep(True) == int('100001111', 2)
         assert immediate_rep(False) == int('1111', 2)
+
+
+class TestRepresentation64(TestCase):
+    """Checks the 64-bit represetation for each data type"""
+
+    @given(st.integers(-2 ** 60, 2 ** 60 - 1))
+    def test_integer(self, x):
+        assert immediate_rep(x, X86_64) == x << 3
+        assert immediate_rep(x, X86_64) & X86_64.fixnum_mask == 0
+
+    def test_char_and_bool_unchanged(self):
+        for x in ('a', True, False):
+            assert immediate_rep(x, X86_64) == immediate_rep(x)
@@ -0,0 +1,129 @@
+from pathlib import Path
+from shutil import which
+from subprocess import run, PIPE
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+import pytest
+
+from pasquim.compiler import Compiler
+from pasquim.elf import RUNTIME_SOURCE
+from pasquim.x86 import Assembler, AssemblerError
+
+
+TEMP_FOLDER = "tmp"
+PROGRAMS = [
+    "42", "-7", "#t", "#f", "q",
+    "(primcall add1 (primcall sub1 9))",
+    "(primcall + 3 (primcall * -4 5))",
+    "(primcall - (primcall * 7 7) 100)",
+    "(primcall < (primcall + 1 2) 3)",
+    "(primcall = (primcall + 1 2) 3)",
+    "(primcall char=? b b)",
+    "(primcall integer? (primcall boolean? (primcall char? x)))",
+    "(primcall zero? (primcall - 5 5))",
+]
+
+
+def _encode(lines):
+    asm = Assembler()
+    asm.feed(lines)
+    asm.link({".text": 0, ".data": 0})
+    return bytes(asm.sections[".text"])
+
+
+def _gas_encode(lines):
+    """Assembles lines with the GNU assembler and returns the text bytes."""
+    with TemporaryDirectory() as tmp:
+        source, obj, text = (Path(tmp).joinpath(name)
+                             for name in ("x.s", "x.o", "x.bin"))
+        source.write_text("\n".join(lines) + "\n")
+        run(["as", "--32", str(source), "-o", str(obj)], check=True)
+        run(["objcopy", "-O", "binary", "-j", ".text", str(obj), str(text)],
+            check=True)
+        return text.read_bytes()
+
+
+def _instructions(program):
+    compiler = Compiler(TEMP_FOLDER, program)
+    compiler.compile_program()
+    return [line for line in compiler.asm_program.splitlines()
+            if not line.startswith(".") and not line.endswith(":")]
+
+
+@pytest.mark.skipif(which("as") is None, reason="GNU as is not installed")
+class TestEncodingMatchesGas(TestCase):
+    def test_compiled_programs(self):
+        for program in PROGRAMS:
+            lines = _instructions(program)
+            assert _encode(lines) == _gas_encode(lines), program
+
+    def test_runtime_instructions(self):
+        # branch displacements are the only encodings allowed to differ
+        lines = [line.split("#")[0].strip()
+                 for line in RUNTIME_SOURCE.read_text().splitlines()]
+        lines = [line for line in lines
+                 if line and not line.startswith((".", "j", "call"))
+                 and not line.endswith(":") and "$__" not in line
+                 and "__rts_heap" not in line
+                 and "__rts_symbols" not in line
+                 and "scheme_entr" not in line
+                 and "scheme_symbol" not in line]
+        for line in lines:
+            assert _encode([line]) == _gas_encode([line]), line
+
+    def test_string_instructions(self):
+        lines = ["rep movsb", "rep movsl", "rep stosb", "rep stosl",
+                 "repe cmpsb", "std", "cld"]
+        assert _encode(lines) == _gas_encode(lines)
+
+
+class TestAssembler(TestCase):
+    def test_labels(self):
+        code = _encode(["jmp end", "ret", "end:", "ret"])
+        assert code == b"\xe9\x01\x00\x00\x00\xc3\xc3"
+
+    def test_prefixes(self):
+        assert _encode(["rep stosl", "repe cmpsb"]) == b"\xf3\xab\xf3\xa6"
+
+    def test_unknown_instruction(self):
+        with pytest.raises(AssemblerError):
+            _encode(["frobl %eax"])
+
+    def test_undefined_symbol(self):
+        asm = Assembler()
+        asm.feed(["call nowhere"])
+        with pytest.raises(AssemblerError):
+            asm.link({".text": 0, ".data": 0})
+
+
+class TestBuiltinBackend(TestCase):
+    def test_programs(self):
+        for program in PROGRAMS:
+            Compiler(TEMP_FOLDER, program,
+                     backend="builtin").compile_to_binary()
+            results = run(TEMP_FOLDER+"/a.out", stdout=PIPE)
+            expected = {
+                "42": "42", "-7": "-7", "#t": "#t", "#f": "#f", "q": "#\\q"
+            }.get(program)
+            if expected is not None:
+                assert results.stdout == (expected + "\n").encode()
+
+    def test_batch(self):
+        Compiler(TEMP_FOLDER, backend="builtin").compile_many(PROGRAMS)
+        results = run([TEMP_FOLDER+"/a.out"], stdout=PIPE)
+        assert results.stdout.decode().splitlines() == [
+            "42", "-7", "#t", "#f", "#\\q", "9", "-17", "-51",
+            "#f", "#t", "#t", "#f", "#t"
+        ]
+
+        results = run([TEMP_FOLDER+"/a.out", "6"], stdout=PIPE)
+        assert results.stdout == b"-17\n"
+
+    def test_matches_gcc_backend(self):
+        for program in PROGRAMS:
+            outputs = []
+            for backend in Compiler.backends:
+                path = f"{TEMP_FOLDER}/{backend}"
+                Compiler(path, program, backend=backend).compile_to_binary()
+                outputs.append(run(path+"/a.out", stdout=PIPE).stdout)
+            assert outputs[0] == outputs[1], program